@@ -0,0 +1,107 @@
+'''
+Measures the write throughput of the database service under each SQLite storage profile.
+
+Several producer threads stand in for the MQTT network thread and dispatch "save_check_in" and
+"update_service_states" events as fast as they can, the same way the communication interface does. The events
+are configured as in main.py, so they are written on the dispatcher's worker threads, each write in its own
+session and transaction. Every profile writes to fresh database files in a temporary directory.
+
+Run from the project root:
+    python services/database/app/benchmarks/bench_storage_profiles.py [--producers 4] [--events 500]
+'''
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add the project root and the database app directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+app_dir = os.path.abspath(os.path.join(current_dir, "../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session
+
+from shared_libraries.event_dispatcher import EventDispatcher
+from src.database import STORAGE_PROFILES, create_sqlite_engine
+from src.migrations import migrate, PERSISTENT_DATA_MIGRATIONS, STUDY_DATA_MIGRATIONS
+from src.persistent_data_db_manager import PersistentDataManager
+from src.study_data_db_manager import StudyDatabaseManager
+
+CHECK_IN = {
+    "check_in_time": "10:30:12",
+    "check_in_duration_seconds": 245,
+    "responses": [
+        {"question": "Did you exercise today?", "response": "yes"},
+        {"question": "What does a typical day of physical activity look like for you?", "response": "A walk after lunch"},
+        {"question": "On a scale of 1 to 10, with 1 being low and 10 being high, how confident are you about staying active this week?", "response": "7"},
+        {"question": "What would help you feel even more confident?", "response": "Going with a friend"},
+        {"question": "What is your main focus for staying active this week?", "response": "Walking every day"},
+    ],
+}
+
+
+def run_profile(pragmas, producers, events_per_producer):
+    with tempfile.TemporaryDirectory() as directory:
+        study_engine = create_sqlite_engine(f"sqlite:///{os.path.join(directory, 'study.db')}", pragmas)
+        persistent_engine = create_sqlite_engine(f"sqlite:///{os.path.join(directory, 'persistent.db')}", pragmas)
+        migrate(study_engine, STUDY_DATA_MIGRATIONS)
+        migrate(persistent_engine, PERSISTENT_DATA_MIGRATIONS)
+
+        dispatcher = EventDispatcher(asynchronous=True)
+        dispatcher.configure_event("save_check_in", policy="block")
+        dispatcher.configure_event("update_service_states", policy="block")
+        # Published state updates are not part of the measurement
+        dispatcher.register_event("publish_service_state", lambda state: None)
+        StudyDatabaseManager(sessionmaker(study_engine, class_=Session, expire_on_commit=False), dispatcher)
+        persistent_data = PersistentDataManager(sessionmaker(persistent_engine, class_=Session, expire_on_commit=False), dispatcher)
+        for index in range(20):
+            persistent_data.update_service_state("user_interface", f"state_{index}", "0")
+
+        def produce(producer):
+            for index in range(events_per_producer):
+                if index % 2:
+                    dispatcher.dispatch_event("save_check_in", CHECK_IN)
+                else:
+                    dispatcher.dispatch_event("update_service_states", {"state_name": f"state_{index % 20}", "state_value": str(producer)})
+
+        threads = [threading.Thread(target=produce, args=(producer,)) for producer in range(producers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        dispatcher.wait_until_idle()
+        elapsed = time.perf_counter() - started
+        dispatcher.shutdown()
+        study_engine.dispose()
+        persistent_engine.dispose()
+
+    return producers * events_per_producer, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--events", type=int, default=500, help="events dispatched by each producer")
+    args = parser.parse_args()
+
+    # The handlers print every write, keep the table readable
+    stdout = sys.stdout
+    print(f"{'profile':<10}{'writes':>8}{'seconds':>10}{'writes/s':>12}")
+    for name, pragmas in STORAGE_PROFILES.items():
+        sys.stdout = open(os.devnull, "w")
+        try:
+            writes, elapsed = run_profile(pragmas, args.producers, args.events)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print(f"{name:<10}{writes:>8}{elapsed:>10.2f}{writes / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''
+Exports a study database to Parquet (or CSV) datasets partitioned by participant and day, see
+src/study_data_export.py. The database is opened read-only, so it can be exported while the service is running
+or after copying it from a unit.
+
+    python services/database/app/export_study_data.py --output exports --participant P01
+    python services/database/app/export_study_data.py --database /media/usb/P02/hri_study.db --output exports --participant P02
+
+Each run only exports what was saved since the previous one, unless --full is given.
+'''
+import argparse
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session
+
+from src.database import create_sqlite_engine
+from src.migrations import schema_version
+from src.study_data_export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, StudyDataExporter, parquet_supported
+
+# The first schema with typed dates, times and durations
+MIN_EXPORT_SCHEMA_VERSION = 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=os.path.join(current_dir, "database", "hri_study.db"), help="study database to export")
+    parser.add_argument("--output", required=True, help="root directory of the exported datasets")
+    parser.add_argument("--participant", default=os.getenv("PARTICIPANT_ID") or "anonymous", help="participant the database belongs to (default: $PARTICIPANT_ID)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="rows read and written at a time")
+    parser.add_argument("--full", action="store_true", help="export everything again instead of what was saved since the last export")
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not parquet_supported():
+        parser.error("--format parquet requires pyarrow (pip install -r requirements.txt), or pass --format csv")
+    if not os.path.exists(args.database):
+        parser.error(f"No database at {args.database}")
+    engine = create_sqlite_engine(f"sqlite:///file:{os.path.abspath(args.database)}?mode=ro&uri=true", {"busy_timeout": 5000})
+    try:
+        version = schema_version(engine)
+        if version < MIN_EXPORT_SCHEMA_VERSION:
+            parser.error(f"The database is at schema version {version}, start the database service once to migrate it before exporting")
+
+        exporter = StudyDataExporter(
+            sessionmaker(engine, class_=Session),
+            args.output,
+            args.participant,
+            file_format=args.format,
+            batch_size=args.batch_size,
+        )
+        exporter.export(full=args.full)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 from src.communication_interface import CommunicationInterface
-from src.study_data_db_manager import StudyDatabaseManager
+from src.study_data_db_manager import ShardedStudyDatabaseManager, StudyDatabaseManager
 from src.persistent_data_db_manager import PersistentDataManager
 from src.persistent_data_db_schema import ServiceState
-from src.database import init_persistent_db, get_study_data_session, init_study_db, get_persistent_data_session
+from src.database import init_persistent_db, init_study_db, get_persistent_data_session, persistent_data_session_factory, study_data_session_factory, storage_profile, ShardRouter
+from src.migrations import STUDY_DATA_MIGRATIONS
 
 from sqlmodel import select
 import logging
@@ -18,7 +19,7 @@ sys.path.insert(0, project_root)
 
 from configurations.initial_configurations import StudyConfigs
 from shared_libraries.logging_config import setup_logger
-from shared_libraries.event_dispatcher import EventDispatcher
+from shared_libraries.event_dispatcher import EventDispatcher, service_state_key
 
 def initialise_persistent_database(session):
     # Load the initial configurations
@@ -81,17 +82,43 @@ if __name__ == "__main__":
 
         logger = logging.getLogger("Main")
 
-        dispatcher = EventDispatcher()
+        dispatcher = EventDispatcher(asynchronous=True)
+        # Only forward the latest value of each service state published within the window, so bursts of
+        # updates (e.g. from the brightness slider) don't trigger a robot call or subprocess per message
+        dispatcher.configure_event("publish_service_state", policy="coalesce", coalesce_key=service_state_key, coalesce_window=0.25)
+        # "publish_all_service_states" is left inline: the states of every service have to be published before the
+        # database acknowledges update_system_state, services are only set up once they have them
+        # Write to the databases on a worker thread instead of the MQTT network thread. The writes share one queue
+        # and worker, so they are made in the order they were received. Writes are never dropped, a full queue holds
+        # up the network thread until there is space again
+        for write_event in ("save_check_in", "save_check_in_batch", "create_new_reminder", "update_service_states"):
+            dispatcher.configure_event(write_event, policy="block", channel="database_writes")
+        # History is streamed in chunks, which can take a while for a long study
+        dispatcher.configure_event("request_history", max_queue_size=10)
+        dispatcher.configure_event("request_aggregates", max_queue_size=10)
         
-        # Initialise the databases
-        init_study_db()
+        # Initialise the databases. With DATABASE_SHARD_ROOT set the study data of every participant is kept in
+        # its own database under that directory, otherwise in hri_study.db
+        shard_root = os.getenv("DATABASE_SHARD_ROOT")
+        if not shard_root:
+            init_study_db()
         init_persistent_db()
 
         with get_persistent_data_session() as persistent_data_session:
-            PersistentDataManager(persistent_data_session, dispatcher)
             initialise_persistent_database(persistent_data_session)
-        with get_study_data_session() as study_data_session:
-            StudyDatabaseManager(study_data_session, dispatcher)
+        # Loads the service states into memory, so it is created once the defaults have been saved
+        PersistentDataManager(persistent_data_session_factory, dispatcher)
+        if shard_root:
+            router = ShardRouter(
+                shard_root,
+                "hri_study.db",
+                STUDY_DATA_MIGRATIONS,
+                storage_profile,
+                max_open_shards=int(os.getenv("DATABASE_MAX_OPEN_SHARDS") or 8),
+            )
+            ShardedStudyDatabaseManager(router, dispatcher, default_participant=os.getenv("PARTICIPANT_ID") or None)
+        else:
+            StudyDatabaseManager(study_data_session_factory, dispatcher)
 
         communication_interface = CommunicationInterface(
             broker_address=str(os.getenv("MQTT_BROKER_ADDRESS")),
@@ -1,9 +1,6 @@
-import json
-import time
 import sys
 import os
 import logging
-import collections
 
 # Add the project root directory to sys.path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,6 +8,7 @@ project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
 sys.path.insert(0, project_root)
 
 from shared_libraries.mqtt_client_base import MQTTClientBase
+from shared_libraries.timestamps import timestamp
 
 class CommunicationInterface(MQTTClientBase):
     def __init__(self, broker_address, port, event_dispatcher):
@@ -27,7 +25,9 @@ class CommunicationInterface(MQTTClientBase):
         self.service_control_cmd = "database_control_cmd"
         self.update_persistent_data_topic = "update_persistent_data"
         self.save_check_in_topic = "save_check_in"
+        self.save_check_in_batch_topic = "save_check_in_batch"
         self.save_reminder_topic = "save_reminder"
+        self.aggregates_requested_topic = "request/study_aggregates"
 
         # Publish topics
         self.database_service_status_topic = "database_status"
@@ -35,13 +35,16 @@ class CommunicationInterface(MQTTClientBase):
         self.voice_assistant_state_topic = "voice_assistant_state"
         self.user_interface_state_topic = "user_interface_state"
         self.study_history_topic = "study_history"
+        self.study_aggregates_topic = "study_aggregates"
 
         # Subscribe to necessary topics
-        self.subscribe(self.service_status_requested_topic, self._respond_with_service_status)
-        self.subscribe(self.service_control_cmd, self._handle_control_command)
-        self.subscribe(self.save_check_in_topic, self._save_check_in)
-        self.subscribe(self.update_persistent_data_topic, self._update_persistent_data)
-        self.subscribe(self.save_reminder_topic, self._save_reminder)
+        self.add_route(self.service_status_requested_topic, self._respond_with_service_status)
+        self.add_route(self.service_control_cmd, self._handle_control_command)
+        self.add_route(self.save_check_in_topic, self._save_check_in)
+        self.add_route(self.save_check_in_batch_topic, self._save_check_in_batch)
+        self.add_route(self.save_reminder_topic, self._save_reminder)
+        self.add_route(self.aggregates_requested_topic, self._request_aggregates)
+        self.add_route(self.update_persistent_data_topic, self._update_persistent_data)
 
         self._register_event_handlers()
 
@@ -49,89 +52,115 @@ class CommunicationInterface(MQTTClientBase):
         """Register event handlers for robot actions."""
         if self.dispatcher:
             self.dispatcher.register_event("publish_service_state", self.publish_service_states)
+            self.dispatcher.register_event("publish_all_service_states", self.publish_service_states)
             self.dispatcher.register_event("send_history", self._publish_history)
+            self.dispatcher.register_event("send_aggregates", self._publish_aggregates)
+            self.dispatcher.register_event("acknowledge_messages", self._acknowledge_messages)
     
-    def _respond_with_service_status(self, client, userdata, message):
-        self.publish_database_status(self.service_status)
-    
-    def _handle_control_command(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            command = payload.get("cmd", "")
-
-            if command == "update_system_state":
-                self.dispatcher.dispatch_event("service_control_command", command)
-                self.logger.info("Sending update system state to all services")
-            elif command == "request_history":
-                self.logger.info("Sending history to the user interface")
-                self.dispatcher.dispatch_event("request_history")
-
-            status_response = {
-                "set_up": "ready",
-                "start": "running",
-                "end": "completed",
-                "update_system_state": "set_up"
-            }
-            self.publish_database_status(status_response.get(command, "running"))
-        except json.JSONDecodeError:
+    def _respond_with_service_status(self, payload, message):
+        correlation_id = payload.get("correlation_id") if isinstance(payload, dict) else None
+        self.publish_database_status(self.service_status, correlation_id=correlation_id)
+
+    def _handle_control_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload. Using default retry parameters.")
+            return
+        command = payload.get("cmd", "")
+
+        if command == "update_system_state":
+            self.dispatcher.dispatch_event("service_control_command", command)
+            self.logger.info("Sending update system state to all services")
+        elif command == "request_history":
+            self.logger.info("Sending history to the user interface")
+            self.dispatcher.dispatch_event("request_history", payload.get("query"))
+
+        status_response = {
+            "set_up": "ready",
+            "start": "running",
+            "end": "completed",
+            "update_system_state": "set_up"
+        }
+        self.publish_database_status(status_response.get(command, "running"), correlation_id=payload.get("correlation_id"))
 
-    def _save_check_in(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"Saving check-in data: {payload}")
-            self.dispatcher.dispatch_event("save_check_in", payload)
-        except json.JSONDecodeError:
+    def _save_check_in(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for check-in data. Unable to save check-in data.")
-    
-    def _save_reminder(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"Saving reminder: {payload}")
-            reminder_message = payload.get("reminder_message", "")
-            self.dispatcher.dispatch_event("create_new_reminder", reminder_message)
-        except json.JSONDecodeError:
+            return
+        self.logger.info(f"Saving check-in data: {payload}")
+        self.dispatcher.dispatch_event("save_check_in", payload)
+
+    def _save_check_in_batch(self, payload, message):
+        check_ins = payload.get("messages") if isinstance(payload, dict) else None
+        if not isinstance(check_ins, list) or not check_ins or not all(isinstance(check_in, dict) for check_in in check_ins):
+            self.logger.error("Invalid JSON payload for check-in batch. Unable to save check-in data.")
+            return
+        self.logger.info(f"Saving batch of {len(check_ins)} check-ins")
+        self.dispatcher.dispatch_event("save_check_in_batch", payload)
+
+    def _save_reminder(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for reminder. Unable to save reminder data.")
-
-    def _update_persistent_data(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"Updating persistent data: {payload}")
-            self.dispatcher.dispatch_event("update_service_states", payload)
-        except json.JSONDecodeError:
+            return
+        self.logger.info(f"Saving reminder: {payload}")
+        self.dispatcher.dispatch_event("create_new_reminder", payload)
+
+    def _request_aggregates(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error("Invalid JSON payload for aggregates request. Unable to send aggregates.")
+            return
+        self.logger.info(f"Aggregates requested: {payload}")
+        self.dispatcher.dispatch_event("request_aggregates", payload)
+
+    def _update_persistent_data(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for persistent data. Unable to update persistent data.")
-    
+            return
+        self.logger.info(f"Updating persistent data: {payload}")
+        self.dispatcher.dispatch_event("update_service_states", payload)
+
     def publish_service_states(self, upated_state):
         """
-        Clusters service states and publishes them to the appropriate MQTT topics.
+        Clusters service states and publishes them to the appropriate MQTT topics. upated_state is either a single
+        state or the states of every service, keyed by service name.
         """
-        if type(upated_state) is collections.defaultdict:
+        if isinstance(upated_state, dict) and "state_name" not in upated_state:
             self.logger.info(f"Publishing service states: {upated_state}")
             for service_name, state_values in upated_state.items():
                 topic = f"service/{service_name}/update_state"
                 for state in state_values:
                     payload = {"state_name": state["state_name"], "state_value": state["state_value"]}
-                    self.publish(topic, json.dumps(payload))
+                    self.publish(topic, payload)
                 # Publish that database has completed setting up the service
         else:
             payload = {"state_name": upated_state["state_name"], "state_value": upated_state["state_value"]}
             service_name = upated_state["service_name"]
             topic = f"service/{service_name}/update_state"
-            self.publish(topic, json.dumps(payload))
+            self.publish(topic, payload)
     
-    def publish_database_status(self, status, message="", details=None):
+    def publish_database_status(self, status, message="", details=None, correlation_id=None):
         logging.info(f"Publishing database status: {status}")        
         payload = {
             "service_name": "database",
             "status": status,
             "message": message,
             "details": details,
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            "timestamp": timestamp()
         }
-        self.publish(self.database_service_status_topic, json.dumps(payload))
+        if correlation_id:
+            payload["correlation_id"] = correlation_id
+        self.publish(self.database_service_status_topic, payload)
 
         self.service_status = status
 
-    def _publish_history(self, history):
-        logging.info(f"Publishing history to the user interface {history}")
-        self.publish(self.study_history_topic, json.dumps(history))
\ No newline at end of file
+    def _publish_history(self, history_chunk):
+        logging.info(f"Publishing history chunk {history_chunk['chunk']} with {len(history_chunk['items'])} days to the user interface")
+        self.publish(self.study_history_topic, history_chunk)
+
+    def _publish_aggregates(self, aggregates):
+        """Answers the request on its reply_to topic when it was made with call(), on the aggregates topic otherwise."""
+        self.logger.info(f"Publishing study aggregates for request {aggregates['response'].get('request_id')}")
+        self.reply(aggregates["request"], aggregates["response"], topic=self.study_aggregates_topic)
+
+    def _acknowledge_messages(self, requests):
+        for request in requests:
+            self.reply(request, {"status": "saved", "idempotency_key": request.get("idempotency_key")})
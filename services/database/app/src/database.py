@@ -1,49 +1,217 @@
+'''
+SQLite storage profiles.
+
+A profile is the set of PRAGMAs applied to every connection the engines open. The profile is selected with the
+SQLITE_PROFILE environment variable and any PRAGMA can be overridden individually, e.g.
+    SQLITE_PROFILE=balanced
+    SQLITE_SYNCHRONOUS=FULL
+    SQLITE_MMAP_SIZE=0
+
+    default   SQLite's own defaults: rollback journal and a full fsync on every commit
+    safe      WAL journal, still fsyncing every commit, so no committed check-in is lost on power failure
+    balanced  WAL journal, fsyncing at checkpoints only. A power cut can lose the last commits, but the database
+              can not be corrupted. Writes no longer block reads, which matters now that events are handled on
+              worker threads.
+'''
+from collections import OrderedDict
 from contextlib import contextmanager
-from sqlmodel import create_engine, Session, SQLModel
+import os
+import re
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import create_engine, Session
+from .migrations import migrate, PERSISTENT_DATA_MIGRATIONS, STUDY_DATA_MIGRATIONS
 # from .persistent_data_db_schema import ServiceState
 # from .study_data_db_schema import StudyMeta, CheckIn, Reminder
 
+
+STORAGE_PROFILES = {
+    "default": {},
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8000,  # KiB when negative, i.e. 8 MB of page cache per connection
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+}
+DEFAULT_STORAGE_PROFILE = "balanced"
+PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout", "foreign_keys")
+
+
+def storage_profile_from_env():
+    """Returns the PRAGMAs of the profile named by SQLITE_PROFILE, with the SQLITE_<PRAGMA> overrides applied."""
+    name = os.getenv("SQLITE_PROFILE", DEFAULT_STORAGE_PROFILE)
+    if name not in STORAGE_PROFILES:
+        print(f"Unknown SQLite profile '{name}', using '{DEFAULT_STORAGE_PROFILE}'")
+        name = DEFAULT_STORAGE_PROFILE
+    pragmas = dict(STORAGE_PROFILES[name])
+    for pragma in PRAGMAS:
+        value = os.getenv(f"SQLITE_{pragma.upper()}")
+        if value:
+            pragmas[pragma] = value
+    return pragmas
+
+
+def create_sqlite_engine(url, pragmas):
+    """
+    Creates an engine whose connections are pooled and can be used from any thread, each configured with the PRAGMAs.
+    Sessions must not be shared between threads, use one session per unit of work instead.
+    """
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
+
+    return engine
+
+
+class ShardRouter:
+    """
+    Routes each participant (or robot serial) to their own SQLite database, <root>/<participant>/<file_name>, so
+    one process can serve a whole cohort without participants contending for the same file lock.
+
+    A shard's engine is opened, and the shard migrated, the first time it is used. At most max_open_shards
+    engines are kept open; opening another one closes the pooled connections of the least recently used shard.
+    """
+    def __init__(self, root, file_name, migrations, pragmas, max_open_shards=8):
+        if max_open_shards < 1:
+            raise ValueError("max_open_shards must be at least 1")
+        self.root = root
+        self.file_name = file_name
+        self.migrations = migrations
+        self.pragmas = pragmas
+        self.max_open_shards = max_open_shards
+
+        # participant -> (engine, sessionmaker), least recently used first
+        self._open_shards = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shard_key(participant):
+        """Returns the participant as a shard name, refusing anything that is not safe as a directory name."""
+        participant = str(participant or "")
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", participant):
+            raise ValueError(f"Invalid participant '{participant}', expected letters, digits, '_' or '-'")
+        return participant
+
+    def path_of(self, participant):
+        return os.path.join(self.root, self.shard_key(participant), self.file_name)
+
+    def participants(self):
+        """Returns the participants that have a shard on disk."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            participant for participant in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, participant, self.file_name))
+        )
+
+    def open_shards(self):
+        with self._lock:
+            return list(self._open_shards)
+
+    def sessionmaker_for(self, participant):
+        """Returns the session factory of a participant's shard, opening and migrating it if needed."""
+        participant = self.shard_key(participant)
+        with self._lock:
+            if participant in self._open_shards:
+                self._open_shards.move_to_end(participant)
+                return self._open_shards[participant][1]
+
+            os.makedirs(os.path.join(self.root, participant), exist_ok=True)
+            engine = create_sqlite_engine(f"sqlite:///{self.path_of(participant)}", self.pragmas)
+            migrate(engine, self.migrations)
+            shard_sessionmaker = sessionmaker(engine, class_=Session, expire_on_commit=False)
+            self._open_shards[participant] = (engine, shard_sessionmaker)
+
+            while len(self._open_shards) > self.max_open_shards:
+                _, (least_recently_used, _) = self._open_shards.popitem(last=False)
+                # Sessions still using it keep their connection until they close
+                least_recently_used.dispose()
+            return shard_sessionmaker
+
+    def session_factory(self, participant):
+        """
+        Returns a session factory for a participant that can be kept: every session is opened through the router,
+        so the shard is reopened if it was closed in the meantime.
+        """
+        return ShardSessionFactory(self, self.shard_key(participant))
+
+    def close(self):
+        with self._lock:
+            for engine, _ in self._open_shards.values():
+                engine.dispose()
+            self._open_shards.clear()
+
+
+class ShardSessionFactory:
+    """Used like a sessionmaker, opens the sessions of one participant's shard."""
+    def __init__(self, router, participant):
+        self.router = router
+        self.participant = participant
+
+    def __call__(self, **kwargs):
+        return self.router.sessionmaker_for(self.participant)(**kwargs)
+
+    def begin(self):
+        return self.router.sessionmaker_for(self.participant).begin()
+
+
+storage_profile = storage_profile_from_env()
+
 # Study data database connection
 study_data_file_name = "services/database/app/database/hri_study.db"
 study_data_url = f"sqlite:///{study_data_file_name}"
-study_data_engine = create_engine(study_data_url)
+study_data_engine = create_sqlite_engine(study_data_url, storage_profile)
 
 
 # Persistent data database connection
 persistent_data_file_name = "services/database/app/database/persistent.db"
 persistent_data_url = f"sqlite:///{persistent_data_file_name}"
-persistent_data_engine = create_engine(persistent_data_url)
+persistent_data_engine = create_sqlite_engine(persistent_data_url, storage_profile)
+
+# Thread-safe session factories, every unit of work opens its own session:
+#     with study_data_session_factory.begin() as session:
+#         ...  # committed when the block exits, rolled back if it raises
+# Objects stay readable after the session is closed.
+study_data_session_factory = sessionmaker(study_data_engine, class_=Session, expire_on_commit=False)
+persistent_data_session_factory = sessionmaker(persistent_data_engine, class_=Session, expire_on_commit=False)
 
 
 def init_study_db():
     """
-    Initializes the study data database with only study-related tables.
+    Initializes the study data database with only study-related tables, migrating it to the latest schema.
     """
-    SQLModel.metadata.create_all(
-        study_data_engine,
-        tables=[
-            SQLModel.metadata.tables["studymeta"],
-            SQLModel.metadata.tables["checkinmeta"],
-            SQLModel.metadata.tables["checkin"],
-        ],
-    )
+    migrate(study_data_engine, STUDY_DATA_MIGRATIONS)
 
 
 def init_persistent_db():
     """
-    Initializes the persistent data database with only persistent tables.
+    Initializes the persistent data database with only persistent tables, migrating it to the latest schema.
     """
-    SQLModel.metadata.create_all(
-        persistent_data_engine,
-        tables=[
-            SQLModel.metadata.tables["servicestate"],
-        ],
-    )
+    migrate(persistent_data_engine, PERSISTENT_DATA_MIGRATIONS)
 
 
 @contextmanager
 def get_study_data_session():
-    session = Session(study_data_engine)
+    session = study_data_session_factory()
     try:
         yield session
     finally:
@@ -52,7 +220,7 @@ def get_study_data_session():
 
 @contextmanager
 def get_persistent_data_session():
-    session = Session(persistent_data_engine)
+    session = persistent_data_session_factory()
     try:
         yield session
     finally:
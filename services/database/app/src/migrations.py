@@ -0,0 +1,239 @@
+'''
+Forward-only schema migrations for the study and persistent databases.
+
+The schema version of a database is kept in SQLite's PRAGMA user_version. At start up every migration with a
+higher version than the database's is applied in order, each in its own transaction together with the version
+bump, so a migration that fails leaves the database at the previous version. Migrations are plain SQL and must
+never be edited once released; change the schema by appending a migration with the next version, and update the
+SQLModel classes in *_db_schema.py to match.
+
+Version 1 is the schema the tables had before migrations were introduced. Databases created by those versions of
+the service already have it, so it is created with IF NOT EXISTS.
+'''
+
+STUDY_DATA_MIGRATIONS = [
+    (1, "Initial schema", [
+        """CREATE TABLE IF NOT EXISTS studymeta (
+            id INTEGER NOT NULL,
+            number_of_interactions_in_a_day INTEGER NOT NULL,
+            number_of_robot_crashes INTEGER NOT NULL,
+            number_of_network_failures INTEGER NOT NULL,
+            date VARCHAR NOT NULL,
+            reminder_message VARCHAR NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS checkinmeta (
+            id INTEGER NOT NULL,
+            checkin_time VARCHAR NOT NULL,
+            checkin_duration VARCHAR NOT NULL,
+            study_meta_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(study_meta_id) REFERENCES studymeta (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS checkin (
+            id INTEGER NOT NULL,
+            question VARCHAR NOT NULL,
+            response VARCHAR NOT NULL,
+            checkin_meta_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(checkin_meta_id) REFERENCES checkinmeta (id)
+        )""",
+    ]),
+    (2, "Typed date, time and duration columns, index the lookups", [
+        # SQLite can not change the type of a column, so checkinmeta is rebuilt. Times are stored the way
+        # SQLAlchemy's TIME type reads them (HH:MM:SS.ffffff) and durations as whole seconds.
+        """CREATE TABLE checkinmeta_new (
+            id INTEGER NOT NULL,
+            checkin_time TIME NOT NULL,
+            checkin_duration INTEGER NOT NULL,
+            study_meta_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(study_meta_id) REFERENCES studymeta (id)
+        )""",
+        """INSERT INTO checkinmeta_new (id, checkin_time, checkin_duration, study_meta_id)
+        SELECT
+            id,
+            CASE length(checkin_time)
+                WHEN 5 THEN checkin_time || ':00.000000'
+                WHEN 8 THEN checkin_time || '.000000'
+                ELSE checkin_time
+            END,
+            CAST(round(CAST(checkin_duration AS REAL)) AS INTEGER),
+            study_meta_id
+        FROM checkinmeta""",
+        "DROP TABLE checkinmeta",
+        "ALTER TABLE checkinmeta_new RENAME TO checkinmeta",
+        # Dates are already stored as YYYY-MM-DD, which is how SQLAlchemy's DATE type stores them
+        """CREATE TABLE studymeta_new (
+            id INTEGER NOT NULL,
+            number_of_interactions_in_a_day INTEGER NOT NULL,
+            number_of_robot_crashes INTEGER NOT NULL,
+            number_of_network_failures INTEGER NOT NULL,
+            date DATE NOT NULL,
+            reminder_message VARCHAR NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        "INSERT INTO studymeta_new SELECT id, number_of_interactions_in_a_day, number_of_robot_crashes, number_of_network_failures, date, reminder_message FROM studymeta",
+        "DROP TABLE studymeta",
+        "ALTER TABLE studymeta_new RENAME TO studymeta",
+        "CREATE INDEX ix_studymeta_date ON studymeta (date)",
+        "CREATE INDEX ix_checkinmeta_study_meta_id ON checkinmeta (study_meta_id)",
+        "CREATE INDEX ix_checkin_checkin_meta_id ON checkin (checkin_meta_id)",
+    ]),
+    (3, "Daily aggregates, backfilled from the existing check-ins", [
+        """CREATE TABLE dailyaggregate (
+            date DATE NOT NULL,
+            interactions INTEGER NOT NULL,
+            check_ins INTEGER NOT NULL,
+            reminders INTEGER NOT NULL,
+            check_in_duration_total INTEGER NOT NULL,
+            check_in_duration_min INTEGER,
+            check_in_duration_max INTEGER,
+            PRIMARY KEY (date)
+        )""",
+        """CREATE TABLE dailyquestionscore (
+            date DATE NOT NULL,
+            question VARCHAR NOT NULL,
+            responses INTEGER NOT NULL,
+            score_total INTEGER NOT NULL,
+            score_min INTEGER NOT NULL,
+            score_max INTEGER NOT NULL,
+            PRIMARY KEY (date, question)
+        )""",
+        "CREATE INDEX ix_dailyquestionscore_question_date ON dailyquestionscore (question, date)",
+        # Only the last reminder message of a day was kept, so a day counts at most one reminder
+        """INSERT INTO dailyaggregate
+        SELECT
+            studymeta.date,
+            sum(studymeta.number_of_interactions_in_a_day),
+            coalesce(sum(checkins.count), 0),
+            sum(studymeta.reminder_message != ''),
+            coalesce(sum(checkins.duration_total), 0),
+            min(checkins.duration_min),
+            max(checkins.duration_max)
+        FROM studymeta
+        LEFT JOIN (
+            SELECT study_meta_id, count(*) AS count, sum(checkin_duration) AS duration_total,
+                min(checkin_duration) AS duration_min, max(checkin_duration) AS duration_max
+            FROM checkinmeta
+            GROUP BY study_meta_id
+        ) AS checkins ON checkins.study_meta_id = studymeta.id
+        GROUP BY studymeta.date""",
+        # The same responses study_data_db_manager.response_score accepts: whole numbers from 1 to 10
+        """INSERT INTO dailyquestionscore
+        SELECT
+            studymeta.date,
+            checkin.question,
+            count(*),
+            sum(CAST(trim(checkin.response) AS INTEGER)),
+            min(CAST(trim(checkin.response) AS INTEGER)),
+            max(CAST(trim(checkin.response) AS INTEGER))
+        FROM checkin
+        JOIN checkinmeta ON checkinmeta.id = checkin.checkin_meta_id
+        JOIN studymeta ON studymeta.id = checkinmeta.study_meta_id
+        WHERE trim(checkin.response) != ''
+            AND trim(checkin.response) NOT GLOB '*[^0-9]*'
+            AND CAST(trim(checkin.response) AS INTEGER) BETWEEN 1 AND 10
+        GROUP BY studymeta.date, checkin.question""",
+    ]),
+    (4, "One StudyMeta row per day", [
+        # Concurrent writers could each create a row for the same day. Merge them into the first one, the daily
+        # aggregates are kept per date and already count all of them.
+        """UPDATE checkinmeta SET study_meta_id = (
+            SELECT min(same_day.id) FROM studymeta
+            JOIN studymeta AS same_day ON same_day.date = studymeta.date
+            WHERE studymeta.id = checkinmeta.study_meta_id
+        )""",
+        """UPDATE studymeta SET
+            number_of_interactions_in_a_day = (SELECT sum(number_of_interactions_in_a_day) FROM studymeta AS same_day WHERE same_day.date = studymeta.date),
+            number_of_robot_crashes = (SELECT sum(number_of_robot_crashes) FROM studymeta AS same_day WHERE same_day.date = studymeta.date),
+            number_of_network_failures = (SELECT sum(number_of_network_failures) FROM studymeta AS same_day WHERE same_day.date = studymeta.date),
+            reminder_message = coalesce((
+                SELECT reminder_message FROM studymeta AS same_day
+                WHERE same_day.date = studymeta.date AND same_day.reminder_message != ''
+                ORDER BY same_day.id DESC LIMIT 1
+            ), '')
+        WHERE id IN (SELECT min(id) FROM studymeta GROUP BY date HAVING count(*) > 1)""",
+        "DELETE FROM studymeta WHERE id NOT IN (SELECT min(id) FROM studymeta GROUP BY date)",
+        "DROP INDEX ix_studymeta_date",
+        "CREATE UNIQUE INDEX ix_studymeta_date ON studymeta (date)",
+    ]),
+    (5, "Idempotency keys of the saved messages", [
+        """CREATE TABLE processedmessage (
+            idempotency_key VARCHAR NOT NULL,
+            processed_at DATETIME NOT NULL,
+            PRIMARY KEY (idempotency_key)
+        )""",
+    ]),
+]
+
+PERSISTENT_DATA_MIGRATIONS = [
+    (1, "Initial schema", [
+        """CREATE TABLE IF NOT EXISTS servicestate (
+            id INTEGER NOT NULL,
+            service_name VARCHAR NOT NULL,
+            state_name VARCHAR NOT NULL,
+            state_value VARCHAR NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+    ]),
+    (2, "One row per service state, index the lookups", [
+        # Keep the most recently inserted row of any duplicated state
+        """DELETE FROM servicestate WHERE id NOT IN (
+            SELECT max(id) FROM servicestate GROUP BY service_name, state_name
+        )""",
+        "CREATE UNIQUE INDEX ix_servicestate_service_name_state_name ON servicestate (service_name, state_name)",
+        "CREATE INDEX ix_servicestate_state_name ON servicestate (state_name)",
+    ]),
+]
+
+
+def schema_version(engine):
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine, migrations):
+    """
+    Applies the migrations the database has not had yet.
+
+    Returns:
+        int: The schema version of the database
+    """
+    latest_version = migrations[-1][0] if migrations else 0
+    raw_connection = engine.raw_connection()
+    connection = raw_connection.driver_connection
+    isolation_level = connection.isolation_level
+    # Manage the transactions explicitly, the sqlite3 module would otherwise commit in the middle of the DDL
+    connection.isolation_level = None
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > latest_version:
+            raise RuntimeError(f"The database is at schema version {version}, newer than this service supports ({latest_version})")
+
+        # Tables are rebuilt while other tables reference them, so foreign keys are checked once at the end instead
+        foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+        connection.execute("PRAGMA foreign_keys=OFF")
+        try:
+            for migration_version, description, statements in migrations:
+                if migration_version <= version:
+                    continue
+                print(f"Migrating database to version {migration_version}: {description}")
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    for statement in statements:
+                        connection.execute(statement)
+                    if connection.execute("PRAGMA foreign_key_check").fetchone() is not None:
+                        raise RuntimeError(f"Migration {migration_version} left rows referencing missing rows")
+                    connection.execute(f"PRAGMA user_version={migration_version}")
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+                version = migration_version
+        finally:
+            connection.execute(f"PRAGMA foreign_keys={foreign_keys}")
+    finally:
+        connection.isolation_level = isolation_level
+        raw_connection.close()
+    return version
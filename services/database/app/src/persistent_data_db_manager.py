@@ -1,17 +1,29 @@
-from sqlmodel import Session, select
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import select
 from .persistent_data_db_schema import ServiceState
 from collections import defaultdict
-import datetime
+import threading
 
 class PersistentDataManager:
-    def __init__(self, session: Session, dispatcher=None):
+    def __init__(self, session_factory: sessionmaker, dispatcher=None):
         """
-        Initialises the ServiceStateManager with a session.
-        :param session: An active SQLModel session object.
+        Initialises the ServiceStateManager with a session factory.
+        :param session_factory: Creates the session used by each operation, so events can be handled on several threads at once.
+
+        All service states are loaded into memory once and reads are served from there. Writes go to SQLite first
+        and only update the cache once they are committed, so the cache never holds a state that was not saved.
         """
-        self.session = session
+        self.session_factory = session_factory
         self.dispatcher = dispatcher
 
+        # service_name -> {state_name: state_value}
+        self.service_states = {}
+        # Serialises writes so the cache is updated in the same order as the database
+        self._lock = threading.Lock()
+        self.load_service_states()
+
         self._register_event_handlers()
 
     def _register_event_handlers(self):
@@ -20,93 +32,107 @@ class PersistentDataManager:
             self.dispatcher.register_event("update_service_states", self.update_specific_service_states_field)
             self.dispatcher.register_event("service_control_command", self._process_control_command)
 
+    def load_service_states(self):
+        """(Re)loads the cache from the database."""
+        with self.session_factory() as session:
+            states = session.exec(select(ServiceState)).all()
+        service_states = {}
+        for state in states:
+            service_states.setdefault(state.service_name, {})[state.state_name] = state.state_value
+        with self._lock:
+            self.service_states = service_states
+
     def _process_control_command(self, command):
         """
         Retrieves all service states. Clusters service states by `service_name`.
         """
         print(f"Processing control command: {command}")
         if command == "update_system_state":
-            # Step 1: Go through each row of the ServiceStates and get the data
-            states = self.session.exec(select(ServiceState)).all()
+            # Step 1: Go through the cached states of each service
             clustered_states = defaultdict(list)
-            for state in states:
-                print(f"Processing state: {state}")
-                clustered_states[state.service_name].append(
-                    {
-                        "service_name": state.service_name,
-                        "state_name": state.state_name,
-                        "state_value": state.state_value,
-                    }
-                )
+            with self._lock:
+                for service_name, states in self.service_states.items():
+                    for state_name, state_value in states.items():
+                        clustered_states[service_name].append(
+                            {
+                                "service_name": service_name,
+                                "state_name": state_name,
+                                "state_value": state_value,
+                            }
+                        )
             # Ensure a default return value
             if not clustered_states:
                 print("No service states found.")
                 return {}
-            
-            # Step 2: Publish the clustered states
-            self.dispatcher.dispatch_event("publish_service_state", clustered_states)
+
+            # Step 2: Publish the clustered states, before the command is acknowledged (see main.py)
+            self.dispatcher.dispatch_event("publish_all_service_states", clustered_states)
 
     # Read
     def get_all_service_states_fields(self):
-        return self.session.get(select(ServiceState)).all()
-    
+        with self._lock:
+            return [
+                ServiceState(service_name=service_name, state_name=state_name, state_value=state_value)
+                for service_name, states in self.service_states.items()
+                for state_name, state_value in states.items()
+            ]
+
     # I might need to create some shared libraries with enums of something to store all these string values for retriving data
     # Get any field required from the user profile
     def get_specific_service_states(self, state_name: str):
-        statement = select(ServiceState).where(ServiceState.state_name == state_name)
-        service_states = self.session.exec(statement).one_or_none()
-        if not service_states:
-            return None
-        if hasattr(service_states, state_name):
-            return getattr(service_states, "state_value")
-        else:
-            raise AttributeError(f"{state_name} is not a valid attribute of UserProfile")
+        """
+        Returns the value of a state, or None if no service has it. States shared by several services are kept
+        in sync by update_specific_service_states_field, so any of them can be returned.
+        """
+        with self._lock:
+            for states in self.service_states.values():
+                if state_name in states:
+                    return states[state_name]
+        return None
 
     def get_specific_service_state(self, service_name: str):
         """
-        Retrieves the state of a specific service.
+        Retrieves the states of a specific service as a dict of state name to value, or None if it has none.
         """
-        return self.session.exec(
-            select(ServiceState).where(ServiceState.service_name == service_name)
-        ).one_or_none()
-    
+        with self._lock:
+            states = self.service_states.get(service_name)
+            return dict(states) if states is not None else None
+
     # Update
     # UserProfile Operations
     def update_specific_service_states_field(self, payload):
         state_name = payload.get("state_name", "")
         value = payload.get("state_value", "")
 
-        statement = select(ServiceState).where(ServiceState.state_name == state_name)
-        service_states = self.session.exec(statement).all()
-
-        print(f"All service states to be updated: {service_states}")
-
-        if not service_states:
-            print(f"No service states found for {state_name}.")
-            service_name = payload.get("service_name", "")
-            service_state = ServiceState(
-                service_name=service_name,
-                state_name=state_name,
-                state_value=value,
-            )
-            self.session.add(service_state)
-            self.session.commit()
-            self.session.refresh(service_state)
-            return
-
-        updated_services = []
-        for service_state in service_states:
-            setattr(service_state, "state_value", value)  # Update the field in the object
-            updated_services.append(service_state)
-
-        self.session.commit()
-
-        for service_state in updated_services:
-            self.session.refresh(service_state)
+        with self._lock:
+            service_names = [service_name for service_name, states in self.service_states.items() if state_name in states]
+
+            print(f"All services whose {state_name} is updated: {service_names}")
+
+            if not service_names:
+                print(f"No service states found for {state_name}.")
+                service_name = payload.get("service_name", "")
+                with self.session_factory.begin() as session:
+                    session.add(ServiceState(
+                        service_name=service_name,
+                        state_name=state_name,
+                        state_value=value,
+                    ))
+                self.service_states.setdefault(service_name, {})[state_name] = value
+                return
+
+            with self.session_factory.begin() as session:
+                session.execute(
+                    update(ServiceState).where(ServiceState.state_name == state_name).values(state_value=value)
+                )
+            for service_name in service_names:
+                self.service_states[service_name][state_name] = value
+
+        for service_name in service_names:
             update_state = {
-                "service_name": service_state.service_name,
-                "state_name": service_state.state_name,
-                "state_value": service_state.state_value
+                "service_name": service_name,
+                "state_name": state_name,
+                "state_value": value
             }
             self.dispatcher.dispatch_event("publish_service_state", update_state)
 
@@ -114,31 +140,21 @@ class PersistentDataManager:
         """
         Updates or inserts a service state.
         """
-        service_state = self.session.exec(
-            select(ServiceState).where(ServiceState.service_name == service_name and ServiceState.state_name == state_name)
-        ).one_or_none()
-
-        if service_state:
-            service_state.state_value = state_value
-        else:
-            service_state = ServiceState(
-                service_name=service_name,
-                state_name=state_name,
-                state_value=state_value,
-            )
-            self.session.add(service_state)
-
-        self.session.commit()
-        self.session.refresh(service_state)
-        return service_state
+        with self._lock:
+            with self.session_factory.begin() as session:
+                session.execute(
+                    insert(ServiceState)
+                    .values(service_name=service_name, state_name=state_name, state_value=state_value)
+                    .on_conflict_do_update(index_elements=["service_name", "state_name"], set_={"state_value": state_value})
+                )
+            self.service_states.setdefault(service_name, {})[state_name] = state_value
+        return ServiceState(service_name=service_name, state_name=state_name, state_value=state_value)
 
     def delete_service_state(self, service_name: str):
         """
-        Deletes the state of a specific service.
+        Deletes the states of a specific service.
         """
-        service_state = self.session.exec(
-            select(ServiceState).where(ServiceState.service_name == service_name)
-        ).one_or_none()
-        if service_state:
-            self.session.delete(service_state)
-            self.session.commit()
+        with self._lock:
+            with self.session_factory.begin() as session:
+                session.execute(delete(ServiceState).where(ServiceState.service_name == service_name))
+            self.service_states.pop(service_name, None)
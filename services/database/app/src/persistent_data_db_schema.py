@@ -1,10 +1,15 @@
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 
 class ServiceState(SQLModel, table=True):
     """
-    Stores the state of the services.
+    Stores the state of the services. Each service has at most one row per state.
     """
+    __table_args__ = (
+        Index("ix_servicestate_service_name_state_name", "service_name", "state_name", unique=True),
+    )
+
     id: int = Field(default=None, primary_key=True)
     service_name: str
-    state_name: str
+    state_name: str = Field(index=True)
     state_value: str
\ No newline at end of file
@@ -1,113 +1,678 @@
-from sqlmodel import Session, select
-from .study_data_db_schema import StudyMeta, CheckInMeta, CheckIn
-from datetime import datetime
+from sqlalchemy import bindparam, func, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import select
+from .study_data_db_schema import StudyMeta, CheckInMeta, CheckIn, DailyAggregate, DailyQuestionScore, ProcessedMessage
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import sqlite3
+import threading
+
+HISTORY_PROJECTIONS = ("counts", "durations", "responses")
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_CHUNK_SIZE = 100
+AGGREGATE_PERIODS = ("day", "week")
+SCORE_SCALE = (1, 10)
+# INSERT ... RETURNING needs SQLite 3.35, Raspberry Pi OS bullseye ships 3.34
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def encode_history_cursor(study_meta):
+    return f"{study_meta.date.isoformat()}/{study_meta.id}"
+
+def decode_history_cursor(cursor):
+    history_date, _, study_meta_id = cursor.partition("/")
+    return date.fromisoformat(history_date), int(study_meta_id)
+
+def response_score(response):
+    """Returns the response as a score if it is a whole number on the 1 to 10 scale of the habit questions, else None."""
+    text = str(response).strip()
+    if not (text.isascii() and text.isdigit()):
+        return None
+    score = int(text)
+    return score if SCORE_SCALE[0] <= score <= SCORE_SCALE[1] else None
+
+def daily_totals(day, interactions=0, check_ins=0, reminders=0, durations=()):
+    """Returns the amounts to add to the DailyAggregate of a day."""
+    return {
+        "date": day,
+        "interactions": interactions,
+        "check_ins": check_ins,
+        "reminders": reminders,
+        "check_in_duration_total": sum(durations),
+        "check_in_duration_min": min(durations, default=None),
+        "check_in_duration_max": max(durations, default=None),
+    }
+
+def parse_check_in_time(check_in_time):
+    """Parses the time a check-in started at, sent as HH:MM:SS (or HH:MM)."""
+    for time_format in ("%H:%M:%S", "%H:%M"):
+        try:
+            return datetime.strptime(check_in_time, time_format).time()
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid check-in time '{check_in_time}'")
 
 class StudyDatabaseManager:
-    def __init__(self, session: Session, dispatcher=None):
+    def __init__(self, session_factory: sessionmaker, dispatcher=None, register_events=True):
         """
-        Initializes the StudyDatabaseManager with a session.
+        Initializes the StudyDatabaseManager with a session factory. Every operation uses its own session, so
+        events can be handled on several threads at once.
+        :param register_events: Whether to handle the study data events of the dispatcher, or only send responses
+            through it (when the events are routed by a ShardedStudyDatabaseManager).
         """
-        self.session = session
+        self.session_factory = session_factory
         self.dispatcher = dispatcher
-        self._register_event_handlers()
+        if register_events:
+            self._register_event_handlers()
 
     def _register_event_handlers(self):
         """Register event handlers for robot actions."""
         if self.dispatcher:
             self.dispatcher.register_event("save_check_in", self.save_check_in)
+            self.dispatcher.register_event("save_check_in_batch", self.save_check_in_batch)
             self.dispatcher.register_event("create_new_reminder", self.create_new_reminder)
             self.dispatcher.register_event("request_history", self.retrieve_history)
+            self.dispatcher.register_event("request_aggregates", self.retrieve_aggregates)
     
     def save_check_in(self, check_in_data):
         print("Saving check-in data")
+        self.save_check_ins([check_in_data])
 
-        today_date = datetime.now().date().strftime("%Y-%m-%d")
+    def save_check_ins(self, check_ins):
+        """
+        Saves check-ins in a single transaction: the StudyMeta rows of their days, their CheckInMeta rows, all
+        responses and the interaction counters. Rows are inserted with one executemany per table, so a batch
+        of buffered check-ins (e.g. replayed after being offline) costs the same number of statements as one.
 
-        # Check if a StudyMeta entry exists for today
-        statement = select(StudyMeta).where(StudyMeta.date == today_date)
-        study_meta = self.session.exec(statement).one_or_none()
+        Each check-in may give the "date" (YYYY-MM-DD) it took place on, otherwise it is saved under today.
+        Check-ins sent through a DurableOutbox carry an "idempotency_key" and are only saved the first time they
+        are delivered. Every check-in that asked for a reply (reply_to) is acknowledged once it is committed.
+        """
+        if not check_ins:
+            return
+        print(f"Saving {len(check_ins)} check-in(s)")
 
-        # If no StudyMeta entry exists, create one
-        if not study_meta:
-            study_meta = StudyMeta(
-                number_of_interactions_in_a_day=0,  # Initial values
-                date=today_date,
-                reminder_message="",
-                number_of_network_failures=0,
-                number_of_robot_crashes=0
-            )
-            self.session.add(study_meta)
-            self.session.commit()  # Commit to generate an ID for the new StudyMeta
-            self.session.refresh(study_meta)
-                
-        # Create a new CheckInMeta for this check-in
-        checkin_meta = CheckInMeta(
-            checkin_time=check_in_data["check_in_time"],
-            checkin_duration=check_in_data["check_in_duration_seconds"],  # Placeholder duration
-            study_meta_id=study_meta.id,
-        )
-        self.session.add(checkin_meta)
-        self.session.commit()  # Commit to generate an ID for the new CheckInMeta
-        self.session.refresh(checkin_meta)
-        
-        responses = check_in_data["responses"]
-        print(f"responses received: {responses}")
-        # Add CheckIn responses and associate them with CheckInMeta
-        for response in check_in_data["responses"]:
-            new_checkin = CheckIn(
-                question=response["question"],
-                response=response["response"],
-                checkin_meta_id=checkin_meta.id  # Link to the correct CheckInMeta entry
-            )
-            self.session.add(new_checkin)
+        with self.session_factory.begin() as session:
+            new_check_ins = self._claim_idempotency_keys(session, check_ins)
+            if new_check_ins:
+                self._insert_check_ins(session, new_check_ins)
+            if len(new_check_ins) < len(check_ins):
+                print(f"Ignored {len(check_ins) - len(new_check_ins)} check-in(s) that were already saved")
+        self._acknowledge(check_ins)
+
+    def save_check_in_batch(self, batch):
+        """
+        Saves the check-ins a DurableOutbox published together ({"messages": [...]}) in a single transaction and
+        acknowledges the batch with one reply.
+        """
+        self.save_check_ins(batch["messages"])
+        self._acknowledge([batch])
+
+    def _insert_check_ins(self, session, check_ins):
+        """Inserts the rows of check-ins and updates the counters of their days, in the caller's transaction."""
+        today_date = datetime.now().date()
+        dates = [date.fromisoformat(check_in_data["date"]) if check_in_data.get("date") else today_date for check_in_data in check_ins]
+        durations = [round(float(check_in_data["check_in_duration_seconds"])) for check_in_data in check_ins]
+
+        # The check-in durations and response scores of each day, for the daily aggregates
+        durations_by_date = defaultdict(list)
+        scores = defaultdict(list)
+        for check_in_data, check_in_date, duration in zip(check_ins, dates, durations):
+            durations_by_date[check_in_date].append(duration)
+            for response in check_in_data["responses"]:
+                score = response_score(response["response"])
+                if score is not None:
+                    scores[(check_in_date, response["question"])].append(score)
+
+        study_meta_ids = self._get_or_create_study_meta_ids(session, set(dates))
 
-        self.session.commit()
+        # Create a CheckInMeta for each check-in
+        checkin_meta_ids = self._insert_checkin_metas(session, [
+            {
+                "checkin_time": parse_check_in_time(check_in_data["check_in_time"]),
+                "checkin_duration": duration,
+                "study_meta_id": study_meta_ids[check_in_date],
+            }
+            for check_in_data, check_in_date, duration in zip(check_ins, dates, durations)
+        ])
+
+        # Add CheckIn responses and associate them with their CheckInMeta
+        responses = [
+            {
+                "question": response["question"],
+                "response": response["response"],
+                "checkin_meta_id": checkin_meta_id,
+            }
+            for check_in_data, checkin_meta_id in zip(check_ins, checkin_meta_ids)
+            for response in check_in_data["responses"]
+        ]
+        print(f"responses received: {len(responses)}")
+        if responses:
+            session.execute(insert(CheckIn), responses)
 
         # Update StudyMeta fields (e.g., number of interactions)
-        study_meta.number_of_interactions_in_a_day += 1
-        self.session.commit()
+        study_meta_table = StudyMeta.__table__
+        session.execute(
+            update(study_meta_table)
+            .where(study_meta_table.c.id == bindparam("study_meta_id"))
+            .values(number_of_interactions_in_a_day=study_meta_table.c.number_of_interactions_in_a_day + bindparam("check_ins")),
+            [
+                {"study_meta_id": study_meta_ids[check_in_date], "check_ins": len(day_durations)}
+                for check_in_date, day_durations in durations_by_date.items()
+            ],
+        )
 
-    def create_new_reminder(self, reminder_message: str):
+        self._add_to_daily_aggregates(
+            session,
+            [
+                daily_totals(check_in_date, interactions=len(day_durations), check_ins=len(day_durations), durations=day_durations)
+                for check_in_date, day_durations in durations_by_date.items()
+            ],
+            [
+                {
+                    "date": check_in_date,
+                    "question": question,
+                    "responses": len(question_scores),
+                    "score_total": sum(question_scores),
+                    "score_min": min(question_scores),
+                    "score_max": max(question_scores),
+                }
+                for (check_in_date, question), question_scores in scores.items()
+            ],
+        )
+
+    def _insert_checkin_metas(self, session, rows):
+        """Inserts CheckInMeta rows in the caller's transaction and returns their ids, in the order of the rows."""
+        if SQLITE_HAS_RETURNING:
+            return session.execute(insert(CheckInMeta).returning(CheckInMeta.id, sort_by_parameter_order=True), rows).scalars().all()
+        # New rows get ids above every existing one, and the transaction holds the write lock from the insert until it
+        # commits, so the newest ids are those of the rows just inserted
+        session.execute(insert(CheckInMeta), rows)
+        statement = select(CheckInMeta.id).order_by(CheckInMeta.id.desc()).limit(len(rows))
+        return sorted(session.exec(statement).all())
+
+    def _get_or_create_study_meta_ids(self, session, dates):
+        """Returns the StudyMeta id of each date, inserting (without committing) the days that have no entry yet."""
+        # Insert first, a concurrent transaction creating the same day makes this one wait instead of adding a
+        # second row for it
+        session.execute(
+            insert(StudyMeta).on_conflict_do_nothing(index_elements=["date"]),
+            [
+                {
+                    "number_of_interactions_in_a_day": 0,  # Initial values
+                    "date": missing_date,
+                    "reminder_message": "",
+                    "number_of_network_failures": 0,
+                    "number_of_robot_crashes": 0,
+                }
+                for missing_date in sorted(dates)
+            ],
+        )
+        statement = select(StudyMeta.date, StudyMeta.id).where(StudyMeta.date.in_(dates))
+        return dict(session.exec(statement).all())
+
+    def _add_to_daily_aggregates(self, session, days, question_scores=()):
+        """
+        Adds to the running totals of days (rows made by daily_totals) and of the scores given to questions on
+        them, creating the totals of the days and questions that have none yet. Runs in the caller's transaction,
+        so the aggregates are only changed if the rows they count are saved.
+        """
+        if days:
+            statement = insert(DailyAggregate)
+            excluded = statement.excluded
+            session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["date"],
+                    set_={
+                        "interactions": DailyAggregate.interactions + excluded.interactions,
+                        "check_ins": DailyAggregate.check_ins + excluded.check_ins,
+                        "reminders": DailyAggregate.reminders + excluded.reminders,
+                        "check_in_duration_total": DailyAggregate.check_in_duration_total + excluded.check_in_duration_total,
+                        # SQLite's min() and max() of NULL are NULL, so a day without check-ins keeps the new duration
+                        "check_in_duration_min": func.coalesce(func.min(DailyAggregate.check_in_duration_min, excluded.check_in_duration_min), DailyAggregate.check_in_duration_min, excluded.check_in_duration_min),
+                        "check_in_duration_max": func.coalesce(func.max(DailyAggregate.check_in_duration_max, excluded.check_in_duration_max), DailyAggregate.check_in_duration_max, excluded.check_in_duration_max),
+                    },
+                ),
+                days,
+            )
+        if question_scores:
+            statement = insert(DailyQuestionScore)
+            excluded = statement.excluded
+            session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["date", "question"],
+                    set_={
+                        "responses": DailyQuestionScore.responses + excluded.responses,
+                        "score_total": DailyQuestionScore.score_total + excluded.score_total,
+                        "score_min": func.min(DailyQuestionScore.score_min, excluded.score_min),
+                        "score_max": func.max(DailyQuestionScore.score_max, excluded.score_max),
+                    },
+                ),
+                question_scores,
+            )
+
+    def create_new_reminder(self, reminder):
+        """
+        Records a reminder, given as its message or as the save_reminder payload. The payload may give the "date"
+        (YYYY-MM-DD) the reminder was sent on, otherwise it is recorded under today. Like check-ins, reminders
+        are only recorded the first time their idempotency key is seen, and acknowledged if they asked for it.
+        """
         print("Creating new reminder")
-        today_date = datetime.now().date().strftime("%Y-%m-%d")
-
-        # Check if a StudyMeta entry exists for today
-        statement = select(StudyMeta).where(StudyMeta.date == today_date)
-        study_meta = self.session.exec(statement).one_or_none()
-
-        # If no StudyMeta entry exists, create one
-        if not study_meta:
-            study_meta = StudyMeta(
-                number_of_interactions_in_a_day=1,  # Initial values
-                total_duration_of_interaction="",
-                date=today_date,
-                reminder_message = "",
-                number_of_network_failures=0,
-                number_of_robot_crashes=0
+        if not isinstance(reminder, dict):
+            reminder = {"reminder_message": reminder}
+        reminder_message = reminder.get("reminder_message", "")
+        reminder_date = date.fromisoformat(reminder["date"]) if reminder.get("date") else datetime.now().date()
+
+        with self.session_factory.begin() as session:
+            if self._claim_idempotency_keys(session, [reminder]):
+                # Get or create the StudyMeta entry of the day
+                study_meta_id = self._get_or_create_study_meta_ids(session, {reminder_date})[reminder_date]
+                session.execute(
+                    update(StudyMeta)
+                    .where(StudyMeta.id == study_meta_id)
+                    .values(
+                        reminder_message=reminder_message,
+                        number_of_interactions_in_a_day=StudyMeta.number_of_interactions_in_a_day + 1,
+                    )
+                )
+                self._add_to_daily_aggregates(session, [daily_totals(reminder_date, interactions=1, reminders=1)])
+            else:
+                print("Ignored a reminder that was already saved")
+        self._acknowledge([reminder])
+
+    def _claim_idempotency_keys(self, session, messages):
+        """
+        Records the idempotency keys of messages in the caller's transaction and returns the messages that were
+        not handled before, in order. Messages without a key are always returned. If another transaction claims
+        the same key first, inserting it fails and this transaction is rolled back.
+        """
+        keys = [message["idempotency_key"] for message in messages if message.get("idempotency_key")]
+        if not keys:
+            return messages
+        seen = set(session.exec(
+            select(ProcessedMessage.idempotency_key).where(ProcessedMessage.idempotency_key.in_(keys))
+        ).all())
+
+        new_messages = []
+        new_keys = []
+        for message in messages:
+            key = message.get("idempotency_key")
+            if key:
+                if key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+            new_messages.append(message)
+
+        if new_keys:
+            processed_at = datetime.now()
+            session.execute(
+                insert(ProcessedMessage),
+                [{"idempotency_key": key, "processed_at": processed_at} for key in new_keys],
             )
-        
-        study_meta.reminder_message = reminder_message
-        study_meta.number_of_interactions_in_a_day += 1
+        return new_messages
+
+    def _acknowledge(self, messages):
+        """Replies to the messages sent with call() (by a DurableOutbox), once what they asked for is committed."""
+        requests = [message for message in messages if isinstance(message, dict) and message.get("reply_to")]
+        if requests and self.dispatcher:
+            self.dispatcher.dispatch_event("acknowledge_messages", requests)
+
+    def query_history(self, start_date=None, end_date=None, after=None, limit=HISTORY_PAGE_SIZE, projections=(), newest_first=False):
+        """
+        Returns one page of the study history, one item per day, and the cursor of the next page.
+
+        Args:
+            start_date, end_date (date): Only days within this range (inclusive) are returned
+            after (str): Cursor returned with the previous page, None for the first page
+            limit (int): Maximum number of days in the page
+            projections (iterable): What to add to each day besides its date, any of HISTORY_PROJECTIONS
+            newest_first (bool): Order the days from the most recent one
+
+        Returns:
+            tuple: (list of days, cursor of the next page or None if this was the last page)
+        """
+        unknown = set(projections) - set(HISTORY_PROJECTIONS)
+        if unknown:
+            raise ValueError(f"Unknown history projections {sorted(unknown)}, expected any of {HISTORY_PROJECTIONS}")
+
+        # Keyset pagination on (date, id) so every page is an index range scan, however far into the study it is
+        date_order, id_order = (StudyMeta.date.desc(), StudyMeta.id.desc()) if newest_first else (StudyMeta.date, StudyMeta.id)
+        statement = select(StudyMeta).order_by(date_order, id_order).limit(limit + 1)
+        if start_date:
+            statement = statement.where(StudyMeta.date >= start_date)
+        if end_date:
+            statement = statement.where(StudyMeta.date <= end_date)
+        if after:
+            after_date, after_id = decode_history_cursor(after)
+            if newest_first:
+                statement = statement.where(tuple_(StudyMeta.date, StudyMeta.id) < tuple_(after_date, after_id))
+            else:
+                statement = statement.where(tuple_(StudyMeta.date, StudyMeta.id) > tuple_(after_date, after_id))
+
+        with self.session_factory() as session:
+            rows = session.exec(statement).all()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_history_cursor(rows[-1])
+
+            days = {row.id: {"date": row.date.isoformat()} for row in rows}
+            if "counts" in projections:
+                for row in rows:
+                    days[row.id].update({
+                        "interactions": row.number_of_interactions_in_a_day,
+                        "robot_crashes": row.number_of_robot_crashes,
+                        "network_failures": row.number_of_network_failures,
+                        "check_ins": 0,
+                    })
+            if "durations" in projections:
+                for row in rows:
+                    days[row.id].update({"total_duration_seconds": 0, "check_in_times": []})
+            if days and ("counts" in projections or "durations" in projections):
+                # One query for the check-ins of every day in the page
+                check_ins = session.exec(
+                    select(CheckInMeta.study_meta_id, CheckInMeta.checkin_time, CheckInMeta.checkin_duration)
+                    .where(CheckInMeta.study_meta_id.in_(days.keys()))
+                    .order_by(CheckInMeta.study_meta_id, CheckInMeta.checkin_time)
+                ).all()
+                for study_meta_id, checkin_time, checkin_duration in check_ins:
+                    day = days[study_meta_id]
+                    if "counts" in projections:
+                        day["check_ins"] += 1
+                    if "durations" in projections:
+                        day["total_duration_seconds"] += checkin_duration
+                        day["check_in_times"].append(checkin_time.strftime("%H:%M:%S"))
+            if "responses" in projections:
+                for day in days.values():
+                    day["responses"] = []
+                if days:
+                    responses = session.exec(
+                        select(CheckInMeta.study_meta_id, CheckIn.question, CheckIn.response)
+                        .join(CheckIn, CheckIn.checkin_meta_id == CheckInMeta.id)
+                        .where(CheckInMeta.study_meta_id.in_(days.keys()))
+                        .order_by(CheckInMeta.study_meta_id, CheckIn.id)
+                    ).all()
+                    for study_meta_id, question, response in responses:
+                        days[study_meta_id]["responses"].append({"question": question, "response": response})
+
+        return [days[row.id] for row in rows], next_cursor
 
-        self.session.add(study_meta)
-        self.session.commit()  # Commit to generate an ID for the new StudyMeta
-        self.session.refresh(study_meta)
+    def retrieve_history(self, query=None):
+        """
+        Streams the study history to the user interface, one "send_history" event per chunk of days, so a long
+        study is rendered as it arrives instead of in one message.
 
-    def retrieve_history(self):
+        The query is a dict that may hold "request_id" (echoed in every chunk), "start_date" and "end_date"
+        (YYYY-MM-DD), "cursor", "limit" (days in total), "chunk_size", "projections" and "newest_first". Without a
+        query the whole history is streamed. The last chunk is marked "done" and carries the cursor to continue
+        from if the limit was reached before the end of the history.
+        """
         print("Retrieving history")
-        statement = select(StudyMeta)
-        study_meta_list = self.session.exec(statement).all()
-        if not study_meta_list:
-            return None
-        
-        serialised_data = []
-        
-        for row in study_meta_list:
-            serialised_data.append(
-                {
-                    "date": row.date,
+        query = query or {}
+        request_id = query.get("request_id")
+        remaining = int(query["limit"]) if query.get("limit") else None
+        chunk_size = max(1, min(int(query.get("chunk_size") or HISTORY_PAGE_SIZE), MAX_HISTORY_CHUNK_SIZE))
+        start_date = date.fromisoformat(query["start_date"]) if query.get("start_date") else None
+        end_date = date.fromisoformat(query["end_date"]) if query.get("end_date") else None
+        cursor = query.get("cursor")
+
+        chunk_index = 0
+        while True:
+            page_size = chunk_size if remaining is None else min(chunk_size, remaining)
+            days, cursor = self.query_history(
+                start_date=start_date,
+                end_date=end_date,
+                after=cursor,
+                limit=page_size,
+                projections=query.get("projections") or (),
+                newest_first=bool(query.get("newest_first")),
+            )
+            if remaining is not None:
+                remaining -= len(days)
+            done = cursor is None or remaining == 0
+            self.dispatcher.dispatch_event("send_history", {
+                "request_id": request_id,
+                "chunk": chunk_index,
+                "items": days,
+                "done": done,
+                "next_cursor": cursor,
+            })
+            if done:
+                print(f"Retrieved history in {chunk_index + 1} chunk(s)")
+                return
+            chunk_index += 1
+
+    def query_aggregates(self, start_date=None, end_date=None, period="day", questions=None):
+        """
+        Returns the aggregates of every day, or week (starting on Monday), of the study within the range. Only the
+        precomputed daily totals are read, so the cost depends on the number of days rather than of check-ins.
+
+        Args:
+            start_date, end_date (date): Only days within this range (inclusive) are aggregated
+            period (str): One of AGGREGATE_PERIODS
+            questions (iterable): Only return the scores of these questions, all of them when None
+
+        Returns:
+            list: One dict per period with activity, in date order
+        """
+        if period not in AGGREGATE_PERIODS:
+            raise ValueError(f"Unknown aggregate period '{period}', expected one of {AGGREGATE_PERIODS}")
+
+        days_statement = select(DailyAggregate).order_by(DailyAggregate.date)
+        scores_statement = select(DailyQuestionScore).order_by(DailyQuestionScore.date, DailyQuestionScore.question)
+        if start_date:
+            days_statement = days_statement.where(DailyAggregate.date >= start_date)
+            scores_statement = scores_statement.where(DailyQuestionScore.date >= start_date)
+        if end_date:
+            days_statement = days_statement.where(DailyAggregate.date <= end_date)
+            scores_statement = scores_statement.where(DailyQuestionScore.date <= end_date)
+        if questions is not None:
+            scores_statement = scores_statement.where(DailyQuestionScore.question.in_(list(questions)))
+
+        with self.session_factory() as session:
+            days = session.exec(days_statement).all()
+            question_scores = session.exec(scores_statement).all()
+
+        def period_of(day):
+            return day - timedelta(days=day.weekday()) if period == "week" else day
+
+        totals = {}
+        def totals_of(day):
+            return totals.setdefault(period_of(day), {
+                "interactions": 0,
+                "check_ins": 0,
+                "reminders": 0,
+                "days_with_reminders": 0,
+                "days_checked_in_after_reminder": 0,
+                "durations": {"total": 0, "min": None, "max": None},
+                "scores": {},
+            })
+
+        for day in days:
+            period_totals = totals_of(day.date)
+            period_totals["interactions"] += day.interactions
+            period_totals["check_ins"] += day.check_ins
+            period_totals["reminders"] += day.reminders
+            if day.reminders:
+                period_totals["days_with_reminders"] += 1
+                if day.check_ins:
+                    period_totals["days_checked_in_after_reminder"] += 1
+            durations = period_totals["durations"]
+            durations["total"] += day.check_in_duration_total
+            if day.check_in_duration_min is not None:
+                durations["min"] = min(durations["min"], day.check_in_duration_min) if durations["min"] is not None else day.check_in_duration_min
+                durations["max"] = max(durations["max"], day.check_in_duration_max) if durations["max"] is not None else day.check_in_duration_max
+
+        for question_score in question_scores:
+            scores = totals_of(question_score.date)["scores"]
+            if question_score.question in scores:
+                score = scores[question_score.question]
+                score["responses"] += question_score.responses
+                score["total"] += question_score.score_total
+                score["min"] = min(score["min"], question_score.score_min)
+                score["max"] = max(score["max"], question_score.score_max)
+            else:
+                scores[question_score.question] = {
+                    "responses": question_score.responses,
+                    "total": question_score.score_total,
+                    "min": question_score.score_min,
+                    "max": question_score.score_max,
                 }
+
+        aggregates = []
+        for start, period_totals in sorted(totals.items()):
+            durations = period_totals["durations"]
+            check_ins = period_totals["check_ins"]
+            days_with_reminders = period_totals["days_with_reminders"]
+            aggregates.append({
+                "date": start.isoformat(),
+                "interactions": period_totals["interactions"],
+                "check_ins": check_ins,
+                "reminders": period_totals["reminders"],
+                # Share of the days a reminder was sent on that had a check-in
+                "reminder_adherence": period_totals["days_checked_in_after_reminder"] / days_with_reminders if days_with_reminders else None,
+                "check_in_duration_seconds": {
+                    "total": durations["total"],
+                    "mean": durations["total"] / check_ins if check_ins else None,
+                    "min": durations["min"],
+                    "max": durations["max"],
+                },
+                "scores": {
+                    question: {
+                        "responses": score["responses"],
+                        "mean": score["total"] / score["responses"],
+                        "min": score["min"],
+                        "max": score["max"],
+                    }
+                    for question, score in period_totals["scores"].items()
+                },
+            })
+        return aggregates
+
+    def retrieve_aggregates(self, request=None):
+        """
+        Sends the aggregates asked for to the requester as a "send_aggregates" event.
+
+        The request is a dict that may hold "request_id" (echoed in the response), "period" ("day" or "week"),
+        "start_date" and "end_date" (YYYY-MM-DD) and "questions". An invalid request is answered with an "error".
+        """
+        print("Retrieving aggregates")
+        request = request or {}
+        response = {"request_id": request.get("request_id"), "period": request.get("period") or "day"}
+        try:
+            response["items"] = self.query_aggregates(
+                start_date=date.fromisoformat(request["start_date"]) if request.get("start_date") else None,
+                end_date=date.fromisoformat(request["end_date"]) if request.get("end_date") else None,
+                period=response["period"],
+                questions=request.get("questions"),
             )
-            
-        print(f"Retrieved history: {serialised_data}")
-        self.dispatcher.dispatch_event("send_history", serialised_data)
\ No newline at end of file
+        except (TypeError, ValueError) as error:
+            print(f"Invalid aggregates request: {error}")
+            response["items"] = []
+            response["error"] = str(error)
+        self.dispatcher.dispatch_event("send_aggregates", {"request": request, "response": response})
+
+
+class ShardedStudyDatabaseManager:
+    def __init__(self, router, dispatcher=None, default_participant=None):
+        """
+        Handles the study data events of a cohort, each participant's data in their own shard (see ShardRouter).
+        Payloads name their participant in a "participant" field, payloads without one are saved to the default
+        participant.
+        """
+        self.router = router
+        self.dispatcher = dispatcher
+        self.default_participant = default_participant
+
+        # participant -> StudyDatabaseManager of their shard
+        self.managers = {}
+        self._lock = threading.Lock()
+
+        if self.dispatcher:
+            self.dispatcher.register_event("save_check_in", self.save_check_in)
+            self.dispatcher.register_event("save_check_in_batch", self.save_check_in_batch)
+            self.dispatcher.register_event("create_new_reminder", self.create_new_reminder)
+            self.dispatcher.register_event("request_history", self.retrieve_history)
+            self.dispatcher.register_event("request_aggregates", self.retrieve_aggregates)
+
+    def manager_for(self, participant=None):
+        participant = self.router.shard_key(participant or self.default_participant)
+        with self._lock:
+            if participant not in self.managers:
+                self.managers[participant] = StudyDatabaseManager(
+                    self.router.session_factory(participant), self.dispatcher, register_events=False
+                )
+            return self.managers[participant]
+
+    @staticmethod
+    def participant_of(payload):
+        return payload.get("participant") if isinstance(payload, dict) else None
+
+    def save_check_in(self, check_in_data):
+        self.manager_for(self.participant_of(check_in_data)).save_check_in(check_in_data)
+
+    def save_check_ins(self, check_ins):
+        """Saves a batch that may hold the check-ins of several participants, in one transaction per shard."""
+        by_participant = defaultdict(list)
+        for check_in_data in check_ins:
+            by_participant[self.router.shard_key(self.participant_of(check_in_data) or self.default_participant)].append(check_in_data)
+        for participant, participant_check_ins in by_participant.items():
+            self.manager_for(participant).save_check_ins(participant_check_ins)
+
+    def save_check_in_batch(self, batch):
+        self.save_check_ins(batch["messages"])
+        if batch.get("reply_to") and self.dispatcher:
+            self.dispatcher.dispatch_event("acknowledge_messages", [batch])
+
+    def create_new_reminder(self, reminder):
+        self.manager_for(self.participant_of(reminder)).create_new_reminder(reminder)
+
+    def retrieve_history(self, query=None):
+        self.manager_for(self.participant_of(query)).retrieve_history(query)
+
+    def retrieve_aggregates(self, request=None):
+        """
+        Answers like StudyDatabaseManager.retrieve_aggregates for a single participant. A request with "cohort"
+        set is answered with the aggregates of every participant instead, under "participants".
+        """
+        request = request or {}
+        if not request.get("cohort"):
+            self.manager_for(self.participant_of(request)).retrieve_aggregates(request)
+            return
+
+        print("Retrieving cohort aggregates")
+        response = {"request_id": request.get("request_id"), "period": request.get("period") or "day"}
+        try:
+            response["participants"] = self.cohort_aggregates(
+                start_date=date.fromisoformat(request["start_date"]) if request.get("start_date") else None,
+                end_date=date.fromisoformat(request["end_date"]) if request.get("end_date") else None,
+                period=response["period"],
+                questions=request.get("questions"),
+                participants=request.get("participants"),
+            )
+        except (TypeError, ValueError) as error:
+            print(f"Invalid aggregates request: {error}")
+            response["participants"] = {}
+            response["error"] = str(error)
+        self.dispatcher.dispatch_event("send_aggregates", {"request": request, "response": response})
+
+    # Cross-shard queries
+    def for_each_participant(self, function, participants=None):
+        """
+        Calls function(manager) with the StudyDatabaseManager of each participant, every participant with a shard
+        by default. Shards are visited one at a time, so no more than the router's open shards are held open.
+
+        Returns:
+            dict: participant -> what the function returned for them
+        """
+        if participants is None:
+            participants = self.router.participants()
+        return {participant: function(self.manager_for(participant)) for participant in participants}
+
+    def cohort_aggregates(self, start_date=None, end_date=None, period="day", questions=None, participants=None):
+        """Returns the daily or weekly aggregates (see StudyDatabaseManager.query_aggregates) of each participant."""
+        return self.for_each_participant(
+            lambda manager: manager.query_aggregates(start_date=start_date, end_date=end_date, period=period, questions=questions),
+            participants,
+        )
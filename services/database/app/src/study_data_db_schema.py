@@ -1,5 +1,7 @@
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel, Relationship
 from typing import List, Optional
+from datetime import date as Date, datetime as DateTime, time as Time
 
 class StudyMeta(SQLModel, table=True):
     """
@@ -9,7 +11,7 @@ class StudyMeta(SQLModel, table=True):
     number_of_interactions_in_a_day: int
     number_of_robot_crashes: int
     number_of_network_failures: int
-    date: str  # Format: YYYY-MM-DD
+    date: Date = Field(index=True, unique=True)
     reminder_message: str
 
     # Relationship with CheckInMeta
@@ -21,11 +23,11 @@ class CheckInMeta(SQLModel, table=True):
     Stores metadata for each check-in session.
     """
     id: int = Field(default=None, primary_key=True)
-    checkin_time: str  # Format: HH:MM
-    checkin_duration: str  # Format: HH:MM
+    checkin_time: Time
+    checkin_duration: int  # Seconds
 
     # Foreign Key linking to StudyMeta
-    study_meta_id: int = Field(default=None, foreign_key="studymeta.id")
+    study_meta_id: int = Field(default=None, foreign_key="studymeta.id", index=True)
     study_meta: Optional[StudyMeta] = Relationship(back_populates="checkin_meta")
 
     # Relationship with CheckIn
@@ -41,5 +43,43 @@ class CheckIn(SQLModel, table=True):
     response: str
 
     # Foreign Key linking to CheckInMeta
-    checkin_meta_id: int = Field(default=None, foreign_key="checkinmeta.id")
+    checkin_meta_id: int = Field(default=None, foreign_key="checkinmeta.id", index=True)
     checkin_meta: Optional[CheckInMeta] = Relationship(back_populates="checkins")
+
+
+class DailyAggregate(SQLModel, table=True):
+    """
+    Running totals of each day of the study, updated in the same transaction as the check-ins and reminders
+    they count, so they never need to be recomputed from the rows above.
+    """
+    date: Date = Field(primary_key=True)
+    interactions: int = 0
+    check_ins: int = 0
+    reminders: int = 0
+    check_in_duration_total: int = 0  # Seconds
+    check_in_duration_min: Optional[int] = None
+    check_in_duration_max: Optional[int] = None
+
+
+class DailyQuestionScore(SQLModel, table=True):
+    """
+    Running totals of the numeric (1 to 10) responses given to each question on each day.
+    """
+    __table_args__ = (
+        Index("ix_dailyquestionscore_question_date", "question", "date"),
+    )
+
+    date: Date = Field(primary_key=True)
+    question: str = Field(primary_key=True)
+    responses: int = 0
+    score_total: int = 0
+    score_min: int
+    score_max: int
+
+
+class ProcessedMessage(SQLModel, table=True):
+    """
+    Idempotency keys of the messages already saved, so a message delivered again by a DurableOutbox is ignored.
+    """
+    idempotency_key: str = Field(primary_key=True)
+    processed_at: DateTime
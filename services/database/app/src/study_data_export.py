@@ -0,0 +1,264 @@
+'''
+Exports the study data to columnar files for analysis.
+
+Each table is written as a dataset partitioned by participant and day, in the hive layout Arrow, pandas, Polars
+and DuckDB discover partitions from:
+
+    <output>/checkin/participant=<participant>/date=<YYYY-MM-DD>/part-<first id>.parquet
+    <output>/checkinmeta/participant=<participant>/date=<YYYY-MM-DD>/part-<first id>.parquet
+    <output>/studymeta/participant=<participant>/date=<YYYY-MM-DD>/part-0.parquet
+
+Rows are read in batches of batch_size and every batch is written as soon as it is read, so the memory used does
+not grow with the size of the study. Check-ins are never changed once saved, so exports are incremental: the last
+id exported from each check-in table is kept in <output>/_watermark_<participant>.json, and the next export only
+writes the rows saved since, to new part files. StudyMeta rows are updated in place (interaction counters and
+reminder message) and there is only one per day, so the StudyMeta file of every day is rewritten on each export.
+Part files are written under a temporary name and renamed once complete, and the watermark is saved last, so an
+interrupted export is simply repeated by the next one.
+
+Parquet needs pyarrow (pinned in requirements.txt). The csv format writes the same layout without it.
+'''
+import csv
+import json
+import os
+import re
+from datetime import datetime
+
+from sqlmodel import select
+from .study_data_db_schema import StudyMeta, CheckInMeta, CheckIn
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FORMATS = ("parquet", "csv")
+EXPORT_BATCH_SIZE = 10000
+
+# Columns of each exported table, the date and participant are given by the partition
+EXPORT_TABLES = {
+    "studymeta": [
+        ("id", "int64"),
+        ("number_of_interactions_in_a_day", "int64"),
+        ("number_of_robot_crashes", "int64"),
+        ("number_of_network_failures", "int64"),
+        ("reminder_message", "string"),
+    ],
+    "checkinmeta": [
+        ("id", "int64"),
+        ("study_meta_id", "int64"),
+        ("checkin_time", "time"),
+        ("checkin_duration", "int64"),
+    ],
+    "checkin": [
+        ("id", "int64"),
+        ("checkin_meta_id", "int64"),
+        ("question", "string"),
+        ("response", "string"),
+    ],
+}
+# Tables whose rows are never updated, exported incrementally from the watermark
+INCREMENTAL_TABLES = ("checkinmeta", "checkin")
+
+
+def parquet_supported():
+    return pyarrow is not None
+
+
+def partition_value(value):
+    """Makes a value safe to use as a directory name."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(value))
+
+
+def _arrow_type(column_type):
+    return {
+        "int64": pyarrow.int64(),
+        "string": pyarrow.string(),
+        "time": pyarrow.time64("us"),
+    }[column_type]
+
+
+class ParquetPartWriter:
+    """Writes the batches of one partition as the row groups of a Parquet file."""
+    extension = "parquet"
+
+    def __init__(self, path, columns):
+        self.schema = pyarrow.schema([(name, _arrow_type(column_type)) for name, column_type in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write_batch(self, rows):
+        columns = list(zip(*rows))
+        arrays = [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_batch(pyarrow.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvPartWriter:
+    """Writes the batches of one partition to a CSV file with a header row."""
+    extension = "csv"
+
+    def __init__(self, path, columns):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write_batch(self, rows):
+        self.writer.writerows(
+            [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+            for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+
+PART_WRITERS = {"parquet": ParquetPartWriter, "csv": CsvPartWriter}
+
+
+class StudyDataExporter:
+    def __init__(self, session_factory, output_dir, participant, file_format="parquet", batch_size=EXPORT_BATCH_SIZE):
+        """
+        Args:
+            session_factory (sessionmaker): Opens sessions on the study database to export
+            output_dir (str): Root directory of the exported datasets, shared by all participants
+            participant (str): Identifies the participant (unit) the database belongs to
+            file_format (str): One of EXPORT_FORMATS
+            batch_size (int): Rows read from the database and written at a time
+        """
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{file_format}', expected one of {EXPORT_FORMATS}")
+        if file_format == "parquet" and not parquet_supported():
+            raise RuntimeError("Exporting to Parquet requires pyarrow (pip install pyarrow), or use the csv format")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.session_factory = session_factory
+        self.output_dir = output_dir
+        self.participant = partition_value(participant)
+        self.part_writer = PART_WRITERS[file_format]
+        self.batch_size = batch_size
+        self.watermark_path = os.path.join(output_dir, f"_watermark_{self.participant}.json")
+
+    def load_watermark(self):
+        """Returns the last id exported from each incremental table."""
+        try:
+            with open(self.watermark_path, encoding="utf-8") as file:
+                watermark = json.load(file)
+        except FileNotFoundError:
+            watermark = {}
+        return {table: int(watermark.get(table, 0)) for table in INCREMENTAL_TABLES}
+
+    def save_watermark(self, watermark):
+        temporary_path = f"{self.watermark_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(dict(watermark, exported_at=datetime.now().isoformat(timespec="seconds")), file, indent=4)
+        os.replace(temporary_path, self.watermark_path)
+
+    def export(self, full=False):
+        """
+        Exports the rows saved since the previous export, or every row if full is True. A full export first
+        removes the participant's previously exported files so that no row is exported twice.
+
+        Returns:
+            dict: The number of rows exported from each table
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        if full:
+            self._remove_exported_files()
+        watermark = {table: 0 for table in INCREMENTAL_TABLES} if full else self.load_watermark()
+
+        studymeta_statement = (
+            select(StudyMeta.date, StudyMeta.id, StudyMeta.number_of_interactions_in_a_day, StudyMeta.number_of_robot_crashes,
+                   StudyMeta.number_of_network_failures, StudyMeta.reminder_message)
+            .order_by(StudyMeta.date, StudyMeta.id)
+        )
+        checkinmeta_statement = (
+            select(StudyMeta.date, CheckInMeta.id, CheckInMeta.study_meta_id, CheckInMeta.checkin_time, CheckInMeta.checkin_duration)
+            .join(StudyMeta, StudyMeta.id == CheckInMeta.study_meta_id)
+            .where(CheckInMeta.id > watermark["checkinmeta"])
+            .order_by(StudyMeta.date, CheckInMeta.id)
+        )
+        checkin_statement = (
+            select(StudyMeta.date, CheckIn.id, CheckIn.checkin_meta_id, CheckIn.question, CheckIn.response)
+            .join(CheckInMeta, CheckInMeta.id == CheckIn.checkin_meta_id)
+            .join(StudyMeta, StudyMeta.id == CheckInMeta.study_meta_id)
+            .where(CheckIn.id > watermark["checkin"])
+            .order_by(StudyMeta.date, CheckIn.id)
+        )
+
+        exported = {}
+        with self.session_factory() as session:
+            exported["studymeta"], _ = self._export_table(session, "studymeta", studymeta_statement, incremental=False)
+            for table, statement in (("checkinmeta", checkinmeta_statement), ("checkin", checkin_statement)):
+                exported[table], last_id = self._export_table(session, table, statement, incremental=True)
+                watermark[table] = max(watermark[table], last_id)
+
+        self.save_watermark(watermark)
+        print(f"Exported {exported} for participant {self.participant} to {self.output_dir}")
+        return exported
+
+    def _export_table(self, session, table, statement, incremental):
+        """
+        Streams the rows of a statement selecting the date followed by the exported columns, ordered by date, into
+        one part file per day. Returns the number of rows written and the largest id among them.
+        """
+        columns = EXPORT_TABLES[table]
+        rows_written = 0
+        last_id = 0
+        current_date = None
+        writer = None
+        part_path = None
+        try:
+            result = session.execute(statement, execution_options={"yield_per": self.batch_size})
+            for partition in result.partitions():
+                start = 0
+                while start < len(partition):
+                    # Split the batch where the day changes, each day goes to its own file
+                    batch_date = partition[start][0]
+                    end = start
+                    while end < len(partition) and partition[end][0] == batch_date:
+                        end += 1
+                    rows = [tuple(row[1:]) for row in partition[start:end]]
+
+                    if batch_date != current_date:
+                        if writer:
+                            self._close_part(writer, part_path)
+                        current_date = batch_date
+                        first_id = rows[0][0] if incremental else 0
+                        part_path = self._part_path(table, current_date, f"part-{first_id}")
+                        writer = self.part_writer(f"{part_path}.tmp", columns)
+                    writer.write_batch(rows)
+
+                    rows_written += len(rows)
+                    last_id = max(last_id, max(row[0] for row in rows))
+                    start = end
+            if writer:
+                self._close_part(writer, part_path)
+                writer = None
+        finally:
+            if writer:
+                writer.close()
+                os.remove(f"{part_path}.tmp")
+        return rows_written, last_id
+
+    def _part_path(self, table, day, name):
+        directory = os.path.join(self.output_dir, table, f"participant={self.participant}", f"date={day.isoformat()}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{name}.{self.part_writer.extension}")
+
+    def _close_part(self, writer, part_path):
+        writer.close()
+        os.replace(f"{part_path}.tmp", part_path)
+
+    def _remove_exported_files(self):
+        for table in EXPORT_TABLES:
+            participant_dir = os.path.join(self.output_dir, table, f"participant={self.participant}")
+            for directory, _, file_names in os.walk(participant_dir):
+                for file_name in file_names:
+                    if file_name.startswith("part-"):
+                        os.remove(os.path.join(directory, file_name))
+        if os.path.exists(self.watermark_path):
+            os.remove(self.watermark_path)
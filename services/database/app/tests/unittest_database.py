@@ -0,0 +1,90 @@
+# unittest_database.py
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+
+# Add the database app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from sqlalchemy import text
+
+from src.database import DEFAULT_STORAGE_PROFILE, STORAGE_PROFILES, create_sqlite_engine, storage_profile_from_env
+
+# PRAGMA values as SQLite reports them: synchronous OFF=0, NORMAL=1, FULL=2 and temp_store MEMORY=2
+EXPECTED_PRAGMAS = {
+    "default": {"journal_mode": "delete", "synchronous": 2, "mmap_size": 0, "foreign_keys": 0},
+    "safe": {"journal_mode": "wal", "synchronous": 2, "mmap_size": 0, "busy_timeout": 5000, "foreign_keys": 1},
+    "balanced": {
+        "journal_mode": "wal",
+        "synchronous": 1,
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -8000,
+        "temp_store": 2,
+        "busy_timeout": 5000,
+        "foreign_keys": 1,
+    },
+}
+
+
+class TestStorageProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engines = []
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.dispose()
+        self.directory.cleanup()
+
+    def pragmas_of(self, pragmas, names):
+        engine = create_sqlite_engine(f"sqlite:///{os.path.join(self.directory.name, f'{len(self.engines)}.db')}", pragmas)
+        self.engines.append(engine)
+        with engine.connect() as connection:
+            return {name: connection.execute(text(f"PRAGMA {name}")).scalar() for name in names}
+
+    def test_every_profile_is_applied_to_new_connections(self):
+        self.assertEqual(sorted(EXPECTED_PRAGMAS), sorted(STORAGE_PROFILES))
+        for profile, expected in EXPECTED_PRAGMAS.items():
+            with self.subTest(profile=profile):
+                self.assertEqual(self.pragmas_of(STORAGE_PROFILES[profile], expected), expected)
+
+    def test_every_pooled_connection_is_configured(self):
+        engine = create_sqlite_engine(f"sqlite:///{os.path.join(self.directory.name, 'pooled.db')}", STORAGE_PROFILES["balanced"])
+        self.engines.append(engine)
+        with engine.connect() as first, engine.connect() as second:
+            for connection in (first, second):
+                self.assertEqual(connection.execute(text("PRAGMA synchronous")).scalar(), 1)
+
+    def test_profile_is_selected_with_sqlite_profile(self):
+        with patch.dict(os.environ, {"SQLITE_PROFILE": "safe"}):
+            self.assertEqual(storage_profile_from_env(), STORAGE_PROFILES["safe"])
+        with patch.dict(os.environ, {"SQLITE_PROFILE": ""}):
+            self.assertEqual(storage_profile_from_env(), STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
+        with patch.dict(os.environ, {"SQLITE_PROFILE": "fastest"}):
+            self.assertEqual(storage_profile_from_env(), STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
+
+    def test_pragmas_are_overridden_individually(self):
+        environment = {"SQLITE_PROFILE": "balanced", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_MMAP_SIZE": "0", "SQLITE_JOURNAL_MODE": ""}
+        with patch.dict(os.environ, environment):
+            pragmas = storage_profile_from_env()
+        self.assertEqual(pragmas, dict(STORAGE_PROFILES["balanced"], synchronous="FULL", mmap_size="0"))
+        self.assertEqual(
+            self.pragmas_of(pragmas, ("journal_mode", "synchronous", "mmap_size")),
+            {"journal_mode": "wal", "synchronous": 2, "mmap_size": 0},
+        )
+
+    def test_overrides_apply_to_the_default_profile(self):
+        with patch.dict(os.environ, {"SQLITE_PROFILE": "default", "SQLITE_JOURNAL_MODE": "WAL"}):
+            pragmas = storage_profile_from_env()
+        self.assertEqual(pragmas, {"journal_mode": "WAL"})
+        self.assertEqual(self.pragmas_of(pragmas, ("journal_mode",)), {"journal_mode": "wal"})
+
+
+if __name__ == '__main__':
+    unittest.main()
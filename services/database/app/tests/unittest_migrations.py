@@ -0,0 +1,170 @@
+# unittest_migrations.py
+
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date, time
+
+# Add the database app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from src.database import create_sqlite_engine
+from src.migrations import PERSISTENT_DATA_MIGRATIONS, STUDY_DATA_MIGRATIONS, migrate, schema_version
+from src.persistent_data_db_schema import ServiceState
+from src.study_data_db_schema import CheckInMeta, DailyAggregate, DailyQuestionScore, ProcessedMessage, StudyMeta
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_sqlite_engine(f"sqlite:///{os.path.join(self.directory.name, 'study.db')}", {"foreign_keys": "ON"})
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def execute(self, *statements):
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+
+    def rows(self, query):
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.exec_driver_sql(query)]
+
+    def create_legacy_study_database(self):
+        """The schema and the way values were stored before migrations were introduced (version 0)."""
+        self.execute(*STUDY_DATA_MIGRATIONS[0][2])
+        self.execute(
+            "INSERT INTO studymeta VALUES (1, 2, 0, 0, '2025-01-10', 'Time for your check-in')",
+            "INSERT INTO studymeta VALUES (2, 1, 1, 0, '2025-01-10', '')",
+            "INSERT INTO studymeta VALUES (3, 1, 0, 0, '2025-01-11', '')",
+            "INSERT INTO checkinmeta VALUES (1, '09:05', '12.6', 1)",
+            "INSERT INTO checkinmeta VALUES (2, '10:00:30', '30', 2)",
+            "INSERT INTO checkinmeta VALUES (3, '08:00:00.250000', '5', 3)",
+            "INSERT INTO checkin VALUES (1, 'How motivated are you?', '7', 1)",
+            "INSERT INTO checkin VALUES (2, 'How motivated are you?', 'nine', 1)",
+            "INSERT INTO checkin VALUES (3, 'How motivated are you?', ' 3 ', 2)",
+            "INSERT INTO checkin VALUES (4, 'How was your day?', '10', 3)",
+        )
+
+    def test_new_database_is_created_at_the_latest_version(self):
+        self.assertEqual(migrate(self.engine, STUDY_DATA_MIGRATIONS), STUDY_DATA_MIGRATIONS[-1][0])
+        self.assertEqual(schema_version(self.engine), STUDY_DATA_MIGRATIONS[-1][0])
+
+        # The tables match the SQLModel classes
+        with Session(self.engine) as session:
+            session.add(StudyMeta(id=1, number_of_interactions_in_a_day=1, number_of_robot_crashes=0,
+                                  number_of_network_failures=0, date=date(2025, 1, 10), reminder_message=""))
+            session.add(CheckInMeta(id=1, checkin_time=time(9, 5), checkin_duration=60, study_meta_id=1))
+            session.add(ProcessedMessage(idempotency_key="check-in-1", processed_at=date(2025, 1, 10)))
+            session.commit()
+            self.assertEqual(session.exec(select(CheckInMeta)).one().checkin_time, time(9, 5))
+
+    def test_migrating_again_does_nothing(self):
+        migrate(self.engine, STUDY_DATA_MIGRATIONS)
+        tables = self.rows("SELECT name FROM sqlite_master ORDER BY name")
+
+        self.assertEqual(migrate(self.engine, STUDY_DATA_MIGRATIONS), STUDY_DATA_MIGRATIONS[-1][0])
+        self.assertEqual(self.rows("SELECT name FROM sqlite_master ORDER BY name"), tables)
+
+    def test_legacy_columns_are_converted(self):
+        self.create_legacy_study_database()
+        migrate(self.engine, STUDY_DATA_MIGRATIONS)
+
+        self.assertEqual(self.rows("SELECT id, checkin_time, checkin_duration FROM checkinmeta ORDER BY id"), [
+            (1, "09:05:00.000000", 13),
+            (2, "10:00:30.000000", 30),
+            (3, "08:00:00.250000", 5),
+        ])
+        with Session(self.engine) as session:
+            self.assertEqual([meta.checkin_time for meta in session.exec(select(CheckInMeta).order_by(CheckInMeta.id))],
+                             [time(9, 5), time(10, 0, 30), time(8, 0, 0, 250000)])
+            self.assertEqual(session.exec(select(StudyMeta).where(StudyMeta.id == 3)).one().date, date(2025, 1, 11))
+
+    def test_rows_of_the_same_day_are_merged(self):
+        self.create_legacy_study_database()
+        migrate(self.engine, STUDY_DATA_MIGRATIONS)
+
+        self.assertEqual(self.rows("SELECT * FROM studymeta ORDER BY id"), [
+            (1, 3, 1, 0, "2025-01-10", "Time for your check-in"),
+            (3, 1, 0, 0, "2025-01-11", ""),
+        ])
+        self.assertEqual(self.rows("SELECT id, study_meta_id FROM checkinmeta ORDER BY id"), [(1, 1), (2, 1), (3, 3)])
+        with self.assertRaises(IntegrityError):
+            self.execute("INSERT INTO studymeta VALUES (4, 1, 0, 0, '2025-01-11', '')")
+
+    def test_daily_aggregates_are_backfilled(self):
+        self.create_legacy_study_database()
+        migrate(self.engine, STUDY_DATA_MIGRATIONS)
+
+        with Session(self.engine) as session:
+            aggregates = {aggregate.date: aggregate for aggregate in session.exec(select(DailyAggregate))}
+            scores = {(score.date, score.question): score for score in session.exec(select(DailyQuestionScore))}
+
+        first_day = aggregates[date(2025, 1, 10)]
+        self.assertEqual((first_day.interactions, first_day.check_ins, first_day.reminders), (3, 2, 1))
+        self.assertEqual((first_day.check_in_duration_total, first_day.check_in_duration_min, first_day.check_in_duration_max), (43, 13, 30))
+        self.assertEqual(aggregates[date(2025, 1, 11)].reminders, 0)
+
+        # Responses that are not whole numbers from 1 to 10 are not scored
+        motivation = scores[(date(2025, 1, 10), "How motivated are you?")]
+        self.assertEqual((motivation.responses, motivation.score_total, motivation.score_min, motivation.score_max), (2, 10, 3, 7))
+        self.assertEqual(scores[(date(2025, 1, 11), "How was your day?")].score_total, 10)
+
+    def test_duplicate_service_states_keep_the_latest_value(self):
+        self.execute(*PERSISTENT_DATA_MIGRATIONS[0][2])
+        self.execute(
+            "INSERT INTO servicestate VALUES (1, 'reminder', 'user_name', 'Alex')",
+            "INSERT INTO servicestate VALUES (2, 'peripherals', 'brightness', '50')",
+            "INSERT INTO servicestate VALUES (3, 'reminder', 'user_name', 'Sam')",
+        )
+        self.assertEqual(migrate(self.engine, PERSISTENT_DATA_MIGRATIONS), PERSISTENT_DATA_MIGRATIONS[-1][0])
+
+        with Session(self.engine) as session:
+            states = {(state.service_name, state.state_name): state.state_value for state in session.exec(select(ServiceState))}
+        self.assertEqual(states, {("reminder", "user_name"): "Sam", ("peripherals", "brightness"): "50"})
+        with self.assertRaises(IntegrityError):
+            self.execute("INSERT INTO servicestate VALUES (4, 'reminder', 'user_name', 'Alex')")
+
+    def test_a_failed_migration_is_rolled_back(self):
+        migrations = [
+            (1, "Table a", ["CREATE TABLE a (id INTEGER PRIMARY KEY)"]),
+            (2, "Table b", ["CREATE TABLE b (id INTEGER PRIMARY KEY)", "INSERT INTO missing_table VALUES (1)"]),
+        ]
+        with self.assertRaises(Exception):
+            migrate(self.engine, migrations)
+
+        self.assertEqual(schema_version(self.engine), 1)
+        self.assertEqual(self.rows("SELECT name FROM sqlite_master ORDER BY name"), [("a",)])
+
+    def test_a_migration_breaking_foreign_keys_is_rolled_back(self):
+        migrations = [
+            (1, "Tables", ["CREATE TABLE parent (id INTEGER PRIMARY KEY)",
+                           "CREATE TABLE child (id INTEGER PRIMARY KEY, parent_id INTEGER REFERENCES parent (id))"]),
+            (2, "Orphan", ["INSERT INTO child VALUES (1, 42)"]),
+        ]
+        with self.assertRaises(RuntimeError):
+            migrate(self.engine, migrations)
+
+        self.assertEqual(schema_version(self.engine), 1)
+        self.assertEqual(self.rows("SELECT * FROM child"), [])
+        self.assertEqual(self.rows("PRAGMA foreign_keys"), [(1,)])  # Restored after the migrations
+
+    def test_a_newer_database_is_refused(self):
+        self.execute("PRAGMA user_version=99")
+        with self.assertRaises(RuntimeError):
+            migrate(self.engine, STUDY_DATA_MIGRATIONS)
+
+
+if __name__ == '__main__':
+    unittest.main()
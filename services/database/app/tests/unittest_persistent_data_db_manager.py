@@ -0,0 +1,114 @@
+# unittest_persistent_data_db_manager.py
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+
+# Add the database app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session, select
+
+from shared_libraries.event_dispatcher import EventDispatcher, service_state_key
+from src.communication_interface import CommunicationInterface
+from src.database import create_sqlite_engine
+from src.migrations import PERSISTENT_DATA_MIGRATIONS, migrate
+from src.persistent_data_db_manager import PersistentDataManager
+from src.persistent_data_db_schema import ServiceState
+
+
+class TestPersistentDataManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_sqlite_engine(f"sqlite:///{os.path.join(self.directory.name, 'persistent.db')}", {})
+        migrate(self.engine, PERSISTENT_DATA_MIGRATIONS)
+        self.session_factory = sessionmaker(self.engine, class_=Session, expire_on_commit=False)
+        with self.session_factory.begin() as session:
+            session.add_all([
+                ServiceState(service_name="reminder", state_name="user_name", state_value="Alex"),
+                ServiceState(service_name="reminder", state_name="reminder_time_hr", state_value="9"),
+                ServiceState(service_name="speech_recognition", state_name="user_name", state_value="Alex"),
+                ServiceState(service_name="peripherals", state_name="brightness", state_value="50"),
+            ])
+
+        self.dispatcher = EventDispatcher()
+        self.manager = PersistentDataManager(self.session_factory, self.dispatcher)
+
+        # The communication interface publishes through a mocked MQTT client
+        with patch("shared_libraries.mqtt_client_base.mqtt.Client"):
+            self.communication_interface = CommunicationInterface("localhost", 1883, self.dispatcher)
+        self.published = []
+        self.communication_interface.publish = lambda topic, message: self.published.append((topic, message))
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def saved_states(self):
+        with self.session_factory() as session:
+            return {(state.service_name, state.state_name): state.state_value for state in session.exec(select(ServiceState))}
+
+    def test_states_are_read_from_the_cache(self):
+        self.assertEqual(self.manager.get_specific_service_state("reminder"), {"user_name": "Alex", "reminder_time_hr": "9"})
+        self.assertEqual(self.manager.get_specific_service_states("brightness"), "50")
+        self.assertIsNone(self.manager.get_specific_service_state("robot_control"))
+        self.assertEqual(len(self.manager.get_all_service_states_fields()), 4)
+
+    def test_update_is_written_through_and_published_to_every_service(self):
+        self.dispatcher.dispatch_event("update_service_states", {"service_name": "user_interface", "state_name": "user_name", "state_value": "Sam"})
+
+        self.assertEqual(self.saved_states()[("reminder", "user_name")], "Sam")
+        self.assertEqual(self.saved_states()[("speech_recognition", "user_name")], "Sam")
+        self.assertEqual(self.manager.get_specific_service_state("speech_recognition"), {"user_name": "Sam"})
+        self.assertCountEqual(self.published, [
+            ("service/reminder/update_state", {"state_name": "user_name", "state_value": "Sam"}),
+            ("service/speech_recognition/update_state", {"state_name": "user_name", "state_value": "Sam"}),
+        ])
+
+    def test_update_of_a_new_state_is_inserted(self):
+        self.dispatcher.dispatch_event("update_service_states", {"service_name": "robot_control", "state_name": "robot_colour", "state_value": "blue"})
+
+        self.assertEqual(self.saved_states()[("robot_control", "robot_colour")], "blue")
+        self.assertEqual(self.manager.get_specific_service_state("robot_control"), {"robot_colour": "blue"})
+
+    def test_system_state_update_publishes_the_states_of_every_service(self):
+        self.dispatcher.dispatch_event("service_control_command", "update_system_state")
+
+        self.assertCountEqual(self.published, [
+            ("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"}),
+            ("service/reminder/update_state", {"state_name": "reminder_time_hr", "state_value": "9"}),
+            ("service/speech_recognition/update_state", {"state_name": "user_name", "state_value": "Alex"}),
+            ("service/peripherals/update_state", {"state_name": "brightness", "state_value": "50"}),
+        ])
+
+    def test_system_state_update_is_published_before_it_is_acknowledged(self):
+        # Dispatch publish_service_state on a worker thread, the way main.py does
+        self.dispatcher.asynchronous = True
+        self.dispatcher.configure_event("publish_service_state", policy="coalesce", coalesce_key=service_state_key, coalesce_window=0.25)
+        self.communication_interface._handle_control_command({"cmd": "update_system_state"}, None)
+        self.dispatcher.shutdown(timeout=1)
+
+        topics = [topic for topic, _ in self.published]
+        self.assertEqual(len(topics), 5)
+        self.assertEqual(topics[-1], "database_status")
+        self.assertEqual(self.published[-1][1]["status"], "set_up")
+
+    def test_cache_is_reloaded_from_the_database(self):
+        self.manager.update_service_state("peripherals", "brightness", "80")
+        self.manager.delete_service_state("reminder")
+        self.manager.load_service_states()
+
+        self.assertEqual(self.manager.get_specific_service_states("brightness"), "80")
+        self.assertIsNone(self.manager.get_specific_service_state("reminder"))
+
+
+if __name__ == '__main__':
+    unittest.main()
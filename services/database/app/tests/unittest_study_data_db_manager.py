@@ -0,0 +1,267 @@
+# unittest_study_data_db_manager.py
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+from datetime import date
+
+# Add the database app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session, select
+
+from shared_libraries.event_dispatcher import EventDispatcher
+from src import study_data_db_manager
+from src.database import ShardRouter, create_sqlite_engine
+from src.migrations import STUDY_DATA_MIGRATIONS, migrate
+from src.study_data_db_manager import ShardedStudyDatabaseManager, StudyDatabaseManager
+from src.study_data_db_schema import CheckIn, CheckInMeta, DailyAggregate, ProcessedMessage, StudyMeta
+
+
+def check_in(day, check_in_time="09:00:00", duration=60, responses=(("How motivated are you?", "7"),), **fields):
+    return dict({
+        "date": day,
+        "check_in_time": check_in_time,
+        "check_in_duration_seconds": duration,
+        "responses": [{"question": question, "response": response} for question, response in responses],
+    }, **fields)
+
+
+class TestStudyDatabaseManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_sqlite_engine(f"sqlite:///{os.path.join(self.directory.name, 'study.db')}", {"foreign_keys": "ON"})
+        migrate(self.engine, STUDY_DATA_MIGRATIONS)
+        self.session_factory = sessionmaker(self.engine, class_=Session, expire_on_commit=False)
+
+        self.dispatcher = EventDispatcher()
+        self.events = []
+        for event_name in ("acknowledge_messages", "send_history", "send_aggregates"):
+            self.dispatcher.register_event(event_name, lambda payload, event_name=event_name: self.events.append((event_name, payload)))
+        self.manager = StudyDatabaseManager(self.session_factory, self.dispatcher)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def all(self, model):
+        with self.session_factory() as session:
+            return session.exec(select(model)).all()
+
+    def responses_by_check_in(self):
+        with self.session_factory() as session:
+            rows = session.exec(
+                select(CheckInMeta.checkin_duration, CheckIn.response)
+                .join(CheckIn, CheckIn.checkin_meta_id == CheckInMeta.id)
+                .order_by(CheckIn.id)
+            ).all()
+        return [tuple(row) for row in rows]
+
+    # Saving check-ins
+    def test_batch_of_check_ins_is_saved(self):
+        self.manager.save_check_ins([
+            check_in("2025-03-03", duration=60, responses=[("Q1", "7"), ("Q2", "walked")]),
+            check_in("2025-03-03", "18:00:00", duration=30, responses=[("Q1", "9")]),
+            check_in("2025-03-04", duration=45, responses=[]),
+        ])
+
+        self.assertEqual(len(self.all(CheckInMeta)), 3)
+        self.assertEqual(self.responses_by_check_in(), [(60, "7"), (60, "walked"), (30, "9")])
+        interactions = {row.date: row.number_of_interactions_in_a_day for row in self.all(StudyMeta)}
+        self.assertEqual(interactions, {date(2025, 3, 3): 2, date(2025, 3, 4): 1})
+
+    def test_check_in_ids_without_returning(self):
+        # SQLite before 3.35 has no INSERT ... RETURNING
+        self.manager.save_check_in(check_in("2025-03-02", duration=10, responses=[("Q1", "1")]))
+        with patch.object(study_data_db_manager, "SQLITE_HAS_RETURNING", False):
+            self.manager.save_check_ins([
+                check_in("2025-03-03", duration=20, responses=[("Q1", "2")]),
+                check_in("2025-03-03", duration=30, responses=[("Q1", "3"), ("Q2", "4")]),
+            ])
+        self.assertEqual(self.responses_by_check_in(), [(10, "1"), (20, "2"), (30, "3"), (30, "4")])
+
+    def test_batch_is_saved_in_one_transaction(self):
+        with self.assertRaises(ValueError):
+            self.manager.save_check_ins([
+                check_in("2025-03-03", idempotency_key="a"),
+                check_in("2025-03-03", check_in_time="not a time"),
+            ])
+        for model in (StudyMeta, CheckInMeta, CheckIn, DailyAggregate, ProcessedMessage):
+            self.assertEqual(self.all(model), [], model.__name__)
+
+    def test_duplicate_idempotency_keys_are_saved_once(self):
+        self.manager.save_check_ins([
+            check_in("2025-03-03", idempotency_key="a", reply_to="reply/ui", correlation_id="1"),
+            check_in("2025-03-03", idempotency_key="a", reply_to="reply/ui", correlation_id="2"),
+            check_in("2025-03-03", idempotency_key="b"),
+        ])
+        # Delivered again by the outbox, e.g. because the acknowledgement was lost
+        self.manager.save_check_in(check_in("2025-03-03", idempotency_key="b", reply_to="reply/ui", correlation_id="3"))
+
+        self.assertEqual(len(self.all(CheckInMeta)), 2)
+        self.assertEqual(sorted(row.idempotency_key for row in self.all(ProcessedMessage)), ["a", "b"])
+        self.assertEqual(self.all(DailyAggregate)[0].check_ins, 2)
+        # Duplicates are acknowledged as well, so the outbox stops sending them
+        acknowledged = [message["correlation_id"] for event_name, messages in self.events if event_name == "acknowledge_messages" for message in messages]
+        self.assertEqual(acknowledged, ["1", "2", "3"])
+
+    def test_batch_is_acknowledged_with_one_reply(self):
+        batch = {
+            "messages": [check_in("2025-03-03", idempotency_key="a"), check_in("2025-03-04", idempotency_key="b")],
+            "reply_to": "reply/ui",
+            "correlation_id": "1",
+        }
+        self.dispatcher.dispatch_event("save_check_in_batch", batch)
+        self.dispatcher.dispatch_event("save_check_in_batch", batch)
+
+        self.assertEqual(len(self.all(CheckInMeta)), 2)
+        self.assertEqual(self.events, [("acknowledge_messages", [batch]), ("acknowledge_messages", [batch])])
+
+    def test_reminder_is_recorded_once(self):
+        reminder = {"reminder_message": "Time for your check-in", "date": "2025-03-03", "idempotency_key": "r"}
+        self.manager.create_new_reminder(reminder)
+        self.manager.create_new_reminder(reminder)
+
+        study_meta = self.all(StudyMeta)[0]
+        self.assertEqual((study_meta.reminder_message, study_meta.number_of_interactions_in_a_day), ("Time for your check-in", 1))
+        self.assertEqual((self.all(DailyAggregate)[0].reminders, self.all(DailyAggregate)[0].interactions), (1, 1))
+
+    # Daily aggregates
+    def test_daily_aggregates_are_added_to(self):
+        self.manager.save_check_ins([check_in("2025-03-03", duration=60, responses=[("Q1", "7"), ("Q2", "walked")])])
+        self.manager.save_check_ins([check_in("2025-03-03", duration=20, responses=[("Q1", "3")])])
+        self.manager.create_new_reminder({"reminder_message": "Hi", "date": "2025-03-03"})
+
+        day = self.all(DailyAggregate)[0]
+        self.assertEqual(
+            (day.interactions, day.check_ins, day.reminders, day.check_in_duration_total, day.check_in_duration_min, day.check_in_duration_max),
+            (3, 2, 1, 80, 20, 60),
+        )
+
+    def test_query_aggregates_by_day_and_week(self):
+        self.manager.save_check_ins([
+            check_in("2025-03-03", duration=60, responses=[("Q1", "7")]),  # Monday
+            check_in("2025-03-03", duration=20, responses=[("Q1", "3"), ("Q2", "10")]),
+            check_in("2025-03-05", duration=40, responses=[("Q1", "8")]),
+            check_in("2025-03-10", duration=10, responses=[("Q1", "not a score")]),  # The next Monday
+        ])
+        self.manager.create_new_reminder({"reminder_message": "Hi", "date": "2025-03-03"})
+        self.manager.create_new_reminder({"reminder_message": "Hi", "date": "2025-03-04"})
+
+        days = self.manager.query_aggregates()
+        self.assertEqual([day["date"] for day in days], ["2025-03-03", "2025-03-04", "2025-03-05", "2025-03-10"])
+        monday = days[0]
+        self.assertEqual((monday["interactions"], monday["check_ins"], monday["reminders"]), (3, 2, 1))
+        self.assertEqual(monday["check_in_duration_seconds"], {"total": 80, "mean": 40, "min": 20, "max": 60})
+        self.assertEqual(monday["scores"]["Q1"], {"responses": 2, "mean": 5, "min": 3, "max": 7})
+        self.assertEqual(days[3]["scores"], {})
+
+        weeks = self.manager.query_aggregates(period="week", questions=["Q1"])
+        self.assertEqual([week["date"] for week in weeks], ["2025-03-03", "2025-03-10"])
+        first_week = weeks[0]
+        self.assertEqual((first_week["check_ins"], first_week["reminders"], first_week["reminder_adherence"]), (3, 2, 0.5))
+        self.assertEqual(first_week["check_in_duration_seconds"], {"total": 120, "mean": 40, "min": 20, "max": 60})
+        self.assertEqual(first_week["scores"], {"Q1": {"responses": 3, "mean": 6, "min": 3, "max": 8}})
+
+        in_range = self.manager.query_aggregates(start_date=date(2025, 3, 4), end_date=date(2025, 3, 5))
+        self.assertEqual([day["date"] for day in in_range], ["2025-03-04", "2025-03-05"])
+        with self.assertRaises(ValueError):
+            self.manager.query_aggregates(period="month")
+
+    # History
+    def save_days(self, count):
+        self.manager.save_check_ins([check_in(f"2025-03-{day:02d}", duration=day) for day in range(1, count + 1)])
+
+    def test_history_pages_end_at_the_boundary(self):
+        self.save_days(5)
+
+        first, cursor = self.manager.query_history(limit=2)
+        second, cursor = self.manager.query_history(after=cursor, limit=2)
+        third, last_cursor = self.manager.query_history(after=cursor, limit=2)
+        self.assertEqual([day["date"] for day in first + second + third], [f"2025-03-0{day}" for day in range(1, 6)])
+        self.assertIsNone(last_cursor)
+
+        # A last page that is exactly full has no next page
+        _, cursor = self.manager.query_history(limit=4)
+        page, cursor = self.manager.query_history(after=cursor, limit=1)
+        self.assertEqual(([day["date"] for day in page], cursor), (["2025-03-05"], None))
+
+    def test_history_newest_first_within_a_range(self):
+        self.save_days(5)
+
+        page, cursor = self.manager.query_history(start_date=date(2025, 3, 2), end_date=date(2025, 3, 4), limit=2, newest_first=True)
+        self.assertEqual([day["date"] for day in page], ["2025-03-04", "2025-03-03"])
+        page, cursor = self.manager.query_history(start_date=date(2025, 3, 2), end_date=date(2025, 3, 4), after=cursor, limit=2, newest_first=True)
+        self.assertEqual(([day["date"] for day in page], cursor), (["2025-03-02"], None))
+
+    def test_history_projections(self):
+        self.manager.save_check_ins([
+            check_in("2025-03-03", "09:00:00", duration=60, responses=[("Q1", "7")]),
+            check_in("2025-03-03", "18:00:00", duration=30, responses=[("Q1", "9")]),
+        ])
+
+        page, _ = self.manager.query_history(projections=("counts", "durations", "responses"))
+        self.assertEqual(page, [{
+            "date": "2025-03-03",
+            "interactions": 2,
+            "robot_crashes": 0,
+            "network_failures": 0,
+            "check_ins": 2,
+            "total_duration_seconds": 90,
+            "check_in_times": ["09:00:00", "18:00:00"],
+            "responses": [{"question": "Q1", "response": "7"}, {"question": "Q1", "response": "9"}],
+        }])
+        with self.assertRaises(ValueError):
+            self.manager.query_history(projections=("everything",))
+
+    def test_history_is_streamed_in_chunks(self):
+        self.save_days(5)
+        self.manager.retrieve_history({"request_id": "h", "chunk_size": 2, "limit": 3})
+
+        chunks = [payload for event_name, payload in self.events if event_name == "send_history"]
+        self.assertEqual([(chunk["chunk"], len(chunk["items"]), chunk["done"]) for chunk in chunks], [(0, 2, False), (1, 1, True)])
+        self.assertIsNotNone(chunks[-1]["next_cursor"])
+
+
+class TestShardedStudyDatabaseManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.router = ShardRouter(self.directory.name, "study.db", STUDY_DATA_MIGRATIONS, {}, max_open_shards=1)
+        self.dispatcher = EventDispatcher()
+        self.manager = ShardedStudyDatabaseManager(self.router, self.dispatcher, default_participant="p0")
+
+    def tearDown(self):
+        self.router.close()
+        self.directory.cleanup()
+
+    def test_check_ins_are_saved_to_the_shard_of_their_participant(self):
+        self.manager.save_check_ins([
+            check_in("2025-03-03", participant="p1"),
+            check_in("2025-03-03", participant="p2"),
+            check_in("2025-03-04", participant="p1"),
+            check_in("2025-03-04"),
+        ])
+        self.assertEqual(self.router.participants(), ["p0", "p1", "p2"])
+
+        aggregates = self.manager.cohort_aggregates(period="week")
+        self.assertEqual({participant: [week["check_ins"] for week in weeks] for participant, weeks in aggregates.items()}, {
+            "p0": [1],
+            "p1": [2],
+            "p2": [1],
+        })
+        aggregates = self.manager.cohort_aggregates(participants=["p1"], start_date=date(2025, 3, 4))
+        self.assertEqual(list(aggregates), ["p1"])
+        self.assertEqual([day["date"] for day in aggregates["p1"]], ["2025-03-04"])
+
+
+if __name__ == '__main__':
+    unittest.main()
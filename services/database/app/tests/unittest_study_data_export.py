@@ -0,0 +1,162 @@
+# unittest_study_data_export.py
+
+import unittest
+from unittest.mock import patch
+import csv
+import json
+import os
+import sys
+import tempfile
+
+# Add the database app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session
+
+from src import study_data_export
+from src.database import create_sqlite_engine
+from src.migrations import STUDY_DATA_MIGRATIONS, migrate
+from src.study_data_db_manager import StudyDatabaseManager
+from src.study_data_export import CsvPartWriter, StudyDataExporter
+
+
+def check_in(day, responses=("7",)):
+    return {
+        "date": day,
+        "check_in_time": "09:00:00",
+        "check_in_duration_seconds": 60,
+        "responses": [{"question": f"Q{index}", "response": response} for index, response in enumerate(responses, 1)],
+    }
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        return list(csv.DictReader(file))
+
+
+class TestStudyDataExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_sqlite_engine(f"sqlite:///{os.path.join(self.directory.name, 'study.db')}", {"foreign_keys": "ON"})
+        migrate(self.engine, STUDY_DATA_MIGRATIONS)
+        self.session_factory = sessionmaker(self.engine, class_=Session, expire_on_commit=False)
+        self.manager = StudyDatabaseManager(self.session_factory)
+        self.output = os.path.join(self.directory.name, "exports")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def exporter(self, **kwargs):
+        kwargs.setdefault("file_format", "csv")
+        return StudyDataExporter(self.session_factory, self.output, "P/01", **kwargs)
+
+    def exported_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, file_name), self.output)
+            for directory, _, file_names in os.walk(self.output)
+            for file_name in file_names
+        )
+
+    def test_tables_are_partitioned_by_participant_and_day(self):
+        self.manager.save_check_ins([check_in("2025-03-03", ("7", "walked")), check_in("2025-03-04")])
+        exported = self.exporter(batch_size=1).export()
+
+        self.assertEqual(exported, {"studymeta": 2, "checkinmeta": 2, "checkin": 3})
+        self.assertEqual(self.exported_files(), [
+            "_watermark_P_01.json",
+            "checkin/participant=P_01/date=2025-03-03/part-1.csv",
+            "checkin/participant=P_01/date=2025-03-04/part-3.csv",
+            "checkinmeta/participant=P_01/date=2025-03-03/part-1.csv",
+            "checkinmeta/participant=P_01/date=2025-03-04/part-2.csv",
+            "studymeta/participant=P_01/date=2025-03-03/part-0.csv",
+            "studymeta/participant=P_01/date=2025-03-04/part-0.csv",
+        ])
+        responses = read_csv(os.path.join(self.output, "checkin/participant=P_01/date=2025-03-03/part-1.csv"))
+        self.assertEqual([(row["id"], row["question"], row["response"]) for row in responses], [("1", "Q1", "7"), ("2", "Q2", "walked")])
+        check_in_meta = read_csv(os.path.join(self.output, "checkinmeta/participant=P_01/date=2025-03-04/part-2.csv"))
+        self.assertEqual([(row["checkin_time"], row["checkin_duration"]) for row in check_in_meta], [("09:00:00", "60")])
+
+    def test_next_export_starts_after_the_watermark(self):
+        self.manager.save_check_ins([check_in("2025-03-03")])
+        self.exporter().export()
+        with open(os.path.join(self.output, "_watermark_P_01.json"), encoding="utf-8") as file:
+            watermark = json.load(file)
+        self.assertEqual((watermark["checkinmeta"], watermark["checkin"]), (1, 1))
+
+        self.manager.save_check_ins([check_in("2025-03-03", ("8", "9"))])
+        exported = self.exporter().export()
+        self.assertEqual(exported, {"studymeta": 1, "checkinmeta": 1, "checkin": 2})
+        day = "participant=P_01/date=2025-03-03"
+        self.assertEqual([row["id"] for row in read_csv(os.path.join(self.output, "checkin", day, "part-2.csv"))], ["2", "3"])
+        # StudyMeta rows change in place, so the file of the day is rewritten with the new counters
+        self.assertEqual(read_csv(os.path.join(self.output, "studymeta", day, "part-0.csv"))[0]["number_of_interactions_in_a_day"], "2")
+
+        self.assertEqual(self.exporter().export(), {"studymeta": 1, "checkinmeta": 0, "checkin": 0})
+
+    def test_full_export_replaces_the_exported_files(self):
+        self.manager.save_check_ins([check_in("2025-03-03")])
+        self.exporter().export()
+        self.manager.save_check_ins([check_in("2025-03-03")])
+        self.exporter().export()
+
+        exported = self.exporter().export(full=True)
+        self.assertEqual(exported, {"studymeta": 1, "checkinmeta": 2, "checkin": 2})
+        self.assertNotIn("checkin/participant=P_01/date=2025-03-03/part-2.csv", self.exported_files())
+
+    def test_part_file_is_renamed_once_complete(self):
+        self.manager.save_check_ins([check_in("2025-03-03")])
+        written = []
+        replace = os.replace
+
+        def record_replace(source, destination):
+            written.append((os.path.basename(source), os.path.exists(source), os.path.exists(destination)))
+            replace(source, destination)
+
+        with patch.object(study_data_export.os, "replace", record_replace):
+            self.exporter().export()
+        self.assertIn(("part-1.csv.tmp", True, False), written)
+        self.assertFalse([path for path in self.exported_files() if path.endswith(".tmp")])
+
+    def test_interrupted_export_is_repeated(self):
+        self.manager.save_check_ins([check_in("2025-03-03"), check_in("2025-03-04")])
+        write_batch = CsvPartWriter.write_batch
+        batches = []
+
+        def fail_second_batch(writer, rows):
+            batches.append(rows)
+            if len(batches) == 2:
+                raise OSError("No space left on device")
+            write_batch(writer, rows)
+
+        with patch.object(CsvPartWriter, "write_batch", fail_second_batch):
+            with self.assertRaises(OSError):
+                self.exporter().export()
+        # No partial part file and no watermark is left behind
+        self.assertEqual(self.exported_files(), ["studymeta/participant=P_01/date=2025-03-03/part-0.csv"])
+
+        self.assertEqual(self.exporter().export(), {"studymeta": 2, "checkinmeta": 2, "checkin": 2})
+
+    def test_parquet_without_pyarrow_fails(self):
+        with patch.object(study_data_export, "pyarrow", None):
+            with self.assertRaises(RuntimeError):
+                self.exporter(file_format="parquet")
+
+    @unittest.skipUnless(study_data_export.parquet_supported(), "pyarrow is not installed")
+    def test_parquet_export(self):
+        import pyarrow.parquet
+
+        self.manager.save_check_ins([check_in("2025-03-03", ("7", "walked"))])
+        self.exporter(file_format="parquet").export()
+        table = pyarrow.parquet.read_table(os.path.join(self.output, "checkin/participant=P_01/date=2025-03-03/part-1.parquet"))
+        self.assertEqual(table.column("response").to_pylist(), ["7", "walked"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from src.communication_interface import CommunicationInterface
+from src.event_log import EventLog
+
+import logging
+import time
+import threading
+
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries.logging_config import setup_logger
+from shared_libraries.event_dispatcher import EventDispatcher
+from shared_libraries.payload_codecs import get_codec_registry
+from shared_libraries.topic_router import TopicTrie
+
+FLUSH_INTERVAL = 1.0  # Seconds between writes of the active segment to disk
+MAINTENANCE_INTERVAL = 3600  # Seconds between retention and compaction runs
+
+# Only the last value of every service state is kept by compaction
+state_update_topics = TopicTrie()
+state_update_topics.add("service/+/update_state", True)
+codecs = get_codec_registry()
+
+
+def state_update_key(topic, payload):
+    if not state_update_topics.match(topic):
+        return None
+    try:
+        payload = codecs.decode(payload)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or "state_name" not in payload:
+        return None
+    return (topic, str(payload["state_name"]))
+
+
+def maintain(event_log):
+    last_maintenance = time.monotonic()
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            event_log.flush()
+            if time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                last_maintenance = time.monotonic()
+                removed_segments = event_log.apply_retention()
+                removed_records = event_log.compact()
+                logger.info(f"Event store maintenance removed {removed_segments} segment(s) and compacted away {removed_records} record(s)")
+        except Exception as e:
+            logger.error(f"Event store maintenance failed: {e}")
+
+
+if __name__ == "__main__":
+    try:
+        setup_logger()
+
+        logger = logging.getLogger("Main")
+
+        dispatcher = EventDispatcher(asynchronous=True)
+        # Queries read from disk, so they are answered on a worker thread instead of the MQTT network thread
+        dispatcher.configure_event("query_events", max_queue_size=10)
+
+        retention_days = float(os.getenv("EVENT_STORE_RETENTION_DAYS") or 0)
+        retention_mb = float(os.getenv("EVENT_STORE_RETENTION_MB") or 0)
+        event_log = EventLog(
+            os.getenv("EVENT_STORE_DIR") or os.path.join(current_dir, "data", "events"),
+            segment_size=int(float(os.getenv("EVENT_STORE_SEGMENT_MB") or 16) * 1024 * 1024),
+            retention_seconds=retention_days * 24 * 3600 if retention_days else None,
+            retention_bytes=int(retention_mb * 1024 * 1024) if retention_mb else None,
+            compaction_key=state_update_key,
+        )
+
+        communication_interface = CommunicationInterface(
+            broker_address=str(os.getenv("MQTT_BROKER_ADDRESS")),
+            port=int(os.getenv("MQTT_BROKER_PORT")),
+            event_log=event_log,
+            event_dispatcher=dispatcher,
+            excluded_topics=[topic for topic in (os.getenv("EVENT_STORE_EXCLUDE") or "robot/video_feed").split(",") if topic.strip()],
+        )
+
+        threading.Thread(target=maintain, args=(event_log,), daemon=True).start()
+        print("Event store service started.")
+
+        # Keep the main thread alive
+        while True:
+            time.sleep(0.4)
+    except KeyboardInterrupt:
+        communication_interface.disconnect()
+        event_log.close()
@@ -0,0 +1,139 @@
+import base64
+import collections
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries.mqtt_client_base import MQTTClientBase
+from shared_libraries.topic_router import TopicTrie
+
+DEFAULT_QUERY_LIMIT = 500
+MAX_QUERY_LIMIT = 5000
+
+
+def parse_time(value):
+    """Returns seconds since the epoch for a number of seconds or an ISO 8601 date or time, None for None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+class CommunicationInterface(MQTTClientBase):
+    def __init__(self, broker_address, port, event_log, event_dispatcher, excluded_topics=()):
+        super().__init__(broker_address, port)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.event_log = event_log
+        self.dispatcher = event_dispatcher
+
+        # Subscription topics
+        self.events_requested_topic = "request/event_store"
+
+        # Publish topics
+        self.events_topic = "event_store/events"
+
+        # Topics that are not recorded, e.g. the video feed
+        self.excluded_topics = TopicTrie()
+        for topic_filter in excluded_topics:
+            self.excluded_topics.add(topic_filter, topic_filter)
+
+        # Correlation ids of the queries answered recently, so the answers are not recorded in turn
+        self._answered = collections.deque(maxlen=100)
+        self._answered_lock = threading.Lock()
+
+        # Record every message on the bus
+        self.subscribe("#", self._record_message)
+        self.add_route(self.events_requested_topic, self._request_events)
+
+        self._register_event_handlers()
+
+    def _register_event_handlers(self):
+        if self.dispatcher:
+            self.dispatcher.register_event("query_events", self._answer_query)
+
+    def _record_message(self, client, userdata, message):
+        if self.excluded_topics.match(message.topic) or self._is_own_answer(message):
+            return
+        try:
+            self.event_log.append(message.topic, message.payload)
+        except ValueError as e:
+            self.metrics.increment("event_store.dropped", message.topic)
+            self.logger.error(f"Not recording the message on {message.topic}: {e}")
+
+    def _is_own_answer(self, message):
+        if message.topic == self.events_topic:
+            return True
+        if not message.topic.startswith("reply/"):
+            return False
+        correlation_id = self.correlation_id_of(message)
+        with self._answered_lock:
+            return correlation_id is not None and correlation_id in self._answered
+
+    def _request_events(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error("Invalid JSON payload for event store query. Unable to send events.")
+            return
+        self.logger.info(f"Events requested: {payload}")
+        self.dispatcher.dispatch_event("query_events", payload)
+
+    def _answer_query(self, request):
+        """
+        Answers a query with the recorded messages, on its reply_to topic when it was made with call(), on the events
+        topic otherwise. A query selects messages with
+
+            start, end: time range, in seconds since the epoch or ISO 8601
+            topic_prefix: start of the topics
+            after_sequence: next_sequence of the previous answer, to page through a range
+            limit: number of messages at most
+        """
+        response = {"request_id": request.get("request_id")}
+        try:
+            limit = min(int(request.get("limit") or DEFAULT_QUERY_LIMIT), MAX_QUERY_LIMIT)
+            records = self.event_log.query(
+                start=parse_time(request.get("start")),
+                end=parse_time(request.get("end")),
+                topic_prefix=request.get("topic_prefix"),
+                after_sequence=request.get("after_sequence"),
+                limit=limit,
+            )
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Invalid event store query {request}: {e}")
+            response["error"] = str(e)
+            records = []
+            limit = None
+
+        response["events"] = [self._event_of(record) for record in records]
+        # More may match when the limit was reached
+        response["next_sequence"] = records[-1].sequence if records and len(records) == limit else None
+
+        if request.get("correlation_id"):
+            with self._answered_lock:
+                self._answered.append(request["correlation_id"])
+        self.logger.info(f"Sending {len(records)} events for request {response['request_id']}")
+        self.reply(request, response, topic=self.events_topic)
+
+    def _event_of(self, record):
+        event = {
+            "sequence": record.sequence,
+            "timestamp": datetime.fromtimestamp(record.timestamp).isoformat(timespec="milliseconds"),
+            "topic": record.topic,
+        }
+        try:
+            payload = self.decode_payload(record.payload)
+        except ValueError:
+            # Encoded with a codec that is not installed here
+            payload = record.payload
+        if isinstance(payload, (bytes, bytearray)):
+            event["payload"] = base64.b64encode(record.payload).decode("ascii")
+            event["payload_encoding"] = "base64"
+        else:
+            event["payload"] = payload
+        return event
@@ -0,0 +1,399 @@
+'''
+Segmented, memory-mapped, append-only log of the messages seen on the bus.
+
+The log is a directory of segment files, each named after the sequence number of its first record and at most
+segment_size bytes long. The active segment is preallocated and memory-mapped, and records are appended to it as
+
+    crc32 (I) | sequence (Q) | timestamp (d) | topic length (H) | payload length (I) | topic | payload
+
+The CRC covers everything after it, so after a crash the end of the active segment is the first record that does
+not check out (the unused rest of a segment is zeros). When a segment is full it is truncated to its records and
+a new one is started.
+
+Timestamps never decrease, so each segment keeps a sparse time index in <segment>.index, one (timestamp, offset)
+entry every index_interval bytes, and a query starts reading at the last entry before its time range.
+
+Retention deletes whole segments once their last record is older than retention_seconds, or the oldest ones
+while the log is larger than retention_bytes. Compaction rewrites closed segments without the records superseded
+by a later record with the same compaction key, e.g. keeping only the last value of every state published on
+service/+/update_state.
+'''
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+RECORD_HEADER = struct.Struct("<IQdHI")
+RECORD_BODY_HEADER = struct.Struct("<QdHI")
+INDEX_ENTRY = struct.Struct("<dQ")
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".index"
+
+EventRecord = namedtuple("EventRecord", ["sequence", "timestamp", "topic", "payload"])
+
+
+def encode_record(sequence, timestamp, topic, payload):
+    body = RECORD_BODY_HEADER.pack(sequence, timestamp, len(topic), len(payload)) + topic + payload
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+
+def read_records(buffer, start, end, verify=False):
+    """
+    Yields (offset, end offset, EventRecord) for the records in buffer[start:end], stopping at the first one that is
+    incomplete, or that fails its CRC when verify is set.
+    """
+    offset = start
+    while offset + RECORD_HEADER.size <= end:
+        crc, sequence, timestamp, topic_length, payload_length = RECORD_HEADER.unpack_from(buffer, offset)
+        topic_start = offset + RECORD_HEADER.size
+        payload_start = topic_start + topic_length
+        record_end = payload_start + payload_length
+        if sequence == 0 or record_end > end:
+            return
+        if verify and zlib.crc32(buffer[offset + 4:record_end]) != crc:
+            return
+        topic = bytes(buffer[topic_start:payload_start]).decode("utf-8", errors="replace")
+        yield offset, record_end, EventRecord(sequence, timestamp, topic, bytes(buffer[payload_start:record_end]))
+        offset = record_end
+
+
+class _Segment:
+    def __init__(self, directory, first_sequence):
+        self.first_sequence = first_sequence
+        self.path = os.path.join(directory, f"{first_sequence:020d}{SEGMENT_SUFFIX}")
+        self.index_path = self.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+        self.size = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.last_sequence = first_sequence - 1
+        self.index_timestamps = []
+        self.index_offsets = []
+
+    def add_record(self, offset, record, end, index_interval):
+        """Updates the metadata with a record, returns True if the record should be added to the index."""
+        if self.first_timestamp is None:
+            self.first_timestamp = record.timestamp
+        self.last_timestamp = record.timestamp
+        self.last_sequence = record.sequence
+        self.size = end
+        if not self.index_offsets or offset - self.index_offsets[-1] >= index_interval:
+            self.index_timestamps.append(record.timestamp)
+            self.index_offsets.append(offset)
+            return True
+        return False
+
+    def offset_of(self, timestamp):
+        """Returns the offset to start reading at to find the first record at or after the timestamp."""
+        if timestamp is None or not self.index_timestamps:
+            return 0
+        position = bisect.bisect_left(self.index_timestamps, timestamp) - 1
+        return self.index_offsets[position] if position >= 0 else 0
+
+
+class EventLog:
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, index_interval=4096, retention_seconds=None,
+                 retention_bytes=None, compaction_key=None):
+        """
+        Args:
+            directory (str): Directory of the segment files, created if needed
+            segment_size (int): Bytes of records per segment at most
+            index_interval (int): Bytes of records between two entries of the time index
+            retention_seconds (float): Age after which whole segments are deleted, None to keep them
+            retention_bytes (int): Size the log is kept under by deleting its oldest segments, None for no limit
+            compaction_key (callable): Maps (topic, payload) to the key whose last value compaction keeps, or
+                None for records that are never compacted away. No compaction without it.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_interval = index_interval
+        self.retention_seconds = retention_seconds
+        self.retention_bytes = retention_bytes
+        self.compaction_key = compaction_key
+
+        self.segments = []
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._map = None
+        self._file = None
+        self._index_file = None
+        self._last_timestamp = 0.0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # Opening
+    def _load(self):
+        first_sequences = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for position, first_sequence in enumerate(first_sequences):
+            segment = _Segment(self.directory, first_sequence)
+            self._load_segment(segment, active=position == len(first_sequences) - 1)
+            self.segments.append(segment)
+
+        if not self.segments:
+            self.segments.append(_Segment(self.directory, 1))
+        active = self.segments[-1]
+        self._last_timestamp = max((segment.last_timestamp or 0.0) for segment in self.segments)
+        self._open_active(active)
+
+    def _load_segment(self, segment, active):
+        """Recovers the metadata of a segment from its index, rebuilding the index if it does not match the records."""
+        file_size = os.path.getsize(segment.path)
+        if file_size == 0:
+            return
+        with open(segment.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            index = self._read_index(segment, buffer, file_size)
+            if index:
+                segment.index_timestamps, segment.index_offsets = index
+                start = segment.index_offsets[-1]
+                first = next(read_records(buffer, 0, file_size, verify=True), None)
+                segment.first_timestamp = first[2].timestamp if first else None
+            else:
+                start = 0
+            # Only the records after the last index entry need reading, verified as they may be incomplete
+            for offset, end, record in read_records(buffer, start, file_size, verify=True):
+                segment.add_record(offset, record, end, self.index_interval)
+        if not index:
+            self._write_index(segment)
+
+    def _read_index(self, segment, buffer, file_size):
+        """Returns the (timestamps, offsets) of a segment's index file, or None if it is missing or stale."""
+        try:
+            with open(segment.index_path, "rb") as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            return None
+        count = len(data) // INDEX_ENTRY.size
+        if count == 0:
+            return None
+        entries = [INDEX_ENTRY.unpack_from(data, position * INDEX_ENTRY.size) for position in range(count)]
+        # The first and last entries must point at the records they were written for
+        for timestamp, offset in (entries[0], entries[-1]):
+            record = next(read_records(buffer, offset, file_size, verify=True), None)
+            if record is None or record[2].timestamp != timestamp:
+                return None
+        return [timestamp for timestamp, _ in entries], [offset for _, offset in entries]
+
+    def _write_index(self, segment, path=None):
+        with open(path or segment.index_path, "wb") as index_file:
+            index_file.write(b"".join(
+                INDEX_ENTRY.pack(timestamp, offset)
+                for timestamp, offset in zip(segment.index_timestamps, segment.index_offsets)
+            ))
+
+    def _open_active(self, segment):
+        if not os.path.exists(segment.path) or os.path.getsize(segment.path) < self.segment_size:
+            with open(segment.path, "ab") as file:
+                file.truncate(self.segment_size)
+        self._file = open(segment.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), self.segment_size)
+        self._index_file = open(segment.index_path, "ab")
+
+    def _close_active(self):
+        segment = self.segments[-1]
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(segment.size)
+        self._file.close()
+        self._index_file.close()
+
+    # Writing
+    def append(self, topic, payload, timestamp=None):
+        """Appends a message and returns its sequence number."""
+        topic = topic.encode("utf-8")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        record_size = RECORD_HEADER.size + len(topic) + len(payload)
+        if record_size > self.segment_size:
+            raise ValueError(f"A record of {record_size} bytes does not fit in a segment of {self.segment_size} bytes")
+
+        with self._lock:
+            segment = self.segments[-1]
+            if segment.size + record_size > self.segment_size:
+                segment = self._roll()
+            sequence = segment.last_sequence + 1
+            timestamp = max(time.time() if timestamp is None else timestamp, self._last_timestamp)
+            self._last_timestamp = timestamp
+
+            offset = segment.size
+            end = offset + record_size
+            self._map[offset:end] = encode_record(sequence, timestamp, topic, payload)
+            if segment.add_record(offset, EventRecord(sequence, timestamp, None, None), end, self.index_interval):
+                self._index_file.write(INDEX_ENTRY.pack(timestamp, offset))
+        return sequence
+
+    def _roll(self):
+        next_sequence = self.segments[-1].last_sequence + 1
+        self._close_active()
+        segment = _Segment(self.directory, next_sequence)
+        self.segments.append(segment)
+        self._open_active(segment)
+        return segment
+
+    def flush(self):
+        """Writes the active segment and its index to disk."""
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._index_file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._close_active()
+                self._map = None
+
+    # Reading
+    def query(self, start=None, end=None, topic_prefix=None, after_sequence=None, limit=None):
+        """
+        Returns the records in time order.
+
+        Args:
+            start, end (float): Only records with a timestamp (seconds since the epoch) in this range, inclusive
+            topic_prefix (str): Only records whose topic starts with this prefix
+            after_sequence (int): Only records after this sequence number, to continue a query that hit its limit
+            limit (int): Maximum number of records returned
+        """
+        records = []
+        for record in self.scan(start, end, after_sequence):
+            if topic_prefix and not record.topic.startswith(topic_prefix):
+                continue
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+    def scan(self, start=None, end=None, after_sequence=None):
+        """Yields the records within a time range and after a sequence number, in time order."""
+        with self._lock:
+            segments = list(self.segments)
+        for segment in segments:
+            if segment.last_timestamp is None:
+                continue
+            if end is not None and segment.first_timestamp > end:
+                return
+            if start is not None and segment.last_timestamp < start:
+                continue
+            if after_sequence is not None and segment.last_sequence <= after_sequence:
+                continue
+            for record in self._segment_records(segment, segment.offset_of(start)):
+                if end is not None and record.timestamp > end:
+                    return
+                if start is not None and record.timestamp < start:
+                    continue
+                if after_sequence is not None and record.sequence <= after_sequence:
+                    continue
+                yield record
+
+    def _segment_records(self, segment, offset):
+        with self._lock:
+            if segment is self.segments[-1]:
+                # Copy the part of the active segment to read, appends continue while it is parsed
+                buffer = self._map[offset:segment.size]
+                active = True
+            else:
+                active = False
+        if active:
+            for _, _, record in read_records(buffer, 0, len(buffer)):
+                yield record
+            return
+
+        try:
+            file = open(segment.path, "rb")
+        except FileNotFoundError:
+            # Deleted by retention since the query started
+            return
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                # A segment compacted since the query started has moved its records, read it from the start
+                if offset >= size or segment.size != size:
+                    offset = 0
+                for _, _, record in read_records(buffer, offset, size):
+                    yield record
+
+    # Maintenance
+    def apply_retention(self, now=None):
+        """Deletes the oldest closed segments that are past the retention period or over the size limit."""
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            total_size = sum(segment.size for segment in self.segments)
+            while len(self.segments) > 1:
+                oldest = self.segments[0]
+                expired = self.retention_seconds is not None and oldest.last_timestamp is not None and oldest.last_timestamp < now - self.retention_seconds
+                oversized = self.retention_bytes is not None and total_size > self.retention_bytes
+                if not (expired or oversized or oldest.last_timestamp is None):
+                    break
+                removed.append(self.segments.pop(0))
+                total_size -= oldest.size
+        for segment in removed:
+            for path in (segment.path, segment.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(removed)
+
+    def compact(self):
+        """
+        Rewrites the closed segments without the records superseded by a later record with the same compaction key.
+        Returns the number of records removed.
+        """
+        if self.compaction_key is None:
+            return 0
+        with self._compaction_lock:
+            # The last sequence number of every key, over the whole log
+            latest = {}
+            for record in self.scan():
+                key = self.compaction_key(record.topic, record.payload)
+                if key is not None:
+                    latest[key] = record.sequence
+
+            with self._lock:
+                closed_segments = self.segments[:-1]
+            removed = 0
+            for segment in closed_segments:
+                removed += self._compact_segment(segment, latest)
+            return removed
+
+    def _compact_segment(self, segment, latest):
+        compacted = _Segment(self.directory, segment.first_sequence)
+        temporary_path = f"{segment.path}.compacting"
+        removed = 0
+        with open(temporary_path, "wb") as output:
+            for record in self._segment_records(segment, 0):
+                key = self.compaction_key(record.topic, record.payload)
+                if key is not None and latest.get(key) != record.sequence:
+                    removed += 1
+                    continue
+                data = encode_record(record.sequence, record.timestamp, record.topic.encode("utf-8"), record.payload)
+                offset = compacted.size
+                output.write(data)
+                compacted.add_record(offset, record, offset + len(data), self.index_interval)
+            output.flush()
+            os.fsync(output.fileno())
+        if not removed:
+            os.remove(temporary_path)
+            return 0
+
+        # The index is replaced after the records, an index left stale by a crash in between is rebuilt on start-up
+        self._write_index(compacted, f"{segment.index_path}.compacting")
+        with self._lock:
+            if segment not in self.segments:
+                # Deleted by retention in the meantime
+                os.remove(temporary_path)
+                os.remove(f"{segment.index_path}.compacting")
+                return 0
+            os.replace(temporary_path, segment.path)
+            os.replace(f"{segment.index_path}.compacting", segment.index_path)
+            # Keep the sequence numbers the segment covered, even if its last records were removed
+            compacted.last_sequence = segment.last_sequence
+            self.segments[self.segments.index(segment)] = compacted
+        return removed
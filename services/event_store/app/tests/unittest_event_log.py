@@ -0,0 +1,178 @@
+# unittest_event_log.py
+
+import unittest
+import os
+import sys
+import tempfile
+
+# Add the event store app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from src.event_log import INDEX_SUFFIX, RECORD_HEADER, SEGMENT_SUFFIX, EventLog, encode_record
+
+
+def state_key(topic, payload):
+    return topic if topic.startswith("service/") else None
+
+
+class TestEventLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logs = []
+
+    def tearDown(self):
+        for event_log in self.logs:
+            event_log.close()
+        self.directory.cleanup()
+
+    def open_log(self, **kwargs):
+        event_log = EventLog(self.directory.name, **kwargs)
+        self.logs.append(event_log)
+        return event_log
+
+    def segment_files(self):
+        return sorted(name for name in os.listdir(self.directory.name) if name.endswith(SEGMENT_SUFFIX))
+
+    def test_appended_records_are_queried_in_order(self):
+        event_log = self.open_log()
+        self.assertEqual(event_log.append("a/b", b"1", timestamp=10.0), 1)
+        self.assertEqual(event_log.append("a/c", "2", timestamp=11.0), 2)
+        self.assertEqual(event_log.append("d", b"3", timestamp=12.0), 3)
+
+        records = event_log.query()
+        self.assertEqual([(r.sequence, r.timestamp, r.topic, r.payload) for r in records], [
+            (1, 10.0, "a/b", b"1"),
+            (2, 11.0, "a/c", b"2"),
+            (3, 12.0, "d", b"3"),
+        ])
+        self.assertEqual([r.sequence for r in event_log.query(topic_prefix="a/")], [1, 2])
+        self.assertEqual([r.sequence for r in event_log.query(start=11.0, end=12.0)], [2, 3])
+        self.assertEqual([r.sequence for r in event_log.query(after_sequence=1, limit=1)], [2])
+
+    def test_timestamps_never_decrease(self):
+        event_log = self.open_log()
+        event_log.append("a", b"", timestamp=10.0)
+        event_log.append("a", b"", timestamp=5.0)
+        self.assertEqual([r.timestamp for r in event_log.query()], [10.0, 10.0])
+
+    def test_record_larger_than_a_segment_is_refused(self):
+        event_log = self.open_log(segment_size=64)
+        with self.assertRaises(ValueError):
+            event_log.append("a", b"x" * 64)
+
+    def test_full_segment_is_rolled(self):
+        record_size = RECORD_HEADER.size + 1 + 10
+        event_log = self.open_log(segment_size=record_size * 3)
+        for i in range(7):
+            event_log.append("a", b"%010d" % i, timestamp=float(i))
+
+        self.assertEqual(self.segment_files(), [f"{1:020d}.log", f"{4:020d}.log", f"{7:020d}.log"])
+        # Closed segments are truncated to their records
+        self.assertEqual(os.path.getsize(os.path.join(self.directory.name, self.segment_files()[0])), record_size * 3)
+        self.assertEqual([r.sequence for r in event_log.query()], list(range(1, 8)))
+        self.assertEqual([r.sequence for r in event_log.query(start=2.5, end=4.0)], [4, 5])
+
+    def test_reopened_log_continues_where_it_stopped(self):
+        event_log = self.open_log(segment_size=256, index_interval=32)
+        for i in range(20):
+            event_log.append("a", b"payload", timestamp=float(i))
+        event_log.close()
+
+        event_log = self.open_log(segment_size=256, index_interval=32)
+        self.assertEqual([r.sequence for r in event_log.query()], list(range(1, 21)))
+        self.assertEqual(event_log.append("a", b"payload", timestamp=1.0), 21)
+        self.assertEqual(event_log.query(after_sequence=20)[0].timestamp, 19.0)
+        self.assertEqual([r.sequence for r in event_log.query(start=15.0, end=16.0)], [16, 17])
+
+    def test_missing_index_is_rebuilt(self):
+        event_log = self.open_log(segment_size=256, index_interval=32)
+        for i in range(20):
+            event_log.append("a", b"payload", timestamp=float(i))
+        event_log.close()
+        for name in os.listdir(self.directory.name):
+            if name.endswith(INDEX_SUFFIX):
+                os.remove(os.path.join(self.directory.name, name))
+
+        event_log = self.open_log(segment_size=256, index_interval=32)
+        self.assertEqual([r.sequence for r in event_log.query(start=15.0, end=16.0)], [16, 17])
+        self.assertTrue(all(os.path.getsize(os.path.join(self.directory.name, name)) > 0
+                            for name in os.listdir(self.directory.name) if name.endswith(INDEX_SUFFIX)))
+
+    def test_torn_record_at_the_end_is_ignored(self):
+        event_log = self.open_log(segment_size=1024)
+        event_log.append("a", b"1", timestamp=1.0)
+        event_log.append("a", b"2", timestamp=2.0)
+        event_log.flush()
+        end = event_log.segments[-1].size
+        event_log.close()
+
+        # A record cut short by a crash, followed by the zeros of the preallocated segment
+        path = os.path.join(self.directory.name, self.segment_files()[-1])
+        with open(path, "r+b") as file:
+            file.truncate(1024)
+            file.seek(end)
+            file.write(encode_record(3, 3.0, b"a", b"333")[:-2])
+
+        event_log = self.open_log(segment_size=1024)
+        self.assertEqual([r.payload for r in event_log.query()], [b"1", b"2"])
+        self.assertEqual(event_log.append("a", b"3", timestamp=3.0), 3)
+        self.assertEqual([r.payload for r in event_log.query()], [b"1", b"2", b"3"])
+
+    def test_compaction_keeps_the_last_record_of_every_key(self):
+        record_size = RECORD_HEADER.size + len("service/a/update_state") + 1
+        event_log = self.open_log(segment_size=record_size * 4, compaction_key=state_key)
+        for i, topic in enumerate(["service/a/update_state", "service/b/update_state", "service/a/update_state",
+                                   "other", "service/a/update_state", "service/b/update_state"]):
+            event_log.append(topic, str(i), timestamp=float(i))
+
+        # Only closed segments are compacted, the last b record is in the active one
+        self.assertEqual(event_log.compact(), 3)
+        records = event_log.query()
+        self.assertEqual([(r.sequence, r.topic) for r in records], [
+            (4, "other"),
+            (5, "service/a/update_state"),
+            (6, "service/b/update_state"),
+        ])
+
+        # Appends continue after the compacted sequence numbers, also after reopening
+        self.assertEqual(event_log.append("other", "6", timestamp=6.0), 7)
+        event_log.close()
+        event_log = self.open_log(segment_size=record_size * 4, compaction_key=state_key)
+        self.assertEqual([r.sequence for r in event_log.query()], [4, 5, 6, 7])
+
+    def test_no_compaction_without_a_key(self):
+        event_log = self.open_log(segment_size=64)
+        for i in range(5):
+            event_log.append("a", b"", timestamp=float(i))
+        self.assertEqual(event_log.compact(), 0)
+        self.assertEqual(len(event_log.query()), 5)
+
+    def test_retention_deletes_expired_segments(self):
+        record_size = RECORD_HEADER.size + 1
+        event_log = self.open_log(segment_size=record_size * 2, retention_seconds=100)
+        for timestamp in [0.0, 10.0, 50.0, 60.0, 200.0]:
+            event_log.append("a", b"", timestamp=timestamp)
+
+        self.assertEqual(event_log.apply_retention(now=155.0), 1)
+        self.assertEqual([r.timestamp for r in event_log.query()], [50.0, 60.0, 200.0])
+        # The active segment is never deleted
+        self.assertEqual(event_log.apply_retention(now=1000.0), 1)
+        self.assertEqual([r.timestamp for r in event_log.query()], [200.0])
+        self.assertEqual(len(self.segment_files()), 1)
+
+    def test_retention_keeps_the_log_under_its_size_limit(self):
+        record_size = RECORD_HEADER.size + 1
+        event_log = self.open_log(segment_size=record_size * 2, retention_bytes=record_size * 3)
+        for i in range(6):
+            event_log.append("a", b"", timestamp=float(i))
+
+        self.assertEqual(event_log.apply_retention(), 2)
+        self.assertEqual([r.sequence for r in event_log.query()], [5, 6])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, f"{1:020d}{INDEX_SUFFIX}")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,7 +24,10 @@ if __name__ == "__main__":
 
             logger = logging.getLogger("Main")
 
-            dispatcher = EventDispatcher()
+            # Waking the screen spawns one subprocess per brightness step, so handle it off the MQTT network
+            # loop and collapse repeated wake up requests into one
+            dispatcher = EventDispatcher(asynchronous=True)
+            dispatcher.configure_event("wake_up_screen", workers=1, max_queue_size=1, policy="coalesce")
             
             try:
                 screen_monitor = ScreenMonitor(
@@ -76,6 +79,7 @@ if __name__ == "__main__":
 
             except Exception as e:
                 logger.error(f"Peripherals service threw the following Error: {e}")
+                dispatcher.shutdown(timeout=1)
                 time.sleep(5)
 
     except KeyboardInterrupt as e:
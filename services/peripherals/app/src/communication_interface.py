@@ -1,4 +1,3 @@
-import json
 import sys
 import os
 import logging
@@ -36,11 +35,11 @@ class CommunicationInterface(MQTTClientBase):
         self.service_error_topic = "service_error"
         
         # subscribe to topics
-        self.subscribe(self.service_status_requested_topic, self._respond_with_service_status)
-        self.subscribe(self.control_cmd, self._handle_command)
-        self.subscribe(self.update_state_topic, self._update_service_state)
-        self.subscribe(self.wake_up_screen_topic, self._wake_up_screen)
-        self.subscribe(self.configure_sleep_timer_topic, self._configure_sleep_timer)
+        self.add_route(self.service_status_requested_topic, self._respond_with_service_status)
+        self.add_route(self.control_cmd, self._handle_command)
+        self.add_route(self.update_state_topic, self._update_service_state)
+        self.add_route(self.wake_up_screen_topic, self._wake_up_screen)
+        self.add_route(self.configure_sleep_timer_topic, self._configure_sleep_timer)
 
         self._register_event_handlers()
 
@@ -50,12 +49,12 @@ class CommunicationInterface(MQTTClientBase):
             self.dispatcher.register_event("send_network_speed", self.publish_network_speed)
             self.dispatcher.register_event("send_service_error", self.publish_service_error)
 
-    def _respond_with_service_status(self, client, userdata, message):
-        self.publish_peripherals_status(self.service_status)
+    def _respond_with_service_status(self, payload, message):
+        correlation_id = payload.get("correlation_id") if isinstance(payload, dict) else None
+        self.publish_peripherals_status(self.service_status, correlation_id=correlation_id)
 
-    def _handle_command(self, client, userdata, message):
+    def _handle_command(self, payload, message):
         try:
-            payload = json.loads(message.payload.decode("utf-8"))
             cmd = payload.get("cmd", "")
             logging.info(f"peripherals received the command: {cmd}")
             self.logger.info(f"cmd = {cmd}")
@@ -70,31 +69,30 @@ class CommunicationInterface(MQTTClientBase):
                 "check_network_speed": "running",
                 "check_network_status": "running"
             }
-            self.publish_peripherals_status(status[cmd])
+            self.publish_peripherals_status(status[cmd], correlation_id=payload.get("correlation_id"))
         except Exception as e:
             logging.error(f"Error handling command: {e}")
 
-    def _update_service_state(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            state_name = payload.get("state_name", "")
-            state = payload.get("state_value", [])
-            self.logger.info(f"Peripherals service received state update for {state_name}: {state}")
-            self.dispatcher.dispatch_event("update_state_variable", payload)
-            self.service_status = "set_up"
-        except json.JSONDecodeError:
+    def _update_service_state(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for updating service state. Using default retry parameters.")
-
-    def _wake_up_screen(self, client, userdata, message):
+            return
+        state_name = payload.get("state_name", "")
+        state = payload.get("state_value", [])
+        self.logger.info(f"Peripherals service received state update for {state_name}: {state}")
+        self.dispatcher.dispatch_event("update_state_variable", payload)
+        self.service_status = "set_up"
+
+    def _wake_up_screen(self, payload, message):
         # self.logger.info("Waking up screen")
         self.dispatcher.dispatch_event("wake_up_screen")
 
-    def _configure_sleep_timer(self, client, userdata, message):
-        configuration = message.payload.decode("utf-8") == "On"
+    def _configure_sleep_timer(self, payload, message):
+        configuration = payload == "On"
         self.logger.info(f"Configuring sleep timer to: {configuration}")
         self.dispatcher.dispatch_event("configure_sleep_timer", {"control": configuration})
 
-    def publish_peripherals_status(self, status, message = "", details = None):
+    def publish_peripherals_status(self, status, message = "", details = None, correlation_id=None):
         self.service_status = status
         self.logger.info(f"Peripherals status: {status}")
         payload = {
@@ -104,7 +102,9 @@ class CommunicationInterface(MQTTClientBase):
             "details": details,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.peripherals_status_topic, json.dumps(payload))
+        if correlation_id:
+            payload["correlation_id"] = correlation_id
+        self.publish(self.peripherals_status_topic, payload)
 
     def publish_peripherals_heartbeat(self):
         self.publish(self.peripherals_hearbeat_topic, "alive")
@@ -115,14 +115,14 @@ class CommunicationInterface(MQTTClientBase):
             "status": status,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.network_status_topic, json.dumps(message))
+        self.publish(self.network_status_topic, message)
 
     def publish_network_speed(self, results):
         payload = {
             "download": int(results["download"]/1000000),
             "upload": int(results["upload"]/1000000,)
         }
-        self.publish(self.network_speed_topic, json.dumps(payload))
+        self.publish(self.network_speed_topic, payload)
     
     def publish_service_error(self, error_message):
         payload = {
@@ -130,4 +130,4 @@ class CommunicationInterface(MQTTClientBase):
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
             "service_name": "robot_control"
             }
-        self.publish("error_message", json.dumps(payload))
\ No newline at end of file
+        self.publish("error_message", payload)
\ No newline at end of file
@@ -34,10 +34,10 @@ class CommunicationInterface(MQTTClientBase):
         self.update_persistent_data_topic = "update_persistent_data"
 
         # subscribe to topics
-        self.subscribe(self.service_status_requested_topic, self._respond_with_service_status)
-        self.subscribe(self.control_cmd, self._handle_command)
-        self.subscribe(self.update_reminder_time, self._update_reminder_time)
-        self.subscribe(self.update_state_topic, self._update_service_state)
+        self.add_route(self.service_status_requested_topic, self._respond_with_service_status)
+        self.add_route(self.control_cmd, self._handle_command)
+        self.add_route(self.update_reminder_time, self._update_reminder_time)
+        self.add_route(self.update_state_topic, self._update_service_state)
 
         self._register_event_handlers()
 
@@ -46,52 +46,50 @@ class CommunicationInterface(MQTTClientBase):
             self.dispatcher.register_event("send_reminder", self._send_reminder)
             self.dispatcher.register_event("update_persistent_data", self._update_persistent_data)
 
-    def _respond_with_service_status(self, client, userdata, message):
-        self.publish_reminder_status(self.service_status)
+    def _respond_with_service_status(self, payload, message):
+        correlation_id = payload.get("correlation_id") if isinstance(payload, dict) else None
+        self.publish_reminder_status(self.service_status, correlation_id=correlation_id)
     
-    def _handle_command(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            cmd = payload.get("cmd", "")
-            logging.info(f"vocie assistant received the command: {cmd}")
-            self.logger.info(f"cmd = {cmd}")
-            if cmd == "end":
-                self.command = ""
-            elif cmd == "set_up" or cmd == "start":
-                self.command = cmd
-            else:
-                self.command = ""
-
-            status = {
-                "set_up": "ready",
-                "start": "running",
-                "end": "completed"
-            }
-            
-            self.publish_reminder_status(status[cmd])
-        except json.JSONDecodeError:
+    def _handle_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for control commands. Using default retry parameters.")
+            return
+        cmd = payload.get("cmd", "")
+        logging.info(f"vocie assistant received the command: {cmd}")
+        self.logger.info(f"cmd = {cmd}")
+        if cmd == "end":
+            self.command = ""
+        elif cmd == "set_up" or cmd == "start":
+            self.command = cmd
+        else:
+            self.command = ""
+
+        status = {
+            "set_up": "ready",
+            "start": "running",
+            "end": "completed"
+        }
+        
+        self.publish_reminder_status(status[cmd], correlation_id=payload.get("correlation_id"))
 
-    def _update_reminder_time(self, client, userdata, message):
-        try:
-            time = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"Reminder time updated to {time}")
-            self.dispatcher.dispatch_event("set_reminder", time)
-        except json.JSONDecodeError:
+    def _update_reminder_time(self, payload, message):
+        if isinstance(payload, bytes):
             self.logger.error("Invalid JSON payload for setting reminder time. Using default retry parameters.")
+            return
+        self.logger.info(f"Reminder time updated to {payload}")
+        self.dispatcher.dispatch_event("set_reminder", payload)
 
-    def _update_service_state(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            state_name = payload.get("state_name", "")
-            state = payload.get("state_value", [])
-            self.logger.info(f"Remender received state update for {state_name}: {state}")
-            self.dispatcher.dispatch_event("update_service_state", payload)
-            self.service_status = "set_up"
-        except json.JSONDecodeError:
+    def _update_service_state(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for updating service state. Using default retry parameters.")
-
-    def publish_reminder_status(self, status, message="", details=None):        
+            return
+        state_name = payload.get("state_name", "")
+        state = payload.get("state_value", [])
+        self.logger.info(f"Remender received state update for {state_name}: {state}")
+        self.dispatcher.dispatch_event("update_service_state", payload)
+        self.service_status = "set_up"
+
+    def publish_reminder_status(self, status, message="", details=None, correlation_id=None):        
         payload = {
             "service_name": "reminder",
             "status": status,
@@ -99,7 +97,9 @@ class CommunicationInterface(MQTTClientBase):
             "details": details,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.reminder_status_topic, json.dumps(payload))
+        if correlation_id:
+            payload["correlation_id"] = correlation_id
+        self.publish(self.reminder_status_topic, payload)
 
         self.service_status = status
 
@@ -112,7 +112,7 @@ class CommunicationInterface(MQTTClientBase):
             "service_name": "reminder",
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.vocie_assistant_hearbeat_topic, json.dumps(payload))
+        self.publish(self.vocie_assistant_hearbeat_topic, payload)
 
     def _update_persistent_data(self, state):
         try:
@@ -122,7 +122,7 @@ class CommunicationInterface(MQTTClientBase):
                 "state_value": state["state_value"]
             }
             self.logger.info(f"Sending reminder time update: {payload}")
-            self.publish(self.update_persistent_data_topic, json.dumps(payload))
+            self.publish(self.update_persistent_data_topic, payload)
         except json.JSONDecodeError:
             self.logger.error("Invalid JSON payload for updating persistent data. Using default retry parameters.")
 
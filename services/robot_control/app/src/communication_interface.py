@@ -1,4 +1,3 @@
-import json
 import time
 from PIL import Image
 import io
@@ -34,7 +33,6 @@ class CommunicationInterface(MQTTClientBase):
         # self.activate_camera_topic = "robot/activate_camera"
         self.robot_behaviour_topic = "robot_behaviour_command"
         self.update_state_topic = "service/robot_control/update_state"
-        self.save_check_in_topic = "save_check_in"
         self.reconnect_request_topic = "reconnect_robot_request"
 
         # Publish topics
@@ -47,110 +45,95 @@ class CommunicationInterface(MQTTClientBase):
         self.robot_connection_status_topic = "robot_connection_status"
 
         # Subscribe to necessary topics
-        self.subscribe(self.service_status_requested_topic, self._respond_with_service_status)
-        self.subscribe(self.service_control_cmd, self._handle_control_command)
-        self.subscribe(self.robot_volume, self._handle_volume_command)
-        self.subscribe(self.robot_colour, self._handle_colour_command)
-        self.subscribe(self.recive_robot_tts_topic, self._handle_tts_command)
-        self.subscribe(self.animation_topic, self._handle_animation_command)
-        self.subscribe(self.robot_behaviour_topic, self._handle_behaviour_request)
-        # self.subscribe(self.activate_camera_topic, self._process_camera_active)
-        self.subscribe(self.update_state_topic, self._update_service_state)
-        self.subscribe(self.save_check_in_topic, self._save_check_in)
-        self.subscribe(self.reconnect_request_topic, self._reconnect_to_robot)
+        self.add_route(self.service_status_requested_topic, self._respond_with_service_status)
+        self.add_route(self.service_control_cmd, self._handle_control_command)
+        self.add_route(self.robot_volume, self._handle_volume_command)
+        self.add_route(self.robot_colour, self._handle_colour_command)
+        self.add_route(self.recive_robot_tts_topic, self._handle_tts_command)
+        self.add_route(self.animation_topic, self._handle_animation_command)
+        self.add_route(self.robot_behaviour_topic, self._handle_behaviour_request)
+        self.add_route(self.update_state_topic, self._update_service_state)
+        self.add_route(self.reconnect_request_topic, self._reconnect_to_robot)
     
-    def _respond_with_service_status(self, client, userdata, message):
-        self.publish_robot_status(self.service_status)
+    def _respond_with_service_status(self, payload, message):
+        correlation_id = payload.get("correlation_id") if isinstance(payload, dict) else None
+        self.publish_robot_status(self.service_status, correlation_id=correlation_id)
     
-    def _handle_control_command(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            command = payload.get("cmd", "")
-            if command == "set_up":
-                self.start_command = command
-            else:
-                self.robot_controler.handle_control_command(command)
-            
-            status_response = {
-                "set_up": "ready",
-                "start": "running",
-                "end": "completed"
-            }
-            self.publish_robot_status(status_response.get(command, "running"))
-        except json.JSONDecodeError:
+    def _handle_control_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload. Using default retry parameters.")
+            return
+        command = payload.get("cmd", "")
+        if command == "set_up":
+            self.start_command = command
+        else:
+            self.robot_controler.handle_control_command(command)
+        
+        status_response = {
+            "set_up": "ready",
+            "start": "running",
+            "end": "completed"
+        }
+        self.publish_robot_status(status_response.get(command, "running"), correlation_id=payload.get("correlation_id"))
     
-    def _handle_volume_command(self, client, userdata, message):
-        try:
-            volume = message.payload.decode("utf-8")
-            self.logger.info(f"Volume command received: {volume}")
-            self.robot_controler.set_volume(volume)
-        except json.JSONDecodeError:
-            self.logger.error("Invalid JSON payload for volume command.")
+    def _handle_volume_command(self, payload, message):
+        volume = str(payload)
+        self.logger.info(f"Volume command received: {volume}")
+        self.robot_controler.set_volume(volume)
     
-    def _handle_colour_command(self, client, userdata, message):
-        selected_colour = message.payload.decode()
-        try:
-            self.logger.info(f"Colour received: {selected_colour}")
-            if selected_colour:
-                self.robot_controler.handle_eye_colour_command(selected_colour)
-        except json.JSONDecodeError:
-            self.logger.error("Invalid JSON payload for colour command.")
+    def _handle_colour_command(self, payload, message):
+        selected_colour = str(payload)
+        self.logger.info(f"Colour received: {selected_colour}")
+        if selected_colour:
+            self.robot_controler.handle_eye_colour_command(selected_colour)
     
-    def _handle_tts_command(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            sender = payload.get("sender", "")
-            if sender == "orchestrator":
-                self.robot_controler.handle_tts_command(payload)
-                payload["sender"] = "robot"
-                self.publish(self.conversation_history_topic, json.dumps(payload))
-        except json.JSONDecodeError:
+    def _handle_tts_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for TTS command.")
+            return
+        sender = payload.get("sender", "")
+        if sender == "orchestrator":
+            self.robot_controler.handle_tts_command(payload)
+            payload["sender"] = "robot"
+            self.publish(self.conversation_history_topic, payload)
             
-    def _handle_animation_command(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            animation_name = payload.get("animation", "")
-            self.logger.info(f"Animation command received: {animation_name}")
-            # if animation_name:
-            #     self.robot_controler.dispatch_event("animation_command", animation_name)
-        except json.JSONDecodeError:
+    def _handle_animation_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for animation command.")
+            return
+        animation_name = payload.get("animation", "")
+        self.logger.info(f"Animation command received: {animation_name}")
+        # if animation_name:
+        #     self.robot_controler.dispatch_event("animation_command", animation_name)
 
-    def _handle_behaviour_request(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            behaviour_name = payload.get("cmd", "")
-            self.logger.info(f"behaviour command received: {behaviour_name}")
-            if behaviour_name == "sentiment":
-                sentiment = int(payload.get("additional_details", ""))
-                self.logger.info(f"Generating feedback animation. with sentiment {sentiment}")
-                self.robot_controler.generate_feedback_animation(sentiment)
-            else:
-                self.robot_controler.handle_control_command(behaviour_name)
-            self.logger.info("Behaviour control command processed")
-        except json.JSONDecodeError:
+    def _handle_behaviour_request(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for animation command.")
+            return
+        behaviour_name = payload.get("cmd", "")
+        self.logger.info(f"behaviour command received: {behaviour_name}")
+        if behaviour_name == "sentiment":
+            sentiment = int(payload.get("additional_details", ""))
+            self.logger.info(f"Generating feedback animation. with sentiment {sentiment}")
+            self.robot_controler.generate_feedback_animation(sentiment)
+        else:
+            self.robot_controler.handle_control_command(behaviour_name)
+        self.logger.info("Behaviour control command processed")
         
     def update_behaviour_status(self, message):
-        self.publish(self.robot_control_status_topic, json.dumps(message))
+        self.publish(self.robot_control_status_topic, message)
     
-    def _update_service_state(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            state_name = payload.get("state_name", "")
-            state = payload.get("state_value", [])
-            self.logger.info(f"Received state update for {state_name}: {state}")
-            self.robot_controler.update_service_state(payload)
-            self.service_status = "set_up"
-        except json.JSONDecodeError:
+    def _update_service_state(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for updating service state. Using default retry parameters.")
+            return
+        state_name = payload.get("state_name", "")
+        state = payload.get("state_value", [])
+        self.logger.info(f"Received state update for {state_name}: {state}")
+        self.robot_controler.update_service_state(payload)
+        self.service_status = "set_up"
 
-    def _save_check_in(self, client, userdata, message):
-        self.robot_controler.handle_control_command("return_home")
-
-    def _reconnect_to_robot(self, client, userdata, message):
+    def _reconnect_to_robot(self, payload, message):
         self.robot_controler.connect()
 
     # def _process_camera_active(self, client, userdata, message):
@@ -177,7 +160,7 @@ class CommunicationInterface(MQTTClientBase):
     #                 self.logger.error(f"Error in video streaming: {e}")
     #                 break
     
-    def publish_robot_status(self, status, message="", details=None):
+    def publish_robot_status(self, status, message="", details=None, correlation_id=None):
         logging.info(f"Publishing robot status: {status}")
         if status == "ready":
             self.publish(self.camera_active_topic, "1")
@@ -191,7 +174,9 @@ class CommunicationInterface(MQTTClientBase):
             "details": details,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.robot_service_status_topic, json.dumps(payload))
+        if correlation_id:
+            payload["correlation_id"] = correlation_id
+        self.publish(self.robot_service_status_topic, payload)
 
         self.service_status = status
 
@@ -204,15 +189,15 @@ class CommunicationInterface(MQTTClientBase):
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
             "service_name": "robot_control"
             }
-        self.publish(self.publish_error_message_topic, json.dumps(payload))
+        self.publish(self.publish_error_message_topic, payload)
 
     def publish_robot_connection_status(self, status):
         self.logger.info(f"Robot connection status = {status}")
-        self.publish(self.robot_connection_status_topic, json.dumps({
+        self.publish(self.robot_connection_status_topic, {
             "service_name": "robot_control",
             "status": status,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-        }))
+        })
         # The only critical error that is being managed is the robot connection error, so every time the robot is connected ensure that all errors that might have been raised are resolved
         if status == "connected":
             self.publish("critical_event_resolved", "-")
\ No newline at end of file
@@ -0,0 +1,79 @@
+'''
+Measures what the audio pipeline saves on the upload to the cloud recognizer, and what it costs on the CPU.
+
+The audio is fed in 100 ms chunks the way MicrophoneStream yields it and streamed as it was before (48 kHz
+LINEAR16), resampled to 16 kHz, and resampled and FLAC encoded (if pyflac is installed). Without --wav the audio is
+a synthetic vowel-like signal in background noise, use a recording of an answer for realistic FLAC sizes.
+
+Run from the project root:
+    python services/speech_recognitoin/app/benchmarks/bench_audio_pipeline.py [--wav answer.wav] [--seconds 10]
+'''
+import argparse
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+# Add the project root and the speech recognition app directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+app_dir = os.path.abspath(os.path.join(current_dir, "../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from src.audio_pipeline import RECOGNITION_RATE, FlacStreamEncoder, Resampler
+
+
+def synthetic_audio(sample_rate, seconds):
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    voice = sum(np.sin(2 * np.pi * 140 * harmonic * t) / harmonic for harmonic in range(1, 20))
+    envelope = (np.sin(2 * np.pi * 0.5 * t) > 0).astype(np.float64)
+    audio = 3000 * voice * envelope + rng.normal(0, 200, t.size)
+    return np.clip(audio, -32768, 32767).astype("<i2").tobytes()
+
+
+def measure(name, pipeline, chunks, seconds):
+    started = time.perf_counter()
+    sent = sum(len(content) for content in pipeline(chunks))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22}{sent * 8 / seconds / 1000:>10.0f}{sent / 1024:>10.0f}{elapsed / len(chunks) * 1e6:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--wav", help="16-bit mono recording to stream")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the synthetic audio")
+    args = parser.parse_args()
+
+    if args.wav:
+        with wave.open(args.wav, "rb") as recording:
+            if recording.getnchannels() != 1 or recording.getsampwidth() != 2:
+                parser.error(f"{args.wav} is not 16-bit mono")
+            sample_rate = recording.getframerate()
+            audio = recording.readframes(recording.getnframes())
+    else:
+        sample_rate = 48000
+        audio = synthetic_audio(sample_rate, args.seconds)
+    seconds = len(audio) / 2 / sample_rate
+    chunk_bytes = int(sample_rate / 10) * 2
+    chunks = [audio[start:start + chunk_bytes] for start in range(0, len(audio), chunk_bytes)]
+
+    print(f"{'stream':<22}{'kbit/s':>10}{'KiB':>10}{'us/chunk':>12}")
+    measure(f"{sample_rate // 1000} kHz LINEAR16", lambda audio_chunks: audio_chunks, chunks, seconds)
+    measure("16 kHz LINEAR16", lambda audio_chunks: Resampler(sample_rate, RECOGNITION_RATE).stream(audio_chunks), chunks, seconds)
+    if FlacStreamEncoder.available():
+        measure(
+            "16 kHz FLAC",
+            lambda audio_chunks: FlacStreamEncoder(RECOGNITION_RATE).stream(Resampler(sample_rate, RECOGNITION_RATE).stream(audio_chunks)),
+            chunks,
+            seconds,
+        )
+    else:
+        print(f"{'16 kHz FLAC':<22}pyflac is not installed")
+
+
+if __name__ == "__main__":
+    main()
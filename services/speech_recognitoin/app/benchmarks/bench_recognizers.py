@@ -0,0 +1,129 @@
+'''
+Measures how long each speech recognizer takes to transcribe recorded answers, and how many it gets right.
+
+Fixtures are 16-bit mono WAV recordings of answers, in a directory per expected format, each with the expected
+transcript in a text file of the same name:
+
+    <fixtures>/short/seven.wav, <fixtures>/short/seven.txt
+    <fixtures>/closed-ended/yes_quiet_room.wav, <fixtures>/closed-ended/yes_quiet_room.txt
+
+Audio is fed in 100 ms chunks, the way MicrophoneStream yields it, and a constrained answer is returned as soon as
+its transcript holds the answer (see answer_parser.answer_complete), as in the service. The ms columns are the time
+from the first chunk to the transcript. With --realtime the chunks are paced like a live microphone, so that is the
+turnaround of a question, to compare with the length of the recordings; without it the audio is fed as fast as the
+recognizer takes it and it is the decode time.
+
+Run from the project root:
+    python services/speech_recognitoin/app/benchmarks/bench_recognizers.py --fixtures recordings [--recognizers vosk,google] [--realtime]
+'''
+import argparse
+import glob
+import os
+import re
+import statistics
+import sys
+import time
+import wave
+
+# Add the project root and the speech recognition app directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+app_dir = os.path.abspath(os.path.join(current_dir, "../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from src.answer_parser import answer_complete, parse_answer
+from src.recognizers import GoogleRecognizer, VoskRecognizer
+
+RECOGNIZERS = {"google": GoogleRecognizer, "vosk": VoskRecognizer}
+
+
+def load_fixtures(directory):
+    """Returns (expected format, path, expected transcript, sample rate, audio) for every recording."""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*", "*.wav"))):
+        with wave.open(path, "rb") as recording:
+            if recording.getnchannels() != 1 or recording.getsampwidth() != 2:
+                print(f"Skipping {path}, it is not 16-bit mono")
+                continue
+            sample_rate = recording.getframerate()
+            audio = recording.readframes(recording.getnframes())
+        transcript_path = os.path.splitext(path)[0] + ".txt"
+        expected = open(transcript_path, encoding="utf-8").read() if os.path.exists(transcript_path) else None
+        fixtures.append((os.path.basename(os.path.dirname(path)), path, expected, sample_rate, audio))
+    return fixtures
+
+
+def normalise(text):
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", text.lower()).split())
+
+
+def chunks_of(audio, sample_rate, realtime):
+    chunk_size = int(sample_rate / 10) * 2
+    for start in range(0, len(audio), chunk_size):
+        if realtime:
+            time.sleep(0.1)
+        yield audio[start:start + chunk_size]
+
+
+def run(recognizer, expected_format, audio, sample_rate, realtime):
+    started = time.perf_counter()
+    transcript = recognizer.recognise(
+        chunks_of(audio, sample_rate, realtime),
+        expected_format,
+        lambda text, final: answer_complete(text, expected_format, final),
+    )
+    return transcript, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", required=True, help="directory of the recordings, one sub-directory per expected format")
+    parser.add_argument("--recognizers", default="vosk,google", help="comma separated recognizers to compare")
+    parser.add_argument("--realtime", action="store_true", help="feed the audio at the pace of a live microphone")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No recordings found in {args.fixtures}")
+
+    print(f"{'recognizer':<12}{'format':<14}{'answers':>8}{'correct':>9}{'audio s':>9}{'mean ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for name in args.recognizers.split(","):
+        instances = {}
+        results = {}
+        for expected_format, path, expected, sample_rate, audio in fixtures:
+            if sample_rate not in instances:
+                instances[sample_rate] = RECOGNIZERS[name](sample_rate)
+            recognizer = instances[sample_rate]
+            if not recognizer.available():
+                break
+            if hasattr(recognizer, "load"):
+                # Loading the model is not part of answering
+                recognizer.load()
+            try:
+                transcript, latency = run(recognizer, expected_format, audio, sample_rate, args.realtime)
+            except Exception as e:
+                print(f"{name} failed on {path}: {e}")
+                continue
+            if expected is None:
+                correct = False
+            elif expected_format == "open-ended":
+                correct = normalise(transcript) == normalise(expected)
+            else:
+                correct = parse_answer(transcript, expected_format) == parse_answer(expected, expected_format)
+            result = results.setdefault(expected_format, {"latencies": [], "correct": 0, "audio": 0.0})
+            result["latencies"].append(latency * 1000)
+            result["correct"] += correct
+            result["audio"] += len(audio) / 2 / sample_rate
+        else:
+            for expected_format, result in sorted(results.items()):
+                latencies = sorted(result["latencies"])
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                print(f"{name:<12}{expected_format:<14}{len(latencies):>8}{result['correct']:>9}{result['audio']:>9.1f}"
+                      f"{statistics.mean(latencies):>9.0f}{p95:>9.0f}{latencies[-1]:>9.0f}")
+            continue
+        print(f"{name:<12}not available, check it is installed (and VOSK_MODEL_PATH is set for vosk)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+'''
+Compares the voice activity detection of MicrophoneStream with the fixed RMS threshold it replaced, on labelled
+recordings.
+
+Every 16-bit mono WAV recording in the fixtures directory needs a <name>.labels file with the speech segments in
+the format Audacity exports label tracks in, one "start<TAB>end[<TAB>text]" line per segment in seconds.
+
+For each detector the table shows, over 20 ms frames, how much of the labelled speech is detected (recall) and how
+much silence is taken for speech (false alarms). It also shows when the end of the answer is detected, counted
+from the end of the last labelled segment, using the end of speech silence of each detector the way
+MicrophoneStream.generator does. Answers cut off before their end are counted as early.
+
+Run from the project root:
+    python services/speech_recognitoin/app/benchmarks/bench_vad.py --fixtures recordings [--end-of-speech 1.2]
+'''
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+import wave
+
+import numpy as np
+
+# Add the project root and the speech recognition app directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+app_dir = os.path.abspath(os.path.join(current_dir, "../"))
+sys.path.insert(0, project_root)
+sys.path.insert(0, app_dir)
+
+from src.voice_activity import FRAME_MS, VoiceActivityDetector
+
+CHUNK_SECONDS = 0.1
+LEGACY_SILENCE_THRESHOLD = 500
+LEGACY_SILENCE_DURATION = 3
+
+
+class LegacyDetector:
+    """The RMS of each chunk against a fixed threshold, as computed by audioop.rms."""
+
+    def contains_speech(self, chunk):
+        samples = np.frombuffer(chunk, dtype="<i2").astype(np.int64)
+        return int(np.sqrt(np.mean(samples * samples))) >= LEGACY_SILENCE_THRESHOLD
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        labels_path = os.path.splitext(path)[0] + ".labels"
+        if not os.path.exists(labels_path):
+            print(f"Skipping {path}, it has no labels")
+            continue
+        with wave.open(path, "rb") as recording:
+            if recording.getnchannels() != 1 or recording.getsampwidth() != 2:
+                print(f"Skipping {path}, it is not 16-bit mono")
+                continue
+            sample_rate = recording.getframerate()
+            audio = recording.readframes(recording.getnframes())
+        segments = []
+        with open(labels_path, encoding="utf-8") as labels:
+            for line in labels:
+                fields = line.split("\t")
+                if len(fields) >= 2:
+                    segments.append((float(fields[0]), float(fields[1])))
+        fixtures.append((path, sample_rate, audio, segments))
+    return fixtures
+
+
+def evaluate(detector, audio, sample_rate, segments, end_of_speech_seconds):
+    """Returns (speech frames, detected speech frames, silent frames, false alarms, end detected at, seconds spent)."""
+    chunk_bytes = int(sample_rate * CHUNK_SECONDS) * 2
+    frames_per_chunk = int(CHUNK_SECONDS * 1000 / FRAME_MS)
+    speech_frames = detected = silent_frames = false_alarms = 0
+    silent_seconds = 0.0
+    started = False
+    end_detected_at = None
+    spent = 0.0
+    for index, start in enumerate(range(0, len(audio), chunk_bytes)):
+        chunk = audio[start:start + chunk_bytes]
+        timer = time.perf_counter()
+        if isinstance(detector, VoiceActivityDetector):
+            frames = detector.speech_frames(chunk)
+            speech = int(np.count_nonzero(frames)) >= detector.min_speech_frames
+        else:
+            speech = detector.contains_speech(chunk)
+            frames = np.full(frames_per_chunk, speech)
+        spent += time.perf_counter() - timer
+
+        chunk_start = index * CHUNK_SECONDS
+        for position, is_speech in enumerate(frames):
+            frame_time = chunk_start + (position + 0.5) * FRAME_MS / 1000
+            labelled = any(segment_start <= frame_time < segment_end for segment_start, segment_end in segments)
+            if labelled:
+                speech_frames += 1
+                detected += bool(is_speech)
+            else:
+                silent_frames += 1
+                false_alarms += bool(is_speech)
+
+        if end_detected_at is None:
+            if speech:
+                started = True
+                silent_seconds = 0.0
+            elif started:
+                silent_seconds += CHUNK_SECONDS
+                if silent_seconds >= end_of_speech_seconds:
+                    end_detected_at = chunk_start + CHUNK_SECONDS
+    return speech_frames, detected, silent_frames, false_alarms, end_detected_at, spent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", required=True, help="directory of the labelled recordings")
+    parser.add_argument("--end-of-speech", type=float, default=1.2, help="seconds of silence ending an answer with the new detector")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No labelled recordings found in {args.fixtures}")
+
+    detectors = [
+        ("rms 500", lambda sample_rate: LegacyDetector(), LEGACY_SILENCE_DURATION),
+        ("vad", VoiceActivityDetector, args.end_of_speech),
+    ]
+    print(f"{'detector':<10}{'recall':>8}{'false al':>10}{'end ms':>9}{'p95 ms':>9}{'early':>7}{'missed':>8}{'us/chunk':>10}")
+    for name, create, end_of_speech_seconds in detectors:
+        totals = [0, 0, 0, 0]
+        delays = []
+        early = missed = chunks = 0
+        spent = 0.0
+        for path, sample_rate, audio, segments in fixtures:
+            result = evaluate(create(sample_rate), audio, sample_rate, segments, end_of_speech_seconds)
+            for position in range(4):
+                totals[position] += result[position]
+            end_detected_at = result[4]
+            spent += result[5]
+            chunks += -(-len(audio) // (int(sample_rate * CHUNK_SECONDS) * 2))
+            speech_end = max(segment_end for _, segment_end in segments) if segments else 0.0
+            if end_detected_at is None:
+                missed += 1
+            elif end_detected_at < speech_end:
+                early += 1
+            else:
+                delays.append((end_detected_at - speech_end) * 1000)
+        recall = totals[1] / totals[0] if totals[0] else 0.0
+        false_alarms = totals[3] / totals[2] if totals[2] else 0.0
+        delays.sort()
+        mean_delay = f"{statistics.mean(delays):.0f}" if delays else "-"
+        p95_delay = f"{delays[min(len(delays) - 1, int(len(delays) * 0.95))]:.0f}" if delays else "-"
+        print(f"{name:<10}{recall:>8.1%}{false_alarms:>10.1%}{mean_delay:>9}{p95_delay:>9}{early:>7}{missed:>8}{spent / chunks * 1e6:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
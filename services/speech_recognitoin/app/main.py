@@ -75,4 +75,5 @@ if __name__ == "__main__":
             time.sleep(1)
     except KeyboardInterrupt:
         logger.info("Exiting voice assistant service...")
+        speech_to_text.close()
         communication_interface.disconnect()
@@ -0,0 +1,108 @@
+'''
+Parses the answers to "short" (a number from 1 to 10) and "closed-ended" (yes or no) questions from transcripts.
+
+Numbers may be spoken as words or transcribed as digits, and "seven out of ten" is seven. When several numbers are
+said the last one counts, as people correct themselves ("six, no, seven"). A yes/no answer is decided by its first
+affirmative or negative word, so "not really" and "I didn't" are no and "yeah I did" is yes. A word such as "did"
+or "have" only counts as yes once the next word shows it is not "did not".
+
+answer_complete() tells a recognizer that the transcript so far already holds the answer, so it is returned without
+waiting for the microphone to detect the end of the answer. A yes/no answer can be taken from an interim transcript as
+its first word decides it. A number is only taken from a final result, i.e. once the recognizer has heard a pause:
+interim transcripts change as more audio arrives, and "six, no, seven" must not stop at "six".
+'''
+import re
+
+NUMBERS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+MIN_SCORE = 1
+MAX_SCORE = 10
+
+AFFIRMATIVES = {"yes", "yeah", "yea", "yep", "yup", "ya", "sure", "definitely", "absolutely", "certainly", "correct", "right", "ok", "okay"}
+# Affirmative only when not followed by a negation ("I did" but not "I did not")
+WEAK_AFFIRMATIVES = {"did", "do", "have", "done"}
+NEGATIVES = {"no", "nope", "nah", "not", "never", "nay", "negative", "nothing", "none"}
+
+# Sentiment of a yes/no answer, on the scale of the short answers
+YES_NO_SENTIMENT = {"Yes": "8", "No": "2"}
+
+# Words a small-vocabulary recognizer needs to transcribe the answers of each format
+ANSWER_VOCABULARY = {
+    "short": list(NUMBERS) + ["out", "of", "no"],
+    "closed-ended": sorted(AFFIRMATIVES | WEAK_AFFIRMATIVES | NEGATIVES | {"i", "didn't", "don't", "haven't", "really"}),
+}
+
+_OUT_OF = re.compile(r"\b(out of|/)\s*(10|ten)\b")
+
+
+def words_of(text):
+    text = text.lower().replace("’", "'")
+    return re.findall(r"[a-z']+|\d+", text)
+
+
+def _is_negative(word):
+    return word in NEGATIVES or word.endswith("n't")
+
+
+def parse_number(text):
+    """Returns the last number from 1 to 10 said in the text, or None."""
+    text = _OUT_OF.sub(" ", text.lower())
+    for word in reversed(words_of(text)):
+        number = int(word) if word.isdigit() else NUMBERS.get(word)
+        if number is not None and MIN_SCORE <= number <= MAX_SCORE:
+            return number
+    return None
+
+
+def parse_yes_no(text, final=True):
+    """
+    Returns "Yes" or "No", or None if the text does not answer the question. With final False the text is a partial
+    transcript, and a weak affirmative at its end is not an answer yet as a negation may follow.
+    """
+    words = words_of(text)
+    for position, word in enumerate(words):
+        if _is_negative(word):
+            return "No"
+        if word in AFFIRMATIVES:
+            return "Yes"
+        if word in WEAK_AFFIRMATIVES:
+            if position + 1 < len(words):
+                if _is_negative(words[position + 1]):
+                    return "No"
+                return "Yes"
+            if final:
+                return "Yes"
+            return None
+    return None
+
+
+def parse_answer(text, expected_format):
+    """
+    Returns the response text and sentiment of an answer. The response text is empty when a constrained answer could
+    not be parsed, open-ended answers are returned as they are.
+    """
+    if expected_format == "short":
+        number = parse_number(text)
+        if number is None:
+            return {"response_text": "", "sentiment": ""}
+        return {"response_text": str(number), "sentiment": str(number)}
+    if expected_format == "closed-ended":
+        answer = parse_yes_no(text)
+        if answer is None:
+            return {"response_text": "", "sentiment": ""}
+        return {"response_text": answer, "sentiment": YES_NO_SENTIMENT[answer]}
+    return {"response_text": text, "sentiment": ""}
+
+
+def answer_complete(text, expected_format, final=False):
+    """
+    Returns True if a transcript already answers a constrained question. final is True when the text ends with a
+    final result of the recognizer, and False when it ends with an interim result that may still change.
+    """
+    if expected_format == "short":
+        return final and parse_number(text) is not None
+    if expected_format == "closed-ended":
+        return parse_yes_no(text, final=final) is not None
+    return False
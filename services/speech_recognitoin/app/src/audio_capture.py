@@ -0,0 +1,197 @@
+'''
+Captures the microphone audio for the whole life of the service.
+
+Opening the microphone for every answer took one PyAudio instance to find the microphone and another to open the
+stream, after the main loop had polled for the command, so the first syllables of an answer given straight after
+the robot's question were lost. AudioCapture keeps a single stream open and writes its chunks into a ring buffer
+with the time they were captured, and listen() reads an answer from the ring buffer starting from the moment it
+was asked for.
+
+The microphone found is kept until its stream fails or, on Linux, the sound cards in /proc/asound/cards change
+(PortAudio only sees a microphone plugged in after it is initialised again).
+'''
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+import pyaudio
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries import metrics
+
+SOUND_CARDS = "/proc/asound/cards"
+
+
+def find_microphone_index(audio):
+    """Finds the microphone index, prioritising device 0 with 'USB Audio' in its name."""
+    mic_index = None
+
+    for i in range(audio.get_device_count()):
+        device_info = audio.get_device_info_by_index(i)
+        device_name = device_info["name"]
+        input_channels = device_info.get("maxInputChannels", 0)
+
+        if i == 0 and "USB Audio" in device_name:
+            mic_index = i  # Prioritise device 0
+            break
+
+        if "USB" in device_name and input_channels > 0:
+            mic_index = i  # Fallback if device 0 is incorrect
+
+    if mic_index is None:
+        raise RuntimeError("USB microphone not found! Check the connection.")
+
+    return mic_index
+
+
+def sound_cards():
+    """Returns the sound cards known to the kernel, which change when a USB microphone is plugged in or out."""
+    try:
+        with open(SOUND_CARDS) as cards:
+            return cards.read()
+    except OSError:
+        return None  # Not Linux, hotplugging is then only noticed when the stream fails
+
+
+class AudioCapture:
+    def __init__(self, rate, chunk, buffer_seconds=30, stall_seconds=2.0):
+        """
+        Args:
+            rate (int): Sample rate of the 16-bit mono audio
+            chunk (int): Samples in each chunk
+            buffer_seconds (float): Audio kept in the ring buffer, a reader that falls further behind loses the oldest
+            stall_seconds (float): Time without a chunk after which the stream is taken to have failed
+        """
+        self.rate = rate
+        self.chunk = chunk
+        self.chunk_seconds = chunk / rate
+        self.stall_seconds = stall_seconds
+        self.microphone_index = None
+
+        # (time the chunk was captured, chunk), _next_sequence is the number of the chunk captured next
+        self._ring = collections.deque(maxlen=max(1, round(buffer_seconds / self.chunk_seconds)))
+        self._next_sequence = 0
+        self._last_chunk_at = None
+        self._condition = threading.Condition()
+
+        self._audio_interface = None
+        self._audio_stream = None
+        self._sound_cards = None
+        self._lock = threading.Lock()
+
+        self.metrics = metrics.get_registry()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def start(self):
+        """Opens the microphone, unless it is already open and working."""
+        with self._lock:
+            cards = sound_cards()
+            if self._audio_stream is not None:
+                reason = self._restart_reason(cards)
+                if reason is None:
+                    return
+                self.logger.warning(f"Reopening the microphone, {reason}")
+                self.metrics.increment("speech.capture_restarts", reason)
+                self._close_stream()
+
+            started = time.monotonic()
+            self._audio_interface = pyaudio.PyAudio()
+            try:
+                self.microphone_index = find_microphone_index(self._audio_interface)
+                self._audio_stream = self._audio_interface.open(
+                    format=pyaudio.paInt16,
+                    channels=1,
+                    rate=self.rate,
+                    input=True,
+                    frames_per_buffer=self.chunk,
+                    stream_callback=self._fill_buffer,
+                    input_device_index=self.microphone_index,
+                )
+            except Exception:
+                self._audio_interface.terminate()
+                self._audio_interface = None
+                raise
+            self._sound_cards = cards
+            with self._condition:
+                self._last_chunk_at = time.monotonic()  # The stream has stall_seconds to deliver its first chunk
+            self.logger.info(f"Microphone {self.microphone_index} opened in {(time.monotonic() - started) * 1000:.0f} ms")
+
+    def _restart_reason(self, cards):
+        if cards != self._sound_cards:
+            return "sound cards changed"
+        if not self._audio_stream.is_active():
+            return "stream stopped"
+        with self._condition:
+            if time.monotonic() - self._last_chunk_at > self.stall_seconds:
+                return "stream stalled"
+        return None
+
+    def close(self):
+        with self._lock:
+            if self._audio_stream is not None:
+                self._close_stream()
+
+    def _close_stream(self):
+        try:
+            self._audio_stream.stop_stream()
+            self._audio_stream.close()
+        except Exception as e:
+            # The microphone may have been unplugged
+            self.logger.warning(f"Failed to close the microphone stream: {e}")
+        self._audio_interface.terminate()
+        self._audio_stream = None
+        self._audio_interface = None
+
+    def _fill_buffer(self, in_data, frame_count, time_info, status_flags):
+        with self._condition:
+            self._last_chunk_at = time.monotonic()
+            self._ring.append((self._last_chunk_at - self.chunk_seconds, in_data))
+            self._next_sequence += 1
+            self._condition.notify_all()
+        return None, pyaudio.paContinue
+
+    def listen(self, since=None, stopped=None):
+        """
+        Returns a generator of the chunks captured from since (a time.monotonic() time, now by default) on, waiting
+        for the chunks still to be captured. It ends once stopped() returns True, after calling wake(), or if the
+        microphone stops delivering audio.
+        """
+        self.start()
+        since = time.monotonic() if since is None else since
+        with self._condition:
+            # The first chunk that ends after since
+            sequence = self._next_sequence
+            for captured_at, _ in reversed(self._ring):
+                if captured_at + self.chunk_seconds <= since:
+                    break
+                sequence -= 1
+        return self._read(sequence, stopped or (lambda: False))
+
+    def wake(self):
+        """Wakes up the readers waiting for a chunk, to check whether they are stopped."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def _read(self, sequence, stopped):
+        while True:
+            with self._condition:
+                if not self._condition.wait_for(lambda: self._next_sequence > sequence or stopped(), timeout=self.stall_seconds):
+                    # start() reopens the microphone before the next answer
+                    self.logger.error(f"The microphone delivered no audio for {self.stall_seconds} s")
+                    return
+                if stopped():
+                    return
+                oldest = self._next_sequence - len(self._ring)
+                if sequence < oldest:
+                    self.logger.warning(f"Fell {oldest - sequence} chunks behind the microphone, they are lost")
+                    self.metrics.increment("speech.capture_dropped_chunks", "overrun", oldest - sequence)
+                    sequence = oldest
+                _, chunk = self._ring[sequence - oldest]
+            sequence += 1
+            yield chunk
@@ -0,0 +1,111 @@
+'''
+Processing of the microphone audio before it is sent to a recognizer.
+
+The microphone records at 48 kHz, but speech recognition models work at 16 kHz, so streaming 48 kHz LINEAR16
+(768 kbit/s) to the cloud spends two thirds of the upload on frequencies the recognizer throws away. Resampler
+converts the chunks to 16 kHz with a polyphase filter, and FlacStreamEncoder optionally compresses them further
+as one FLAC stream (pyflac, see requirements.txt), which Google Speech-to-Text accepts in a streaming request.
+'''
+import math
+
+import numpy as np
+
+try:
+    import pyflac
+except ImportError:
+    pyflac = None
+
+RECOGNITION_RATE = 16000
+
+
+def lowpass_filter(up, down, taps_per_phase=24, beta=8.0):
+    """
+    Designs the anti-aliasing filter of a resampler by up/down: a Kaiser windowed sinc, cut off just below the
+    lower of the two Nyquist frequencies, with taps_per_phase taps for each of the up phases.
+    """
+    length = taps_per_phase * up
+    cutoff = 0.95 / max(up, down)  # In half cycles per sample at the upsampled rate
+    n = np.arange(length) - (length - 1) / 2
+    return (cutoff * np.sinc(cutoff * n) * np.kaiser(length, beta)).astype(np.float32)
+
+
+class Resampler:
+    '''
+    Resamples LINEAR16 mono chunks from one rate to another, keeping the filter state between chunks so a stream
+    resampled chunk by chunk is the same as resampled at once.
+
+    A polyphase resampler only computes the output samples: output sample n is the dot product of the input
+    samples before it with the phase of the filter it falls on, and all the output samples of a chunk are computed
+    in one NumPy operation on a sliding window view of the input.
+    '''
+
+    def __init__(self, input_rate, output_rate, taps_per_phase=24):
+        divisor = math.gcd(input_rate, output_rate)
+        self.up = output_rate // divisor
+        self.down = input_rate // divisor
+        self.taps_per_phase = taps_per_phase
+        # phases[p][j] weighs the input sample j samples before the output sample, reversed for the sliding windows
+        phases = lowpass_filter(self.up, self.down, taps_per_phase).reshape(taps_per_phase, self.up).T * self.up
+        self.phases = np.ascontiguousarray(phases[:, ::-1])
+        # The last input samples of the previous chunk, zeros before the first one
+        self._history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._base = -len(self._history)  # Index of the first history sample in the input stream
+        self._produced = 0  # Output samples produced so far
+
+    def process(self, chunk):
+        """Returns the resampled LINEAR16 bytes of a chunk of LINEAR16 bytes."""
+        if self.up == self.down:
+            return chunk
+        samples = np.concatenate((self._history, np.frombuffer(chunk, dtype="<i2").astype(np.float32)))
+        last_input = self._base + len(samples) - 1
+        # Output sample n falls on upsampled position n * down, its last input sample is (n * down) // up
+        end = ((last_input + 1) * self.up - 1) // self.down + 1
+        positions = np.arange(self._produced, end) * self.down
+        starts = positions // self.up - (self.taps_per_phase - 1) - self._base
+
+        windows = np.lib.stride_tricks.sliding_window_view(samples, self.taps_per_phase)
+        resampled = np.einsum("ij,ij->i", windows[starts], self.phases[positions % self.up])
+
+        self._produced = max(end, self._produced)
+        self._base += len(samples) - len(self._history)
+        self._history = samples[len(samples) - len(self._history):]
+        return np.clip(np.round(resampled), -32768, 32767).astype("<i2").tobytes()
+
+    def stream(self, audio_chunks):
+        for chunk in audio_chunks:
+            resampled = self.process(chunk)
+            if resampled:
+                yield resampled
+
+
+class FlacStreamEncoder:
+    """Encodes LINEAR16 mono chunks as one FLAC stream, yielding the encoded bytes as they are produced."""
+
+    def __init__(self, sample_rate, block_ms=100, compression_level=5):
+        if pyflac is None:
+            raise RuntimeError("FLAC encoding requires pyflac (pip install -r requirements.txt)")
+        self.sample_rate = sample_rate
+        self.block_size = int(sample_rate * block_ms / 1000)
+        self.compression_level = compression_level
+
+    @staticmethod
+    def available():
+        return pyflac is not None
+
+    def stream(self, audio_chunks):
+        encoded = []
+        # Blocks as long as the chunks, so every chunk is sent as soon as it is encoded
+        encoder = pyflac.StreamEncoder(
+            sample_rate=self.sample_rate,
+            write_callback=lambda buffer, num_bytes, num_samples, current_frame: encoded.append(bytes(buffer)),
+            compression_level=self.compression_level,
+            blocksize=self.block_size,
+        )
+        for chunk in audio_chunks:
+            encoder.process(np.frombuffer(chunk, dtype="<i2"))
+            if encoded:
+                yield b"".join(encoded)
+                encoded.clear()
+        encoder.finish()
+        if encoded:
+            yield b"".join(encoded)
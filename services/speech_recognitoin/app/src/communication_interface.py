@@ -1,5 +1,4 @@
 import queue
-import json
 import time
 import sys
 import os
@@ -20,8 +19,10 @@ class CommunicationInterface(MQTTClientBase):
         self.command = ""
         self.collect_response = False
         self.format = "open-ended"
+        self.response_requested_at = None # time.monotonic() of the last request for a response
         self.max_retries = 5
         self.delay = 10
+        self.network_connected = True # Until the peripherals service reports otherwise
 
         self.service_status = "Awake" # As soon as the voice assistant starts, it is awake
 
@@ -31,6 +32,7 @@ class CommunicationInterface(MQTTClientBase):
         self.service_status_requested_topic = "request/service_status"
         self.control_cmd = "speech_recognition_control_cmd"
         self.update_state_topic = "service/speech_recognition/update_state"
+        self.network_status_topic = "network_status"
 
         # Publish topics
         self.speech_recognition_status_topic = "speech_recognition_status"
@@ -42,31 +44,32 @@ class CommunicationInterface(MQTTClientBase):
         self.robot_control_status_topic = "robot_control_status"
 
         # subscribe to topics
-        self.subscribe(self.service_status_requested_topic, self._respond_with_service_status)
-        self.subscribe(self.control_cmd, self._handle_command)
-        self.subscribe(self.update_state_topic, self._update_service_state)
-
-    def _respond_with_service_status(self, client, userdata, message):
-        self.publish_speech_recognition_status(self.service_status)
+        self.add_route(self.service_status_requested_topic, self._respond_with_service_status)
+        self.add_route(self.control_cmd, self._handle_command)
+        self.add_route(self.update_state_topic, self._update_service_state)
+        self.add_route(self.network_status_topic, self._update_network_status)
+
+    def _respond_with_service_status(self, payload, message):
+        correlation_id = payload.get("correlation_id") if isinstance(payload, dict) else None
+        self.publish_speech_recognition_status(self.service_status, correlation_id=correlation_id)
     
-    def _handle_command(self, client, userdata, message):
-        
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            cmd = payload.get("cmd", "")
-            logging.info(f"vocie assistant received the command: {cmd}")
-            self.logger.info(f"cmd = {cmd}")
-            if cmd == "end":
-                self.command = ""
-            elif cmd == "set_up" or cmd == "start":
-                self.command = cmd
-            elif cmd == "open-ended" or cmd == "closed-ended" or cmd =="short":
-                self.collect_response = True
-                self.format = cmd
-            else:
-                self.command = ""
-        except json.JSONDecodeError:
+    def _handle_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload. Using default retry parameters.")
+            return
+        cmd = payload.get("cmd", "")
+        logging.info(f"vocie assistant received the command: {cmd}")
+        self.logger.info(f"cmd = {cmd}")
+        if cmd == "end":
+            self.command = ""
+        elif cmd == "set_up" or cmd == "start":
+            self.command = cmd
+        elif cmd == "open-ended" or cmd == "closed-ended" or cmd =="short":
+            self.response_requested_at = time.monotonic()
+            self.collect_response = True
+            self.format = cmd
+        else:
+            self.command = ""
 
         status = {
             "set_up": "ready",
@@ -77,17 +80,24 @@ class CommunicationInterface(MQTTClientBase):
             "closed-ended": "running"
         }
 
-        self.publish_speech_recognition_status(status[cmd])
-    def _update_service_state(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            state_name = payload.get("state_name", "")
-            state = payload.get("state_value", [])
-            self.logger.info(f"Speach recognitino received state update for {state_name}: {state}")
-            # self.dispatcher.dispatch_event("update_service_state", payload)
-            self.service_status = "set_up"
-        except json.JSONDecodeError:
+        self.publish_speech_recognition_status(status[cmd], correlation_id=payload.get("correlation_id"))
+
+    def _update_service_state(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for updating service state. Using default retry parameters.")
+            return
+        state_name = payload.get("state_name", "")
+        state = payload.get("state_value", [])
+        self.logger.info(f"Speach recognitino received state update for {state_name}: {state}")
+        # self.dispatcher.dispatch_event("update_service_state", payload)
+        self.service_status = "set_up"
+
+    def _update_network_status(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error("Invalid JSON payload for network status.")
+            return
+        self.network_connected = payload.get("status") == "connected"
+        self.logger.info(f"Network status: {payload.get('status')}")
 
     def publish_user_response(self, user_response, message_type="response"):
         self.logger.info(f"Publishing User response to conversation history topic: {user_response}")
@@ -99,16 +109,16 @@ class CommunicationInterface(MQTTClientBase):
             "content": user_response["response_text"],
             "sentiment": user_response["sentiment"],
         }
-        self._thread_safe_publish(self.conversation_history_topic, json.dumps(message))
+        self._thread_safe_publish(self.conversation_history_topic, message)
 
         status = {
             "behaviour_name": "user response",
             "status": "failed" if user_response == "" else "complete",
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
             }
-        self._thread_safe_publish(self.robot_control_status_topic, json.dumps(status))
+        self._thread_safe_publish(self.robot_control_status_topic, status)
     
-    def publish_speech_recognition_status(self, status, message="", details=None):
+    def publish_speech_recognition_status(self, status, message="", details=None, correlation_id=None):
         if status == "running":
             self.publish(self.audio_active_topic, "1")
         if status == "completed":
@@ -122,7 +132,9 @@ class CommunicationInterface(MQTTClientBase):
             "details": details,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.speech_recognition_status_topic, json.dumps(payload))
+        if correlation_id:
+            payload["correlation_id"] = correlation_id
+        self.publish(self.speech_recognition_status_topic, payload)
 
         self.service_status = status
 
@@ -131,7 +143,7 @@ class CommunicationInterface(MQTTClientBase):
             "service_name": "speech_recognition",
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.vocie_assistant_hearbeat_topic, json.dumps(payload))
+        self.publish(self.vocie_assistant_hearbeat_topic, payload)
     
     def publish_silance_detected(self, duration):
         '''
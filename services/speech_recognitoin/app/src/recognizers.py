@@ -0,0 +1,291 @@
+'''
+Speech recognizers that SpeechToText transcribes the user's answers with.
+
+A recognizer reads the LINEAR16 mono chunks of one answer from an iterator as they are captured and returns the
+transcript. GoogleRecognizer streams them to Google Cloud Speech-to-Text. VoskRecognizer decodes them on the
+device with Vosk (see requirements.txt) and a model from https://alphacephei.com/vosk/models set in VOSK_MODEL_PATH.
+For the "short" and "closed-ended" formats Vosk only considers the words such an answer can contain, which keeps
+a small model fast and accurate, and the check-in carries on when the network is down.
+
+Both return as soon as the transcript of a constrained answer holds the answer (see answer_parser.answer_complete)
+instead of waiting for the microphone to detect the end of the answer.
+
+RecognizerChain picks the recognizers for each expected format and falls back to the next one when a recognizer
+fails. The audio read so far is kept, so the next recognizer still hears the whole answer.
+'''
+import abc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries import metrics
+
+from . import answer_parser
+from .audio_pipeline import FlacStreamEncoder
+
+try:
+    from google.cloud import speech
+except ImportError:
+    speech = None
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+# Recognizers tried for each expected format, in order. Overridden by SPEECH_RECOGNIZERS, e.g.
+# "short=vosk,google;closed-ended=vosk,google;open-ended=google"
+DEFAULT_RECOGNIZER_ORDER = {
+    "short": ["vosk", "google"],
+    "closed-ended": ["vosk", "google"],
+    "open-ended": ["google", "vosk"],
+}
+
+
+def recognizer_order_from_env():
+    order = dict(DEFAULT_RECOGNIZER_ORDER)
+    for entry in os.getenv("SPEECH_RECOGNIZERS", "").split(";"):
+        expected_format, _, names = entry.partition("=")
+        names = [name.strip() for name in names.split(",") if name.strip()]
+        if expected_format.strip() and names:
+            order[expected_format.strip()] = names
+    return order
+
+
+class Recognizer(abc.ABC):
+    name = None
+    needs_network = False
+
+    def available(self):
+        """Returns False if the recognizer can not be used, e.g. because it is not installed."""
+        return True
+
+    @abc.abstractmethod
+    def recognise(self, audio_chunks, expected_format, answer_complete=None):
+        """
+        Transcribes the audio chunks of one answer, returns the transcript. If answer_complete(transcript, final)
+        returns True the transcript so far is returned without reading the rest of the audio. final tells whether
+        the transcript ends with a final result or with an interim one that may still change.
+        """
+
+
+class GoogleRecognizer(Recognizer):
+    name = "google"
+    needs_network = True
+
+    def __init__(self, sample_rate, language_code="en-US", encoding=None):
+        """
+        Args:
+            sample_rate (int): Sample rate of the LINEAR16 chunks
+            language_code (str): Language of the answers
+            encoding (str): "linear16" to stream the chunks as they are or "flac" to compress them first, which
+                needs pyflac. SPEECH_AUDIO_ENCODING by default.
+        """
+        self.sample_rate = sample_rate
+        self.language_code = language_code
+        self.encoding = (encoding or os.getenv("SPEECH_AUDIO_ENCODING") or "linear16").lower()
+        if self.encoding == "flac" and not FlacStreamEncoder.available():
+            logging.getLogger(self.__class__.__name__).warning("pyflac is not installed, streaming LINEAR16 audio instead of FLAC")
+            self.encoding = "linear16"
+        self._client = None
+        self.metrics = metrics.get_registry()
+
+    def available(self):
+        return speech is not None
+
+    @property
+    def client(self):
+        # Created on first use, so the service starts without credentials when only local recognizers are used
+        if self._client is None:
+            self._client = speech.SpeechClient()
+        return self._client
+
+    def config(self, expected_format):
+        encoding = speech.RecognitionConfig.AudioEncoding.FLAC if self.encoding == "flac" else speech.RecognitionConfig.AudioEncoding.LINEAR16
+        vocabulary = answer_parser.ANSWER_VOCABULARY.get(expected_format)
+        if vocabulary is None:
+            return speech.RecognitionConfig(
+                encoding=encoding,
+                sample_rate_hertz=self.sample_rate,
+                language_code=self.language_code,
+            )
+        return speech.RecognitionConfig(
+            encoding=encoding,
+            sample_rate_hertz=self.sample_rate,
+            language_code=self.language_code,
+            speech_contexts=[speech.SpeechContext(phrases=vocabulary)],
+        )
+
+    def recognise(self, audio_chunks, expected_format, answer_complete=None):
+        streaming_config = speech.StreamingRecognitionConfig(
+            config=self.config(expected_format),
+            interim_results=True,
+            single_utterance=False,
+        )
+        if self.encoding == "flac":
+            audio_chunks = FlacStreamEncoder(self.sample_rate).stream(audio_chunks)
+        timing = {}
+        requests = (speech.StreamingRecognizeRequest(audio_content=content) for content in self._measure(audio_chunks, timing))
+        responses = self.client.streaming_recognize(streaming_config, requests)
+        return self.listen_print_loop(responses, answer_complete, timing)
+
+    def _measure(self, audio_chunks, timing):
+        for content in audio_chunks:
+            timing.setdefault("first_sent", time.monotonic())
+            self.metrics.increment("speech.bytes_sent", self.encoding, len(content))
+            yield content
+
+    def listen_print_loop(self, responses, answer_complete=None, timing=None):
+        """Processes server responses and captures transcripts."""
+        transcript = ""
+        for response in responses:
+            if not response.results:
+                continue
+            if timing and "first_result" not in timing:
+                timing["first_result"] = time.monotonic()
+                self.metrics.observe("speech.first_result_ms", self.encoding, (timing["first_result"] - timing["first_sent"]) * 1000)
+
+            result = response.results[0]
+            if not result.alternatives:
+                continue
+
+            # Append interim results to the transcript
+            if result.is_final:
+                transcript += result.alternatives[0].transcript + " "
+                print(f"Final result: {result.alternatives[0].transcript}")
+                if answer_complete and answer_complete(transcript, True):
+                    break
+            else:
+                print(f"Interim result: {result.alternatives[0].transcript}", end="\r")
+                if answer_complete and answer_complete(transcript + result.alternatives[0].transcript, False):
+                    # Cancels the stream, the transcript is not final but already holds the answer
+                    transcript += result.alternatives[0].transcript
+                    break
+
+        return transcript.strip()
+
+
+class VoskRecognizer(Recognizer):
+    name = "vosk"
+
+    def __init__(self, sample_rate, model_path=None):
+        self.sample_rate = sample_rate
+        self.model_path = model_path or os.getenv("VOSK_MODEL_PATH")
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def available(self):
+        return vosk is not None and bool(self.model_path) and os.path.isdir(self.model_path)
+
+    def load(self):
+        """Loads the model, which takes a few seconds, so it is done before the first answer rather than during it."""
+        with self._model_lock:
+            if self._model is None:
+                vosk.SetLogLevel(-1)
+                started = time.monotonic()
+                self._model = vosk.Model(self.model_path)
+                logging.getLogger(self.__class__.__name__).info(f"Loaded Vosk model {self.model_path} in {time.monotonic() - started:.1f} s")
+        return self._model
+
+    def recogniser_for(self, expected_format):
+        vocabulary = answer_parser.ANSWER_VOCABULARY.get(expected_format)
+        if vocabulary is None:
+            return vosk.KaldiRecognizer(self.load(), self.sample_rate)
+        # Anything else said is decoded as [unk] rather than forced onto the closest answer word
+        return vosk.KaldiRecognizer(self.load(), self.sample_rate, json.dumps(vocabulary + ["[unk]"]))
+
+    def recognise(self, audio_chunks, expected_format, answer_complete=None):
+        recogniser = self.recogniser_for(expected_format)
+        texts = []
+        for chunk in audio_chunks:
+            final = recogniser.AcceptWaveform(chunk)
+            if final:
+                texts.append(json.loads(recogniser.Result()).get("text", ""))
+                partial = ""
+            else:
+                partial = json.loads(recogniser.PartialResult()).get("partial", "")
+            if answer_complete and answer_complete(self._words(texts + [partial]), final):
+                texts.append(partial)
+                return self._words(texts)
+        texts.append(json.loads(recogniser.FinalResult()).get("text", ""))
+        return self._words(texts)
+
+    def _words(self, texts):
+        return " ".join(word for text in texts for word in text.split() if word != "[unk]")
+
+
+class _RecordedAudio:
+    """Keeps the chunks read from the microphone, so every recognizer reads the answer from its start."""
+
+    def __init__(self, audio_chunks):
+        self._audio_chunks = iter(audio_chunks)
+        self._recorded = []
+        self._lock = threading.Lock()
+        self.finished_at = None
+
+    def replay(self):
+        position = 0
+        while True:
+            with self._lock:
+                if position == len(self._recorded):
+                    chunk = next(self._audio_chunks, None)
+                    if chunk is None:
+                        self.finished_at = self.finished_at or time.monotonic()
+                        return
+                    self._recorded.append(chunk)
+                chunk = self._recorded[position]
+            position += 1
+            yield chunk
+
+
+class RecognizerChain:
+    def __init__(self, recognizers, order=None, network_available=None):
+        """
+        Args:
+            recognizers (list): The Recognizer instances that can be used
+            order (dict): Names of the recognizers to try for each expected format, DEFAULT_RECOGNIZER_ORDER by default
+            network_available (callable): Returns False while the network is known to be down, recognizers that
+                need it are then tried last
+        """
+        self.recognizers = {recognizer.name: recognizer for recognizer in recognizers}
+        self.order = order or DEFAULT_RECOGNIZER_ORDER
+        self.network_available = network_available or (lambda: True)
+        self.metrics = metrics.get_registry()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def candidates(self, expected_format):
+        names = self.order.get(expected_format) or list(self.recognizers)
+        candidates = [self.recognizers[name] for name in names if name in self.recognizers and self.recognizers[name].available()]
+        if not self.network_available():
+            candidates.sort(key=lambda recognizer: recognizer.needs_network)
+        return candidates
+
+    def recognise(self, audio_chunks, expected_format):
+        """Transcribes an answer with the first recognizer for the format that succeeds."""
+        candidates = self.candidates(expected_format)
+        if not candidates:
+            raise RuntimeError(f"No speech recognizer is available for {expected_format} answers")
+        audio = _RecordedAudio(audio_chunks)
+        errors = []
+        for recognizer in candidates:
+            try:
+                transcript = recognizer.recognise(audio.replay(), expected_format, lambda text, final: answer_parser.answer_complete(text, expected_format, final))
+            except Exception as e:
+                self.logger.error(f"{recognizer.name} failed to recognise the {expected_format} answer: {e}")
+                self.metrics.increment("speech.recognizer_errors", recognizer.name)
+                errors.append(f"{recognizer.name}: {e}")
+                continue
+            if audio.finished_at is not None:
+                # Time the user waits for the transcript once they stopped talking
+                self.metrics.observe("speech.decode_ms", recognizer.name, (time.monotonic() - audio.finished_at) * 1000)
+            self.metrics.increment("speech.recognised", recognizer.name)
+            self.logger.info(f"{recognizer.name} recognised the {expected_format} answer: {transcript}")
+            return transcript
+        raise RuntimeError(f"Every speech recognizer failed: {'; '.join(errors)}")
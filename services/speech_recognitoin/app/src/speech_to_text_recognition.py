@@ -1,22 +1,26 @@
-import queue
 import time
 import os
-import re
-from google.cloud import speech
-
-import pyaudio
-import audioop
 
 import logging
 
+from . import answer_parser
+from .audio_capture import AudioCapture
+from .audio_pipeline import RECOGNITION_RATE, Resampler
+from .recognizers import GoogleRecognizer, RecognizerChain, VoskRecognizer, recognizer_order_from_env
+from .voice_activity import VoiceActivityDetector
+
 # Audio recording parameters
 RATE = 48000
 CHUNK = int(RATE / 10)  # 100ms
-SILENCE_THRESHOLD = 500  # RMS threshold for silence (This value was arbitrarily chosen based on testing)
 INITIAL_SILENCE_DURATION = 15 # Silence duration in seconds
 SILENCE_DURATION = 3  # Silence duration in seconds
+# A number or yes/no is a single word, a shorter silence is enough to tell the user has finished
+END_OF_SPEECH_SECONDS = {"short": 1.2, "closed-ended": 1.2}
+# Audio kept from before the response was requested, for an answer started as the robot finished the question
+PRE_ROLL_SECONDS = 0.3
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
 class SpeechToText:
     def __init__(self, communication_interface):
@@ -24,9 +28,29 @@ class SpeechToText:
         self.speech_key = os.getenv('SPEECH_KEY')
         self.service_region = os.getenv('SPEECH_REGION')
         self.communication_interface = communication_interface
-        self.client = speech.SpeechClient()
 
         self.logger = logging.getLogger(self.__class__.__name__)
+
+        # Answers are transcribed by the recognizers configured for their format, falling back to the next one
+        # The audio is resampled to RECOGNITION_RATE first, see _recognise_response
+        local_recognizer = VoskRecognizer(RECOGNITION_RATE)
+        self.recognizers = RecognizerChain(
+            [GoogleRecognizer(RECOGNITION_RATE), local_recognizer],
+            order=recognizer_order_from_env(),
+            network_available=lambda: communication_interface.network_connected,
+        )
+        if local_recognizer.available():
+            local_recognizer.load()
+
+        # The microphone stays open between answers, so capturing an answer starts without delay
+        self.capture = AudioCapture(RATE, CHUNK)
+        try:
+            self.capture.start()
+        except Exception as e:
+            self.logger.error(f"Failed to open the microphone, retrying for the first response: {e}")
+
+    def close(self):
+        self.capture.close()
     
     def get_response(self, expected_format):
         self.logger.info(f"Getting response with expected format: {expected_format}")
@@ -40,203 +64,85 @@ class SpeechToText:
         if not isinstance(response_text, str) or not response_text.strip():
             self.logger.debug(f"Invalid response: {response_text}. Expected a non-empty string.")
             return {"response_text": "", "sentiment": sentiment}
-        if expected_format == "short":
-            # Check if the response is a valid number
-            try:
-                response = self._extract_number_from(response_text)
-                if not response["response_text"]:
-                    return {"response_text": "", "sentiment": sentiment}
-                if int(response["response_text"]) < 0 and int(response["response_text"]) > 10:
-                    return {"response_text": "", "sentiment": sentiment}
-                else:
-                    sentiment = response["sentiment"]
-                    return {"response_text": response["response_text"], "sentiment": sentiment}
-            except ValueError:
-                self.logger.debug(f"Invalid response: {response_text}. Expected a number.")
-                return {"response_text": "", "sentiment": sentiment}
-        elif expected_format == "closed-ended":
-            if "yes" in response_text.lower():
-                sentiment = "8"
-                return {"response_text": "Yes", "sentiment": sentiment}
-            elif "no" in response_text.lower():
-                sentiment = "2"
-                return {"response_text": "No", "sentiment": sentiment}
-            else:
-                self.logger.debug(f"Invalid response: {response_text}. Expected 'yes' or 'no'.")
-                return {"response_text": "", "sentiment": sentiment}
-        # TODO: publish respones to the orchestrator and the user interface for display
+        response = answer_parser.parse_answer(response_text, expected_format)
+        if not response["response_text"]:
+            self.logger.debug(f"Invalid response: {response_text}. Expected a {expected_format} answer.")
+        # TODO: publish respones to the orchestrator and the user interface for display
         # Send the response to the orchestrator
-        return {"response_text": response_text, "sentiment": sentiment}
+        return response
     
     def _recognise_response(self, response_type):
-        while True:
-            # Configure recognition settings based on the response type
-            config = self.long_response() if response_type == "open-ended" else self.short_response()
-            streaming_config = speech.StreamingRecognitionConfig(
-                config=config,
-                interim_results=True,
-                single_utterance=False,
-            )
-            
-            transcript = ""
-            with MicrophoneStream(RATE, CHUNK, self.communication_interface) as stream:
-                audio_generator = stream.generator()
-                requests = (
-                    speech.StreamingRecognizeRequest(audio_content=content)
-                    for content in audio_generator
-                )
-                responses = self.client.streaming_recognize(streaming_config, requests)
-
-                # Process the responses
-                transcript = self.listen_print_loop(responses)
-                print(f"Captured transcript: {transcript}")
-
-            return transcript
-    
-    def long_response(self):
-        return speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=RATE,
-            language_code="en-US",
-        )
-
-    def short_response(self):
-        return speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=RATE,
-            language_code="en-US",
-            speech_contexts=[speech.SpeechContext(phrases=["yes", "no", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"])],
-        )
-    
-    def listen_print_loop(self, responses):
-        """Processes server responses and captures transcripts."""
-        transcript = ""
-        for response in responses:
-            if not response.results:
-                continue
-
-            result = response.results[0]
-            if not result.alternatives:
-                continue
-            
-            # Append interim results to the transcript
-            if result.is_final:
-                transcript += result.alternatives[0].transcript + " "
-                print(f"Final result: {result.alternatives[0].transcript}")
-            else:
-                print(f"Interim result: {result.alternatives[0].transcript}", end="\r")
-
-        return transcript.strip()
-    
-    def _extract_number_from(self, response):
-        self.logger.info(f"In _extract_number_from() response received = {response}")
-        if not isinstance(response, str):
-            self.logger.debug(f"Invalid response type: {type(response)}. Expected string.")
-            return {"response_text": None, "sentiment": ""}
-        # Use regex to find the first occurrence of a number (integer)
-        match = re.search(r'\d+', response)
-        if match:
-            self.logger.info(f"Extracted number: {match.group()} or the last index {match}")
-            return {"response_text": match.group(), "sentiment": match.group()} # Return the last digit spoken
-        else:
-            return {"response_text": None, "sentiment": ""}
+        end_of_speech_seconds = END_OF_SPEECH_SECONDS.get(response_type, SILENCE_DURATION)
+        # The answer starts when the response was requested, not when the main loop got round to it
+        requested_at = self.communication_interface.response_requested_at or time.monotonic()
+        self.communication_interface.response_requested_at = None
+        since = requested_at - PRE_ROLL_SECONDS
+        with MicrophoneStream(self.capture, self.communication_interface, end_of_speech_seconds, since) as stream:
+            # Recognizers work at 16 kHz, there is no need to send them three times as much audio
+            audio = Resampler(RATE, RECOGNITION_RATE).stream(stream.generator())
+            transcript = self.recognizers.recognise(audio, response_type)
+            print(f"Captured transcript: {transcript}")
+        return transcript
 
 class MicrophoneStream:
-    """Opens a recording stream as a generator yielding the audio chunks."""
+    """Reads the audio chunks of one answer from the microphone capture as a generator."""
 
-    def __init__(self, rate=RATE, chunk=CHUNK, communication_interface=None):
-        self._rate = rate
-        self._chunk = chunk
-        self._buff = queue.Queue()
+    def __init__(self, capture, communication_interface=None, end_of_speech_seconds=SILENCE_DURATION, since=None):
+        self._capture = capture
+        self._rate = capture.rate
+        self.end_of_speech_seconds = end_of_speech_seconds
+        self.since = since
         self.closed = True
         self.communication_interface = communication_interface
-        self.microphone_index = self.get_microphone_index()
-
-    def get_microphone_index(self):
-        """Finds the microphone index, prioritising device 0 with 'USB Audio' in its name."""
-        audio = pyaudio.PyAudio()
-        mic_index = None
-
-        for i in range(audio.get_device_count()):
-            device_info = audio.get_device_info_by_index(i)
-            device_name = device_info["name"]
-            input_channels = device_info.get("maxInputChannels", 0)
-
-            if i == 0 and "USB Audio" in device_name:
-                mic_index = i  # Prioritise device 0
-                break
-
-            if "USB" in device_name and input_channels > 0:
-                mic_index = i  # Fallback if device 0 is incorrect
-
-        audio.terminate()
-        
-        if mic_index is None:
-            raise RuntimeError("USB microphone not found! Check the connection.")
-        
-        print(f"Microphne index detected at {mic_index}")
-
-        return mic_index
 
     def __enter__(self):
-        self._audio_interface = pyaudio.PyAudio()
-        self._audio_stream = self._audio_interface.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self._rate,
-            input=True,
-            frames_per_buffer=self._chunk,
-            stream_callback=self._fill_buffer,
-            input_device_index=self.microphone_index,
-        )
+        self._chunks = self._capture.listen(self.since, stopped=lambda: self.closed)
         self.closed = False
         return self
     
     def __exit__(self, type, value, traceback):
-        self._audio_stream.stop_stream()
-        self._audio_stream.close()
         self.closed = True
-        self._buff.put(None)
-        self._audio_interface.terminate()
+        self._capture.wake()
 
-    def _fill_buffer(self, in_data, frame_count, time_info, status_flags):
-        self._buff.put(in_data)
-        return None, pyaudio.paContinue
-    
     def generator(self):
         """Generate audio chunks and detect silence.
         Waits {INITIAL_SILENCE_DURATION} seconds for the user to start speaking.
-        Once the user starts talking, if the user is silent for {SILENCE_DURATION}, the conversation will end.
+        Once the user starts talking, if the user is silent for end_of_speech_seconds, the conversation will end.
+        Silence is measured in seconds of audio rather than of wall time, so it is not cut short when the recognizer
+        falls behind and chunks queue up.
         """
-        silence_start = time.time()
+        vad = VoiceActivityDetector(self._rate)
+        silent_seconds = 0.0
         silence_detected = False
         initial_silence = True
         self.communication_interface.publish_silance_detected(INITIAL_SILENCE_DURATION)
         while not self.closed:
-            chunk = self._buff.get()
+            chunk = next(self._chunks, None)
             if chunk is None:
                 return
             yield chunk
 
-            # Detect silence by measuring RMS
-            rms = audioop.rms(chunk, 2)
+            chunk_seconds = len(chunk) / 2 / self._rate
             if initial_silence:
-                if rms < SILENCE_THRESHOLD:
-                    if time.time() - silence_start >= INITIAL_SILENCE_DURATION:
+                if not vad.contains_speech(chunk):
+                    silent_seconds += chunk_seconds
+                    if silent_seconds >= INITIAL_SILENCE_DURATION:
                         self.closed = True
                 else:
                     initial_silence = False
                     silence_detected = False
-                    silence_start = time.time()  # Reset silence timer for post-speaking silence detection
+                    silent_seconds = 0.0  # Reset silence timer for post-speaking silence detection
                     self.communication_interface.publish_silance_detected(0)
             else:
-                if rms < SILENCE_THRESHOLD:
+                if not vad.contains_speech(chunk):
                     if not silence_detected: # publish silence detected only once per silent period
                         silence_detected = True
-                        self.communication_interface.publish_silance_detected(SILENCE_DURATION)
-                    if time.time() - silence_start >= SILENCE_DURATION:
+                        self.communication_interface.publish_silance_detected(self.end_of_speech_seconds)
+                    silent_seconds += chunk_seconds
+                    if silent_seconds >= self.end_of_speech_seconds:
                         self.closed = True
                 else:
-                    silence_start = time.time()  # Reset silence timer when sound is detected
-                    self.communication_interface.publish_silance_detected(0)
+                    silent_seconds = 0.0  # Reset silence timer when speech is detected
+                    if silence_detected:
+                        self.communication_interface.publish_silance_detected(0)
                     silence_detected = False
@@ -0,0 +1,77 @@
+'''
+Voice activity detection for the microphone audio, replacing the RMS of each chunk compared with a fixed threshold
+(audioop is removed in Python 3.13, and a fixed threshold misfires in a noisy room).
+
+Each chunk is split into frames of frame_ms, and the energy and zero-crossing rate of every frame are computed
+in one NumPy pass over the chunk. A frame is speech when its energy is margin_db above the noise floor. Unvoiced
+sounds such as the "s" of "yes" are quiet but cross zero often, so a frame with a high zero-crossing rate only
+needs half that margin. The noise floor follows the quietest frames down at once and rises slowly, so it adapts
+to a fan or traffic noise without taking the user's speech for noise.
+'''
+import numpy as np
+
+FRAME_MS = 20
+
+
+class VoiceActivityDetector:
+    def __init__(self, sample_rate, frame_ms=FRAME_MS, margin_db=9.0, fricative_zcr=0.25, min_level_db=-55.0,
+                 floor_rise_db_per_second=2.0, min_speech_ms=40):
+        """
+        Args:
+            sample_rate (int): Sample rate of the 16-bit mono audio
+            frame_ms (int): Length of the frames the audio is analysed in
+            margin_db (float): Energy above the noise floor a frame needs to be speech
+            fricative_zcr (float): Zero-crossing rate (crossings per sample) above which half the margin is enough
+            min_level_db (float): Energy in dB full scale below which a frame is never speech, however quiet the room
+            floor_rise_db_per_second (float): How fast the noise floor rises when the room gets louder
+            min_speech_ms (int): Speech a chunk must contain to count as speech, so clicks do not
+        """
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self.frame_seconds = frame_ms / 1000
+        self.margin_db = margin_db
+        self.fricative_zcr = fricative_zcr
+        self.min_level_db = min_level_db
+        self.floor_rise_db_per_second = floor_rise_db_per_second
+        self.min_speech_frames = max(1, round(min_speech_ms / frame_ms))
+        self.noise_floor_db = None
+        # Samples of a frame started at the end of the previous chunk
+        self._remainder = np.zeros(0, dtype=np.int16)
+
+    def _frames(self, chunk):
+        samples = np.frombuffer(chunk, dtype="<i2")
+        if self._remainder.size:
+            samples = np.concatenate((self._remainder, samples))
+        count = samples.size // self.frame_length
+        self._remainder = samples[count * self.frame_length:].copy()
+        return samples[:count * self.frame_length].reshape(count, self.frame_length)
+
+    def speech_frames(self, chunk):
+        """Returns whether each whole frame of the chunk (LINEAR16 bytes) is speech, as a boolean array."""
+        frames = self._frames(chunk)
+        if not len(frames):
+            return np.zeros(0, dtype=bool)
+
+        samples = frames.astype(np.float32) / 32768.0
+        energy_db = 10 * np.log10(np.mean(samples * samples, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_length - 1)
+
+        if self.noise_floor_db is None:
+            self.noise_floor_db = float(np.percentile(energy_db, 10))
+        threshold = max(self.noise_floor_db + self.margin_db, self.min_level_db)
+        speech = (energy_db > threshold) | (
+            (zero_crossing_rate > self.fricative_zcr) & (energy_db > threshold - self.margin_db / 2)
+        )
+
+        quiet = energy_db[~speech]
+        level = float(np.median(quiet)) if quiet.size else float(energy_db.min())
+        if level < self.noise_floor_db:
+            self.noise_floor_db = level
+        else:
+            rise = self.floor_rise_db_per_second * self.frame_seconds * len(frames)
+            self.noise_floor_db = min(level, self.noise_floor_db + rise)
+        return speech
+
+    def contains_speech(self, chunk):
+        """Returns True if the chunk contains at least min_speech_ms of speech."""
+        return int(np.count_nonzero(self.speech_frames(chunk))) >= self.min_speech_frames
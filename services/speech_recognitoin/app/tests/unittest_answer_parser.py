@@ -0,0 +1,102 @@
+# unittest_answer_parser.py
+
+import unittest
+import os
+import sys
+from types import SimpleNamespace
+
+# Add the speech recognition app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from src.answer_parser import answer_complete, parse_answer, parse_number, parse_yes_no
+from src.recognizers import GoogleRecognizer
+
+
+def streaming_response(transcript, is_final):
+    """A response of Google's streaming_recognize with a single result."""
+    result = SimpleNamespace(alternatives=[SimpleNamespace(transcript=transcript)], is_final=is_final)
+    return SimpleNamespace(results=[result])
+
+
+class TestAnswerParser(unittest.TestCase):
+
+    def test_numbers_as_words_and_digits(self):
+        self.assertEqual(parse_number("ten"), 10)
+        self.assertEqual(parse_number("I'd say nine"), 9)
+        self.assertEqual(parse_number("7"), 7)
+        self.assertIsNone(parse_number("not sure"))
+
+    def test_numbers_out_of_range_are_ignored(self):
+        self.assertIsNone(parse_number("0"))
+        self.assertIsNone(parse_number("42"))
+
+    def test_out_of_ten_is_not_the_answer(self):
+        self.assertEqual(parse_number("seven out of ten"), 7)
+        self.assertEqual(parse_number("8/10"), 8)
+        self.assertEqual(parse_number("ten out of ten"), 10)
+
+    def test_last_number_counts(self):
+        self.assertEqual(parse_number("six, no, seven"), 7)
+
+    def test_yes_variants(self):
+        for text in ["yes", "Yeah I did", "yep", "sure", "I did", "definitely"]:
+            self.assertEqual(parse_yes_no(text), "Yes", text)
+
+    def test_no_variants_and_negations(self):
+        for text in ["no", "Nope", "nah", "not really", "I didn't", "I did not", "I don’t think so", "never"]:
+            self.assertEqual(parse_yes_no(text), "No", text)
+
+    def test_no_inside_a_word_is_not_an_answer(self):
+        # A substring match read "know" as no
+        self.assertIsNone(parse_yes_no("I know"))
+        self.assertIsNone(parse_yes_no("maybe"))
+
+    def test_parse_answer(self):
+        self.assertEqual(parse_answer("nine", "short"), {"response_text": "9", "sentiment": "9"})
+        self.assertEqual(parse_answer("not really", "closed-ended"), {"response_text": "No", "sentiment": "2"})
+        self.assertEqual(parse_answer("yeah", "closed-ended"), {"response_text": "Yes", "sentiment": "8"})
+        self.assertEqual(parse_answer("banana", "short"), {"response_text": "", "sentiment": ""})
+        self.assertEqual(parse_answer("A walk after lunch", "open-ended"), {"response_text": "A walk after lunch", "sentiment": ""})
+
+    def test_answer_complete(self):
+        self.assertTrue(answer_complete("seven", "short", final=True))
+        self.assertFalse(answer_complete("um", "short", final=True))
+        self.assertTrue(answer_complete("yeah", "closed-ended"))
+        # A negation may still follow
+        self.assertFalse(answer_complete("I did", "closed-ended"))
+        self.assertTrue(answer_complete("I did", "closed-ended", final=True))
+        self.assertTrue(answer_complete("I did not", "closed-ended"))
+        self.assertFalse(answer_complete("yes", "open-ended", final=True))
+
+    def test_number_is_not_taken_from_an_interim_transcript(self):
+        # The user may still correct themselves, "six, no, seven"
+        self.assertFalse(answer_complete("six", "short"))
+        self.assertFalse(answer_complete("six no", "short"))
+        self.assertTrue(answer_complete("six no seven", "short", final=True))
+        self.assertEqual(parse_answer("six no seven", "short")["response_text"], "7")
+
+    def test_recognizer_returns_on_the_final_result_of_a_number(self):
+        responses = [
+            streaming_response("six", False),
+            streaming_response("six no", False),
+            streaming_response("six no seven", False),
+            streaming_response("six no seven", True),
+            streaming_response("and something else", True),
+        ]
+        recognizer = GoogleRecognizer(16000)
+        transcript = recognizer.listen_print_loop(iter(responses), lambda text, final: answer_complete(text, "short", final))
+        self.assertEqual(transcript, "six no seven")
+
+    def test_recognizer_returns_on_an_interim_yes_no(self):
+        responses = [
+            streaming_response("yeah", False),
+            streaming_response("yeah I did", True),
+        ]
+        recognizer = GoogleRecognizer(16000)
+        transcript = recognizer.listen_print_loop(iter(responses), lambda text, final: answer_complete(text, "closed-ended", final))
+        self.assertEqual(transcript, "yeah")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+# unittest_audio_capture.py
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import threading
+import types
+
+# Add the speech recognition app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+try:
+    from src import audio_capture
+    from src.audio_capture import AudioCapture, find_microphone_index
+except ImportError:  # pyaudio is not installed
+    audio_capture = None
+
+RATE = 16000
+CHUNK = 1600  # 100ms
+
+
+class FakeStream:
+    '''A microphone stream whose chunks are delivered by the test through the stream callback.'''
+    def __init__(self, stream_callback, input_device_index, **kwargs):
+        self.callback = stream_callback
+        self.input_device_index = input_device_index
+        self.active = True
+        self.closed = False
+
+    def deliver(self, chunk):
+        self.callback(chunk, CHUNK, None, 0)
+
+    def is_active(self):
+        return self.active
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakePyAudio:
+    '''Stands in for pyaudio.PyAudio, listing the devices of the fake module and recording the streams opened.'''
+    def __init__(self, module):
+        self.module = module
+        self.terminated = False
+        module.interfaces.append(self)
+
+    def get_device_count(self):
+        return len(self.module.devices)
+
+    def get_device_info_by_index(self, index):
+        return self.module.devices[index]
+
+    def open(self, **kwargs):
+        if self.module.open_error is not None:
+            raise self.module.open_error
+        stream = FakeStream(**kwargs)
+        self.module.streams.append(stream)
+        return stream
+
+    def terminate(self):
+        self.terminated = True
+
+
+def fake_pyaudio(devices):
+    module = types.SimpleNamespace(paInt16=8, paContinue=0, devices=devices, open_error=None, interfaces=[], streams=[])
+    module.PyAudio = lambda: FakePyAudio(module)
+    return module
+
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+USB_MICROPHONE = {"name": "USB PnP Sound Device: Audio (hw:2,0)", "maxInputChannels": 1}
+SPEAKER = {"name": "bcm2835 Headphones", "maxInputChannels": 0}
+
+
+@unittest.skipIf(audio_capture is None, "pyaudio is not installed")
+class TestFindMicrophoneIndex(unittest.TestCase):
+
+    def test_usb_audio_device_0_is_preferred(self):
+        pyaudio = fake_pyaudio([{"name": "USB Audio Device", "maxInputChannels": 1}, USB_MICROPHONE])
+        self.assertEqual(find_microphone_index(pyaudio.PyAudio()), 0)
+
+    def test_any_usb_input_device(self):
+        pyaudio = fake_pyaudio([SPEAKER, {"name": "USB speaker", "maxInputChannels": 0}, USB_MICROPHONE])
+        self.assertEqual(find_microphone_index(pyaudio.PyAudio()), 2)
+
+    def test_no_microphone(self):
+        with self.assertRaises(RuntimeError):
+            find_microphone_index(fake_pyaudio([SPEAKER]).PyAudio())
+
+
+@unittest.skipIf(audio_capture is None, "pyaudio is not installed")
+class TestAudioCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.pyaudio = fake_pyaudio([SPEAKER, USB_MICROPHONE])
+        self.clock = FakeClock()
+        self.cards = "1 [Device]: USB-Audio - USB PnP Sound Device"
+        for patcher in (
+            patch.object(audio_capture, "pyaudio", self.pyaudio),
+            patch.object(audio_capture, "time", self.clock),
+            patch.object(audio_capture, "sound_cards", lambda: self.cards),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.capture = AudioCapture(RATE, CHUNK, buffer_seconds=1, stall_seconds=0.05)
+
+    def deliver(self, count, first=0):
+        """Delivers count chunks 100ms apart, each labelled with its number."""
+        for number in range(first, first + count):
+            self.clock.now += 0.1
+            self.pyaudio.streams[-1].deliver(b"%d" % number)
+
+    def test_one_stream_is_kept_open(self):
+        self.capture.start()
+        self.capture.start()
+        self.assertEqual(len(self.pyaudio.streams), 1)
+        self.assertEqual(self.pyaudio.streams[0].input_device_index, 1)
+        self.assertEqual(self.capture.microphone_index, 1)
+
+    def test_listen_starts_at_the_request_with_pre_roll(self):
+        self.capture.start()
+        self.deliver(10)
+        # Asked for 250ms before now, the chunks that end after that are read first
+        stopped = threading.Event()
+        chunks = self.capture.listen(since=self.clock.now - 0.25, stopped=stopped.is_set)
+        self.assertEqual([next(chunks) for _ in range(3)], [b"7", b"8", b"9"])
+
+        # then the chunks still to be captured
+        self.deliver(2, first=10)
+        self.assertEqual([next(chunks) for _ in range(2)], [b"10", b"11"])
+        stopped.set()
+        self.capture.wake()
+        self.assertIsNone(next(chunks, None))
+
+    def test_listen_from_now_by_default(self):
+        self.capture.start()
+        self.deliver(5)
+        chunks = self.capture.listen()
+        self.deliver(1, first=5)
+        self.assertEqual(next(chunks), b"5")
+
+    def test_chunks_a_slow_reader_falls_behind_on_are_skipped(self):
+        self.capture.start()
+        chunks = self.capture.listen(since=self.clock.now)
+        # The ring buffer keeps buffer_seconds of audio
+        self.deliver(15)
+        self.assertEqual(next(chunks), b"5")
+
+    def test_reading_ends_when_the_microphone_stops_delivering(self):
+        chunks = self.capture.listen()
+        self.assertIsNone(next(chunks, None))
+
+    def test_microphone_is_found_again_when_the_stream_fails(self):
+        self.capture.start()
+        first_interface, first_stream = self.pyaudio.interfaces[0], self.pyaudio.streams[0]
+        first_stream.active = False
+        # Plugged back into another port
+        self.pyaudio.devices[:] = [SPEAKER, SPEAKER, USB_MICROPHONE]
+
+        chunks = self.capture.listen()
+        self.assertTrue(first_stream.closed)
+        self.assertTrue(first_interface.terminated)
+        self.assertEqual(len(self.pyaudio.interfaces), 2)
+        self.assertEqual(self.pyaudio.streams[-1].input_device_index, 2)
+        self.deliver(1)
+        self.assertEqual(next(chunks), b"0")
+
+    def test_microphone_is_found_again_when_the_sound_cards_change(self):
+        self.capture.start()
+        self.cards = ""
+        self.capture.start()
+        self.assertEqual(len(self.pyaudio.streams), 2)
+        self.assertTrue(self.pyaudio.streams[0].closed)
+
+    def test_stalled_stream_is_reopened(self):
+        self.capture.start()
+        self.deliver(1)
+        self.clock.now += 1
+        self.capture.start()
+        self.assertEqual(len(self.pyaudio.streams), 2)
+
+    def test_failing_to_open_the_microphone_is_retried_by_the_next_start(self):
+        self.pyaudio.open_error = OSError("Invalid input device")
+        with self.assertRaises(OSError):
+            self.capture.start()
+        self.assertTrue(self.pyaudio.interfaces[0].terminated)
+
+        self.pyaudio.open_error = None
+        self.capture.start()
+        self.assertEqual(len(self.pyaudio.streams), 1)
+
+    def test_no_microphone_found(self):
+        self.pyaudio.devices[:] = [SPEAKER]
+        with self.assertRaises(RuntimeError):
+            self.capture.start()
+        self.assertTrue(self.pyaudio.interfaces[0].terminated)
+
+    def test_close(self):
+        self.capture.start()
+        self.capture.close()
+        self.assertTrue(self.pyaudio.streams[0].closed)
+        self.assertTrue(self.pyaudio.interfaces[0].terminated)
+        self.capture.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# unittest_audio_pipeline.py
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+import numpy as np
+
+# Add the speech recognition app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from src import audio_pipeline
+from src.audio_pipeline import FlacStreamEncoder, Resampler
+
+
+def tone(frequency, seconds, rate, amplitude=8000):
+    samples = np.arange(int(seconds * rate))
+    return np.round(amplitude * np.sin(2 * np.pi * frequency * samples / rate)).astype("<i2")
+
+
+def chunks_of(samples, sizes):
+    """Splits the samples into LINEAR16 chunks of the given sizes, repeated until every sample is used."""
+    chunks, start, index = [], 0, 0
+    while start < len(samples):
+        size = sizes[index % len(sizes)]
+        chunks.append(samples[start:start + size].tobytes())
+        start += size
+        index += 1
+    return chunks
+
+
+def samples_of(chunks):
+    return np.frombuffer(b"".join(chunks), dtype="<i2")
+
+
+class FakeStreamEncoder:
+    '''Stands in for pyflac.StreamEncoder: writes a header once, then one frame per complete block.'''
+    def __init__(self, sample_rate, write_callback, compression_level, blocksize):
+        self.write_callback = write_callback
+        self.blocksize = blocksize
+        self.buffered = np.zeros(0, dtype="<i2")
+        self.header_written = False
+
+    def process(self, samples):
+        if not self.header_written:
+            self.write_callback(b"fLaC", 4, 0, 0)
+            self.header_written = True
+        self.buffered = np.concatenate((self.buffered, samples))
+        while len(self.buffered) >= self.blocksize:
+            self._write_frame(self.buffered[:self.blocksize])
+            self.buffered = self.buffered[self.blocksize:]
+
+    def finish(self):
+        if len(self.buffered):
+            self._write_frame(self.buffered)
+
+    def _write_frame(self, samples):
+        frame = b"F" + samples.tobytes()
+        self.write_callback(frame, len(frame), len(samples), 0)
+
+
+class TestResampler(unittest.TestCase):
+
+    def test_48_khz_to_16_khz_keeps_the_duration(self):
+        resampler = Resampler(48000, 16000)
+        self.assertEqual((resampler.up, resampler.down), (1, 3))
+        resampled = samples_of(resampler.stream(chunks_of(tone(440, 1.0, 48000), [4800])))
+        self.assertEqual(len(resampled), 16000)
+
+    def test_44_1_khz_to_16_khz_keeps_the_duration(self):
+        resampled = samples_of(Resampler(44100, 16000).stream(chunks_of(tone(440, 1.0, 44100), [4410])))
+        self.assertEqual(len(resampled), 16000)
+
+    def test_chunks_resample_like_the_whole_stream(self):
+        samples = tone(440, 0.5, 48000)
+        at_once = Resampler(48000, 16000).process(samples.tobytes())
+        # Chunk sizes that are not multiples of the decimation factor, including chunks too short for an output sample
+        chunked = b"".join(Resampler(48000, 16000).stream(chunks_of(samples, [1, 2, 1001, 480, 333])))
+        self.assertEqual(chunked, at_once)
+
+    def test_tone_is_kept(self):
+        resampled = samples_of(Resampler(48000, 16000).stream(chunks_of(tone(440, 1.0, 48000), [960])))
+        spectrum = np.abs(np.fft.rfft(resampled))
+        self.assertEqual(np.argmax(spectrum), 440)  # One bin per Hz for one second of audio
+        # Apart from the filter delay at the start, the amplitude is unchanged
+        self.assertAlmostEqual(np.abs(resampled[100:]).max() / 8000, 1.0, delta=0.02)
+
+    def test_frequencies_above_the_output_nyquist_are_removed(self):
+        resampled = samples_of(Resampler(48000, 16000).stream(chunks_of(tone(12000, 1.0, 48000), [960])))
+        self.assertLess(np.abs(resampled[100:]).max(), 8000 * 0.01)
+
+    def test_same_rate_is_passed_through(self):
+        chunk = tone(440, 0.01, 16000).tobytes()
+        self.assertIs(Resampler(16000, 16000).process(chunk), chunk)
+
+
+class TestFlacStreamEncoder(unittest.TestCase):
+
+    def test_encoded_bytes_are_yielded_as_each_chunk_is_encoded(self):
+        samples = tone(440, 0.25, 16000)
+        with patch.object(audio_pipeline, "pyflac", type("pyflac", (), {"StreamEncoder": FakeStreamEncoder})):
+            encoder = FlacStreamEncoder(16000, block_ms=100)
+            stream = encoder.stream(chunks_of(samples, [1600]))
+
+            self.assertEqual(next(stream), b"fLaC" + b"F" + samples[:1600].tobytes())
+            encoded = list(stream)
+        # A frame for every other complete block, then the rest of the samples once the audio ends
+        self.assertEqual(len(encoded), 2)
+        self.assertEqual(encoded[-1], b"F" + samples[3200:].tobytes())
+
+    def test_block_size_follows_the_block_length(self):
+        with patch.object(audio_pipeline, "pyflac", type("pyflac", (), {"StreamEncoder": FakeStreamEncoder})):
+            self.assertEqual(FlacStreamEncoder(16000, block_ms=100).block_size, 1600)
+            self.assertEqual(FlacStreamEncoder(16000, block_ms=20).block_size, 320)
+
+    def test_pyflac_is_required(self):
+        with patch.object(audio_pipeline, "pyflac", None):
+            self.assertFalse(FlacStreamEncoder.available())
+            with self.assertRaises(RuntimeError):
+                FlacStreamEncoder(16000)
+
+    @unittest.skipUnless(FlacStreamEncoder.available(), "pyflac is not installed")
+    def test_stream_is_valid_flac(self):
+        import pyflac
+
+        samples = tone(440, 0.5, 16000)
+        encoded = b"".join(FlacStreamEncoder(16000).stream(chunks_of(samples, [1600])))
+        self.assertTrue(encoded.startswith(b"fLaC"))
+
+        decoded = []
+        decoder = pyflac.StreamDecoder(write_callback=lambda data, sample_rate, num_channels, num_samples: decoded.append(data))
+        decoder.process(encoded)
+        decoder.finish()
+        np.testing.assert_array_equal(np.concatenate(decoded).ravel(), samples)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# unittest_recognizers.py
+
+import unittest
+import os
+import sys
+
+# Add the speech recognition app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from src.recognizers import Recognizer, RecognizerChain, _RecordedAudio, recognizer_order_from_env
+
+
+class StubRecognizer(Recognizer):
+    '''Reads fail_after chunks and raises, or reads every chunk and returns them joined as the transcript.'''
+    def __init__(self, name, needs_network=False, fail_after=None, available=True):
+        self.name = name
+        self.needs_network = needs_network
+        self.fail_after = fail_after
+        self._available = available
+        self.heard = []
+
+    def available(self):
+        return self._available
+
+    def recognise(self, audio_chunks, expected_format, answer_complete=None):
+        heard = []
+        self.heard.append(heard)
+        for chunk in audio_chunks:
+            if len(heard) == self.fail_after:
+                raise ConnectionError(f"{self.name} is unreachable")
+            heard.append(chunk)
+        return b" ".join(heard).decode()
+
+
+class Microphone:
+    '''Yields the chunks of one answer and counts how many were read, like the capture stream.'''
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+class TestRecognizerChain(unittest.TestCase):
+
+    def setUp(self):
+        self.microphone = Microphone([b"seven", b"out", b"of", b"ten"])
+
+    def test_recognizer_must_implement_recognise(self):
+        with self.assertRaises(TypeError):
+            Recognizer()
+
+    def test_first_recognizer_of_the_format_is_used(self):
+        google, vosk = StubRecognizer("google", needs_network=True), StubRecognizer("vosk")
+        chain = RecognizerChain([google, vosk])
+
+        self.assertEqual(chain.recognise(self.microphone, "short"), "seven out of ten")
+        self.assertEqual((len(vosk.heard), len(google.heard)), (1, 0))
+        self.assertEqual(chain.recognise(Microphone([b"fine"]), "open-ended"), "fine")
+        self.assertEqual(len(google.heard), 1)
+
+    def test_next_recognizer_hears_the_whole_answer_after_an_error(self):
+        google, vosk = StubRecognizer("google", needs_network=True), StubRecognizer("vosk", fail_after=2)
+        chain = RecognizerChain([google, vosk])
+
+        self.assertEqual(chain.recognise(self.microphone, "short"), "seven out of ten")
+        self.assertEqual(vosk.heard, [[b"seven", b"out"]])
+        self.assertEqual(google.heard, [[b"seven", b"out", b"of", b"ten"]])
+        # The microphone is read once, the chunks heard by vosk were replayed to google
+        self.assertEqual(self.microphone.read, 4)
+
+    def test_every_recognizer_failing_raises(self):
+        chain = RecognizerChain([StubRecognizer("google", needs_network=True, fail_after=0), StubRecognizer("vosk", fail_after=1)])
+        with self.assertRaisesRegex(RuntimeError, "google: google is unreachable; vosk: vosk is unreachable"):
+            chain.recognise(self.microphone, "open-ended")
+
+    def test_local_recognizers_are_tried_first_when_the_network_is_down(self):
+        network_up = [True]
+        google, vosk = StubRecognizer("google", needs_network=True), StubRecognizer("vosk")
+        chain = RecognizerChain([google, vosk], network_available=lambda: network_up[0])
+
+        self.assertEqual([recognizer.name for recognizer in chain.candidates("open-ended")], ["google", "vosk"])
+        network_up[0] = False
+        self.assertEqual([recognizer.name for recognizer in chain.candidates("open-ended")], ["vosk", "google"])
+        chain.recognise(self.microphone, "open-ended")
+        self.assertEqual((len(vosk.heard), len(google.heard)), (1, 0))
+
+    def test_unavailable_recognizers_are_skipped(self):
+        chain = RecognizerChain([StubRecognizer("google", needs_network=True), StubRecognizer("vosk", available=False)])
+        self.assertEqual([recognizer.name for recognizer in chain.candidates("short")], ["google"])
+
+        chain = RecognizerChain([StubRecognizer("vosk", available=False)])
+        with self.assertRaisesRegex(RuntimeError, "No speech recognizer is available"):
+            chain.recognise(self.microphone, "short")
+
+    def test_order_from_env(self):
+        os.environ["SPEECH_RECOGNIZERS"] = "short=google; open-ended=vosk,google;unknown="
+        try:
+            order = recognizer_order_from_env()
+        finally:
+            del os.environ["SPEECH_RECOGNIZERS"]
+        self.assertEqual(order["short"], ["google"])
+        self.assertEqual(order["open-ended"], ["vosk", "google"])
+        self.assertEqual(order["closed-ended"], ["vosk", "google"])
+        self.assertNotIn("unknown", order)
+
+
+class TestRecordedAudio(unittest.TestCase):
+
+    def test_replays_start_from_the_first_chunk(self):
+        microphone = Microphone([b"a", b"b", b"c"])
+        audio = _RecordedAudio(microphone)
+
+        first = audio.replay()
+        self.assertEqual([next(first), next(first)], [b"a", b"b"])
+        self.assertEqual(list(audio.replay()), [b"a", b"b", b"c"])
+        self.assertEqual(list(first), [b"c"])
+        self.assertEqual(microphone.read, 3)
+
+    def test_end_of_the_answer_is_timed_once(self):
+        audio = _RecordedAudio([b"a"])
+        self.assertIsNone(audio.finished_at)
+        list(audio.replay())
+        finished_at = audio.finished_at
+        self.assertIsNotNone(finished_at)
+        list(audio.replay())
+        self.assertEqual(audio.finished_at, finished_at)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# unittest_voice_activity.py
+
+import unittest
+import os
+import sys
+
+import numpy as np
+
+# Add the speech recognition app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from src.voice_activity import VoiceActivityDetector
+
+try:
+    from src import speech_to_text_recognition
+except ImportError:  # pyaudio is not installed
+    speech_to_text_recognition = None
+
+RATE = 48000
+CHUNK = RATE // 10  # 100ms, as read from the microphone
+
+
+def noise(seconds, level, seed=0):
+    """White noise with an RMS of level (in samples), like a fan or the hum of the room."""
+    samples = np.random.default_rng(seed).normal(0, level, int(seconds * RATE))
+    return np.clip(np.round(samples), -32768, 32767).astype("<i2")
+
+
+def tone(frequency, seconds, amplitude=8000):
+    samples = np.arange(int(seconds * RATE))
+    return np.round(amplitude * np.sin(2 * np.pi * frequency * samples / RATE)).astype("<i2")
+
+
+def chunks_of(*signals, size=CHUNK):
+    samples = np.concatenate(signals)
+    return [samples[start:start + size].tobytes() for start in range(0, len(samples), size)]
+
+
+def speech(seconds, level=100, seed=1):
+    """A voiced sound over the noise of the room."""
+    return (tone(200, seconds) + noise(seconds, level, seed)).astype("<i2")
+
+
+class TestVoiceActivityDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.vad = VoiceActivityDetector(RATE)
+
+    def detect(self, chunks):
+        return [self.vad.contains_speech(chunk) for chunk in chunks]
+
+    def test_silence_speech_silence(self):
+        detected = self.detect(chunks_of(noise(1, 100), speech(1), noise(2, 100, seed=2)))
+        # Speech is reported from its first chunk to its last, and not a chunk longer
+        self.assertEqual(detected, [False] * 10 + [True] * 10 + [False] * 20)
+
+    def test_noise_floor_is_measured_from_the_first_chunk(self):
+        self.detect(chunks_of(noise(0.1, 100)))
+        expected = 20 * np.log10(100 / 32768)
+        self.assertAlmostEqual(self.vad.noise_floor_db, expected, delta=1.5)
+
+    def test_noise_floor_rises_slowly_when_the_room_gets_louder(self):
+        self.detect(chunks_of(noise(1, 30)))
+        quiet_floor = self.vad.noise_floor_db
+
+        # A fan is switched on: taken for speech at first, until the noise floor has risen to it
+        detected = self.detect(chunks_of(noise(10, 300, seed=1)))
+        self.assertTrue(detected[0])
+        self.assertFalse(any(detected[-10:]))
+        rise_per_chunk = self.vad.floor_rise_db_per_second * CHUNK / RATE
+        self.assertGreaterEqual(detected.index(False), 10 / rise_per_chunk * 0.5)
+        loud_floor = self.vad.noise_floor_db
+        self.assertAlmostEqual(loud_floor, 20 * np.log10(300 / 32768), delta=1.5)
+
+        # Speech is still heard over the fan
+        self.assertEqual(self.detect(chunks_of(speech(0.5, level=300))), [True] * 5)
+        self.assertGreater(loud_floor, quiet_floor + 15)
+
+    def test_noise_floor_follows_the_room_down_at_once(self):
+        self.detect(chunks_of(noise(1, 300)))
+        self.detect(chunks_of(noise(0.1, 30, seed=1)))
+        self.assertAlmostEqual(self.vad.noise_floor_db, 20 * np.log10(30 / 32768), delta=1.5)
+        # Quiet speech is heard as soon as the fan is switched off
+        self.assertEqual(self.detect(chunks_of((tone(200, 0.3, amplitude=300) + noise(0.3, 30, seed=2)).astype("<i2"))), [True] * 3)
+
+    def test_speech_only_raises_the_noise_floor_slowly(self):
+        self.detect(chunks_of(noise(1, 100)))
+        floor = self.vad.noise_floor_db
+        # Without a pause to measure the noise in, the floor rises no faster than floor_rise_db_per_second
+        self.assertEqual(self.detect(chunks_of(speech(5))), [True] * 50)
+        self.assertLessEqual(self.vad.noise_floor_db, floor + self.vad.floor_rise_db_per_second * 5 + 1e-6)
+        # and falls back to the noise at the first pause
+        self.detect(chunks_of(noise(0.1, 100, seed=2)))
+        self.assertAlmostEqual(self.vad.noise_floor_db, floor, delta=1)
+
+    def test_quiet_fricatives_need_half_the_margin(self):
+        self.detect(chunks_of(noise(1, 100)))
+        # 6 dB above the noise floor: below the margin, but above half of it
+        amplitude = 100 * 10 ** (6 / 20) * np.sqrt(2)
+        hiss = chunks_of(tone(8000, 0.1, amplitude))
+        hum = chunks_of(tone(100, 0.1, amplitude))
+        self.assertEqual((self.vad.contains_speech(hiss[0]), self.vad.contains_speech(hum[0])), (True, False))
+
+    def test_clicks_are_not_speech(self):
+        self.detect(chunks_of(noise(1, 100)))
+        click = noise(0.1, 100, seed=1)
+        click[:self.vad.frame_length] = tone(200, 0.02)[:self.vad.frame_length]
+        self.assertEqual(int(np.count_nonzero(self.vad.speech_frames(click.tobytes()))), 1)
+        self.assertFalse(self.vad.contains_speech(click.tobytes()))
+
+    def test_nothing_is_speech_below_the_minimum_level(self):
+        # In a silent room a margin above the floor is still inaudible
+        self.assertEqual(self.detect(chunks_of(noise(0.5, 1), noise(0.5, 3, seed=1))), [False] * 10)
+
+    def test_frames_span_chunks(self):
+        # Chunks that are not a whole number of frames long
+        chunks = chunks_of(noise(1, 100), size=self.vad.frame_length + self.vad.frame_length // 2)
+        frames = sum(len(self.vad.speech_frames(chunk)) for chunk in chunks)
+        self.assertEqual(frames, RATE // self.vad.frame_length)
+        self.assertEqual(len(self.vad.speech_frames(b"")), 0)
+
+
+class FakeCapture:
+    def __init__(self, chunks):
+        self.rate = RATE
+        self.chunks = chunks
+
+    def listen(self, since=None, stopped=None):
+        return iter(self.chunks)
+
+    def wake(self):
+        pass
+
+
+class FakeCommunicationInterface:
+    def __init__(self):
+        self.silence = []
+
+    def publish_silance_detected(self, seconds):
+        self.silence.append(seconds)
+
+
+@unittest.skipIf(speech_to_text_recognition is None, "pyaudio is not installed")
+class TestEndOfSpeech(unittest.TestCase):
+
+    def listen(self, chunks, end_of_speech_seconds):
+        communication_interface = FakeCommunicationInterface()
+        stream = speech_to_text_recognition.MicrophoneStream(FakeCapture(chunks), communication_interface, end_of_speech_seconds)
+        with stream:
+            heard = list(stream.generator())
+        return heard, communication_interface.silence
+
+    def test_end_of_speech_after_the_silence(self):
+        end_of_speech_seconds = speech_to_text_recognition.END_OF_SPEECH_SECONDS["short"]
+        chunks = chunks_of(noise(1, 100), speech(1), noise(5, 100, seed=2))
+        heard, silence = self.listen(chunks, end_of_speech_seconds)
+
+        silent_seconds = (len(heard) - 20) * CHUNK / RATE
+        self.assertGreaterEqual(silent_seconds, end_of_speech_seconds - 1e-6)
+        self.assertLessEqual(silent_seconds, end_of_speech_seconds + CHUNK / RATE)
+        self.assertEqual(silence, [speech_to_text_recognition.INITIAL_SILENCE_DURATION, 0, end_of_speech_seconds])
+
+    def test_pauses_shorter_than_the_end_of_speech_are_kept(self):
+        chunks = chunks_of(noise(1, 100), speech(1), noise(1, 100, seed=2), speech(1, seed=3), noise(5, 100, seed=4))
+        heard, silence = self.listen(chunks, 1.2)
+        self.assertGreater(len(heard), 40)
+        self.assertEqual(silence, [speech_to_text_recognition.INITIAL_SILENCE_DURATION, 0, 1.2, 0, 1.2])
+
+    def test_gives_up_when_the_user_does_not_answer(self):
+        initial_silence = speech_to_text_recognition.INITIAL_SILENCE_DURATION
+        heard, silence = self.listen(chunks_of(noise(initial_silence + 5, 100)), 1.2)
+        self.assertAlmostEqual(len(heard) * CHUNK / RATE, initial_silence, delta=CHUNK / RATE + 1e-6)
+        self.assertEqual(silence, [initial_silence])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,5 @@
-import time
-import threading
-from queue import Queue
+import asyncio
+from src.event_scheduler import LayerWakeup, NotifyingQueue
 from src.reactive_layer.reactive_layer import ReactiveLayer
 import src.deliberate_layer.finite_state_machine.finite_state_machine as fsm
 from src.deliberate_layer.behaviour_tree_state_machine.behaviour_tree import BehaviourTree
@@ -15,65 +14,66 @@ from shared_libraries.logging_config import setup_logger
 
 setup_logger()
 
-# Initialise a shared event queue for communication
-subsumption_layer_event_queue = Queue()
-finite_state_machine_event_queue = Queue()
-behaviour_tree_event_queue = Queue()
-
-# Instantiate High-Level FSM, Behavior Tree, and Reactive Layer
-reactive_layer = ReactiveLayer(subsumption_layer_event_queue=subsumption_layer_event_queue)
-finite_state_machine_layer = fsm.FSM(subsumption_layer_event_queue=subsumption_layer_event_queue, finite_state_machine_event_queue=finite_state_machine_event_queue, behavior_tree_event_queue=behaviour_tree_event_queue)
-deliberate_layer = BehaviourTree(finite_state_machine_event_queue=finite_state_machine_event_queue, behaviour_tree_event_queue=behaviour_tree_event_queue)
-
-# Loop interval
-LOOP_INTERVAL = 0.1
-
-# Define each layer's main function to run in its own thread
-def subsumption_layer():
+# Define each layer's main coroutine, they all run as tasks on the same event loop
+async def subsumption_layer(reactive_layer, wakeup):
     logger = logging.getLogger("SubsumptionLayer")
     logger.info("Subsumption layer started.")
-    try:
-        while True:
-            reactive_layer.detect_critical_condition()
-            time.sleep(LOOP_INTERVAL)
-    except KeyboardInterrupt:
-        logger.info("Shutting down subsumption layer...")
+    while True:
+        generation = wakeup.generation
+        reactive_layer.detect_critical_condition()
+        await wakeup.wait(since=generation)
 
-def finite_state_machine():
+async def finite_state_machine(finite_state_machine_layer, wakeup, subsumption_layer_event_queue, behaviour_tree_event_queue):
     logger = logging.getLogger("FiniteStateMachine")
     logger.info("Finite state machine layer started.")
-    try:
-        while True:
-            finite_state_machine_layer.update()            
-            time.sleep(LOOP_INTERVAL)
-    except KeyboardInterrupt:
-        logger.info("Shutting down finite state machine...")
+    while True:
+        generation = wakeup.generation
+        finite_state_machine_layer.update()
+        # The FSM handles one event from each queue per update, only sleep once both are drained
+        if subsumption_layer_event_queue.empty() and behaviour_tree_event_queue.empty():
+            await wakeup.wait(since=generation)
 
-def behavior_tree():
+async def behavior_tree(deliberate_layer):
     logger = logging.getLogger("BehaviorTree")
     logger.info("Behavior tree layer started.")
-    try:
-        while True:
-            deliberate_layer.update()
-            time.sleep(LOOP_INTERVAL)
-    except KeyboardInterrupt:
-        logger.info("Shutting down behavior tree...")
+    while True:
+        generation = deliberate_layer.wakeup.generation
+        await deliberate_layer.update()
+        if deliberate_layer.finite_state_machine_event_queue.empty():
+            await deliberate_layer.wakeup.wait(since=generation)
 
-if __name__ == "__main__":
-    logger = logging.getLogger("Main")
+async def main():
+    # Each layer sleeps until one of its inputs changes
+    subsumption_layer_wakeup = LayerWakeup("SubsumptionLayer")
+    finite_state_machine_wakeup = LayerWakeup("FiniteStateMachine")
+
+    # Initialise a shared event queue for communication, putting an event wakes up the layer consuming it
+    subsumption_layer_event_queue = NotifyingQueue(finite_state_machine_wakeup)
+    finite_state_machine_event_queue = NotifyingQueue()
+    behaviour_tree_event_queue = NotifyingQueue(finite_state_machine_wakeup)
+
+    # Instantiate High-Level FSM, Behavior Tree, and Reactive Layer
+    reactive_layer = ReactiveLayer(subsumption_layer_event_queue=subsumption_layer_event_queue)
+    finite_state_machine_layer = fsm.FSM(subsumption_layer_event_queue=subsumption_layer_event_queue, finite_state_machine_event_queue=finite_state_machine_event_queue, behavior_tree_event_queue=behaviour_tree_event_queue)
+    deliberate_layer = BehaviourTree(finite_state_machine_event_queue=finite_state_machine_event_queue, behaviour_tree_event_queue=behaviour_tree_event_queue)
 
-    subsumption_thread = threading.Thread(target=subsumption_layer, daemon=False)
-    fsm_thread = threading.Thread(target=finite_state_machine, daemon=False)
-    behavior_tree_thread = threading.Thread(target=behavior_tree, daemon=False)
+    # MQTT messages wake up the layer whose communication interface received them
+    reactive_layer.communication_interface.add_message_listener(subsumption_layer_wakeup.notify)
+    finite_state_machine_event_queue.add_wakeup(deliberate_layer.wakeup)
 
-    subsumption_thread.start()
-    fsm_thread.start()
-    behavior_tree_thread.start()
+    # Step 1: Check if all services are running before any of the layers start
+    await deliberate_layer.check_if_all_services_are_running()
+
+    await asyncio.gather(
+        subsumption_layer(reactive_layer, subsumption_layer_wakeup),
+        finite_state_machine(finite_state_machine_layer, finite_state_machine_wakeup, subsumption_layer_event_queue, behaviour_tree_event_queue),
+        behavior_tree(deliberate_layer),
+    )
+
+if __name__ == "__main__":
+    logger = logging.getLogger("Main")
 
-    # Keep the main thread alive to wait for KeyboardInterrupt
     try:
-        while True:
-            time.sleep(1)
+        asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Exiting state managment service...")
-        
@@ -1,11 +1,19 @@
+import asyncio
 import logging
-import time
 
 class BehaviourBranch:
     """Represents a branch of behaviours accessible during a specific FSM state."""
 
-    def __init__(self, name, communication_interface, orchestrator=None):
+    ACTIVATION_DEADLINE = 2.0 # seconds to wait for the services to acknowledge before setting them up again
+    ACTIVATION_ATTEMPTS = 3 # times the services are set up before the branch carries on without them
+
+    def __init__(self, name, communication_interface, orchestrator=None, activation_deadline=ACTIVATION_DEADLINE, activation_attempts=ACTIVATION_ATTEMPTS):
         self.branch_name = name
+        self.activation_deadline = activation_deadline
+        self.activation_attempts = activation_attempts
+        self.readiness_latency = {} # service name -> seconds from set_up until it reported ready
+        self.unavailable_services = [] # optional services that were not ready, the branch runs without them
+        self.activation_failed = False # a critical service was not ready, reported as an error
         self.communication_interface = communication_interface
         self.services = []
         self.all_services_available = False
@@ -22,54 +30,95 @@ class BehaviourBranch:
             )
         self.services.append(behaviour)
     
-    def activate_behaviour(self):
-        """Activate a specific behaviour by name"""
+    async def activate_behaviour(self):
+        """
+        Activate a specific behaviour by name. Services that are not ready are set up again, at most
+        activation_attempts times. The branch then runs without the optional services that are still not ready,
+        and if a critical one is not ready it reports an error and is not started, so the next update tries again.
+
+        Returns:
+            bool: Whether the branch was started
+        """
         # If all services are available, start the behaviour
         logging.info(f"Activating {self.branch_name} branch")
 
-        retry_counter = 4
-        current_attempts = 1
-        while True:
-            for service in self.services:
-                logging.info(f"{service.name} is in the {self.branch_name} behaviour branch" )
-
-            for service in self.services:
-                logging.info(f"Setting up {service.name} service")
-                service.set_up()
+        for service in self.services:
+            logging.info(f"{service.name} is in the {self.branch_name} behaviour branch" )
 
-            time.sleep(0.5)
-            self.communication_interface.request_service_status()
-            
+        self.readiness_latency = {}
+        # Set up every service at once and keep setting up the ones that did not become ready before the deadline
+        pending = list(self.services)
+        for _ in range(self.activation_attempts):
             logging.info(f"Waiting for services to be available for {self.branch_name} branch")
-
-            # Wait until all services are available
-            waiting = True
-            while True:
-                waiting = False
-                for service in self.services:
-                    serviceStatus = self.communication_interface.get_system_status()[service.name]
-                    if serviceStatus != "ready":
-                        logging.info(f"{service.name} is not ready")
-                        current_attempts += 1
-                        waiting = True
-                    time.sleep(0.5)
-                if not waiting or current_attempts > retry_counter: # Once all services are ready, continue with the behaviour
-                    current_attempts = 1
-                    break
-            
-            if not waiting:
-                logging.info(f"Exiting waiting loop for {self.branch_name} branch")
+            ready = await self._fan_out(pending, "set_up", "ready")
+            self.readiness_latency.update(ready)
+            pending = [service for service in pending if service.name not in ready]
+            for service in pending:
+                logging.info(f"{service.name} is not ready")
+            if not pending:
                 break
 
-        logging.info(f"All services are ready for {self.branch_name} branch")
-        for service in self.services:
-            service.start()
-            time.sleep(0.4) # give service time to process the start command
+        critical = [service.name for service in pending if service.priority != "optional"]
+        if critical:
+            logging.error(f"Critical services {critical} were not ready after {self.activation_attempts} attempts, {self.branch_name} branch was not started")
+            if not self.activation_failed:
+                self.communication_interface.publish_error_message(f"{', '.join(critical)} did not respond, {self.branch_name} could not be started")
+                self.activation_failed = True
+            return False
+        if self.activation_failed:
+            self.communication_interface.publish_error_resolved()
+            self.activation_failed = False
+
+        self.unavailable_services = [service.name for service in pending]
+        for service_name in self.unavailable_services:
+            logging.warning(f"Optional service {service_name} is not ready, {self.branch_name} branch runs without it")
+        available = [service for service in self.services if service.name not in self.unavailable_services]
+
+        logging.info(f"All services are ready for {self.branch_name} branch, readiness latency: " + ", ".join(f"{name} {latency * 1000:.0f} ms" for name, latency in self.readiness_latency.items()))
+        for service_name, latency in self.readiness_latency.items():
+            self.communication_interface.metrics.observe("branch.readiness_ms", f"{self.branch_name}/{service_name}", latency * 1000)
+
+        running = await self._fan_out(available, "start", "running")
+        for service in available:
+            if service.name not in running:
+                logging.warning(f"{service.name} did not acknowledge the start command within {self.activation_deadline} seconds")
         logging.info(f"{self.branch_name} branch has started")
 
         self.behaviour_running = "standby" 
+        return True
+
+    async def _fan_out(self, services, command, expected_status):
+        """
+        Sends a command to all services concurrently and waits for their acknowledgements until the branch deadline.
+        Returns a dict of the services that acknowledged with the expected status and how many seconds that took.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.activation_deadline
+        acknowledged = {}
+
+        async def acknowledgement(service):
+            logging.info(f"{command} {service.name} service")
+            response = getattr(service, command)()
+            if response is None:
+                # The leaf does not send this command, so there is nothing to wait for
+                acknowledged[service.name] = 0.0
+                return
+            try:
+                response = await asyncio.wait_for(asyncio.wrap_future(response), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return
+            if isinstance(response, dict) and response.get("status") == expected_status:
+                acknowledged[service.name] = loop.time() - started
+            else:
+                # A service can acknowledge before it is done, e.g. the robot answers "set_up" while waking up
+                if await self.communication_interface.wait_for_services(expected_status, [service.name], timeout=deadline - loop.time()) == []:
+                    acknowledged[service.name] = loop.time() - started
 
-    def update(self, fsm_state):
+        await asyncio.gather(*(acknowledgement(service) for service in services))
+        return acknowledged
+
+    async def update(self, fsm_state):
         if fsm_state == "Error" and not self.branch_in_error_state:
             # Transition to error state
             if self.orchestrator:
@@ -87,7 +136,7 @@ class BehaviourBranch:
             if self.orchestrator:
                 self.logger.info("Resuming orchestrator.")
                 self.orchestrator.resume()
-            time.sleep(0.5)
+            await asyncio.sleep(0.5)
 
         """Update all active behaviours in this branch"""
         for behaviour in self.services:
@@ -102,18 +151,8 @@ class BehaviourBranch:
                 self.behaviour_running = "running"
                 self.communication_interface.set_behaviour_running_status(self.branch_name, self.behaviour_running)
         
-        # Update the orchestrator if present
-        # Check for a behaviour start command...
-        if self.orchestrator:
-            self.orchestrator.update()
-            if self.orchestrator.is_complete():
-                # If the orchestrator signals completion, 
-                # handle that logic here (e.g., transition back to a default branch)
-                # self.logger.info(f"{self.branch_name} scenario completed.")
-                # Possibly communicate to the BehaviourTree or set a flag.
-                # The BehaviourTree might detect this on the next update and transition out.  
-                pass
-        
+        # Once started the orchestrator runs as its own task, awaiting the robot and speech events itself
+
     def deactivate_behaviour(self):
         """Deactivate a specific behaviour by name"""
         # Ensure all services has ended gracefully
@@ -122,7 +161,6 @@ class BehaviourBranch:
             # call orchestrator.end to start a shut down sequence...
 
         if self.orchestrator:
-            # if you have an end or reset method for orchestrator
-            pass 
+            self.orchestrator.stop()
 
         self.behaviour_running = "disabled"
\ No newline at end of file
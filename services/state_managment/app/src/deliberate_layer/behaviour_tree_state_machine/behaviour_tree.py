@@ -2,8 +2,8 @@ from .leaf_nodes import UserInterface, Reminder, VoiceAssistant, RobotController
 from .behaviour_branch import BehaviourBranch
 from .bt_communication_interface import CommunicationInterface
 import os
+import asyncio
 import logging
-import time
 import sys
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +22,9 @@ class BehaviourTree:
             port = int(os.getenv('MQTT_BROKER_PORT'))
         )
 
+        # Notified by MQTT messages and orchestrators, the tree is updated whenever it is notified
+        self.wakeup = self.communication_interface.state_changed
+
         self.finite_state_machine_event_queue = finite_state_machine_event_queue
         self.behaviour_tree_event_queue = behaviour_tree_event_queue
 
@@ -60,8 +63,7 @@ class BehaviourTree:
         self.configurations_branch.add_service(Databse)
         self.add_branch(self.behaviours[2], self.configurations_branch)
 
-        # Step 1: Check if all services are running
-        self.check_if_all_services_are_running()
+        # Step 1: Check if all services are running, awaited by main before the tree is first updated
 
     def _set_current_state(self, state):
         # self.logger.info(f"treansitioning current state from {self.current_state} to {state}")
@@ -82,7 +84,7 @@ class BehaviourTree:
     def add_branch(self, branch_name, branch):
         self.branches[branch_name] = branch
 
-    def transition_to_branch(self, branch_name):
+    async def transition_to_branch(self, branch_name):
         """Transition to a specific branch of behaviours based on FSM state"""
         self.logger.info(f"processing request to transition to {branch_name} branch")
         if branch_name in self.branches:
@@ -91,30 +93,30 @@ class BehaviourTree:
             self.current_branch = self.branches[branch_name]
             if branch_name == self.behaviours[0]: # If transitioning to reminder branch
                 self.communication_interface.set_behaviour_running_status(self.behaviours[0], "standby") # Default current behaviour to standby
-            self.current_branch.activate_behaviour() # Start behaviour in the new branch
+            await self.current_branch.activate_behaviour() # Start behaviour in the new branch
             self.logger.info(f"Transitioned to {self.current_branch.branch_name} branch")
             self.behaviour_tree_event_queue.put({"state": branch_name})
-            time.sleep(0.4) # Give the system time to process the request
+            await asyncio.sleep(0.4) # Give the system time to process the request
 
-    def update(self):
+    async def update(self):
         """Update the behaviour tree"""
         # Step 2: Check the high-level state in the finite state machine
-        self.check_finite_state_machine_event_queue()
+        await self.check_finite_state_machine_event_queue()
 
         # Step 3: Check if the user has requested a behaviour
-        self.check_for_user_requested_events()
+        await self.check_for_user_requested_events()
 
         # Step 4: If no behaviour is running, transition to the reminder branch
         if self.current_branch == None: # Default to reminder branch
-            self.transition_to_branch(self.behaviours[0])
+            await self.transition_to_branch(self.behaviours[0])
 
         # Step 4: Start and stop behaviours based on the current branch
-        self.manage_behaviour()
+        await self.manage_behaviour()
 
         # Step 5: Update all active behaviours in the current branch
-        self.current_branch.update(self.current_state) # The current_state is used to handel the error state
+        await self.current_branch.update(self.current_state) # The current_state is used to handel the error state
     
-    def check_finite_state_machine_event_queue(self):
+    async def check_finite_state_machine_event_queue(self):
         if self.finite_state_machine_event_queue.empty() is False:
             self.logger.info("Checking FSM event queue...")
             state = self.finite_state_machine_event_queue.get()["state"]
@@ -133,98 +135,69 @@ class BehaviourTree:
                 
                 # Transition based on the FSM state
                 if state == 'Sleep':
-                    self.transition_to_branch(self.behaviours[0])  # Reminder branch
+                    await self.transition_to_branch(self.behaviours[0])  # Reminder branch
                 elif state == 'Active':
-                    self.transition_to_branch(self.behaviours[0])  # Reminder branch
+                    await self.transition_to_branch(self.behaviours[0])  # Reminder branch
     
-    def check_if_all_services_are_running(self):
+    async def check_if_all_services_are_running(self):
         self.logger.info("Checking if all services are Awake...")
         while True:
-            all_services_awake = True
-
-            # Request service status
-            self.communication_interface.request_service_status()
-            
-            time.sleep(1)
+            # Returns as soon as every service has answered the status request
+            not_awake = await self.communication_interface.wait_for_services("Awake", timeout=1)
+            for service in not_awake:
+                self.logger.warning(f"Service {service} is not Awake. Current status: {self.communication_interface.get_system_status()[service]}")
 
-            services = self.communication_interface.get_system_status()
-            for service, status in services.items():
-                if status != "Awake":
-                    all_services_awake = False
-                    self.logger.warning(f"Service {service} is not Awake. Current status: {status}")
-            
             # Notify the user interface about the system status
             self.communication_interface.publish_system_status()
 
-            if all_services_awake:
+            if not not_awake:
                 self.logger.info("All services are Awake.")
                 break  # Exit the loop if all services are Awake
 
         self.logger.info("Ensuring all services are set_up...")
-        timer = 0 # seconds
         while True:
-            all_services_set_up = True
-
             # Publish "update_system_state" to the database
             self.communication_interface.behaviour_controller("database", "update_system_state")
             self.communication_interface.behaviour_controller("peripherals", "set_up")
 
-            time.sleep(1)
-
             # Check if all services are "set_up"
-            while True:
-                # Request service status
-                self.communication_interface.request_service_status()
+            not_set_up = await self.communication_interface.wait_for_services("set_up", timeout=4)
+            for service in not_set_up:
+                self.logger.warning(f"Service {service} is not set_up. Current status: {self.communication_interface.get_system_status()[service]}")
 
-                time.sleep(1)
-
-                services = self.communication_interface.get_system_status()
-                for service, status in services.items():
-                    if status != "set_up":
-                        all_services_set_up = False
-                        self.logger.warning(f"Service {service} is not set_up. Current status: {status}")
-                
-                # Notify the user interface about the system status
-                self.communication_interface.publish_system_status()
-                
-                if all_services_set_up:
-                    self.logger.info("All services are set_up.")
-                    break  # Exit the loop if all services are set_up
-                
-                timer += 1
-                if timer > 3: break
-            timer = 0
+            # Notify the user interface about the system status
+            self.communication_interface.publish_system_status()
 
-            if all_services_set_up:
-                    self.logger.info("All services are set_up.")
-                    break  # Exit the loop if all services are set_up
+            if not not_set_up:
+                self.logger.info("All services are set_up.")
+                break  # Exit the loop if all services are set_up
 
         self.logger.info("All services are running and ready.")
 
-    def check_for_user_requested_events(self):
+    async def check_for_user_requested_events(self):
         ''' Check if the user has requested a behaviour '''
         behaviourRunning = self.communication_interface.get_behaviour_running_status()
 
         # Transition to appropriate branch if it is not already in that branch
         if behaviourRunning['check_in'] != "disabled" and self.current_branch.branch_name != self.behaviours[1]:
             self.logger.info(f"Check-in event received event['check_in'] = {behaviourRunning['check_in']} and self.current_branch.branch_name = {self.current_branch.branch_name}")
-            self.transition_to_branch(self.behaviours[1])
+            await self.transition_to_branch(self.behaviours[1])
             self._set_current_state('interacting')
             self.logger.info("Fulfilled user request and transitioning to check-in branch")
         elif behaviourRunning['configuring'] != "disabled" and self.current_branch.branch_name != self.behaviours[2]:
             self.logger.info("Configurations event received")
-            self.transition_to_branch(self.behaviours[2])
+            await self.transition_to_branch(self.behaviours[2])
             self._set_current_state('configuring')
             self.logger.info("Fulfilled user request and transitioning to configurations branch")
 
-    def manage_behaviour(self):
+    async def manage_behaviour(self):
         """Activate or deactivate a specific behaviour in the current branch"""
         behaviourIsRunning = self.communication_interface.get_behaviour_running_status()[self.current_branch.branch_name] # Check if behaviour branch is running
 
         if behaviourIsRunning != "disabled" and self.current_branch.behaviour_running == "disabled": # Activate the current branch if it's not running
             self.logger.info(f"Current branch is: {self.current_branch.branch_name} and the behaviour is not running")
-            self.current_branch.activate_behaviour() # Activate the current branch if it's not running and not complete
+            await self.current_branch.activate_behaviour() # Activate the current branch if it's not running and not complete
         elif behaviourIsRunning == "disabled" and self.current_branch.behaviour_running != "disabled": # Deactivate the current branch if it's running and complete
             self.logger.info(f"Current branch is: {self.current_branch.branch_name} and the behaviour is complete")
-            self.transition_to_branch(self.behaviours[0])
+            await self.transition_to_branch(self.behaviours[0])
             self._set_current_state('active')
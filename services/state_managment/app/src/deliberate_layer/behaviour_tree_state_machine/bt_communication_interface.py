@@ -1,4 +1,3 @@
-import json
 import sys
 import os
 import logging
@@ -11,12 +10,25 @@ project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
 sys.path.insert(0, project_root)
 
 from shared_libraries.mqtt_client_base import MQTTClientBase
+from shared_libraries.durable_outbox import DurableOutbox
+from shared_libraries.timestamps import timestamp
+from ...event_scheduler import LayerWakeup
 
 class CommunicationInterface(MQTTClientBase):
+    CONTROL_COMMAND_TIMEOUT = 30 # seconds before an unacknowledged control command is given up on
+
     def __init__(self, broker_address, port):
         super().__init__(broker_address, port)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+        # Reminders are kept on disk until the database service confirms it saved them
+        app_dir = os.path.abspath(os.path.join(current_dir, "../../../"))
+        self.outbox = DurableOutbox(self, os.path.join(app_dir, "data", "outbox.db"))
+
+        # Notified whenever a message changed the state below, the behaviour tree and orchestrations wait on it
+        self.state_changed = LayerWakeup("BehaviorTree")
+        self.add_message_listener(self.state_changed.notify)
+
         self.subscriptions = {}
 
         # Behaviour running status used activate/deactivate certain behaviours
@@ -69,30 +81,32 @@ class CommunicationInterface(MQTTClientBase):
         self.peripheral_control_cmd = "peripherals_control_cmd" # Replace with service_control_command_topic
         self.behaviour_status_update_topic = "behaviour_status_update"
         self.configure_sleep_timer_topic = "configure_sleep_timer"
+        self.error_message_topic = "error_message"
+        self.critical_event_resolved_topic = "critical_event_resolved"
 
         # Subscriber and publisher topics
         self.check_in_controls_topic = "check_in_controller"
 
         # Subscribe to topics with custom handlers
-        self.subscribe(self.check_in_controls_topic, self._process_check_in_request)
-        self.subscribe(self.speech_recognition_status_topic, self._process_service_status)
-        # self.subscribe(self.speech_recognition_heartbeat_topic, self._process_heartbeat)
-        self.subscribe(self.robot_status_topic, self._process_service_status)
-        # self.subscribe(self.robot_control_status_topic, self._process_heartbeat)
-        self.subscribe(self.user_interface_status_topic, self._process_service_status)
-        # self.subscribe(self.user_interface_status_topic, self._process_heartbeat)
-        self.subscribe(self.reminder_status_topic, self._process_service_status)
-        # self.subscribe(self.reminder_heartbeat_topic, self._process_heartbeat)
-        self.subscribe(self.database_status_topic, self._process_service_status)
-        self.subscribe(self.peripherals_status_topic, self._process_service_status)
-        self.subscribe(self.configuration_controls_topic, self._process_start_configuration_request)
-        self.subscribe(self.service_error_topic, self._process_error_message)
-        self.subscribe(self.robot_control_status_topic, self._process_robot_behaviour_status)
-        self.subscribe(self.conversation_history_topic, self._handle_user_response)
-        self.subscribe(self.send_reminder_topic, self._send_reminder)
-        self.subscribe(self.update_state_topic, self._update_service_state)
-                       
-    def _process_check_in_request(self, client, userdata, message):
+        self.add_route(self.check_in_controls_topic, self._process_check_in_request)
+        self.add_route(self.speech_recognition_status_topic, self._process_service_status)
+        # self.add_route(self.speech_recognition_heartbeat_topic, self._process_heartbeat)
+        self.add_route(self.robot_status_topic, self._process_service_status)
+        # self.add_route(self.robot_control_status_topic, self._process_heartbeat)
+        self.add_route(self.user_interface_status_topic, self._process_service_status)
+        # self.add_route(self.user_interface_status_topic, self._process_heartbeat)
+        self.add_route(self.reminder_status_topic, self._process_service_status)
+        # self.add_route(self.reminder_heartbeat_topic, self._process_heartbeat)
+        self.add_route(self.database_status_topic, self._process_service_status)
+        self.add_route(self.peripherals_status_topic, self._process_service_status)
+        self.add_route(self.configuration_controls_topic, self._process_start_configuration_request)
+        self.add_route(self.service_error_topic, self._process_error_message)
+        self.add_route(self.robot_control_status_topic, self._process_robot_behaviour_status)
+        self.add_route(self.conversation_history_topic, self._handle_user_response)
+        self.add_route(self.send_reminder_topic, self._send_reminder)
+        self.add_route(self.update_state_topic, self._update_service_state)
+
+    def _process_check_in_request(self, payload, message):
         '''
         Process the check in request from the user interface
         
@@ -102,7 +116,7 @@ class CommunicationInterface(MQTTClientBase):
                 '0' - End check in
         '''
         self.logger.info("Processing check in")
-        if message.payload.decode() == '1':
+        if str(payload) == '1':
             self.behaviourRunningStatus['check_in'] = "enabled"
             # Transition to check in branch
             self.logger.info("Starting check in")
@@ -111,9 +125,9 @@ class CommunicationInterface(MQTTClientBase):
                 self.behaviourRunningStatus[behaviour] = "disabled"
             self.logger.info("Ending check in")
         
-    def _process_start_configuration_request(self, client, userdata, message):
+    def _process_start_configuration_request(self, payload, message):
         self.logger.info("Processing configurations")
-        if message.payload.decode() == '1':
+        if str(payload) == '1':
             self.logger.info("Starting configuration branch")
             self.behaviourRunningStatus['configuring'] = "enabled"
         else:
@@ -121,7 +135,7 @@ class CommunicationInterface(MQTTClientBase):
             for behaviour in self.behaviourRunningStatus:
                 self.behaviourRunningStatus[behaviour] = "disabled"
 
-    def _process_service_status(self, client, uesrdata, message):
+    def _process_service_status(self, payload, message):
         '''
         Process the status of the services to update the current of the entier system status
         
@@ -135,50 +149,46 @@ class CommunicationInterface(MQTTClientBase):
                     "timestamp": "%Y-%m-%d %H:%M:%S"
                 }
         '''
-        payload = json.loads(message.payload.decode("utf-8"))
         service = payload.get("service_name", "")
         status = payload.get("status", "")
 
         self.systemStatus[service] = status
 
-    def _process_error_message(self, client, userdata, message):
+    def _process_error_message(self, payload, message):
         self.logger.info("Processing error message")
         # self.criticalEvents['error'] = message.payload.decode()
 
-    def _process_robot_behaviour_status(self, client, userdata, message):
-        payload = json.loads(message.payload.decode("utf-8"))
+    def _process_robot_behaviour_status(self, payload, message):
         behaviour_name = payload.get("behaviour_name", "")
         behaviour_status = payload.get("status", "")
         self.logger.info(f"behaviour status recived = {behaviour_status} for behaviour name = {behaviour_name}")
         self.robot_behaviour_completion_status[behaviour_name] = behaviour_status
 
-    def _handle_user_response(self, client, userdata, message):
-        self.logger.info(f"the user response is {message.payload.decode()}")
-        payload = json.loads(message.payload.decode("utf-8"))
+    def _handle_user_response(self, payload, message):
+        self.logger.info(f"the user response is {payload}")
         self.user_response["response_text"] = payload.get("content", None)
         self.user_response["sentiment"] = payload.get("sentiment", None)
     
-    def _send_reminder(self, client, userdata, message):
+    def _send_reminder(self, payload, message):
         self.logger.info("Processing reminder request")
-        if message.payload.decode() == '1':
+        if str(payload) == '1':
             self.behaviourRunningStatus['reminder'] = "enabled"
             self.logger.info("enable reminder")
         else:
             self.behaviourRunningStatus['reminder'] = "disabled"
             self.logger.info("disable reminder")
 
-    def _update_service_state(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            state_name = payload.get("state_name", "")
-            state = payload.get("state_value", [])
-            self.logger.info(f"in state machine and received state update for {state_name}: {state}")
-            if state_name == "start_date":
-                self.first_day = state == datetime.now().date().strftime("%Y-%m-%d")
-            elif state_name == "user_name":
-                self.user_name = state
-        except json.JSONDecodeError:
+    def _update_service_state(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for updating service state. Using default retry parameters.")
+            return
+        state_name = payload.get("state_name", "")
+        state = payload.get("state_value", [])
+        self.logger.info(f"in state machine and received state update for {state_name}: {state}")
+        if state_name == "start_date":
+            self.first_day = state == datetime.now().date().strftime("%Y-%m-%d")
+        elif state_name == "user_name":
+            self.user_name = state
 
     def request_service_status(self):
         '''
@@ -187,12 +197,53 @@ class CommunicationInterface(MQTTClientBase):
         # self.logger.info("Requesting service status")
         self.publish(self.request_service_status_topic, "")
 
+    async def gather_service_status(self, services=None, timeout=1.0):
+        '''
+        Request the status of the services and wait until all of them answered, or the timeout expired
+
+        Returns:
+            dict: The status reported by each service that answered in time
+        '''
+        services = list(services) if services is not None else list(self.systemStatus)
+        responses = await self.scatter_gather_async(self.request_service_status_topic, services, timeout=timeout)
+        return {service: response.get("status", "") for service, response in responses.items()}
+
+    async def wait_for_services(self, expected_status, services=None, timeout=5.0):
+        '''
+        Request the status of the services and wait until all of them report the expected status, or the timeout expired.
+        The correlated responses are awaited with scatter_gather_async, services that answered with another status (e.g.
+        the robot while it is waking up) are then waited on until they publish the expected status on their own.
+
+        Returns:
+            list: The services that did not reach the expected status
+        '''
+        services = list(services) if services is not None else list(self.systemStatus)
+        deadline = time.monotonic() + timeout
+        self.systemStatus.update(await self.gather_service_status(services, timeout=timeout))
+
+        def not_ready():
+            return [service for service in services if self.systemStatus.get(service) != expected_status]
+
+        await self.state_changed.wait_until(lambda: not not_ready(), max(0, deadline - time.monotonic()))
+        return not_ready()
+
+    async def wait_for_robot_behaviour(self, behaviour_name, statuses=("complete",), timeout=None):
+        '''
+        Wait until the robot reports one of the statuses for a behaviour
+
+        Returns:
+            str: The status reported, or None if the timeout expired
+        '''
+        if await self.state_changed.wait_until(lambda: self.get_robot_behaviour_completion_status(behaviour_name) in statuses, timeout):
+            return self.get_robot_behaviour_completion_status(behaviour_name)
+        return None
+
     def publish_system_status(self):
         '''
         Publish the system status to all services
         '''
         self.logger.info("Publishing system status")
-        self.publish(self.publish_system_status_topic, json.dumps(self.systemStatus))
+        self.publish(self.publish_system_status_topic, self.systemStatus)
 
     def publish_robot_speech(self, content, message_type="request"):
         message = {
@@ -201,9 +252,8 @@ class CommunicationInterface(MQTTClientBase):
             "content": content
         }
         self.logger.info(f"sending message {message}")
-        json_message = json.dumps(message)
         # This is what the robot should say
-        self.publish(self.robot_speech_topic, json_message)
+        self.publish(self.robot_speech_topic, message)
 
     def publish_robot_behaviour_command(self, cmd, details = "", message_type="request"):
         message = {
@@ -211,11 +261,10 @@ class CommunicationInterface(MQTTClientBase):
             "message_type": message_type,
             "cmd": cmd,
             "additional_details": details,
-            "time": time.strftime("%Y-%m-%d %H:%M:%S")
+            "time": timestamp()
         }
-        json_message = json.dumps(message)
         # This is what the robot should do
-        self.publish(self.robot_behaviour_topic, json_message)
+        self.publish(self.robot_behaviour_topic, message)
 
     def publish_collect_response(self, expected_format):
         self.logger.info("Publishing record response")
@@ -223,13 +272,14 @@ class CommunicationInterface(MQTTClientBase):
         payload = {
             "service_name": service_name,
             "cmd": expected_format,
-            "time": time.strftime("%Y-%m-%d %H:%M:%S")
+            "time": timestamp()
         }
-        self.publish(self.service_control_command_topic(service_name), json.dumps(payload))
+        self.publish(self.service_control_command_topic(service_name), payload)
 
     def publish_reminder_sent(self, payload):
         self.logger.info("Saving reminder message to the database")
-        self.publish(self.save_reminder_topic, json.dumps(payload))
+        # The reminder belongs to the day it was sent, however late the database service receives it
+        self.outbox.send(self.save_reminder_topic, dict(payload, date=datetime.now().date().isoformat()))
 
     def publish_behaviour_status_update(self, status):
         self.logger.info(f"Publishing behaviour status update: {status}")
@@ -239,18 +289,38 @@ class CommunicationInterface(MQTTClientBase):
         # }
         self.publish(self.behaviour_status_update_topic, status)
 
+    def publish_error_message(self, error_message):
+        """Reports a critical error, the reactive layer moves the state machine to its Error state until it is resolved."""
+        self.logger.error(f"Publishing error message: {error_message}")
+        payload = {
+            "error_message": error_message,
+            "response type": "critical",
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "service_name": "state_machine"
+        }
+        self.publish(self.error_message_topic, payload)
+
+    def publish_error_resolved(self):
+        self.publish(self.critical_event_resolved_topic, "-")
+
     def configure_sleep_timer(self, configuration):
         self.logger.info(f"Orchestrator is configuring sleep timer to {configuration}")
         self.publish(self.configure_sleep_timer_topic, configuration)
 
     def behaviour_controller(self, service_name, cmd):
+        '''
+        Send a control command to a service
+
+        Returns:
+            Future: Completes with the status message the service acknowledged the command with
+        '''
         payload = {
             "service_name": service_name,
             "cmd": cmd,
-            "time": time.strftime("%Y-%m-%d %H:%M:%S")
+            "time": timestamp()
         }
         self.logger.info(f"Publishing service control command to {self.service_control_command_topic(service_name)} with command: {cmd}")
-        self.publish(self.service_control_command_topic(service_name), json.dumps(payload))
+        return self.call(self.service_control_command_topic(service_name), payload, timeout=self.CONTROL_COMMAND_TIMEOUT)
 
     def end_check_in(self):
         logging.info("Ending check-in")
@@ -267,13 +337,14 @@ class CommunicationInterface(MQTTClientBase):
     
     def set_behaviour_running_status(self, behaviour, status):
         self.behaviourRunningStatus[behaviour] = status
+        self.state_changed.notify()
 
     def get_robot_behaviour_completion_status(self, behaviour_name):
         status = self.robot_behaviour_completion_status.get(behaviour_name, "")
         return status
     
     def acknowledge_robot_behaviour_completion_status(self, behaviour_name):
-        self.robot_behaviour_completion_status.pop(behaviour_name)
+        self.robot_behaviour_completion_status.pop(behaviour_name, None)
     
     def get_user_response(self):
         return self.user_response
@@ -282,4 +353,9 @@ class CommunicationInterface(MQTTClientBase):
         return self.first_day
     
     def get_user_name(self):
-        return self.user_name
\ No newline at end of file
+        return self.user_name
+
+    def disconnect(self):
+        # Reminders not acknowledged yet are replayed on the next start
+        self.outbox.close(timeout=2)
+        super().disconnect()
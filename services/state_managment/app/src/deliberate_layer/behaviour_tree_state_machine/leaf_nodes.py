@@ -41,13 +41,11 @@ class UserInterface(Leaf):
 
     def set_up(self):
         self.logger.info("Setting up user interface")
-        self.comm_interface.behaviour_controller(self.name, "set_up")
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "set_up")
 
     def start(self):
         self.logger.info("Starting user interface")
-        self.comm_interface.behaviour_controller(self.name, "start")
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "start")
 
     def update(self):
         pass
@@ -64,12 +62,11 @@ class VoiceAssistant(Leaf):
         self.name = "speech_recognition"
 
     def set_up(self):
-        self.comm_interface.behaviour_controller(self.name, "set_up")
+        return self.comm_interface.behaviour_controller(self.name, "set_up")
 
     def start(self):
         # Start voice assistant
-        self.comm_interface.behaviour_controller(self.name, "start")
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "start")
 
     def update(self):
         # Check for errors in the services and pause or restart the check-in process
@@ -87,14 +84,15 @@ class RobotController(Leaf):
         self.name = "robot_control"
 
     def set_up(self):
-        self.comm_interface.behaviour_controller(self.name, "set_up")
+        acknowledgement = self.comm_interface.behaviour_controller(self.name, "set_up")
         self.logger.info("Setting up robot controller")
         if self.branch_name == "configuring":
             self.logger.info("Sending wake up command")
             self.comm_interface.publish_robot_behaviour_command("wake_up")
+        return acknowledgement
 
     def start(self):
-        self.comm_interface.behaviour_controller(self.name, "start")
+        return self.comm_interface.behaviour_controller(self.name, "start")
 
     def update(self):
         pass
@@ -109,14 +107,11 @@ class Reminder(Leaf):
         self.name = "reminder"
 
     def set_up(self):
-        self.comm_interface.behaviour_controller(self.name, "set_up")
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "set_up")
 
     def start(self):
         self.logger.info("Starting reminder")
-        self.comm_interface.behaviour_controller(self.name, "start")
-        # Check if its time to provide a reminder
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "start")
 
     def update(self):
         # Check if its time to provide a reminder
@@ -134,14 +129,11 @@ class Databse(Leaf):
         self.name = "database"
 
     def set_up(self):
-        self.comm_interface.behaviour_controller(self.name, "set_up")
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "set_up")
 
     def start(self):
         self.logger.info("Starting database")
-        self.comm_interface.behaviour_controller(self.name, "start")
-        # Check if its time to provide a reminder
-        pass
+        return self.comm_interface.behaviour_controller(self.name, "start")
                     
     def update(self):
         # Check if its time to provide a reminder
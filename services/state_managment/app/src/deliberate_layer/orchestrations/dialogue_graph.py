@@ -0,0 +1,330 @@
+import json
+import logging
+import os
+import re
+
+'''
+Compiles the check-in dialogue from a JSON definition (check_in_dialogue.json) into graphs of question nodes.
+
+The definition holds one script per conversation, the script used on each weekday and the script used on the
+first day of the study:
+
+    {
+        "days": {"Monday": "monday", ...},
+        "start_of_study": "start_of_study",
+        "scripts": {
+            "monday": {
+                "start": "exercised_today",
+                "nodes": {
+                    "exercised_today": {"question": "...", "expected_format": "closed-ended", "next": "confidence"},
+                    "confidence": {
+                        "question": "...",
+                        "expected_format": "short",
+                        "scale": [1, 10],
+                        "invalid_question": "Please provide a valid number between 1 and 10",
+                        "next": [
+                            {"max": 4, "next": "obstacles"},
+                            {"words": ["no", "not"], "next": "..."},
+                            {"next": "strategies"}
+                        ]
+                    },
+                    ...
+                }
+            }
+        }
+    }
+
+"next" is either the id of the following node, a list of transitions that are tried in order, or left out on the
+last question of the script. A transition matches when the response contains one of its "words" and/or the number
+given on the node's scale is within its "min" and "max"; the last transition must be unconditional. Nodes with a
+"scale" ask again (with their "invalid_question" if they have one) until the response is a number on the scale.
+
+Scripts are validated when they are compiled: every transition has to lead to an existing node, every node has to
+be reachable from the start and the script has to be able to reach its end from every node.
+'''
+
+EXPECTED_FORMATS = ("closed-ended", "open-ended", "short")
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+TRANSITION_KEYS = {"words", "min", "max", "next"}
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+
+class DialogueGraphError(ValueError):
+    '''Raised when a dialogue definition does not compile. Lists every problem that was found.'''
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Invalid dialogue definition:\n  " + "\n  ".join(problems))
+
+
+def scale_value(response, scale):
+    """Returns the response as a number on the scale, or None if it is not a number within the scale."""
+    try:
+        value = int(str(response).strip())
+    except ValueError:
+        return None
+    return value if scale[0] <= value <= scale[1] else None
+
+
+class Transition:
+    __slots__ = ("words", "min", "max", "target")
+
+    def __init__(self, target, words=None, min=None, max=None):
+        self.target = target
+        self.words = frozenset(word.lower() for word in words) if words else None
+        self.min = min
+        self.max = max
+
+    def is_unconditional(self):
+        return self.words is None and self.min is None and self.max is None
+
+    def matches(self, response_words, value):
+        if self.words is not None and not self.words & response_words:
+            return False
+        if self.min is not None and (value is None or value < self.min):
+            return False
+        if self.max is not None and (value is None or value > self.max):
+            return False
+        return True
+
+
+class DialogueNode:
+    __slots__ = ("node_id", "question", "expected_format", "scale", "invalid_question", "transitions", "uses_words")
+
+    def __init__(self, node_id, question, expected_format, scale=None, invalid_question=None, transitions=()):
+        self.node_id = node_id
+        self.question = question
+        self.expected_format = expected_format
+        self.scale = scale
+        self.invalid_question = invalid_question
+        self.transitions = tuple(transitions)
+        self.uses_words = any(transition.words is not None for transition in self.transitions)
+
+    def as_question(self, invalid=False):
+        question = self.invalid_question if invalid and self.invalid_question else self.question
+        return {"question": question, "expected_format": self.expected_format, "node": self.node_id}
+
+
+class DialogueScript:
+    '''A compiled script. Nodes are indexed by id, and by question text for callers that only know the text.'''
+    def __init__(self, name, start, nodes):
+        self.name = name
+        self.start = start
+        self.nodes = nodes
+        self.nodes_by_question = {}
+        for node in nodes.values():
+            self.nodes_by_question[node.question] = node
+            if node.invalid_question:
+                self.nodes_by_question[node.invalid_question] = node
+
+    def first_question(self):
+        return self.nodes[self.start].as_question()
+
+    def node_for_question(self, question):
+        node = self.nodes_by_question.get(question)
+        return node.node_id if node else None
+
+    def next_question(self, node_id, response=""):
+        """Returns the question that follows the node given the user's response, or None at the end of the script."""
+        node = self.nodes.get(node_id)
+        if node is None:
+            return None
+        response = response or ""
+        value = None
+        if node.scale is not None:
+            value = scale_value(response, node.scale)
+            if value is None:
+                return node.as_question(invalid=True)
+        response_words = set(WORD_PATTERN.findall(response.lower())) if node.uses_words else frozenset()
+        for transition in node.transitions:
+            if transition.matches(response_words, value):
+                return self.nodes[transition.target].as_question()
+        return None
+
+
+class DialogueGraph:
+    '''All the compiled scripts and which one is used on each day.'''
+    def __init__(self, scripts, days, start_of_study):
+        self.scripts = scripts
+        self.days = days
+        self.start_of_study = start_of_study
+
+    def script_for(self, weekday, first_day=False):
+        if first_day:
+            return self.scripts[self.start_of_study]
+        return self.scripts[self.days[weekday]]
+
+
+def _compile_transitions(script_name, node_id, definition, problems):
+    next_nodes = definition.get("next")
+    if next_nodes is None:
+        return []
+    if isinstance(next_nodes, str):
+        return [Transition(next_nodes)]
+    if not isinstance(next_nodes, list) or not next_nodes:
+        problems.append(f"{script_name}.{node_id}: 'next' must be a node id or a non-empty list of transitions")
+        return []
+
+    transitions = []
+    for index, entry in enumerate(next_nodes):
+        where = f"{script_name}.{node_id}.next[{index}]"
+        if not isinstance(entry, dict) or not isinstance(entry.get("next"), str):
+            problems.append(f"{where}: a transition must be an object with the id of the next node")
+            continue
+        unknown = set(entry) - TRANSITION_KEYS
+        if unknown:
+            problems.append(f"{where}: unknown keys {sorted(unknown)}")
+        if ("min" in entry or "max" in entry) and definition.get("scale") is None:
+            problems.append(f"{where}: 'min' and 'max' need a 'scale' on the node")
+        transitions.append(Transition(entry["next"], words=entry.get("words"), min=entry.get("min"), max=entry.get("max")))
+
+    for index, transition in enumerate(transitions[:-1]):
+        if transition.is_unconditional():
+            problems.append(f"{script_name}.{node_id}.next[{index}]: unconditional transition makes the following ones unreachable")
+    if transitions and not transitions[-1].is_unconditional():
+        problems.append(f"{script_name}.{node_id}: the last transition must be unconditional, otherwise the dialogue ends when no condition matches")
+    return transitions
+
+
+def _compile_node(script_name, node_id, definition, problems):
+    where = f"{script_name}.{node_id}"
+    if not isinstance(definition, dict):
+        problems.append(f"{where}: a node must be an object")
+        return None
+    if not isinstance(definition.get("question"), str) or not definition["question"].strip():
+        problems.append(f"{where}: missing question")
+    if definition.get("expected_format") not in EXPECTED_FORMATS:
+        problems.append(f"{where}: expected_format must be one of {EXPECTED_FORMATS}")
+    scale = definition.get("scale")
+    if scale is not None:
+        if not (isinstance(scale, list) and len(scale) == 2 and all(isinstance(bound, int) for bound in scale) and scale[0] <= scale[1]):
+            problems.append(f"{where}: scale must be [lowest, highest]")
+            scale = None
+        else:
+            scale = tuple(scale)
+    transitions = _compile_transitions(script_name, node_id, definition, problems)
+    return DialogueNode(
+        node_id,
+        definition.get("question"),
+        definition.get("expected_format"),
+        scale=scale,
+        invalid_question=definition.get("invalid_question"),
+        transitions=transitions
+    )
+
+
+def _validate_script(script, problems):
+    successors = {}
+    for node in script.nodes.values():
+        successors[node.node_id] = set()
+        for transition in node.transitions:
+            if transition.target not in script.nodes:
+                problems.append(f"{script.name}.{node.node_id}: next node '{transition.target}' does not exist")
+            else:
+                successors[node.node_id].add(transition.target)
+
+    # Every node has to be reachable from the start
+    reachable = set()
+    frontier = [script.start]
+    while frontier:
+        node_id = frontier.pop()
+        if node_id not in reachable:
+            reachable.add(node_id)
+            frontier.extend(successors[node_id])
+    for node_id in script.nodes:
+        if node_id not in reachable:
+            problems.append(f"{script.name}.{node_id}: unreachable from '{script.start}'")
+
+    # and the end of the script has to be reachable from every node
+    predecessors = {node_id: set() for node_id in script.nodes}
+    for node_id, targets in successors.items():
+        for target in targets:
+            predecessors[target].add(node_id)
+    can_end = set()
+    frontier = [node.node_id for node in script.nodes.values() if not node.transitions]
+    while frontier:
+        node_id = frontier.pop()
+        if node_id not in can_end:
+            can_end.add(node_id)
+            frontier.extend(predecessors[node_id])
+    for node_id in script.nodes:
+        if node_id not in can_end:
+            problems.append(f"{script.name}.{node_id}: dead end, the script can never finish from this node")
+
+    seen = {}
+    for node in script.nodes.values():
+        for text in {node.question, node.invalid_question} - {None}:
+            if text in seen and seen[text] != node.node_id:
+                problems.append(f"{script.name}.{node.node_id}: question is also asked by '{seen[text]}'")
+            seen.setdefault(text, node.node_id)
+
+
+def compile_dialogue(definition):
+    """Compiles and validates a dialogue definition. Raises DialogueGraphError listing every problem found."""
+    problems = []
+    scripts = {}
+    for script_name, script_definition in (definition.get("scripts") or {}).items():
+        nodes_definition = script_definition.get("nodes") or {}
+        start = script_definition.get("start")
+        if start not in nodes_definition:
+            problems.append(f"{script_name}: start node '{start}' does not exist")
+            continue
+        nodes = {}
+        for node_id, node_definition in nodes_definition.items():
+            node = _compile_node(script_name, node_id, node_definition, problems)
+            if node is not None:
+                nodes[node_id] = node
+        script = DialogueScript(script_name, start, nodes)
+        _validate_script(script, problems)
+        scripts[script_name] = script
+
+    days = definition.get("days") or {}
+    for weekday in WEEKDAYS:
+        if days.get(weekday) not in scripts:
+            problems.append(f"days: no script for {weekday}")
+    start_of_study = definition.get("start_of_study")
+    if start_of_study not in scripts:
+        problems.append(f"start_of_study: script '{start_of_study}' does not exist")
+
+    if problems:
+        raise DialogueGraphError(problems)
+    return DialogueGraph(scripts, days, start_of_study)
+
+
+def load_dialogue(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return compile_dialogue(json.load(f))
+
+
+class DialogueFile:
+    '''
+    The compiled dialogue of a definition file, recompiled when the file changes so scripts can be edited while
+    the robot is running. If the edited file does not compile, the previous dialogue is kept.
+    '''
+    def __init__(self, path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.graph = None
+        self._modified = None
+        self.reload_if_changed()
+        if self.graph is None:
+            raise DialogueGraphError([f"Could not load the dialogue from {path}"])
+
+    def reload_if_changed(self):
+        """Recompiles the dialogue if the file was modified since it was last loaded. Returns True if it was."""
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            self.logger.error(f"Could not read the dialogue file: {e}")
+            return False
+        if modified == self._modified:
+            return False
+        self._modified = modified
+        try:
+            self.graph = load_dialogue(self.path)
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError and DialogueGraphError are both ValueErrors
+            self.logger.error(f"Keeping the previous dialogue, {self.path} does not compile: {e}")
+            return False
+        self.logger.info(f"Loaded the dialogue from {self.path}")
+        return True
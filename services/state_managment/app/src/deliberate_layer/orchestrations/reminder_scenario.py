@@ -1,4 +1,4 @@
-import time
+import asyncio
 import logging
 import random
 
@@ -8,6 +8,7 @@ class ReminderScenario:
         self.communication_interface = communication_interface
         self.step = 0
         self.complete = False
+        self.task = None
         self.reminder_message = "Hello! Welcome to your daily reminder."
 
         # List of motivational reminders with placeholders for participant's name
@@ -26,60 +27,65 @@ class ReminderScenario:
         self.complete = False
         self.waiting_for_response = False
         self.logger.info("Reminder scenario started")
-        pass
-    
-    def update(self):
-        # self.logger.info(f"Updating orchestrator, currently on step = {self.step}")
-        # If we've completed the scenario, do nothing.
-        if self.complete:
-            return
-        
-        # Step 1: Set up
-        if self.step == 1: 
-            if self._drive_off_charger():
-                 self.step = 2
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def run(self):
+        try:
+            while not self.complete:
+                # self.logger.info(f"Running orchestrator, currently on step = {self.step}")
+                # Step 1: Set up
+                if self.step == 1:
+                    await self._drive_off_charger()
+                    self.step = 2
+
+                # Step 2: Play an animation...
+                elif self.step == 2:
+                    self.communication_interface.publish_robot_behaviour_command("reminder")
+                    self.step = 3
+
+                # Step 3: Send greeting
+                elif self.step == 3:
+                    await self._remind_user()
+                    self.step = 4
+
+                # Step 4: Wish participants farewell
+                elif self.step == 4:
+                    await self._farewell_user()
+                    self.step = 5
+
+                # Step 5: Mark as complete
+                elif self.step == 5:
+                    self.complete = True
+                    self.logger.info("Reminder Scenario Complete")
+                    self.step = 0
+                    # Possibly also send completion signals if needed
+                    payload = {
+                        "reminder_message": self.reminder_message
+                    }
+                    self.communication_interface.publish_reminder_sent(payload)
+                else:
+                    return
+        except asyncio.CancelledError:
+            self.logger.info(f"Reminder scenario stopped on step {self.step}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Reminder scenario failed on step {self.step}: {e}")
 
-        # Step 2: Play an animation...
-        if self.step == 2:
-            self.communication_interface.publish_robot_behaviour_command("reminder")
-            self.step = 3
-        
-        # Step 3: Send greeting
-        if self.step == 3: 
-            if self._remind_user():
-                 self.step = 4
-        
-        # Step 4: Wish participants farewell
-        if self.step == 4:
-            self._farewell_user()
-            self.step = 5
-            return
-        
-        # Step 5: Mark as complete
-        elif self.step == 5:
-            self.complete = True
-            self.logger.info("Reminder Scenario Complete")
-            self.step = 0
-            # Possibly also send completion signals if needed
-            payload = {
-                "reminder_message": self.reminder_message
-            }
-            self.communication_interface.publish_reminder_sent(payload)
-            return
-        
     # Helper methods for each step
-    def _drive_off_charger(self):
+    async def _drive_off_charger(self):
         # Get robot to drive off the charger and wait for it to complete...
-        if self.waiting_for_response == False:
-            self.communication_interface.publish_robot_behaviour_command("drive off charger")
-            self.waiting_for_response = True
-        
-        if self.communication_interface.get_robot_behaviour_completion_status("drive off charger") == "complete":
-            self.waiting_for_response = False
-            self.logger.info("No longer wating, moving to step 2 to greet user")
-            return True
-        
-        return False
+        self.communication_interface.acknowledge_robot_behaviour_completion_status("drive off charger")
+        self.communication_interface.publish_robot_behaviour_command("drive off charger")
+        self.waiting_for_response = True
+        await self.communication_interface.wait_for_robot_behaviour("drive off charger")
+        self.communication_interface.acknowledge_robot_behaviour_completion_status("drive off charger")
+        self.waiting_for_response = False
+        self.logger.info("No longer wating, moving to step 2 to greet user")
 
     def _get_random_reminder(self, name):
         # Generate a random index to select a reminder
@@ -87,29 +93,26 @@ class ReminderScenario:
         # Format the selected reminder with the participant's name
         return self.reminders[index].format(name=name)
         
-    def _remind_user(self):
-        if self.waiting_for_response == False:
-            self.logger.info("Requesting robot to speak")
-            self.communication_interface.publish_robot_speech(
-                message_type="greeting",
-                content=self._get_random_reminder(self.communication_interface.get_user_name())
-            )
-            self.waiting_for_response = True
-        
-        if self.communication_interface.get_robot_behaviour_completion_status("greeting") == "complete":
-            self.logger.info("Sending reminder has completed")
-            self.waiting_for_response = False
-            return True
-        
-        return False
+    async def _remind_user(self):
+        self.logger.info("Requesting robot to speak")
+        self.communication_interface.acknowledge_robot_behaviour_completion_status("greeting")
+        self.communication_interface.publish_robot_speech(
+            message_type="greeting",
+            content=self._get_random_reminder(self.communication_interface.get_user_name())
+        )
+        self.waiting_for_response = True
+        await self.communication_interface.wait_for_robot_behaviour("greeting")
+        self.communication_interface.acknowledge_robot_behaviour_completion_status("greeting")
+        self.logger.info("Sending reminder has completed")
+        self.waiting_for_response = False
 
-    def _farewell_user(self):
+    async def _farewell_user(self):
         self.logger.info("Sending farewell.")
         # Drive back to the charging station
         self.communication_interface.publish_robot_behaviour_command("return_home")
         self.communication_interface.set_behaviour_running_status("reminder", "standby")
         self.logger.info("Sending reminder has completed successfully.")
-        time.sleep(0.5)
+        await asyncio.sleep(0.5)
 
     # def save_response(question, response, summary=""):
         # Save the response to a database or file
@@ -118,9 +121,12 @@ class ReminderScenario:
             return self.complete
     
     def error(self):
-        self.logger.error("An error occurred while processing the check-in scenario.")
-        return
-    
+        self.logger.error("An error occurred while processing the reminder scenario.")
+        self.stop()
+
     def resume(self):
-        self.logger.info("Resuming the check-in scenario.")
-        return
\ No newline at end of file
+        self.logger.info("Resuming the reminder scenario.")
+        if self.step != 0 and not self.complete:
+            # Restart the current step in the scenario
+            self.waiting_for_response = False
+            self.task = asyncio.create_task(self.run())
@@ -0,0 +1,81 @@
+'''
+Wake-up primitives used to run the reactive layer, FSM and behaviour tree as coroutines on a single asyncio
+event loop instead of polling threads.
+
+Each layer owns a LayerWakeup and awaits it between updates. Anything the layer reacts to notifies it:
+MQTT messages received by the layer's communication interface (MQTTClientBase.add_message_listener, called
+from the MQTT network thread) and events put on the queues it reads from (NotifyingQueue).
+'''
+import asyncio
+from queue import Queue
+
+
+class LayerWakeup:
+    '''
+    Thread-safe notification that coroutines on the event loop can wait on.
+    Every notification increments a generation counter, so a coroutine that remembers the generation before
+    doing some work can wait for anything that happened since, without losing notifications sent meanwhile.
+    Any number of coroutines can wait on the same wakeup.
+    '''
+    def __init__(self, name, loop=None):
+        self.name = name
+        self.generation = 0
+        self._loop = loop or asyncio.get_running_loop()
+        self._changed = self._loop.create_future()
+
+    def notify(self, *args):
+        """Wake up the waiting coroutines. Accepts and ignores arguments so it can be used directly as a callback."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._set()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._set)
+            except RuntimeError:
+                pass  # The event loop has been closed, nothing is waiting any more
+
+    def _set(self):
+        self.generation += 1
+        changed, self._changed = self._changed, self._loop.create_future()
+        changed.set_result(None)
+
+    async def wait(self, since=None, timeout=None):
+        """
+        Waits for a notification sent after the given generation (or from now on if no generation is given).
+        Returns True if notified and False if the timeout expired.
+        """
+        if since is not None and self.generation != since:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._changed), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_until(self, predicate, timeout=None):
+        """Waits until predicate() is true, re-checking it on every notification. Returns the final result."""
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while not predicate():
+            remaining = None if deadline is None else deadline - self._loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            await self.wait(timeout=remaining)
+        return True
+
+
+class NotifyingQueue(Queue):
+    '''A Queue that wakes up the layers consuming it whenever an event is put on it.'''
+    def __init__(self, *wakeups, maxsize=0):
+        super().__init__(maxsize)
+        self.wakeups = list(wakeups)
+
+    def add_wakeup(self, wakeup):
+        self.wakeups.append(wakeup)
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        for wakeup in self.wakeups:
+            wakeup.notify()
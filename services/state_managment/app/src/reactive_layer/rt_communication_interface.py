@@ -26,19 +26,19 @@ class CommunicationInterface(MQTTClientBase):
         self.critical_error_resolved_topic = "critical_event_resolved"
 
         # Subscribe to topics with custom handlers
-        self.subscribe(self.switch_state_topic, self._process_switch_state)
-        self.subscribe(self.critial_error_topic, self._process_error_message)
-        self.subscribe(self.critical_error_resolved_topic, self._process_error_resolved_message)
+        self.add_route(self.switch_state_topic, self._process_switch_state)
+        self.add_route(self.critial_error_topic, self._process_error_message)
+        self.add_route(self.critical_error_resolved_topic, self._process_error_resolved_message)
 
-    def _process_switch_state(self, client, userdata, message):
+    def _process_switch_state(self, payload, message):
         self.logger.info("Processing switch state")
         self.criticalEvents['switch_state'] = message.payload.decode()
 
-    def _process_error_message(self, client, userdata, message):
+    def _process_error_message(self, payload, message):
         self.logger.info("Processing error message")
         self.criticalEvents['error'] = True
 
-    def _process_error_resolved_message(self, client, userdata, message):
+    def _process_error_resolved_message(self, payload, message):
         self.logger.info("Processing resolved error message")
         self.criticalEvents['error'] = False
 
@@ -0,0 +1,152 @@
+# unittest_behaviour_branch.py
+
+import unittest
+import asyncio
+import os
+import sys
+from concurrent.futures import Future
+
+# Add the deliberate layer directory to sys.path so the branch can be imported the way the behaviour tree does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+deliberate_layer = os.path.abspath(os.path.join(current_dir, "../src/deliberate_layer"))
+sys.path.insert(0, deliberate_layer)
+
+from behaviour_tree_state_machine.behaviour_branch import BehaviourBranch
+
+DEADLINE = 0.1
+
+
+class FakeMetrics:
+    def __init__(self):
+        self.observed = {}
+
+    def observe(self, metric, key, value):
+        self.observed[(metric, key)] = value
+
+
+class FakeCommunicationInterface:
+    '''Records the errors the branch reports. Services only become ready by answering their commands.'''
+    def __init__(self):
+        self.metrics = FakeMetrics()
+        self.errors = []
+        self.resolved = 0
+
+    async def wait_for_services(self, expected_status, services=None, timeout=5.0):
+        await asyncio.sleep(timeout)
+        return list(services)
+
+    def publish_error_message(self, error_message):
+        self.errors.append(error_message)
+
+    def publish_error_resolved(self):
+        self.resolved += 1
+
+
+class FakeLeaf:
+    '''Answers set_up with "ready" after delay seconds from its ready_on_attempt-th set_up on, never if it is None.'''
+    def __init__(self, name, ready_on_attempt, delay, communication_interface=None, priority='critical', branch_name=''):
+        self.name = name
+        self.ready_on_attempt = ready_on_attempt
+        self.delay = delay
+        self.priority = priority
+        self.commands = []
+
+    def _answer(self, status, answered):
+        future = Future()
+        if answered:
+            asyncio.get_running_loop().call_later(self.delay, future.set_result, {"status": status})
+        return future
+
+    def set_up(self):
+        self.commands.append("set_up")
+        return self._answer("ready", self.ready_on_attempt is not None and self.commands.count("set_up") >= self.ready_on_attempt)
+
+    def start(self):
+        self.commands.append("start")
+        return self._answer("running", True)
+
+    def update(self):
+        pass
+
+    def end(self):
+        self.commands.append("end")
+
+
+def leaf(name, ready_on_attempt=1, delay=0.0):
+    return lambda **kwargs: FakeLeaf(name, ready_on_attempt, delay, **kwargs)
+
+
+class TestBehaviourBranch(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.communication_interface = FakeCommunicationInterface()
+        self.branch = BehaviourBranch("check_in", self.communication_interface, activation_deadline=DEADLINE)
+
+    def add(self, name, priority="critical", **kwargs):
+        self.branch.add_service(leaf(name, **kwargs), priority=priority)
+        return self.branch.services[-1]
+
+    async def test_services_are_set_up_concurrently(self):
+        services = [self.add(name, delay=0.05) for name in ("user_interface", "speech_recognition", "database")]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        self.assertTrue(await self.branch.activate_behaviour())
+        # One deadline for all of them rather than one each
+        self.assertLess(loop.time() - started, 0.05 * len(services))
+        self.assertEqual(sorted(self.branch.readiness_latency), ["database", "speech_recognition", "user_interface"])
+        for latency in self.branch.readiness_latency.values():
+            self.assertGreaterEqual(latency, 0.04)
+        self.assertIn(("branch.readiness_ms", "check_in/database"), self.communication_interface.metrics.observed)
+        self.assertEqual([service.commands for service in services], [["set_up", "start"]] * 3)
+        self.assertEqual(self.branch.behaviour_running, "standby")
+
+    async def test_services_that_are_not_ready_are_set_up_again(self):
+        user_interface = self.add("user_interface")
+        robot = self.add("robot_control", ready_on_attempt=2)
+
+        self.assertTrue(await self.branch.activate_behaviour())
+        self.assertEqual(user_interface.commands, ["set_up", "start"])
+        self.assertEqual(robot.commands, ["set_up", "set_up", "start"])
+        # Measured from the set_up it answered
+        self.assertLess(self.branch.readiness_latency["robot_control"], DEADLINE)
+
+    async def test_optional_services_are_given_up_after_the_last_attempt(self):
+        user_interface = self.add("user_interface")
+        robot = self.add("robot_control", priority="optional", ready_on_attempt=None)
+
+        self.assertTrue(await self.branch.activate_behaviour())
+        self.assertEqual(robot.commands, ["set_up"] * BehaviourBranch.ACTIVATION_ATTEMPTS)
+        self.assertEqual(user_interface.commands, ["set_up", "start"])
+        self.assertEqual(self.branch.unavailable_services, ["robot_control"])
+        self.assertNotIn("robot_control", self.branch.readiness_latency)
+        self.assertEqual(self.communication_interface.errors, [])
+        self.assertEqual(self.branch.behaviour_running, "standby")
+
+    async def test_critical_services_that_are_not_ready_are_reported(self):
+        user_interface = self.add("user_interface")
+        database = self.add("database", ready_on_attempt=BehaviourBranch.ACTIVATION_ATTEMPTS + 1)
+
+        self.assertFalse(await self.branch.activate_behaviour())
+        self.assertEqual(database.commands, ["set_up"] * BehaviourBranch.ACTIVATION_ATTEMPTS)
+        self.assertNotIn("start", user_interface.commands)
+        self.assertEqual(len(self.communication_interface.errors), 1)
+        self.assertIn("database", self.communication_interface.errors[0])
+        self.assertEqual(self.branch.behaviour_running, "disabled")
+
+        # Activated again by the next update, the error is resolved once the service is ready
+        self.assertTrue(await self.branch.activate_behaviour())
+        self.assertEqual(len(self.communication_interface.errors), 1)
+        self.assertEqual(self.communication_interface.resolved, 1)
+        self.assertEqual(self.branch.behaviour_running, "standby")
+
+    async def test_error_is_reported_once_while_the_service_stays_down(self):
+        self.add("database", ready_on_attempt=None)
+        self.assertFalse(await self.branch.activate_behaviour())
+        self.assertFalse(await self.branch.activate_behaviour())
+        self.assertEqual(len(self.communication_interface.errors), 1)
+        self.assertEqual(self.communication_interface.resolved, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
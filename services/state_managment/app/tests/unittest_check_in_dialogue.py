@@ -0,0 +1,98 @@
+# unittest_check_in_dialogue.py
+
+import unittest
+import json
+import os
+import sys
+import tempfile
+
+# Add the deliberate layer directory to sys.path so the orchestrations can be imported the way the behaviour tree does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+deliberate_layer = os.path.abspath(os.path.join(current_dir, "../src/deliberate_layer"))
+sys.path.insert(0, deliberate_layer)
+
+from orchestrations.check_in_scenario import DIALOGUE_PATH
+from orchestrations.dialogue_graph import DialogueFile, DialogueGraphError, compile_dialogue, load_dialogue
+
+def single_script(nodes, start="first"):
+    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    return {
+        "days": {day: "script" for day in days},
+        "start_of_study": "script",
+        "scripts": {"script": {"start": start, "nodes": nodes}}
+    }
+
+class TestCheckInDialogue(unittest.TestCase):
+
+    def setUp(self):
+        self.dialogue = load_dialogue(DIALOGUE_PATH)
+
+    def test_every_day_has_a_script(self):
+        for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
+            script = self.dialogue.script_for(day)
+            self.assertIsNotNone(script.first_question())
+        self.assertEqual(self.dialogue.script_for("Monday", first_day=True).name, "start_of_study")
+
+    def test_scale_branches(self):
+        script = self.dialogue.script_for("Monday")
+        self.assertEqual(script.next_question("confidence", "3")["node"], "obstacles")
+        self.assertEqual(script.next_question("confidence", "6")["node"], "more_confident")
+        self.assertEqual(script.next_question("confidence", "9")["node"], "strategies")
+
+    def test_invalid_scale_response_asks_again(self):
+        script = self.dialogue.script_for("Monday")
+        for response in ["", "11", "not sure"]:
+            question = script.next_question("confidence", response)
+            self.assertEqual(question["node"], "confidence")
+            self.assertEqual(question["question"], "Please provide a valid number between 1 and 10")
+
+    def test_closed_ended_branches(self):
+        script = self.dialogue.script_for("Tuesday")
+        self.assertEqual(script.next_question("challenging_today", "No, it was easy")["node"], "keep_it_this_way")
+        self.assertEqual(script.next_question("challenging_today", "Yes it was")["node"], "make_it_easier")
+
+    def test_last_question_ends_the_script(self):
+        script = self.dialogue.script_for("Thursday")
+        self.assertIsNone(script.next_question("do_differently", "Go for a run"))
+
+    def test_lookup_by_question_text(self):
+        script = self.dialogue.script_for("Monday")
+        self.assertEqual(script.node_for_question("Please provide a valid number between 1 and 10"), "confidence")
+
+    def test_validation_reports_broken_scripts(self):
+        nodes = {
+            "first": {"question": "Did you exercise today?", "expected_format": "closed-ended", "next": [{"words": ["yes"], "next": "missing"}]},
+            "orphan": {"question": "Never asked", "expected_format": "open-ended"},
+            "loop": {"question": "Again?", "expected_format": "open-ended", "next": "loop"}
+        }
+        with self.assertRaises(DialogueGraphError) as context:
+            compile_dialogue(single_script(nodes))
+        problems = "\n".join(context.exception.problems)
+        self.assertIn("'missing' does not exist", problems)
+        self.assertIn("the last transition must be unconditional", problems)
+        self.assertIn("script.orphan: unreachable", problems)
+        self.assertIn("script.loop: dead end", problems)
+
+    def test_reload_keeps_previous_dialogue_when_the_file_is_invalid(self):
+        nodes = {"first": {"question": "Did you exercise today?", "expected_format": "closed-ended"}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dialogue.json")
+            with open(path, "w") as f:
+                json.dump(single_script(nodes), f)
+            dialogue = DialogueFile(path)
+
+            nodes["first"]["question"] = "Have you been active today?"
+            with open(path, "w") as f:
+                json.dump(single_script(nodes), f)
+            os.utime(path, ns=(0, 1))
+            self.assertTrue(dialogue.reload_if_changed())
+            self.assertEqual(dialogue.graph.script_for("Monday").first_question()["question"], "Have you been active today?")
+
+            with open(path, "w") as f:
+                f.write("{")
+            os.utime(path, ns=(0, 2))
+            self.assertFalse(dialogue.reload_if_changed())
+            self.assertEqual(dialogue.graph.script_for("Monday").first_question()["question"], "Have you been active today?")
+
+if __name__ == '__main__':
+    unittest.main()
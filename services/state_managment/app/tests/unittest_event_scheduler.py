@@ -0,0 +1,109 @@
+# unittest_event_scheduler.py
+
+import unittest
+import asyncio
+import os
+import sys
+import threading
+
+# Add the state management app directory to sys.path so src can be imported the way main.py does
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.insert(0, app_dir)
+
+from src.event_scheduler import LayerWakeup, NotifyingQueue
+
+
+class TestLayerWakeup(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.wakeup = LayerWakeup("test")
+
+    async def test_notification_wakes_up_every_waiting_coroutine(self):
+        waiters = [asyncio.create_task(self.wakeup.wait(timeout=1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.wakeup.notify()
+        self.assertEqual(await asyncio.gather(*waiters), [True, True, True])
+        self.assertEqual(self.wakeup.generation, 1)
+
+    async def test_notification_sent_during_an_update_is_not_lost(self):
+        generation = self.wakeup.generation
+        # Notified while the layer is busy, before it waits again
+        self.wakeup.notify()
+        self.assertTrue(await self.wakeup.wait(since=generation, timeout=0.01))
+        # Without a generation only notifications from now on count
+        self.assertFalse(await self.wakeup.wait(timeout=0.01))
+
+    async def test_notification_from_another_thread(self):
+        waiter = asyncio.create_task(self.wakeup.wait(timeout=1))
+        await asyncio.sleep(0)
+        thread = threading.Thread(target=self.wakeup.notify, args=("topic", "message"))
+        thread.start()
+        self.assertTrue(await waiter)
+        thread.join()
+        self.assertEqual(self.wakeup.generation, 1)
+
+    async def test_wait_times_out(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.assertFalse(await self.wakeup.wait(timeout=0.05))
+        self.assertGreaterEqual(loop.time() - started, 0.04)
+
+    async def test_wait_until_rechecks_the_predicate_on_every_notification(self):
+        events = []
+        checks = []
+
+        def predicate():
+            checks.append(len(events))
+            return len(events) == 2
+
+        waiter = asyncio.create_task(self.wakeup.wait_until(predicate, timeout=1))
+        for event in ("first", "second"):
+            await asyncio.sleep(0.01)
+            events.append(event)
+            self.wakeup.notify()
+        self.assertTrue(await waiter)
+        self.assertEqual(checks, [0, 1, 2])
+
+    async def test_wait_until_times_out(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        # Notifications that do not make the predicate true do not extend the timeout
+        notifier = loop.call_later(0.02, self.wakeup.notify)
+        self.assertFalse(await self.wakeup.wait_until(lambda: False, timeout=0.1))
+        self.assertLess(loop.time() - started, 0.5)
+        notifier.cancel()
+
+    async def test_notify_after_the_loop_closed_is_ignored(self):
+        loop = asyncio.new_event_loop()
+        wakeup = LayerWakeup("closed", loop=loop)
+        loop.close()
+        wakeup.notify()
+        self.assertEqual(wakeup.generation, 0)
+
+
+class TestNotifyingQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def test_put_wakes_up_every_consumer(self):
+        reactive_layer, behaviour_tree = LayerWakeup("reactive_layer"), LayerWakeup("behaviour_tree")
+        queue = NotifyingQueue(reactive_layer)
+        queue.add_wakeup(behaviour_tree)
+
+        generations = (reactive_layer.generation, behaviour_tree.generation)
+        queue.put("reminder")
+        self.assertTrue(await reactive_layer.wait(since=generations[0], timeout=0.01))
+        self.assertTrue(await behaviour_tree.wait(since=generations[1], timeout=0.01))
+        self.assertEqual(queue.get_nowait(), "reminder")
+
+    async def test_put_from_another_thread(self):
+        wakeup = LayerWakeup("behaviour_tree")
+        queue = NotifyingQueue(wakeup)
+        thread = threading.Thread(target=queue.put, args=("check_in",))
+        thread.start()
+        self.assertTrue(await wakeup.wait_until(lambda: not queue.empty(), timeout=1))
+        thread.join()
+        self.assertEqual(queue.get_nowait(), "check_in")
+
+
+if __name__ == '__main__':
+    unittest.main()
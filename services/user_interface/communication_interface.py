@@ -1,4 +1,3 @@
-import json
 import sys
 import os
 import time
@@ -11,6 +10,7 @@ sys.path.insert(0, project_root)
 print(f"project_root: {project_root}")
 
 from shared_libraries.mqtt_client_base import MQTTClientBase
+from shared_libraries.durable_outbox import DurableOutbox
 
 class CommunicationInterface(MQTTClientBase):
     def __init__(self, broker_address, port, event_dispatcher):
@@ -58,8 +58,10 @@ class CommunicationInterface(MQTTClientBase):
         self.robot_colour_topic = "robot_colour"
         self.update_persistent_data = "update_persistent_data"
         self.save_check_in_topic = "save_check_in"
+        self.save_check_in_batch_topic = "save_check_in_batch"
         self.service_error_topic = "service_error"
         self.reconnect_request_topic = "reconnect_robot_request"
+        self.robot_behaviour_topic = "robot_behaviour_command"
         self.wake_up_screen_topic = "wake_up_screen"
         self.update_persistent_data_topic = "update_persistent_data"
         self.service_control_cmd = "database_control_cmd"
@@ -68,22 +70,30 @@ class CommunicationInterface(MQTTClientBase):
         # Subscriber and publisher topics
         self.check_in_controls_topic = "check_in_controller"
 
+        # Check-ins are kept on disk until the database service confirms it saved them. Check-ins that are due
+        # together, e.g. after the database was down, are saved in one transaction on the batch topic
+        self.outbox = DurableOutbox(
+            self,
+            os.path.join(current_dir, "data", "outbox.db"),
+            batch_topics={self.save_check_in_topic: self.save_check_in_batch_topic},
+        )
+
         # Subscribe to topics
-        self.subscribe(self.service_status_requested_topic, self._respond_with_service_status)
-        self.subscribe(self.update_system_status_topic, self._update_system_status)
-        self.subscribe(self.check_in_controls_topic, self._process_check_in_commands)
-        self.subscribe(self.user_interface_control_cmd_topic, self._process_control_command)
-        self.subscribe(self.silence_detected_topic, self._process_silence_detected)
-        self.subscribe(self.conversation_history_topic, self._on_message)
-        self.subscribe(self.camera_active_topic, self._process_camera_active)
-        self.subscribe(self.audio_active_topic, self._process_audio_active)
-        self.subscribe(self.error_message_topic, self._process_error_message)
-        self.subscribe(self.update_state_topic, self._update_service_state)
-        self.subscribe(self.behaviour_status_update_topic, self._process_behaviour_status_update)
-        self.subscribe(self.robot_connection_status_topic, self._process_robot_connection_status)
-        self.subscribe(self.network_status_topic, self._process_network_connection_status)
-        self.subscribe(self.network_speed_topic, self._process_network_connection_speed)
-        self.subscribe(self.study_history_topic, self._process_study_history)
+        self.add_route(self.service_status_requested_topic, self._respond_with_service_status)
+        self.add_route(self.update_system_status_topic, self._update_system_status)
+        self.add_route(self.check_in_controls_topic, self._process_check_in_commands)
+        self.add_route(self.user_interface_control_cmd_topic, self._process_control_command)
+        self.add_route(self.silence_detected_topic, self._process_silence_detected)
+        self.add_route(self.conversation_history_topic, self._on_message)
+        self.add_route(self.camera_active_topic, self._process_camera_active)
+        self.add_route(self.audio_active_topic, self._process_audio_active)
+        self.add_route(self.error_message_topic, self._process_error_message)
+        self.add_route(self.update_state_topic, self._update_service_state)
+        self.add_route(self.behaviour_status_update_topic, self._process_behaviour_status_update)
+        self.add_route(self.robot_connection_status_topic, self._process_robot_connection_status)
+        self.add_route(self.network_status_topic, self._process_network_connection_status)
+        self.add_route(self.network_speed_topic, self._process_network_connection_speed)
+        self.add_route(self.study_history_topic, self._process_study_history)
 
         self._register_event_handlers()
 
@@ -91,12 +101,16 @@ class CommunicationInterface(MQTTClientBase):
         self.dispatcher.register_event("send_service_error", self.publish_service_error)
         self.dispatcher.register_event("all_states_updated", self.all_states_updated)
 
-    def _respond_with_service_status(self, client, userdata, message):
+    def _respond_with_service_status(self, payload, message):
         self.logger.info(f"service_status_requested_topic received, current status: {self.service_status}")
-        self.publish_UI_status(self.service_status)
-
-    def _update_system_status(self, client, userdata, message):
-        serviceStatus = json.loads(message.payload.decode("utf-8"))
+        correlation_id = payload.get("correlation_id") if isinstance(payload, dict) else None
+        self.publish_UI_status(self.service_status, correlation_id=correlation_id)
+
+    def _update_system_status(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error(f"Invalid system status: {payload}")
+            return
+        serviceStatus = payload
         self.logger.info(f"User interface service status dictionary: {serviceStatus}")
 
         # Rename the keys to make it more user-friendly
@@ -122,119 +136,115 @@ class CommunicationInterface(MQTTClientBase):
             self.logger.info("Sending loading_complete event")
             self.socketio.emit('loading_complete')
 
-    def _process_check_in_commands(self, client, userdata, message):
-        if message.payload.decode() == '1':
+    def _process_check_in_commands(self, payload, message):
+        if str(payload) == '1':
             self.logger.info("Starting check-in")
             self.check_in_status = True
-        elif message.payload.decode() == '0':
+        elif str(payload) == '0':
             self.logger.info("Ending check-in")
             self.socketio.emit('check_in_complete')
             self.check_in_status = False
 
-    def _process_control_command(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            message = payload.get("cmd", "")
-            self.logger.info(f"User Interface received the command = {message}")
-            self.start_command = message
-            if message == "set_up":
-                # Check to see if the screen is turned on
-                logging.info("UI publishing ready")
-                self.publish_UI_status("ready")
-            elif message == "start":
-                logging.info("UI publishing that it is running")
-                self.publish_UI_status("running")
-            elif message == "end":
-                # put the screen in stand-by or go to home page
-                self.publish_UI_status("completed")
-        except json.JSONDecodeError:
+    def _process_control_command(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload. Using default retry parameters.")
-
-    def _process_silence_detected(self, client, userdata, message):
+            return
+        message = payload.get("cmd", "")
+        correlation_id = payload.get("correlation_id")
+        self.logger.info(f"User Interface received the command = {message}")
+        self.start_command = message
+        if message == "set_up":
+            # Check to see if the screen is turned on
+            logging.info("UI publishing ready")
+            self.publish_UI_status("ready", correlation_id=correlation_id)
+        elif message == "start":
+            logging.info("UI publishing that it is running")
+            self.publish_UI_status("running", correlation_id=correlation_id)
+        elif message == "end":
+            # put the screen in stand-by or go to home page
+            self.publish_UI_status("completed", correlation_id=correlation_id)
+
+    def _process_silence_detected(self, payload, message):
         duration = message.payload.decode()
         self.logger.info(f"Silence detected: {duration}")
         self.socketio.emit('silence_detected', {'duration': duration})
 
-    def _on_message(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"Message received on '{self.conversation_history_topic}, payload: {payload}")
-            if self.message_callback:
-                self.message_callback(payload)
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Error decoding JSON payload: {e}")
-
-    def _process_camera_active(self, client, userdata, message):
-        camera_active = message.payload.decode() == '1'
+    def _on_message(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error(f"Error decoding JSON payload: {payload}")
+            return
+        self.logger.info(f"Message received on '{self.conversation_history_topic}, payload: {payload}")
+        if self.message_callback:
+            self.message_callback(payload)
+
+    def _process_camera_active(self, payload, message):
+        camera_active = str(payload) == '1'
         self.logger.info(f"Camera active: {camera_active}")
         if self.socketio:
             self.logger.info("Emitting cam_status event to clients")
             self.dispatcher.dispatch_event("update_connectoin_status", {'key': 'cam', 'status': camera_active})
 
-    def _process_audio_active(self, client, userdata, message):
-        audio_active = json.loads(message.payload.decode("utf-8")) == '1'
+    def _process_audio_active(self, payload, message):
+        audio_active = str(payload) == '1'
         self.logger.info(f"Microphone active: {audio_active}")
         self.inputs['audioActive'] = audio_active
         if self.socketio:
             self.logger.info("Emitting mic_status event to clients")
             self.dispatcher.dispatch_event("update_connectoin_status", {'key': 'mic', 'status': audio_active})
 
-    def _process_error_message(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"################################### RECIVED ERROR MESSAGE: {payload}")
-            self.logger.info(f"Error message received on '{self.error_message_topic}, payload: {payload}")
-            self.socketio.emit('error_message', payload)
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Error decoding JSON payload: {e}")
-
-    def _update_service_state(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            state_name = payload.get("state_name", "")
-            state = payload.get("state_value", "")
-            self.logger.info(f"User interface received state update for {state_name}: {state}")
-            self.dispatcher.dispatch_event("update_service_state", payload)
-        except json.JSONDecodeError:
+    def _process_error_message(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error(f"Error decoding JSON payload: {payload}")
+            return
+        self.logger.info(f"################################### RECIVED ERROR MESSAGE: {payload}")
+        self.logger.info(f"Error message received on '{self.error_message_topic}, payload: {payload}")
+        self.socketio.emit('error_message', payload)
+
+    def _update_service_state(self, payload, message):
+        if not isinstance(payload, dict):
             self.logger.error("Invalid JSON payload for updating service state. Using default retry parameters.")
+            return
+        state_name = payload.get("state_name", "")
+        state = payload.get("state_value", "")
+        self.logger.info(f"User interface received state update for {state_name}: {state}")
+        self.dispatcher.dispatch_event("update_service_state", payload)
 
     def all_states_updated(self):
         self.service_status = "set_up"        
     
-    def _process_behaviour_status_update(self, client, userdata, message):
-        # try:
-        # payload = json.loads(message.payload.decode("utf-8"))
+    def _process_behaviour_status_update(self, payload, message):
+        # The status is plain text
         message = message.payload.decode("utf-8")
         self.logger.info(f"Behaviour status update received: {message}")
         self.socketio.emit("loading_status", {'message': message})
-        # except json.JSONDecodeError as e:
-        #     self.logger.error(f"Error decoding JSON payload: {e}")
     
-    def _process_robot_connection_status(self, client, userdata, message):
-        status = json.loads(message.payload.decode("utf-8")).get("status", "") == "connected"
+    def _process_robot_connection_status(self, payload, message):
+        status = isinstance(payload, dict) and payload.get("status", "") == "connected"
         self.logger.info(f"Robot connection status in UI: {status}")
         self.dispatcher.dispatch_event("update_connectoin_status", {'key': 'robot', 'status': status})
 
-    def _process_network_connection_status(self, client, userdata, message):
-        status = json.loads(message.payload.decode("utf-8")).get("status", "") == "connected"
+    def _process_network_connection_status(self, payload, message):
+        status = isinstance(payload, dict) and payload.get("status", "") == "connected"
         self.logger.info(f"Network connection status in UI: {status}")
         self.dispatcher.dispatch_event("update_connectoin_status", {'key': 'wifi', 'status': status})
 
-    def _process_network_connection_speed(self, client, userdata, message):
-        download_speed = json.loads(message.payload.decode("utf-8")).get("download", 0)
-        upload_speed = json.loads(message.payload.decode("utf-8")).get("upload", 0)
+    def _process_network_connection_speed(self, payload, message):
+        if not isinstance(payload, dict):
+            self.logger.error(f"Invalid network speed: {payload}")
+            return
+        download_speed = payload.get("download", 0)
+        upload_speed = payload.get("upload", 0)
         self.logger.info(f"Network connection speed in UI: Download = {download_speed}Mbps, Upload = {upload_speed}Mbps")
         self.dispatcher.dispatch_event("update_connectoin_status", {'key': 'wifi_download_speed', 'status': download_speed})
         self.dispatcher.dispatch_event("update_connectoin_status", {'key': 'wifi_upload_speed', 'status': upload_speed})
 
-    def _process_study_history(self, client, userdata, message):
-        try:
-            payload = json.loads(message.payload.decode("utf-8"))
-            self.logger.info(f"Study history received: {payload}")
-            time.sleep(1)
-            self.socketio.emit('study_history', payload)
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Error decoding JSON payload: {e}")
+    def _process_study_history(self, payload, message):
+        # The history arrives in chunks which are forwarded to the history page as they come in
+        if not isinstance(payload, dict):
+            self.logger.error(f"Invalid study history chunk: {payload}")
+            return
+        self.logger.info(f"Study history chunk {payload.get('chunk')} received with {len(payload.get('items', []))} days")
+        self.socketio.emit('study_history', payload)
 
     def publish_service_error(self, error_message):
         self.publish(self.service_error_topic, error_message)
@@ -245,7 +255,7 @@ class CommunicationInterface(MQTTClientBase):
             "service_name": "user_interface",
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.reconnect_request_topic, json.dumps(payload))
+        self.publish(self.reconnect_request_topic, payload)
 
     def start_check_in(self):
         if self.check_in_status != True:
@@ -263,18 +273,18 @@ class CommunicationInterface(MQTTClientBase):
     def change_colour(self, selected_colour):
         self.logger.info(f"Sending colour change command: {selected_colour}")
         # self.publish(self.robot_colour_topic, selected_colour)
-        self.publish(self.update_persistent_data_topic, json.dumps({"service_name": "user_interface", "state_name": "robot_colour", "state_value": selected_colour}))
+        self.publish(self.update_persistent_data_topic, {"service_name": "user_interface", "state_name": "robot_colour", "state_value": selected_colour})
     
     def change_volume(self, volume):
         self.logger.info(f"Sending volume change command: {volume}")
         self.publish(self.robot_volume_topic, volume)
-        self.publish(self.update_persistent_data_topic, json.dumps({"service_name": "user_interface", "state_name": "robot_volume", "state_value": volume}))
+        self.publish(self.update_persistent_data_topic, {"service_name": "user_interface", "state_name": "robot_volume", "state_value": volume})
 
     def change_brightness(self, brightness):
         self.logger.info(f"brightness value is being updated to: {brightness}")
-        self.publish(self.update_persistent_data_topic, json.dumps({"service_name": "user_interface", "state_name": "brightness", "state_value": brightness}))
+        self.publish(self.update_persistent_data_topic, {"service_name": "user_interface", "state_name": "brightness", "state_value": brightness})
 
-    def publish_UI_status(self, status, message="", details=None):
+    def publish_UI_status(self, status, message="", details=None, correlation_id=None):
         self.logger.info(f"Publishing UI status: {status}")
         payload = {
             "service_name": "user_interface",
@@ -283,24 +293,37 @@ class CommunicationInterface(MQTTClientBase):
             "details": details,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
-        self.publish(self.user_interface_status_topic, json.dumps(payload))
+        if correlation_id:
+            payload["correlation_id"] = correlation_id
+        self.publish(self.user_interface_status_topic, payload)
 
         self.service_status = status
 
-    def request_study_history(self):
-        self.logger.info("Requesting study history")
+    def request_study_history(self, query=None):
+        self.logger.info(f"Requesting study history: {query}")
         payload = {
             "cmd": "request_history"
         }
-        self.publish(self.service_control_cmd, json.dumps(payload))
+        if query:
+            payload["query"] = query
+        self.publish(self.service_control_cmd, payload)
 
     def wake_up_screen(self):
         # self.logger.info("Waking up screen")
-        self.publish(self.wake_up_screen_topic, json.dumps({"cmd": "wake_up"}))
+        self.publish(self.wake_up_screen_topic, {"cmd": "wake_up"})
 
     def save_check_in(self, check_in_data):
-        self.publish(self.save_check_in_topic, json.dumps(check_in_data))
+        self.outbox.send(self.save_check_in_topic, check_in_data)
         self.logger.info(f"Check-in data sent to the database service, Payload: {check_in_data}")
+        # The check-in is over, so the robot can return to its charger. This is published once here rather than
+        # triggered by save_check_in, which the outbox delivers again until the database acknowledges it
+        self.publish(self.robot_behaviour_topic, {
+            "sender": "user_interface",
+            "message_type": "request",
+            "cmd": "return_home",
+            "additional_details": "",
+            "time": time.strftime("%Y-%m-%d %H:%M:%S")
+        })
 
     def set_reminder_time(self, hours = 0, minutes = 0, ampm = "AM"):
         self.logger.info(f"Setting reminder time to {hours}:{minutes} {ampm}")
@@ -317,7 +340,12 @@ class CommunicationInterface(MQTTClientBase):
                 "state_value": state[1]
             }
             self.logger.info(f"Sending reminder time update: {payload}")
-            self.publish(self.update_persistent_data, json.dumps(payload))
+            self.publish(self.update_persistent_data, payload)
 
     def get_system_status(self):
         return self.system_status
+
+    def disconnect(self):
+        # Check-ins not acknowledged yet are replayed on the next start
+        self.outbox.close(timeout=2)
+        super().disconnect()
@@ -18,7 +18,7 @@ project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
 sys.path.insert(0, project_root)
 
 from shared_libraries.logging_config import setup_logger
-from shared_libraries.event_dispatcher import EventDispatcher
+from shared_libraries.event_dispatcher import EventDispatcher, state_name_key
 
 # Setup logger
 setup_logger()
@@ -49,7 +49,10 @@ connection_status = {
     'wifi_upload_speed': 0,
 }
 
-dispatcher = EventDispatcher()
+dispatcher = EventDispatcher(asynchronous=True)
+# Brightness updates echo back from the database once per slider step and each one spawns a subprocess,
+# so only apply the latest value of each state received within the window
+dispatcher.configure_event("update_service_state", policy="coalesce", coalesce_key=state_name_key, coalesce_window=0.2)
 
 communication_interface = CommunicationInterface(
     broker_address=os.getenv("MQTT_BROKER_ADDRESS"),
@@ -237,6 +240,7 @@ def save_check_in():
         check_in_duration = (check_in_end_time - check_in_start_time).total_seconds()
         print(f"Check-in duration: {check_in_duration}")
         check_in_data = {
+            "date": check_in_start_time.date().isoformat(),
             "check_in_time": check_in_start_time.strftime("%H:%M:%S"),
             "check_in_duration_seconds": check_in_duration,
             "responses": chat_data}
@@ -253,11 +257,15 @@ def save_check_in():
 @app.route('/history')
 def history():
     # Step 1: Load history page and show loading spinner
-    # Step 2: Fetch history data from database
-    # Step 3: Display history data on page and hide loading spinner
-    communication_interface.request_study_history()
+    # Step 2: The page requests the history over socket.io once it is connected
+    # Step 3: Display each chunk of history data as it arrives and hide loading spinner
     return render_template('history.html')
 
+@socketio.on('request_history')
+def handle_request_history(query):
+    # The query may hold a date range, the cursor of the page to continue from and the projections to include
+    communication_interface.request_study_history(query)
+
 @app.route('/settings')
 def settings():
     communication_interface.configuration_controller("start")
@@ -0,0 +1,108 @@
+'''
+Compares the payload codecs on the messages published by the behaviour tree communication interface.
+
+For every message shape and codec this reports the bytes on the wire and the encode/decode cost per message.
+Codecs whose library is not installed are skipped.
+
+Run from the project root:
+    python shared_libraries/benchmarks/bench_codecs.py [--iterations 20000]
+'''
+import argparse
+import json
+import os
+import sys
+import timeit
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries.payload_codecs import CODECS, CodecRegistry, SchemaRegistry
+from shared_libraries.timestamps import timestamp
+
+# The payloads as they are built in bt_communication_interface.py and the service status publishers
+MESSAGES = {
+    "service_control_command": {
+        "service_name": "speech_recognition",
+        "cmd": "start",
+        "time": timestamp()
+    },
+    "robot_speech": {
+        "sender": "orchestrator",
+        "message_type": "request",
+        "content": "Good morning! How motivated do you feel to complete your habit today, on a scale from 1 to 5?"
+    },
+    "robot_behaviour_command": {
+        "sender": "orchestrator",
+        "message_type": "request",
+        "cmd": "sentiment",
+        "additional_details": "1",
+        "time": timestamp()
+    },
+    "service_status": {
+        "service_name": "database",
+        "status": "running",
+        "message": "",
+        "details": None,
+        "timestamp": timestamp()
+    },
+    "system_status": {
+        "speech_recognition": "running",
+        "robot_control": "running",
+        "user_interface": "running",
+        "reminder": "running",
+        "database": "running",
+        "peripherals": "running"
+    },
+    "reminder_sent": {
+        "reminder_message": "Don't forget to go for your walk after lunch"
+    },
+}
+
+
+def baseline_encode(value):
+    """What the services did before the codec layer."""
+    return json.dumps(value).encode("utf-8")
+
+
+def baseline_decode(data):
+    return json.loads(data.decode("utf-8"))
+
+
+def codec_variants():
+    """Yields (label, encode, decode) for the baseline and every installed codec, with and without schemas."""
+    yield "json.dumps (baseline)", baseline_encode, baseline_decode
+    empty_schemas = SchemaRegistry()
+    for name, codec in CODECS.items():
+        if not codec.available:
+            print(f"Skipping {name}: library not installed")
+            continue
+        registry = CodecRegistry(default=name, schemas=empty_schemas)
+        yield name, (lambda value, r=registry: r.encode("bench", value)), registry.decode
+        if name != "json":
+            registry = CodecRegistry(default=name)
+            yield f"{name} + schema", (lambda value, r=registry: r.encode("bench", value)), registry.decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    variants = list(codec_variants())
+    print(f"{'message':<26}{'codec':<24}{'bytes':>7}{'encode us':>12}{'decode us':>12}")
+    for message_name, message in MESSAGES.items():
+        for label, encode, decode in variants:
+            data = encode(message)
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            assert decode(data) == message, f"{label} did not round trip {message_name}"
+            encode_us = timeit.timeit(lambda: encode(message), number=args.iterations) / args.iterations * 1e6
+            decode_us = timeit.timeit(lambda: decode(data), number=args.iterations) / args.iterations * 1e6
+            print(f"{message_name:<26}{label:<24}{len(data):>7}{encode_us:>12.2f}{decode_us:>12.2f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+'''
+Durable outbox for messages that must not be lost when the service receiving them is down or restarting, e.g.
+the check-ins and reminders saved by the database service.
+
+send() queues a message in memory and returns at once. A worker thread writes everything queued since its last
+write to a local SQLite file in a single transaction, so a burst of messages costs one fsync rather than one
+each (group commit). Once written, messages are published with MQTTClientBase.call() and kept until the receiver
+replies. Unanswered messages are published again after retry_interval, and messages still in the file when the
+service stopped are published again when it starts.
+
+The number of attempts is saved with each message, so it survives a restart. A message that has not been
+acknowledged after max_attempts is moved to the dead_letter table of the same file and no longer published.
+
+Messages of a topic given in batch_topics that are due at the same time, e.g. those replayed after the receiver
+was down, are published together as one {"messages": [...]} request on its batch topic. The receiver saves them
+in one transaction and a single reply acknowledges all of them.
+
+A message can therefore arrive more than once. Every message carries an "idempotency_key" that stays the same
+across retries, and the receiver must ignore keys it has already handled before replying, see
+StudyDatabaseManager.save_check_ins.
+'''
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from shared_libraries import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_SCHEMA = """CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    topic TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)"""
+
+DEAD_LETTER_SCHEMA = """CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    topic TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    failed REAL NOT NULL
+)"""
+
+
+class _OutboxMessage:
+    __slots__ = ("key", "topic", "payload", "attempts", "next_attempt", "in_flight")
+
+    def __init__(self, key, topic, payload, attempts=0):
+        self.key = key
+        self.topic = topic
+        self.payload = payload
+        self.attempts = attempts
+        self.next_attempt = 0.0
+        self.in_flight = False
+
+
+class DurableOutbox:
+    def __init__(self, client, path, ack_timeout=5.0, retry_interval=10.0, commit_interval=0.05, max_batch=500, max_in_flight=20, max_attempts=50, batch_topics=None):
+        """
+        Args:
+            client (MQTTClientBase): Publishes the messages and receives the replies
+            path (str): SQLite file the messages are kept in until they are acknowledged
+            ack_timeout (float): Seconds to wait for the reply to a message
+            retry_interval (float): Seconds before an unacknowledged message is published again
+            commit_interval (float): Seconds the worker waits for more messages before writing a batch
+            max_batch (int): Messages written in one transaction at most
+            max_in_flight (int): Messages waiting for a reply at most, so a replay does not flood the receiver
+            max_attempts (int): Times a message is published before it is moved to the dead_letter table
+            batch_topics (dict): Topic -> topic that several due messages of that topic are published on together
+        """
+        self.client = client
+        self.path = path
+        self.ack_timeout = ack_timeout
+        self.retry_interval = retry_interval
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.batch_topics = batch_topics or {}
+        self.metrics = metrics.get_registry()
+
+        self._condition = threading.Condition()
+        self._queued = []         # Sent but not written yet
+        self._acknowledged = []   # Keys to delete from the file
+        self._failed = []         # (attempts, key) of failed attempts to save in the file
+        self._dead = []           # Keys to move to the dead_letter table
+        self._messages = {}       # key -> _OutboxMessage written and waiting to be acknowledged
+        self._closed = False
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # Every commit is fsynced, batching is what keeps this cheap
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._connection.execute(OUTBOX_SCHEMA)
+        self._connection.execute(DEAD_LETTER_SCHEMA)
+        # Files written before attempts were saved
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(outbox)")]
+        if "attempts" not in columns:
+            self._connection.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+        # Replay what was left by the previous run
+        for key, topic, payload, attempts in self._connection.execute("SELECT idempotency_key, topic, payload, attempts FROM outbox ORDER BY id"):
+            self._messages[key] = _OutboxMessage(key, topic, json.loads(payload), attempts)
+        if self._messages:
+            logger.info(f"Replaying {len(self._messages)} message(s) from the outbox {path}")
+
+        self._worker = threading.Thread(target=self._run, name="DurableOutbox", daemon=True)
+        self._worker.start()
+
+    def send(self, topic, payload):
+        """
+        Queues a dict payload for delivery and returns its idempotency key. A payload that already has an
+        "idempotency_key" keeps it.
+        """
+        payload = dict(payload)
+        key = payload.setdefault("idempotency_key", uuid.uuid4().hex)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The outbox is closed")
+            self._queued.append(_OutboxMessage(key, topic, payload))
+            self._condition.notify_all()
+        self.metrics.increment("outbox.sent", topic)
+        return key
+
+    def pending(self):
+        """Returns the number of messages that have not been acknowledged yet."""
+        with self._condition:
+            return len(self._queued) + len(self._messages)
+
+    def flush(self, timeout=None):
+        """Blocks until every message sent so far has been written to the file. Returns False if the timeout expired."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._queued:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Writes the queued messages and stops the worker. Unacknowledged messages are replayed on the next start."""
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._has_work():
+                    self._condition.wait(self._seconds_until_retry())
+                # Give a burst the chance to finish so it is written in one transaction
+                deadline = time.monotonic() + self.commit_interval
+                while self._queued and len(self._queued) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                queued = self._queued[:self.max_batch]
+                acknowledged, failed, dead = self._acknowledged, self._failed, self._dead
+                self._acknowledged, self._failed, self._dead = [], [], []
+                closed = self._closed
+
+            try:
+                self._write(queued, acknowledged, failed, dead)
+            except sqlite3.Error as e:
+                # Keep the messages queued and try again
+                logger.error(f"Error writing to the outbox {self.path}: {e}")
+                self.metrics.increment("outbox.write_errors", "outbox")
+                with self._condition:
+                    self._acknowledged = acknowledged + self._acknowledged
+                    self._failed = failed + self._failed
+                    self._dead = dead + self._dead
+                time.sleep(self.retry_interval)
+                continue
+
+            with self._condition:
+                del self._queued[:len(queued)]
+                for message in queued:
+                    self._messages[message.key] = message
+                self._condition.notify_all()
+                if closed and not self._queued:
+                    break
+                due = self._due_messages()
+
+            for batch in self._batches(due):
+                self._publish(batch)
+
+        self._connection.close()
+
+    def _has_work(self):
+        return bool(self._queued or self._acknowledged or self._failed or self._dead or self._due_messages(peek=True))
+
+    def _due_messages(self, peek=False):
+        now = time.monotonic()
+        in_flight = sum(message.in_flight for message in self._messages.values())
+        due = []
+        for message in self._messages.values():
+            if in_flight + len(due) >= self.max_in_flight:
+                break
+            if not message.in_flight and message.next_attempt <= now:
+                due.append(message)
+                if peek:
+                    break
+        if not peek:
+            for message in due:
+                message.in_flight = True
+                message.attempts += 1
+        return due
+
+    def _batches(self, due):
+        """Groups the due messages of each batch topic, every other message is published on its own."""
+        batches = {}
+        for message in due:
+            group = message.topic if message.topic in self.batch_topics else message.key
+            batches.setdefault(group, []).append(message)
+        return list(batches.values())
+
+    def _seconds_until_retry(self):
+        # A reply wakes the worker up when the most messages are in flight
+        waiting = [message.next_attempt for message in self._messages.values() if not message.in_flight]
+        if not waiting or len(self._messages) - len(waiting) >= self.max_in_flight:
+            return None
+        return max(0.0, min(waiting) - time.monotonic())
+
+    def _write(self, queued, acknowledged, failed=(), dead=()):
+        if not queued and not acknowledged and not failed and not dead:
+            return
+        with self.metrics.time("outbox.commit_ms", "outbox"):
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO outbox (idempotency_key, topic, payload, created) VALUES (?, ?, ?, ?)",
+                    [(message.key, message.topic, json.dumps(message.payload), time.time()) for message in queued],
+                )
+                self._connection.executemany("DELETE FROM outbox WHERE idempotency_key = ?", [(key,) for key in acknowledged])
+                self._connection.executemany("UPDATE outbox SET attempts = ? WHERE idempotency_key = ?", failed)
+                now = time.time()
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO dead_letter (idempotency_key, topic, payload, created, attempts, failed) "
+                    "SELECT idempotency_key, topic, payload, created, attempts, ? FROM outbox WHERE idempotency_key = ?",
+                    [(now, key) for key in dead],
+                )
+                self._connection.executemany("DELETE FROM outbox WHERE idempotency_key = ?", [(key,) for key in dead])
+                self._connection.execute("COMMIT")
+            except sqlite3.Error:
+                self._connection.execute("ROLLBACK")
+                raise
+        self.metrics.observe("outbox.batch_size", "outbox", len(queued))
+
+    def _publish(self, messages):
+        topic, payload = messages[0].topic, messages[0].payload
+        for message in messages:
+            if message.attempts > 1:
+                self.metrics.increment("outbox.retries", message.topic)
+        if len(messages) > 1:
+            topic, payload = self.batch_topics[topic], {"messages": [message.payload for message in messages]}
+        try:
+            future = self.client.call(topic, payload, timeout=self.ack_timeout)
+        except Exception as e:
+            logger.error(f"Error publishing outbox message to {topic}: {e}")
+            for message in messages:
+                self._retry_later(message)
+            return
+        future.add_done_callback(lambda done: self._on_reply(messages, done))
+
+    def _on_reply(self, messages, future):
+        if future.exception() is not None:
+            for message in messages:
+                self._retry_later(message)
+            return
+        with self._condition:
+            for message in messages:
+                message.in_flight = False
+                if self._messages.pop(message.key, None) is not None:
+                    self._acknowledged.append(message.key)
+            self._condition.notify_all()
+        self.metrics.increment("outbox.acknowledged", messages[0].topic, len(messages))
+
+    def _retry_later(self, message):
+        with self._condition:
+            message.in_flight = False
+            if self._messages.get(message.key) is not message:
+                return
+            self._failed.append((message.attempts, message.key))
+            dead = message.attempts >= self.max_attempts
+            if dead:
+                # Give up, the message is kept in the dead_letter table for inspection
+                del self._messages[message.key]
+                self._dead.append(message.key)
+            else:
+                message.next_attempt = time.monotonic() + self.retry_interval
+            self._condition.notify_all()
+        if dead:
+            logger.warning(f"Outbox message {message.key} to {message.topic} was not acknowledged after {message.attempts} attempts, moved to the dead letters")
+            self.metrics.increment("outbox.dead_lettered", message.topic)
@@ -1,11 +1,171 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from shared_libraries.metrics import get_registry
+
+# Backpressure policies for asynchronous events
+DROP_OLDEST = "drop_oldest"  # Discard the oldest pending payload when the queue is full
+BLOCK = "block"              # Block the caller (e.g. the MQTT network loop) until there is space in the queue
+COALESCE = "coalesce"        # Keep only the most recent pending payload for each coalesce key
+POLICIES = (DROP_OLDEST, BLOCK, COALESCE)
+
+
+def state_name_key(payload):
+    """Coalesce key for state update payloads, e.g. {"state_name": "brightness", "state_value": 20}."""
+    if isinstance(payload, dict):
+        return payload.get("state_name")
+    return None
+
+
+def service_state_key(payload):
+    """Coalesce key for state update payloads that are addressed to a specific service."""
+    if isinstance(payload, dict) and "state_name" in payload:
+        return (payload.get("service_name"), payload["state_name"])
+    return None
+
+
+class _EventChannel:
+    '''
+    A bounded queue of pending payloads for one event, or for several events sharing the channel, and the worker
+    threads that drain it. Pending payloads are stored in insertion order against a key. Payloads only share a key
+    when the event is coalescing, in which case a newer payload replaces the pending one in place. Only payloads
+    that can be coalesced are held back for the coalesce window, the others are due as soon as they are queued.
+    '''
+    def __init__(self, name, dispatcher, workers, max_queue_size, policy, coalesce_key=None, coalesce_window=0.0):
+        self.name = name
+        self.dispatcher = dispatcher
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.coalesce_key = coalesce_key
+        self.coalesce_window = coalesce_window
+        self.dropped = 0
+
+        self._pending = OrderedDict()  # key -> [event name, payload, time the payload is due to be handled]
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"{name}-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _key_for(self, event_name, payload):
+        """Returns the key a payload is queued under and whether it can be coalesced with other payloads."""
+        if self.policy != COALESCE:
+            return next(self._sequence), False
+        if self.coalesce_key is None:
+            return event_name, True  # All payloads of the event share a single slot
+        try:
+            key = self.coalesce_key(payload)
+        except Exception as e:
+            print(f"Error computing coalesce key for event {event_name}: {e}")
+            key = None
+        # Payloads without a key are delivered individually
+        return (next(self._sequence), False) if key is None else (("key", event_name, key), True)
+
+    def put(self, event_name, payload):
+        """Queues a payload, applying the channel's backpressure policy when the queue is full."""
+        with self._condition:
+            if self._closed:
+                return
+            key, coalesced = self._key_for(event_name, payload)
+            if key in self._pending:
+                # Coalesce: keep the original position and due time but deliver the latest payload
+                self._pending[key][1] = payload
+                self._record_drop()
+                return
+            if len(self._pending) >= self.max_queue_size:
+                if self.policy == BLOCK:
+                    while len(self._pending) >= self.max_queue_size and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                else:
+                    self._pending.popitem(last=False)
+                    self._record_drop()
+            self._pending[key] = [event_name, payload, time.monotonic() + (self.coalesce_window if coalesced else 0.0)]
+            get_registry().set_gauge("event.queue_depth", self.name, len(self._pending))
+            self._condition.notify_all()
+
+    def _record_drop(self):
+        self.dropped += 1
+        get_registry().increment("event.dropped", self.name)
+
+    def depth(self):
+        with self._condition:
+            return len(self._pending)
+
+    def wait_until_idle(self, timeout=None):
+        """Blocks until every queued payload has been handled. Returns False if the timeout expired."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and self._in_flight == 0, timeout)
+
+    def close(self, timeout=None):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _next_payload(self):
+        """
+        Waits for the oldest pending payload that is due, so a payload held back for the coalesce window does not
+        hold up the payloads queued after it. Returns None once the channel is closed and drained.
+        """
+        with self._condition:
+            while True:
+                if self._pending:
+                    now = time.monotonic()
+                    key = next((key for key, (_, _, due) in self._pending.items() if due <= now or self._closed), None)
+                    if key is not None:
+                        event_name, payload, _ = self._pending.pop(key)
+                        get_registry().set_gauge("event.queue_depth", self.name, len(self._pending))
+                        self._in_flight += 1
+                        self._condition.notify_all()  # Wake callers blocked on a full queue
+                        return event_name, payload
+                    self._condition.wait(min(due for _, _, due in self._pending.values()) - now)
+                elif self._closed:
+                    return None
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            item = self._next_payload()
+            if item is None:
+                return
+            try:
+                self.dispatcher._call_handlers(*item)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+
 class EventDispatcher:
     '''
     EventDispatcher class is responsible for registering and dispatching events.
     The event dispatcher uses a dictionary to store event handlers, where the key is the event name and the value is a list of handlers (functions).
     Dispatching an event maps the event name to the list of handlers and calls each handler with the payload as an argument.
+
+    By default handlers run inline on the thread that dispatched the event (usually the MQTT network loop).
+    When created with asynchronous=True, events configured with configure_event() are instead placed on a
+    bounded per-event queue and handled by that event's own worker threads, so a slow handler only delays
+    its own event. Events that have not been configured are still dispatched inline. Events configured with the
+    same channel share one queue and its workers instead, so with a single worker they are handled in the order
+    they were dispatched, e.g. writes to the same database.
     '''
-    def __init__(self):
+    def __init__(self, asynchronous=False):
         self.event_handlers = {}
+        self.asynchronous = asynchronous
+        self.event_configurations = {}
+        self._channels = {}
+        self._lock = threading.Lock()
 
     def register_event(self, event_name, handler):
         """Registers a handler for a specific event."""
@@ -13,12 +173,110 @@ class EventDispatcher:
             self.event_handlers[event_name] = []
         self.event_handlers[event_name].append(handler)
 
+    def configure_event(self, event_name, workers=1, max_queue_size=100, policy=DROP_OLDEST, coalesce_key=None, coalesce_window=0.0, channel=None):
+        """
+        Configures an event to be handled asynchronously.
+
+        Args:
+            event_name (str): The event to configure
+            workers (int): Number of worker threads handling the event. Handlers are only guaranteed to see
+                payloads in order when there is a single worker.
+            max_queue_size (int): Maximum number of payloads waiting to be handled
+            policy (str): What to do when the queue is full, one of "drop_oldest", "block" or "coalesce"
+            coalesce_key (callable): Only used by the "coalesce" policy. Maps a payload to the key it is
+                coalesced on, e.g. state_name_key. Payloads mapped to None are never coalesced. When no key
+                function is given the event keeps a single pending payload.
+            coalesce_window (float): Only used by the "coalesce" policy. Seconds a payload is held back so
+                that newer payloads with the same key can replace it before the handlers run. Payloads the
+                coalesce_key maps to None are not held back.
+            channel (str): Name of a queue shared with the other events configured with it, the event's own queue
+                by default. Every event of a channel must be configured with the same settings.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {POLICIES}")
+        if workers < 1 or max_queue_size < 1:
+            raise ValueError("workers and max_queue_size must be at least 1")
+        if policy != COALESCE and (coalesce_key is not None or coalesce_window):
+            raise ValueError("coalesce_key and coalesce_window can only be used with the coalesce policy")
+        if coalesce_window < 0:
+            raise ValueError("coalesce_window must not be negative")
+        configuration = {
+            "workers": workers,
+            "max_queue_size": max_queue_size,
+            "policy": policy,
+            "coalesce_key": coalesce_key,
+            "coalesce_window": coalesce_window,
+        }
+        with self._lock:
+            if event_name in self.event_configurations and self._channel_name(event_name) in self._channels:
+                raise RuntimeError(f"Event {event_name} is already being dispatched asynchronously")
+            if channel is not None:
+                for other_event, other_configuration in self.event_configurations.items():
+                    if other_configuration["channel"] == channel and other_event != event_name and dict(other_configuration, channel=None) != dict(configuration, channel=None):
+                        raise ValueError(f"Event {event_name} is configured differently from {other_event} on channel {channel}")
+            self.event_configurations[event_name] = dict(configuration, channel=channel)
+
     def dispatch_event(self, event_name, payload = None):
-        """Calls all handlers for a specific event."""
+        """Calls all handlers for a specific event, or queues the payload if the event is asynchronous."""
+        channel = self._get_channel(event_name)
+        if channel:
+            channel.put(event_name, payload)
+        else:
+            self._call_handlers(event_name, payload)
+
+    def queue_depth(self, event_name):
+        """Returns the number of payloads waiting to be handled on the channel of an asynchronous event."""
+        channel = self._channels.get(self._channel_name(event_name))
+        return channel.depth() if channel else 0
+
+    def dropped_events(self, event_name):
+        """Returns the number of payloads discarded by the backpressure policy on the channel of an event."""
+        channel = self._channels.get(self._channel_name(event_name))
+        return channel.dropped if channel else 0
+
+    def wait_until_idle(self, timeout=None):
+        """Blocks until all queued events have been handled. Returns False if the timeout expired."""
+        for channel in list(self._channels.values()):
+            if not channel.wait_until_idle(timeout):
+                return False
+        return True
+
+    def shutdown(self, timeout=None):
+        """Stops the worker threads once the events already queued have been handled."""
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels = {}
+            self.asynchronous = False
+        for channel in channels:
+            channel.close(timeout)
+
+    def _channel_name(self, event_name):
+        configuration = self.event_configurations.get(event_name)
+        return (configuration["channel"] or event_name) if configuration else event_name
+
+    def _get_channel(self, event_name):
+        if not self.asynchronous or event_name not in self.event_configurations:
+            return None
+        name = self._channel_name(event_name)
+        channel = self._channels.get(name)
+        if channel is None:
+            with self._lock:
+                channel = self._channels.get(name)
+                if channel is None and self.asynchronous:
+                    configuration = dict(self.event_configurations[event_name])
+                    del configuration["channel"]
+                    channel = _EventChannel(name, self, **configuration)
+                    self._channels[name] = channel
+        return channel
+
+    def _call_handlers(self, event_name, payload):
+        metrics = get_registry()
+        metrics.increment("event.dispatched", event_name)
         handlers = self.event_handlers.get(event_name, [])
-        for handler in handlers:
-            try:
-                handler(payload) if payload else handler()
-            except Exception as e:
-                print(f"Error dispatching event {event_name}: {e}")
-    
\ No newline at end of file
+        with metrics.time("event.handler_ms", event_name):
+            for handler in handlers:
+                try:
+                    handler(payload) if payload else handler()
+                except Exception as e:
+                    metrics.increment("event.errors", event_name)
+                    print(f"Error dispatching event {event_name}: {e}")
@@ -0,0 +1,245 @@
+'''
+Lightweight in-process instrumentation shared by all services.
+
+Every process has a default MetricsRegistry (see get_registry()) that the EventDispatcher and MQTTClientBase
+record into, so each service is instrumented without any changes to its communication interface.
+The registry keeps counters, gauges and latency histograms per metric and key (an event name or MQTT topic).
+
+Snapshots of the registry are available in-process through get_registry().snapshot(), and can be reported
+periodically to pluggable sinks. The sinks are selected with environment variables:
+    METRICS_SINKS     comma separated list of sinks to enable: "json" and/or "mqtt" (default: none)
+    METRICS_FILE      file the json sink writes to (default: custom_logging/metrics/<service>.json)
+    METRICS_INTERVAL  seconds between reports (default: 60)
+    SERVICE_NAME      name the metrics are reported under (default: derived from the service directory)
+'''
+import json
+import os
+import sys
+import threading
+import time
+
+# Upper bounds (in milliseconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+
+def default_service_name():
+    """Returns the SERVICE_NAME environment variable or the name of the directory under services/ that is running."""
+    name = os.getenv("SERVICE_NAME")
+    if name:
+        return name
+    parts = os.path.abspath(sys.argv[0] if sys.argv and sys.argv[0] else "").split(os.sep)
+    if "services" in parts:
+        index = len(parts) - 1 - parts[::-1].index("services")
+        if index + 1 < len(parts):
+            return parts[index + 1]
+    return "unknown"
+
+
+class Histogram:
+    '''
+    Fixed bucket histogram. Recording a value is O(number of buckets) and needs no allocation,
+    percentiles are estimated from the bucket upper bounds.
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile):
+        if self.count == 0:
+            return None
+        rank = percentile / 100 * self.count
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.max if upper_bound == float("inf") else min(upper_bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(self.buckets, self.counts) if c},
+        }
+
+
+class MetricsRegistry:
+    '''
+    Thread-safe store of counters, gauges and histograms.
+    Each metric (e.g. "mqtt.callback_ms") holds one value per key (e.g. the topic the message arrived on).
+    '''
+    def __init__(self, service_name=None):
+        self.service_name = service_name or default_service_name()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._started = time.time()
+
+    def increment(self, metric, key, value=1):
+        with self._lock:
+            values = self._counters.setdefault(metric, {})
+            values[key] = values.get(key, 0) + value
+
+    def set_gauge(self, metric, key, value):
+        with self._lock:
+            self._gauges.setdefault(metric, {})[key] = value
+
+    def observe(self, metric, key, value):
+        with self._lock:
+            values = self._histograms.setdefault(metric, {})
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = values[key] = Histogram()
+            histogram.observe(value)
+
+    def time(self, metric, key):
+        """Context manager that records the time spent in its block, in milliseconds."""
+        return _Timer(self, metric, key)
+
+    def snapshot(self):
+        """Returns a JSON serialisable copy of every metric recorded so far."""
+        with self._lock:
+            return {
+                "service_name": self.service_name,
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "uptime_seconds": round(time.time() - self._started, 1),
+                "counters": {metric: dict(values) for metric, values in self._counters.items()},
+                "gauges": {metric: dict(values) for metric, values in self._gauges.items()},
+                "histograms": {
+                    metric: {key: histogram.to_dict() for key, histogram in values.items()}
+                    for metric, values in self._histograms.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+            self._started = time.time()
+
+
+class _Timer:
+    def __init__(self, registry, metric, key):
+        self.registry = registry
+        self.metric = metric
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.metric, self.key, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class JsonFileSink:
+    '''Writes each snapshot to a local JSON file, replacing the previous one atomically.'''
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, snapshot):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(snapshot, file, indent=2, default=str)
+        os.replace(temporary_path, self.path)
+
+
+class MQTTSink:
+    '''Publishes each snapshot on the metrics/<service> topic.'''
+    def __init__(self, publish, service_name):
+        self.publish = publish
+        self.topic = f"metrics/{service_name}"
+
+    def write(self, snapshot):
+        self.publish(self.topic, json.dumps(snapshot, default=str))
+
+
+class MetricsReporter:
+    '''Background thread that writes a snapshot of a registry to every sink at a fixed interval.'''
+    def __init__(self, registry, sinks, interval=60):
+        self.registry = registry
+        self.sinks = sinks
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.report()
+
+    def report(self):
+        snapshot = self.registry.snapshot()
+        for sink in self.sinks:
+            try:
+                sink.write(snapshot)
+            except Exception as e:
+                print(f"Error writing metrics to {sink.__class__.__name__}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+
+_registry = MetricsRegistry()
+_reporter = None
+_reporter_lock = threading.Lock()
+
+
+def get_registry():
+    """Returns the registry shared by everything running in this process."""
+    return _registry
+
+
+def start_reporting(publish=None):
+    """
+    Starts reporting the process registry to the sinks listed in METRICS_SINKS.
+    Only the first call in a process has an effect. publish is the MQTT publish function used by the mqtt sink.
+    """
+    global _reporter
+    with _reporter_lock:
+        if _reporter is not None:
+            return _reporter
+        sink_names = [name.strip() for name in os.getenv("METRICS_SINKS", "").split(",") if name.strip()]
+        if not sink_names:
+            return None
+        sinks = []
+        service_name = _registry.service_name
+        for name in sink_names:
+            if name == "json":
+                sinks.append(JsonFileSink(os.getenv("METRICS_FILE", f"custom_logging/metrics/{service_name}.json")))
+            elif name == "mqtt" and publish is not None:
+                sinks.append(MQTTSink(publish, service_name))
+            else:
+                print(f"Metrics sink '{name}' is not available")
+        _reporter = MetricsReporter(_registry, sinks, interval=float(os.getenv("METRICS_INTERVAL", 60))).start()
+        return _reporter
@@ -1,9 +1,92 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError
+
 import paho.mqtt.client as mqtt
 
+from shared_libraries import metrics
+from shared_libraries.payload_codecs import SENT_AT, get_codec_registry
+from shared_libraries.topic_router import TopicTrie
+
+
+def route(topic):
+    '''
+    Decorator that subscribes a method of an MQTTClientBase subclass to a topic filter.
+    The method is called with the decoded payload and the original message, e.g.
+
+        @route("service/+/update_state")
+        def _update_service_state(self, payload, message):
+            ...
+
+    The payload is decoded once per message: binary (msgpack/CBOR) and JSON payloads are parsed, anything else
+    is passed on as a string (or as bytes if it is not valid UTF-8).
+    '''
+    def decorator(method):
+        method.__dict__.setdefault("_mqtt_routes", []).append(topic)
+        return method
+    return decorator
+
+
+class _Route:
+    __slots__ = ("topic_filter", "handler", "decoded")
+
+    def __init__(self, topic_filter, handler, decoded):
+        self.topic_filter = topic_filter
+        self.handler = handler
+        self.decoded = decoded
+
+
+def _ignore_message(client, userdata, message):
+    pass
+
+
+class _PendingRequest:
+    '''
+    A request published by call() or scatter_gather() that is waiting for responses carrying its correlation id.
+    Without responders the first response completes the request, otherwise it completes once every responder
+    (identified by the key field of its response) has answered.
+    '''
+    def __init__(self, responders=None, key=None):
+        self.responders = set(responders) if responders is not None else None
+        self.key = key
+        self.responses = {}
+        self.future = Future()
+
+    def add_response(self, payload):
+        if self.future.done():
+            return
+        if self.responders is None:
+            self.future.set_result(payload)
+            return
+        responder = payload.get(self.key)
+        if responder in self.responders:
+            self.responses[responder] = payload
+            if self.responders.issubset(self.responses):
+                self.future.set_result(dict(self.responses))
+
 
 class MQTTClientBase:
     def __init__(self, broker_address, port, client_id=None):
         self.mqtt_client = mqtt.Client(client_id=client_id)
+        self.metrics = metrics.get_registry()
+        # Selects the wire format of dict/list payloads per topic, see shared_libraries/payload_codecs.py
+        self.codecs = get_codec_registry()
+
+        # Incoming messages are matched against a topic trie instead of paho's callback list
+        self.router = TopicTrie()
+        self._router_lock = threading.Lock()
+        self._register_decorated_routes()
+
+        # Requests waiting for a response, see call() and scatter_gather()
+        self._pending_requests = {}
+        self._pending_lock = threading.RLock()  # Re-entrant as completing a Future runs its done callbacks
+        self.reply_topic = f"reply/{uuid.uuid4().hex}"
+        self.add_route(self.reply_topic, self._handle_reply)
+
+        # Called with every message after it has been handled, e.g. to wake up a thread waiting for new state
+        self._message_listeners = []
 
         try:
             self.mqtt_client.connect(broker_address, port, keepalive=60)
@@ -17,34 +100,217 @@ class MQTTClientBase:
         # Default state, can be extended in child classes
         self.state = {}
 
+        metrics.start_reporting(publish=self.publish)
+
+    def _register_decorated_routes(self):
+        for name in dir(type(self)):
+            attribute = getattr(type(self), name, None)
+            for topic in getattr(attribute, "_mqtt_routes", ()):
+                self.add_route(topic, getattr(self, name))
+
     def on_connect(self, client, userdata, flags, rc):
         try:
             if rc == 0:
                 print("Connected to broker")
+                # Subscriptions do not survive a reconnect, so (re)subscribe to every routed topic
+                for topic in self.router.filters():
+                    client.subscribe(topic)
             else:
                 print(f"Failed to connect to broker, return code {rc}")
         except Exception as e:
             print(f"Exception in on_connect: {e}")
 
     def on_message(self, client, userdata, message):
-        """Default on_message handler."""
-        # print(
-            # f"Received message '{message.payload.decode()}' on topic '{message.topic}'"
-        # )
+        """Routes a message to the handlers of every topic filter matching its topic."""
+        routes = self.router.match(message.topic)
+        if not routes and not self._pending_requests:
+            return
+        received = time.time()
+        payload = sent_at = None
+        decoded = False
+        for message_route in routes:
+            topic_filter = message_route.topic_filter
+            self.metrics.increment("mqtt.received", topic_filter)
+            handler_started = time.monotonic()
+            try:
+                if message_route.decoded:
+                    if not decoded:
+                        payload, sent_at = self._decode(message.payload)
+                        decoded = True
+                    if sent_at is not None:
+                        self.metrics.observe("mqtt.delivery_ms", topic_filter, (received - sent_at) * 1000)
+                    message_route.handler(payload, message)
+                else:
+                    message_route.handler(client, userdata, message)
+            except Exception as e:
+                self.metrics.increment("mqtt.callback_errors", topic_filter)
+                print(f"Error handling message on {message.topic}: {e}")
+            finally:
+                self.metrics.observe("mqtt.callback_ms", topic_filter, (time.monotonic() - handler_started) * 1000)
+
+        if routes:
+            for listener in self._message_listeners:
+                try:
+                    listener(message)
+                except Exception as e:
+                    print(f"Error in message listener for {message.topic}: {e}")
+
+        # Resolve requests after the handlers ran, so callers woken up see the state the handlers updated
+        if self._pending_requests:
+            if not decoded:
+                try:
+                    payload = self.decode_payload(message.payload)
+                except Exception:
+                    return
+            # Ignore our own requests, they carry the correlation id too
+            if isinstance(payload, dict) and "correlation_id" in payload and payload.get("reply_to") != self.reply_topic:
+                with self._pending_lock:
+                    pending = self._pending_requests.get(payload["correlation_id"])
+                    if pending:
+                        pending.add_response(payload)
+
+    def decode_payload(self, payload):
+        """Decodes a raw MQTT payload in any supported codec, falling back to a string or the raw bytes."""
+        return self._decode(payload)[0]
+
+    def _decode(self, payload):
+        """Returns the decoded payload without the sent_at stamp added by publish(), and the stamp."""
+        payload = self.codecs.decode(payload)
+        sent_at = payload.pop(SENT_AT, None) if isinstance(payload, dict) else None
+        return payload, sent_at if isinstance(sent_at, (int, float)) else None
+
+    def add_message_listener(self, listener):
+        """Calls listener(message) after every routed message has been handled."""
+        self._message_listeners.append(listener)
+
+    def _handle_reply(self, payload, message):
+        """Responses on the reply topic are matched to their request by on_message."""
         pass
 
+    def correlation_id_of(self, message):
+        """Returns the correlation id of a request message, or None if the sender does not expect a response."""
+        try:
+            payload = self.decode_payload(message.payload)
+        except Exception:
+            return None
+        return payload.get("correlation_id") if isinstance(payload, dict) else None
+
+    def call(self, topic, payload=None, timeout=None):
+        """
+        Publishes a request and returns a Future that completes with the first response carrying its correlation id.
+        The request payload is a dict extended with the correlation_id and the reply_to topic the response can
+        be sent to (see reply()). If a timeout is given the Future fails with TimeoutError once it expires.
+        """
+        correlation_id, pending = self._open_request(None, None)
+        pending.future.add_done_callback(lambda _: self._forget_request(correlation_id))
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._expire_request, args=(pending, topic, timeout))
+            timer.daemon = True
+            timer.start()
+            pending.future.add_done_callback(lambda _: timer.cancel())
+        self.publish(topic, dict(payload or {}, correlation_id=correlation_id, reply_to=self.reply_topic))
+        return pending.future
+
+    def scatter_gather(self, topic, responders, payload=None, timeout=1.0, key="service_name"):
+        """
+        Publishes a request to several services and waits until every responder has answered or the timeout expires.
+        Responses are matched by correlation id and attributed to a responder by their key field (e.g. service_name).
+
+        Returns:
+            dict: The responses received, keyed by responder. Responders that did not answer in time are missing.
+        """
+        correlation_id, pending = self._open_request(responders, key)
+        started = time.monotonic()
+        try:
+            self.publish(topic, dict(payload or {}, correlation_id=correlation_id, reply_to=self.reply_topic))
+            try:
+                return pending.future.result(timeout)
+            except TimeoutError:
+                with self._pending_lock:
+                    return dict(pending.responses)
+        finally:
+            self._forget_request(correlation_id)
+            self.metrics.observe("mqtt.rpc_ms", topic, (time.monotonic() - started) * 1000)
+
+    async def scatter_gather_async(self, topic, responders, payload=None, timeout=1.0, key="service_name"):
+        """Same as scatter_gather() but waits without blocking the running asyncio event loop."""
+        correlation_id, pending = self._open_request(responders, key)
+        started = time.monotonic()
+        try:
+            self.publish(topic, dict(payload or {}, correlation_id=correlation_id, reply_to=self.reply_topic))
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(pending.future), timeout)
+            except asyncio.TimeoutError:
+                with self._pending_lock:
+                    return dict(pending.responses)
+        finally:
+            self._forget_request(correlation_id)
+            self.metrics.observe("mqtt.rpc_ms", topic, (time.monotonic() - started) * 1000)
+
+    def _open_request(self, responders, key):
+        correlation_id = uuid.uuid4().hex
+        pending = _PendingRequest(responders, key)
+        with self._pending_lock:
+            self._pending_requests[correlation_id] = pending
+        return correlation_id, pending
+
+    def reply(self, request, response, topic=None):
+        """Sends a response to a request received from call() or scatter_gather()."""
+        response = dict(response, correlation_id=request.get("correlation_id"))
+        self.publish(request.get("reply_to") or topic, response)
+
+    def _expire_request(self, pending, topic, timeout):
+        with self._pending_lock:
+            if pending.future.done():
+                return
+            self.metrics.increment("mqtt.rpc_timeouts", topic)
+            pending.future.set_exception(TimeoutError(f"No response on {topic} within {timeout} seconds"))
+
+    def _forget_request(self, correlation_id):
+        with self._pending_lock:
+            self._pending_requests.pop(correlation_id, None)
+
     def subscribe(self, topic, callback=None):
-        """Subscribe to a topic and optionally add a callback."""
-        self.mqtt_client.subscribe(topic)
-        # print(f"Subscribed to topic: {topic}")
-        if callback:
-            self.mqtt_client.message_callback_add(topic, callback)
-            # print(f"Callback added for topic: {topic}")
+        """
+        Subscribe to a topic and optionally add a callback that receives the raw paho message. Without a callback
+        the topic is still routed, so it is resubscribed on reconnect and its messages reach the message listeners
+        and pending requests.
+        """
+        self._add(topic, _Route(topic, callback or _ignore_message, decoded=False))
+
+    def add_route(self, topic, handler):
+        """Subscribe to a topic filter with a handler that receives the decoded payload and the message."""
+        self._add(topic, _Route(topic, handler, decoded=True))
+
+    def remove_route(self, topic):
+        """Remove every handler of a topic filter and unsubscribe from it."""
+        with self._router_lock:
+            self.router.remove(topic)
+        self.mqtt_client.unsubscribe(topic)
+
+    def _add(self, topic, message_route):
+        with self._router_lock:
+            already_subscribed = topic in self.router.filters()
+            self.router.add(topic, message_route)
+        if not already_subscribed:
+            self.mqtt_client.subscribe(topic)
 
     def publish(self, topic, message):
-        """Publish a message to a topic."""
-        result = self.mqtt_client.publish(topic, message)
+        """
+        Publish a message to a topic. Dicts and lists are encoded with the codec configured for the topic.
+        Dicts are stamped with the time they were sent, which decode_payload() removes again on the receiving side.
+        """
+        with self.metrics.time("mqtt.publish_ms", topic):
+            if isinstance(message, dict):
+                message = dict(message, **{SENT_AT: time.time()})
+            if isinstance(message, (dict, list)):
+                message = self.codecs.encode(topic, message)
+            result = self.mqtt_client.publish(topic, message)
+        self.metrics.increment("mqtt.published", topic)
+        if isinstance(message, (str, bytes, bytearray)):
+            self.metrics.increment("mqtt.published_bytes", topic, len(message))
         if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.metrics.increment("mqtt.publish_errors", topic)
             print(f"Failed to publish message to {topic}. Return code: {result.rc}")
         else:
             # print(f"Message '{message}' published to topic '{topic}'")
@@ -54,7 +320,7 @@ class MQTTClientBase:
         """Disconnect the MQTT client."""
         self.mqtt_client.loop_stop()
         self.mqtt_client.disconnect()
-    
+
     def on_disconnect(self, client, userdata, rc):
         print(f"Disconnected with return code {rc}")
         if rc != 0:
@@ -63,4 +329,3 @@ class MQTTClientBase:
                 client.reconnect()
             except Exception as e:
                 print(f"Reconnection failed: {e}")
-
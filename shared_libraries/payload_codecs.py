@@ -0,0 +1,221 @@
+'''
+Payload codecs for inter-service MQTT messages.
+
+JSON stays the default wire format. Topics can opt in to a compact binary codec (msgpack, or CBOR). The codec
+is not negotiated: it is a static setting of the sender, and receivers detect the format of every payload
+instead. This only works because every consumer decodes payloads through MQTTClientBase (add_route() /
+@route, or decode_payload()); a consumer that parses payloads with json.loads would break as soon as a topic
+it reads is switched to a binary codec. Every service reads the same .env file, so they share the setting.
+
+Binary payloads are framed as:
+    byte 0    FRAME_MARKER (0xC1, which can start neither a UTF-8 JSON document nor a msgpack value)
+    byte 1    codec id
+    byte 2    schema id (0 when the payload is not encoded against a schema)
+    byte 3..  the encoded body
+
+Payloads whose keys exactly match a registered schema are encoded as a positional array of values, so
+the field names are not sent on the wire. The SENT_AT time MQTTClientBase.publish() adds to every dict is
+sent as an extra trailing value. Schemas are identified by a small integer that has to mean the
+same thing to every service, so new schemas must be appended with a new id and never renumbered.
+
+Per topic codecs are configured with the PAYLOAD_CODECS environment variable, e.g.
+    PAYLOAD_CODECS=robot_behaviour_command=msgpack,speech_recognition_control_cmd=msgpack
+Topic filters may use the MQTT wildcards. Codecs whose library is not installed fall back to JSON.
+'''
+import json
+import os
+
+from shared_libraries.topic_router import TopicTrie
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+FRAME_MARKER = 0xC1
+NO_SCHEMA = 0
+# Wall clock time a dict payload was published at, added as its last key by MQTTClientBase.publish()
+SENT_AT = "sent_at"
+
+
+class JsonCodec:
+    name = "json"
+    codec_id = 0
+    available = True
+
+    def encode(self, value):
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    codec_id = 1
+    available = msgpack is not None
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+class CborCodec:
+    name = "cbor"
+    codec_id = 2
+    available = cbor2 is not None
+
+    def encode(self, value):
+        return cbor2.dumps(value)
+
+    def decode(self, data):
+        return cbor2.loads(data)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec(), CborCodec())}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+class SchemaRegistry:
+    '''
+    Maps the field layout of a payload to a schema id. A dict is only encoded against a schema when its
+    keys are exactly the schema's fields in the same order, which is how the payloads are built in code,
+    optionally followed by SENT_AT.
+    '''
+    def __init__(self):
+        self._schemas = {}
+        self._ids_by_fields = {}
+
+    def register(self, schema_id, name, fields):
+        if not 0 < schema_id < 256:
+            raise ValueError("schema_id must be between 1 and 255")
+        fields = tuple(fields)
+        existing = self._schemas.get(schema_id)
+        if existing is not None and existing != (name, fields):
+            raise ValueError(f"Schema id {schema_id} is already registered as '{existing[0]}'")
+        self._schemas[schema_id] = (name, fields)
+        self._ids_by_fields[fields] = schema_id
+
+    def pack(self, value):
+        """Returns (schema_id, value) where value is a positional list if a schema matched."""
+        if isinstance(value, dict):
+            fields = tuple(value)
+            if fields and fields[-1] == SENT_AT:
+                fields = fields[:-1]
+            schema_id = self._ids_by_fields.get(fields)
+            if schema_id is not None:
+                return schema_id, list(value.values())
+        return NO_SCHEMA, value
+
+    def unpack(self, schema_id, value):
+        if schema_id == NO_SCHEMA:
+            return value
+        schema = self._schemas.get(schema_id)
+        if schema is None:
+            raise ValueError(f"Unknown schema id {schema_id}")
+        fields = schema[1]
+        if len(value) == len(fields) + 1:
+            fields += (SENT_AT,)
+        return dict(zip(fields, value))
+
+    def schemas(self):
+        return {schema_id: {"name": name, "fields": list(fields)} for schema_id, (name, fields) in self._schemas.items()}
+
+
+# Message shapes shared by the services. Append new schemas, never renumber existing ones.
+schema_registry = SchemaRegistry()
+schema_registry.register(1, "service_status", ("service_name", "status", "message", "details", "timestamp"))
+schema_registry.register(2, "service_control_command", ("service_name", "cmd", "time"))
+schema_registry.register(3, "robot_speech", ("sender", "message_type", "content"))
+schema_registry.register(4, "robot_behaviour_command", ("sender", "message_type", "cmd", "additional_details", "time"))
+schema_registry.register(5, "state_update", ("state_name", "state_value"))
+schema_registry.register(6, "robot_behaviour_status", ("behaviour_name", "status"))
+schema_registry.register(7, "service_control_request", ("service_name", "cmd", "time", "correlation_id", "reply_to"))
+schema_registry.register(8, "service_status_response", ("service_name", "status", "message", "details", "timestamp", "correlation_id"))
+
+
+class CodecRegistry:
+    '''
+    Selects the codec used to publish on each topic and decodes payloads of any supported format.
+    '''
+    def __init__(self, default="json", schemas=schema_registry):
+        self.default = self._resolve(default)
+        self.schemas = schemas
+        self._topics = TopicTrie()
+
+    def _resolve(self, name):
+        codec = CODECS.get(name)
+        if codec is None:
+            raise ValueError(f"Unknown codec '{name}', expected one of {list(CODECS)}")
+        if not codec.available:
+            print(f"Codec '{name}' is not installed, falling back to JSON")
+            return CODECS["json"]
+        return codec
+
+    def set_codec(self, topic_filter, name):
+        """Publishes every topic matching the filter with the named codec."""
+        self._topics.remove(topic_filter)
+        self._topics.add(topic_filter, self._resolve(name))
+
+    def codec_for(self, topic):
+        matches = self._topics.match(topic)
+        return matches[0] if matches else self.default
+
+    def encode(self, topic, value):
+        """Encodes a value for the topic. JSON is sent unframed so existing receivers can still read it."""
+        codec = self.codec_for(topic)
+        if codec.codec_id == JsonCodec.codec_id:
+            return json.dumps(value)
+        schema_id, body = self.schemas.pack(value)
+        return bytes((FRAME_MARKER, codec.codec_id, schema_id)) + codec.encode(body)
+
+    def decode(self, payload):
+        """
+        Decodes a payload in any supported format. Payloads that are not framed are parsed as JSON,
+        falling back to a string (or the raw bytes if they are not valid UTF-8).
+        """
+        if isinstance(payload, (bytes, bytearray)) and len(payload) >= 3 and payload[0] == FRAME_MARKER:
+            codec = CODECS_BY_ID.get(payload[1])
+            if codec is None or not codec.available:
+                raise ValueError(f"Payload was encoded with unsupported codec id {payload[1]}")
+            return self.schemas.unpack(payload[2], codec.decode(bytes(payload[3:])))
+        try:
+            text = payload.decode("utf-8") if isinstance(payload, (bytes, bytearray)) else payload
+        except UnicodeDecodeError:
+            return payload
+        try:
+            return json.loads(text)
+        except (TypeError, ValueError):
+            return text
+
+
+def codec_registry_from_env():
+    """Builds a CodecRegistry from the PAYLOAD_CODECS environment variable."""
+    registry = CodecRegistry(default=os.getenv("PAYLOAD_CODEC_DEFAULT", "json"))
+    for entry in os.getenv("PAYLOAD_CODECS", "").split(","):
+        if not entry.strip():
+            continue
+        topic_filter, _, name = entry.strip().rpartition("=")
+        try:
+            registry.set_codec(topic_filter, name)
+        except ValueError as e:
+            print(f"Ignoring payload codec '{entry}': {e}")
+    return registry
+
+
+_registry = None
+
+
+def get_codec_registry():
+    """Returns the codec registry shared by everything running in this process."""
+    global _registry
+    if _registry is None:
+        _registry = codec_registry_from_env()
+    return _registry
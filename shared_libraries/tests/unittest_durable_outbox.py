@@ -0,0 +1,252 @@
+# unittest_durable_outbox.py
+
+import unittest
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries.durable_outbox import DurableOutbox
+
+
+class FakeClient:
+    '''Records the requests published by the outbox and lets the test answer them.'''
+    def __init__(self, path=None):
+        self.path = path
+        self.calls = []
+        self.lock = threading.Lock()
+        self.outbox_rows = None
+
+    def call(self, topic, payload=None, timeout=None):
+        future = Future()
+        with self.lock:
+            if self.path and self.outbox_rows is None:
+                self.outbox_rows = rows(self.path, "outbox")
+            self.calls.append((topic, payload, future))
+        return future
+
+    def wait_for_calls(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.calls) >= count:
+                    return list(self.calls)
+            time.sleep(0.005)
+        with self.lock:
+            return list(self.calls)
+
+    def acknowledge_all(self):
+        with self.lock:
+            calls = list(self.calls)
+        for _, payload, future in calls:
+            if not future.done():
+                future.set_result({"correlation_id": "1"})
+
+    def fail_all(self):
+        with self.lock:
+            calls = list(self.calls)
+        for topic, _, future in calls:
+            if not future.done():
+                future.set_exception(TimeoutError(f"No response on {topic}"))
+
+
+def rows(path, table):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(f"SELECT * FROM {table} ORDER BY id").fetchall()
+    finally:
+        connection.close()
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+
+class TestDurableOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "outbox.db")
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            outbox.close(timeout=1)
+        self.directory.cleanup()
+
+    def create_outbox(self, client, **kwargs):
+        kwargs.setdefault("commit_interval", 0.01)
+        outbox = DurableOutbox(client, self.path, **kwargs)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def test_message_is_written_before_it_is_published(self):
+        client = FakeClient(self.path)
+        outbox = self.create_outbox(client)
+        key = outbox.send("save_check_in", {"question": "How are you?"})
+
+        topic, payload, _ = client.wait_for_calls(1)[0]
+        self.assertEqual(topic, "save_check_in")
+        self.assertEqual(payload, {"question": "How are you?", "idempotency_key": key})
+        self.assertEqual([row[1] for row in client.outbox_rows], [key])
+
+    def test_acknowledged_message_is_deleted(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client)
+        outbox.send("save_check_in", {"question": "How are you?"})
+        client.wait_for_calls(1)
+        client.acknowledge_all()
+
+        self.assertTrue(wait_until(lambda: outbox.pending() == 0))
+        self.assertTrue(wait_until(lambda: rows(self.path, "outbox") == []))
+
+    def test_idempotency_key_of_the_payload_is_kept(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client)
+        self.assertEqual(outbox.send("save_check_in", {"idempotency_key": "abc"}), "abc")
+        self.assertEqual(client.wait_for_calls(1)[0][1]["idempotency_key"], "abc")
+
+    def test_burst_is_written_in_one_transaction(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client, commit_interval=0.2)
+        outbox.metrics.reset()
+        for i in range(10):
+            outbox.send("save_check_in", {"index": i})
+        self.assertTrue(outbox.flush(timeout=2))
+
+        batch_size = outbox.metrics.snapshot()["histograms"]["outbox.batch_size"]["outbox"]
+        self.assertEqual((batch_size["count"], batch_size["max"]), (1, 10))
+        self.assertEqual(len(rows(self.path, "outbox")), 10)
+
+    def test_unacknowledged_message_is_published_again(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client, retry_interval=0.05)
+        key = outbox.send("save_check_in", {})
+        client.wait_for_calls(1)
+        client.fail_all()
+
+        calls = client.wait_for_calls(2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[1][1]["idempotency_key"], key)
+        self.assertTrue(wait_until(lambda: rows(self.path, "outbox")[0][5] == 1))
+
+    def test_most_messages_in_flight_are_limited(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client, max_in_flight=2)
+        for i in range(5):
+            outbox.send("save_check_in", {"index": i})
+        client.wait_for_calls(2)
+        time.sleep(0.1)
+        self.assertEqual(len(client.calls), 2)
+
+        client.acknowledge_all()
+        self.assertEqual(len(client.wait_for_calls(4)), 4)
+
+    def test_messages_are_replayed_after_a_restart(self):
+        outbox = self.create_outbox(FakeClient())
+        key = outbox.send("save_check_in", {"question": "How are you?"})
+        outbox.close(timeout=1)
+
+        client = FakeClient()
+        outbox = self.create_outbox(client)
+        self.assertEqual(outbox.pending(), 1)
+        self.assertEqual(client.wait_for_calls(1)[0][1]["idempotency_key"], key)
+
+    def test_message_is_dead_lettered_after_max_attempts(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client, retry_interval=0.01, max_attempts=3)
+        key = outbox.send("save_check_in", {})
+        for attempt in range(1, 4):
+            client.wait_for_calls(attempt)
+            client.fail_all()
+
+        self.assertTrue(wait_until(lambda: rows(self.path, "dead_letter") != []))
+        time.sleep(0.05)
+        self.assertEqual(len(client.calls), 3)
+        self.assertEqual(outbox.pending(), 0)
+        self.assertEqual(rows(self.path, "outbox"), [])
+        dead_letter = rows(self.path, "dead_letter")[0]
+        self.assertEqual((dead_letter[1], dead_letter[2], dead_letter[5]), (key, "save_check_in", 3))
+
+    def test_attempts_are_counted_across_restarts(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client, retry_interval=10, max_attempts=2)
+        key = outbox.send("save_check_in", {})
+        client.wait_for_calls(1)
+        client.fail_all()
+        self.assertTrue(wait_until(lambda: rows(self.path, "outbox")[0][5] == 1))
+        outbox.close(timeout=1)
+
+        client = FakeClient()
+        outbox = self.create_outbox(client, retry_interval=10, max_attempts=2)
+        client.wait_for_calls(1)
+        client.fail_all()
+
+        self.assertTrue(wait_until(lambda: rows(self.path, "dead_letter") != []))
+        self.assertEqual(rows(self.path, "dead_letter")[0][1], key)
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_outbox_without_attempts_column_is_upgraded(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE outbox (id INTEGER PRIMARY KEY, idempotency_key TEXT NOT NULL UNIQUE, topic TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)")
+        connection.execute("INSERT INTO outbox (idempotency_key, topic, payload, created) VALUES ('abc', 'save_check_in', '{}', 0)")
+        connection.commit()
+        connection.close()
+
+        client = FakeClient()
+        self.create_outbox(client)
+        self.assertEqual(client.wait_for_calls(1)[0][0], "save_check_in")
+
+    def test_due_messages_of_a_batch_topic_are_published_together(self):
+        outbox = self.create_outbox(FakeClient(), batch_topics={"save_check_in": "save_check_in_batch"})
+        keys = [outbox.send("save_check_in", {"index": i}) for i in range(3)]
+        outbox.send("save_reminder", {})
+        outbox.close(timeout=1)
+
+        # Replayed after a restart, all due at once
+        client = FakeClient()
+        outbox = self.create_outbox(client, batch_topics={"save_check_in": "save_check_in_batch"})
+        calls = client.wait_for_calls(2)
+        self.assertEqual(sorted(topic for topic, _, _ in calls), ["save_check_in_batch", "save_reminder"])
+        batch = next(payload for topic, payload, _ in calls if topic == "save_check_in_batch")
+        self.assertEqual([message["idempotency_key"] for message in batch["messages"]], keys)
+
+        client.acknowledge_all()
+        self.assertTrue(wait_until(lambda: outbox.pending() == 0))
+        self.assertTrue(wait_until(lambda: rows(self.path, "outbox") == []))
+
+    def test_failed_batch_is_published_again(self):
+        client = FakeClient()
+        outbox = self.create_outbox(client, retry_interval=0.05, commit_interval=0.2, batch_topics={"save_check_in": "save_check_in_batch"})
+        for i in range(2):
+            outbox.send("save_check_in", {"index": i})
+        self.assertEqual(client.wait_for_calls(1)[0][0], "save_check_in_batch")
+        client.fail_all()
+
+        calls = client.wait_for_calls(2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(calls[1][1]["messages"]), 2)
+        self.assertTrue(wait_until(lambda: [row[5] for row in rows(self.path, "outbox")] == [1, 1]))
+
+    def test_send_after_close_raises(self):
+        outbox = self.create_outbox(FakeClient())
+        outbox.close(timeout=1)
+        with self.assertRaises(RuntimeError):
+            outbox.send("save_check_in", {})
+
+
+if __name__ == '__main__':
+    unittest.main()
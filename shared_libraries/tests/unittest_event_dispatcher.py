@@ -0,0 +1,255 @@
+# unittest_event_dispatcher.py
+
+import unittest
+import os
+import sys
+import threading
+import time
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries.event_dispatcher import EventDispatcher, service_state_key, state_name_key
+
+
+class TestEventDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = EventDispatcher(asynchronous=True)
+        self.handled = []
+        self.release = threading.Event()
+        self.dispatcher.register_event("save_check_in", self.slow_handler)
+
+    def tearDown(self):
+        self.release.set()
+        self.dispatcher.shutdown(timeout=1)
+
+    def slow_handler(self, payload):
+        self.release.wait(timeout=2)
+        self.handled.append(payload)
+
+    def wait_for_worker(self):
+        """Waits until the worker has taken the first payload off the queue and is blocked in slow_handler."""
+        deadline = time.monotonic() + 1
+        while self.dispatcher.queue_depth("save_check_in") and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_unconfigured_events_are_handled_inline(self):
+        threads = []
+        self.dispatcher.register_event("service_control_command", lambda payload: threads.append(threading.current_thread()))
+        self.dispatcher.dispatch_event("service_control_command", "update_system_state")
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_configured_events_are_handled_on_a_worker_thread(self):
+        threads = []
+        self.dispatcher.register_event("request_history", lambda payload: threads.append(threading.current_thread().name))
+        self.dispatcher.configure_event("request_history")
+        self.dispatcher.dispatch_event("request_history", {"days": 7})
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=1))
+        self.assertEqual(threads, ["request_history-worker-0"])
+
+    def test_synchronous_dispatcher_ignores_the_configuration(self):
+        dispatcher = EventDispatcher()
+        handled = []
+        dispatcher.register_event("save_check_in", handled.append)
+        dispatcher.configure_event("save_check_in")
+        dispatcher.dispatch_event("save_check_in", {"day": 1})
+        self.assertEqual(handled, [{"day": 1}])
+
+    def test_drop_oldest_discards_the_oldest_pending_payload(self):
+        self.dispatcher.configure_event("save_check_in", max_queue_size=2)
+        self.dispatcher.dispatch_event("save_check_in", 1)
+        self.wait_for_worker()
+        for payload in (2, 3, 4):
+            self.dispatcher.dispatch_event("save_check_in", payload)
+
+        self.assertEqual(self.dispatcher.queue_depth("save_check_in"), 2)
+        self.assertEqual(self.dispatcher.dropped_events("save_check_in"), 1)
+        self.release.set()
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=2))
+        self.assertEqual(self.handled, [1, 3, 4])
+
+    def test_block_holds_up_the_caller_until_there_is_space(self):
+        self.dispatcher.configure_event("save_check_in", max_queue_size=1, policy="block")
+        self.dispatcher.dispatch_event("save_check_in", 1)
+        self.wait_for_worker()
+        self.dispatcher.dispatch_event("save_check_in", 2)
+
+        caller = threading.Thread(target=self.dispatcher.dispatch_event, args=("save_check_in", 3))
+        caller.start()
+        caller.join(timeout=0.2)
+        self.assertTrue(caller.is_alive())
+
+        self.release.set()
+        caller.join(timeout=2)
+        self.assertFalse(caller.is_alive())
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=2))
+        self.assertEqual(self.handled, [1, 2, 3])
+        self.assertEqual(self.dispatcher.dropped_events("save_check_in"), 0)
+
+    def test_a_slow_event_does_not_delay_other_events(self):
+        handled = []
+        self.dispatcher.register_event("publish_service_state", handled.append)
+        self.dispatcher.configure_event("save_check_in")
+        self.dispatcher.configure_event("publish_service_state")
+        self.dispatcher.dispatch_event("save_check_in", 1)
+        self.dispatcher.dispatch_event("publish_service_state", 2)
+
+        deadline = time.monotonic() + 1
+        while not handled and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(handled, [2])
+        self.assertEqual(self.handled, [])
+
+    def test_several_workers_handle_payloads_concurrently(self):
+        self.dispatcher.configure_event("save_check_in", workers=3)
+        for payload in (1, 2, 3):
+            self.dispatcher.dispatch_event("save_check_in", payload)
+        time.sleep(0.1)
+        self.release.set()
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=1))
+        self.assertCountEqual(self.handled, [1, 2, 3])
+
+    def test_handler_errors_do_not_stop_the_worker(self):
+        handled = []
+        def handler(payload):
+            if payload == 1:
+                raise ValueError("invalid payload")
+            handled.append(payload)
+        self.dispatcher.register_event("save_reminder", handler)
+        self.dispatcher.configure_event("save_reminder")
+        self.dispatcher.dispatch_event("save_reminder", 1)
+        self.dispatcher.dispatch_event("save_reminder", 2)
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=1))
+        self.assertEqual(handled, [2])
+
+    def test_shutdown_handles_the_queued_payloads(self):
+        self.dispatcher.configure_event("save_check_in")
+        for payload in (1, 2, 3):
+            self.dispatcher.dispatch_event("save_check_in", payload)
+        self.release.set()
+        self.dispatcher.shutdown(timeout=2)
+
+        self.assertEqual(self.handled, [1, 2, 3])
+        # Events dispatched after shutdown are handled inline
+        self.dispatcher.dispatch_event("save_check_in", 4)
+        self.assertEqual(self.handled, [1, 2, 3, 4])
+
+    def test_invalid_configurations_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.dispatcher.configure_event("save_check_in", policy="drop_newest")
+        with self.assertRaises(ValueError):
+            self.dispatcher.configure_event("save_check_in", workers=0)
+        with self.assertRaises(ValueError):
+            self.dispatcher.configure_event("save_check_in", coalesce_window=0.1)
+        with self.assertRaises(ValueError):
+            self.dispatcher.configure_event("save_check_in", policy="coalesce", coalesce_window=-1)
+
+    def test_a_running_event_cannot_be_reconfigured(self):
+        self.dispatcher.configure_event("save_check_in")
+        self.release.set()
+        self.dispatcher.dispatch_event("save_check_in", 1)
+        with self.assertRaises(RuntimeError):
+            self.dispatcher.configure_event("save_check_in", policy="block")
+
+    def test_events_sharing_a_channel_are_handled_in_dispatch_order(self):
+        threads = []
+        self.dispatcher.register_event("create_new_reminder", lambda payload: (threads.append(threading.current_thread().name), self.handled.append(payload)))
+        self.dispatcher.configure_event("save_check_in", policy="block", channel="database_writes")
+        self.dispatcher.configure_event("create_new_reminder", policy="block", channel="database_writes")
+
+        self.dispatcher.dispatch_event("save_check_in", "check-in 1")
+        self.wait_for_worker()
+        self.dispatcher.dispatch_event("create_new_reminder", "reminder")
+        self.dispatcher.dispatch_event("save_check_in", "check-in 2")
+        # The reminder waits behind the check-in being saved instead of being handled by a worker of its own
+        self.assertEqual(self.dispatcher.queue_depth("create_new_reminder"), 2)
+        self.release.set()
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=1))
+        self.assertEqual(self.handled, ["check-in 1", "reminder", "check-in 2"])
+        self.assertEqual(threads, ["database_writes-worker-0"])
+
+    def test_events_sharing_a_channel_must_have_the_same_settings(self):
+        self.dispatcher.configure_event("save_check_in", policy="block", channel="database_writes")
+        with self.assertRaises(ValueError):
+            self.dispatcher.configure_event("create_new_reminder", channel="database_writes")
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = EventDispatcher(asynchronous=True)
+        self.handled = []
+        self.dispatcher.register_event("publish_service_state", lambda payload: self.handled.append((time.monotonic(), payload)))
+
+    def tearDown(self):
+        self.dispatcher.shutdown(timeout=1)
+
+    def payloads(self):
+        return [payload for _, payload in self.handled]
+
+    def test_only_the_latest_payload_of_each_key_is_handled(self):
+        self.dispatcher.configure_event("publish_service_state", policy="coalesce", coalesce_key=state_name_key, coalesce_window=0.1)
+        for brightness in (10, 20, 30):
+            self.dispatcher.dispatch_event("publish_service_state", {"state_name": "brightness", "state_value": brightness})
+        self.dispatcher.dispatch_event("publish_service_state", {"state_name": "robot_volume", "state_value": 5})
+        self.dispatcher.dispatch_event("publish_service_state", {"state_name": "brightness", "state_value": 40})
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=2))
+        # The latest value of each key, in the order the keys were first dispatched
+        self.assertEqual(self.payloads(), [
+            {"state_name": "brightness", "state_value": 40},
+            {"state_name": "robot_volume", "state_value": 5},
+        ])
+        self.assertEqual(self.dispatcher.dropped_events("publish_service_state"), 3)
+
+    def test_payloads_are_held_back_for_the_window(self):
+        self.dispatcher.configure_event("publish_service_state", policy="coalesce", coalesce_key=state_name_key, coalesce_window=0.2)
+        dispatched = time.monotonic()
+        self.dispatcher.dispatch_event("publish_service_state", {"state_name": "brightness", "state_value": 10})
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=2))
+        self.assertGreaterEqual(self.handled[0][0] - dispatched, 0.2)
+
+    def test_payloads_without_a_key_are_not_held_back(self):
+        self.dispatcher.configure_event("publish_service_state", policy="coalesce", coalesce_key=service_state_key, coalesce_window=1.0)
+        all_states = {"reminder": [{"service_name": "reminder", "state_name": "user_name", "state_value": "Alex"}]}
+        dispatched = time.monotonic()
+        self.dispatcher.dispatch_event("publish_service_state", {"service_name": "peripherals", "state_name": "brightness", "state_value": 10})
+        self.dispatcher.dispatch_event("publish_service_state", all_states)
+        self.dispatcher.dispatch_event("publish_service_state", {"everything": True})
+
+        deadline = time.monotonic() + 0.5
+        while len(self.handled) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Handled at once and in order, without waiting for the held back state before them
+        self.assertEqual(self.payloads(), [all_states, {"everything": True}])
+        self.assertLess(self.handled[-1][0] - dispatched, 0.5)
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=2))
+        self.assertEqual(self.payloads()[-1], {"service_name": "peripherals", "state_name": "brightness", "state_value": 10})
+        self.assertGreaterEqual(self.handled[-1][0] - dispatched, 1.0)
+
+    def test_without_a_coalesce_key_the_event_keeps_a_single_payload(self):
+        self.dispatcher.configure_event("publish_service_state", policy="coalesce", coalesce_window=0.1)
+        for value in range(1, 6):
+            self.dispatcher.dispatch_event("publish_service_state", value)
+
+        self.assertTrue(self.dispatcher.wait_until_idle(timeout=2))
+        self.assertEqual(self.payloads(), [5])
+
+    def test_coalesce_keys(self):
+        self.assertEqual(state_name_key({"state_name": "brightness", "state_value": 1}), "brightness")
+        self.assertEqual(service_state_key({"service_name": "peripherals", "state_name": "brightness"}), ("peripherals", "brightness"))
+        self.assertIsNone(service_state_key({"reminder": []}))
+        self.assertIsNone(state_name_key("brightness"))
+
+
+if __name__ == '__main__':
+    unittest.main()
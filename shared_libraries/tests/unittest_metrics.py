@@ -0,0 +1,215 @@
+# unittest_metrics.py
+
+import unittest
+from unittest.mock import patch
+import json
+import os
+import sys
+import tempfile
+import threading
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries import metrics
+from shared_libraries.metrics import Histogram, JsonFileSink, MetricsRegistry, MetricsReporter, MQTTSink, default_service_name
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty_histogram(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        self.assertEqual(histogram.to_dict()["mean"], None)
+
+    def test_percentiles_are_bucket_upper_bounds(self):
+        histogram = Histogram()
+        for value in [0.5] * 50 + [7] * 45 + [80] * 4 + [300]:
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(95), 10)
+        self.assertEqual(histogram.percentile(99), 100)
+        self.assertEqual(histogram.percentile(100), 300)
+
+    def test_percentiles_do_not_exceed_the_largest_value(self):
+        histogram = Histogram()
+        for value in (3, 4):
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(50), 4)
+
+    def test_values_above_the_last_bound_are_reported_as_the_largest_value(self):
+        histogram = Histogram()
+        histogram.observe(20000)
+        self.assertEqual(histogram.percentile(99), 20000)
+        self.assertEqual(histogram.to_dict()["buckets"], {"+Inf": 1})
+
+    def test_summary(self):
+        histogram = Histogram()
+        for value in (2, 4, 9):
+            histogram.observe(value)
+        summary = histogram.to_dict()
+        self.assertEqual((summary["count"], summary["sum"], summary["min"], summary["max"], summary["mean"]), (3, 15, 2, 9, 5))
+        self.assertEqual(summary["buckets"], {"2": 1, "5": 1, "10": 1})
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry(service_name="database")
+
+    def test_metrics_are_kept_per_key(self):
+        self.registry.increment("mqtt.published", "save_check_in")
+        self.registry.increment("mqtt.published", "save_check_in", 2)
+        self.registry.increment("mqtt.published", "save_reminder")
+        self.registry.set_gauge("event.queue_depth", "database_writes", 4)
+        self.registry.set_gauge("event.queue_depth", "database_writes", 1)
+        self.registry.observe("event.handler_ms", "save_check_in", 3)
+
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["service_name"], "database")
+        self.assertEqual(snapshot["counters"], {"mqtt.published": {"save_check_in": 3, "save_reminder": 1}})
+        self.assertEqual(snapshot["gauges"], {"event.queue_depth": {"database_writes": 1}})
+        self.assertEqual(snapshot["histograms"]["event.handler_ms"]["save_check_in"]["count"], 1)
+        json.dumps(snapshot)
+
+    def test_timer_records_milliseconds(self):
+        with patch.object(metrics.time, "perf_counter", side_effect=[10.0, 10.25]):
+            with self.registry.time("mqtt.publish_ms", "robot_tts"):
+                pass
+        self.assertEqual(self.registry.snapshot()["histograms"]["mqtt.publish_ms"]["robot_tts"]["max"], 250)
+
+    def test_timer_records_blocks_that_raise(self):
+        with self.assertRaises(ValueError):
+            with self.registry.time("event.handler_ms", "save_check_in"):
+                raise ValueError
+        self.assertEqual(self.registry.snapshot()["histograms"]["event.handler_ms"]["save_check_in"]["count"], 1)
+
+    def test_concurrent_increments_are_not_lost(self):
+        def increment():
+            for _ in range(1000):
+                self.registry.increment("event.dispatched", "save_check_in")
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.registry.snapshot()["counters"]["event.dispatched"]["save_check_in"], 4000)
+
+    def test_reset(self):
+        self.registry.increment("mqtt.published", "save_check_in")
+        self.registry.reset()
+        snapshot = self.registry.snapshot()
+        self.assertEqual((snapshot["counters"], snapshot["gauges"], snapshot["histograms"]), ({}, {}, {}))
+
+    def test_service_name_from_the_environment_or_the_service_directory(self):
+        with patch.dict(os.environ, {"SERVICE_NAME": "reminder"}):
+            self.assertEqual(default_service_name(), "reminder")
+        with patch.dict(os.environ, {"SERVICE_NAME": ""}), patch.object(sys, "argv", ["/home/pi/SAR/services/database/app/main.py"]):
+            self.assertEqual(default_service_name(), "database")
+        with patch.dict(os.environ, {"SERVICE_NAME": ""}), patch.object(sys, "argv", ["/tmp/script.py"]):
+            self.assertEqual(default_service_name(), "unknown")
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry = MetricsRegistry(service_name="database")
+        self.registry.increment("mqtt.published", "save_check_in")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_json_file_sink_replaces_the_file(self):
+        path = os.path.join(self.directory.name, "metrics", "database.json")
+        sink = JsonFileSink(path)
+        sink.write(self.registry.snapshot())
+        self.registry.increment("mqtt.published", "save_check_in")
+        sink.write(self.registry.snapshot())
+
+        with open(path) as file:
+            self.assertEqual(json.load(file)["counters"]["mqtt.published"]["save_check_in"], 2)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["database.json"])
+
+    def test_mqtt_sink_publishes_on_the_service_topic(self):
+        published = []
+        MQTTSink(lambda topic, payload: published.append((topic, payload)), "database").write(self.registry.snapshot())
+        self.assertEqual(published[0][0], "metrics/database")
+        self.assertEqual(json.loads(published[0][1])["counters"], {"mqtt.published": {"save_check_in": 1}})
+
+    def test_a_failing_sink_does_not_stop_the_others(self):
+        class FailingSink:
+            def write(self, snapshot):
+                raise OSError("disk full")
+
+        published = []
+        reporter = MetricsReporter(self.registry, [FailingSink(), MQTTSink(lambda topic, payload: published.append(topic), "database")])
+        reporter.report()
+        self.assertEqual(published, ["metrics/database"])
+
+    def test_reporter_writes_at_the_interval_and_once_more_when_stopped(self):
+        reported = threading.Semaphore(0)
+
+        class CountingSink:
+            def __init__(self):
+                self.snapshots = 0
+
+            def write(self, snapshot):
+                self.snapshots += 1
+                reported.release()
+
+        sink = CountingSink()
+        reporter = MetricsReporter(self.registry, [sink], interval=0.01).start()
+        self.assertTrue(reported.acquire(timeout=1))
+        reporter.stop()
+        reporter._thread.join(timeout=1)
+        self.assertGreaterEqual(sink.snapshots, 2)
+
+
+class TestStartReporting(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        reporter = patch.object(metrics, "_reporter", None)
+        reporter.start()
+        self.addCleanup(reporter.stop)
+
+    def tearDown(self):
+        if metrics._reporter is not None:
+            metrics._reporter.stop()
+        self.directory.cleanup()
+
+    def environment(self, sinks):
+        return patch.dict(os.environ, {
+            "METRICS_SINKS": sinks,
+            "METRICS_FILE": os.path.join(self.directory.name, "database.json"),
+            "METRICS_INTERVAL": "3600",
+        })
+
+    def test_no_sinks_by_default(self):
+        with self.environment(""):
+            self.assertIsNone(metrics.start_reporting())
+
+    def test_sinks_are_parsed_from_the_environment(self):
+        with self.environment(" json, mqtt ,"):
+            reporter = metrics.start_reporting(publish=lambda topic, payload: None)
+        self.assertEqual([sink.__class__ for sink in reporter.sinks], [JsonFileSink, MQTTSink])
+        self.assertEqual(reporter.sinks[0].path, os.path.join(self.directory.name, "database.json"))
+        self.assertEqual(reporter.interval, 3600)
+
+    def test_unknown_sinks_and_mqtt_without_publish_are_skipped(self):
+        with self.environment("mqtt,prometheus,json"):
+            reporter = metrics.start_reporting()
+        self.assertEqual([sink.__class__ for sink in reporter.sinks], [JsonFileSink])
+
+    def test_only_the_first_call_starts_a_reporter(self):
+        with self.environment("json"):
+            reporter = metrics.start_reporting()
+            self.assertIs(metrics.start_reporting(), reporter)
+
+
+if __name__ == '__main__':
+    unittest.main()
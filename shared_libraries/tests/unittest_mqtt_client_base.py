@@ -0,0 +1,277 @@
+# unittest_mqtt_client_base.py
+
+import asyncio
+import unittest
+import unittest.mock
+from unittest.mock import patch
+import os
+import sys
+import time
+from concurrent.futures import TimeoutError
+from types import SimpleNamespace
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries import metrics
+from shared_libraries.mqtt_client_base import MQTTClientBase, route
+from shared_libraries.payload_codecs import CodecRegistry
+
+
+class ServiceInterface(MQTTClientBase):
+    def __init__(self):
+        self.received = []
+        super().__init__("localhost", 1883)
+
+    @route("service/+/update_state")
+    def _update_service_state(self, payload, message):
+        self.received.append((message.topic, payload))
+
+
+def create_client(client_class=ServiceInterface):
+    """Creates a client whose published messages are captured in client.published instead of sent to a broker."""
+    with patch("shared_libraries.mqtt_client_base.mqtt.Client") as mqtt_client:
+        result = mqtt_client.return_value.publish.return_value
+        result.rc = 0
+        client = client_class()
+    client.published = []
+
+    def publish(topic, payload):
+        client.published.append((topic, payload))
+        return result
+    client.mqtt_client.publish.side_effect = publish
+    return client
+
+
+def deliver(client, topic, payload):
+    """Hands a message to the client the way paho's network loop does."""
+    client.on_message(client.mqtt_client, None, SimpleNamespace(topic=topic, payload=payload))
+
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.client = create_client()
+
+    def subscribed_topics(self):
+        return [call.args[0] for call in self.client.mqtt_client.subscribe.call_args_list]
+
+    def test_decorated_routes_receive_the_decoded_payload(self):
+        deliver(self.client, "service/reminder/update_state", b'{"state_name": "user_name", "state_value": "Alex"}')
+        deliver(self.client, "service/peripherals/update_state", b"On")
+        deliver(self.client, "robot_tts", b'{"content": "Hello"}')
+
+        self.assertEqual(self.client.received, [
+            ("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"}),
+            ("service/peripherals/update_state", "On"),
+        ])
+        self.assertIn("service/+/update_state", self.subscribed_topics())
+
+    def test_raw_callbacks_receive_the_message(self):
+        received = []
+        self.client.subscribe("robot_tts", lambda client, userdata, message: received.append(message.payload))
+        deliver(self.client, "robot_tts", b'{"content": "Hello"}')
+
+        self.assertEqual(received, [b'{"content": "Hello"}'])
+
+    def test_a_failing_handler_does_not_stop_the_others(self):
+        received = []
+        def failing_handler(payload, message):
+            raise ValueError("invalid payload")
+        self.client.add_route("service/reminder/update_state", failing_handler)
+        self.client.add_route("service/reminder/update_state", lambda payload, message: received.append(payload))
+        deliver(self.client, "service/reminder/update_state", b'{"state_name": "user_name"}')
+
+        self.assertEqual(received, [{"state_name": "user_name"}])
+        self.assertEqual(len(self.client.received), 1)
+
+    def test_a_topic_is_only_subscribed_to_once(self):
+        self.client.add_route("robot_tts", lambda payload, message: None)
+        self.client.add_route("robot_tts", lambda payload, message: None)
+        self.assertEqual(self.subscribed_topics().count("robot_tts"), 1)
+
+    def test_every_routed_topic_is_resubscribed_on_reconnect(self):
+        self.client.subscribe("network_status")
+        self.client.subscribe("robot_tts", lambda client, userdata, message: None)
+        self.client.add_route("database_status", lambda payload, message: None)
+
+        broker = unittest.mock.MagicMock()
+        self.client.on_connect(broker, None, {}, 0)
+        resubscribed = [call.args[0] for call in broker.subscribe.call_args_list]
+        self.assertCountEqual(resubscribed, ["service/+/update_state", self.client.reply_topic, "network_status", "robot_tts", "database_status"])
+
+    def test_subscribing_without_a_callback_wakes_the_listeners(self):
+        listened = []
+        self.client.add_message_listener(lambda message: listened.append(message.topic))
+        self.client.subscribe("network_status")
+        deliver(self.client, "network_status", b'{"status": "connected"}')
+
+        self.assertEqual(listened, ["network_status"])
+
+    def test_removed_routes_are_no_longer_called(self):
+        self.client.remove_route("service/+/update_state")
+        deliver(self.client, "service/reminder/update_state", b'{"state_name": "user_name"}')
+
+        self.assertEqual(self.client.received, [])
+        self.client.mqtt_client.unsubscribe.assert_called_with("service/+/update_state")
+        self.assertNotIn("service/+/update_state", self.client.router.filters())
+
+
+class Responder(MQTTClientBase):
+    def __init__(self, service_name, status="set_up"):
+        self.service_name = service_name
+        self.status = status
+        super().__init__("localhost", 1883)
+
+    @route("request/service_status")
+    def _respond_with_service_status(self, payload, message):
+        if self.status is not None:
+            self.reply(payload, {"service_name": self.service_name, "status": self.status}, topic=f"{self.service_name}_status")
+
+
+class Broker:
+    """Delivers every message published by one of its clients to all of them, on the publishing thread."""
+    def __init__(self, *clients):
+        self.clients = clients
+        for client in clients:
+            client.mqtt_client.publish.side_effect = lambda topic, payload, client=client: self.publish(client, topic, payload)
+
+    def publish(self, sender, topic, payload):
+        sender.published.append((topic, payload))
+        for client in self.clients:
+            deliver(client, topic, payload if isinstance(payload, bytes) else payload.encode("utf-8"))
+        return unittest.mock.MagicMock(rc=0)
+
+
+class TestRequests(unittest.TestCase):
+
+    def setUp(self):
+        metrics.get_registry().reset()
+        self.requester = create_client()
+        self.reminder = create_client(lambda: Responder("reminder"))
+        self.database = create_client(lambda: Responder("database", status="ready"))
+        self.broker = Broker(self.requester, self.reminder, self.database)
+
+    def test_call_completes_with_the_first_response(self):
+        future = self.requester.call("request/service_status", {"cmd": "status"}, timeout=1)
+
+        self.assertIn(future.result(timeout=1)["service_name"], ("reminder", "database"))
+        request = self.decode(self.requester.published[0][1])
+        self.assertEqual(request["cmd"], "status")
+        self.assertEqual(request["reply_to"], self.requester.reply_topic)
+        self.assertEqual(self.requester._pending_requests, {})
+
+    def test_responses_are_sent_to_the_reply_topic(self):
+        self.requester.call("request/service_status", timeout=1).result(timeout=1)
+
+        request = self.decode(self.requester.published[0][1])
+        for responder in (self.reminder, self.database):
+            topic, response = responder.published[0]
+            self.assertEqual(topic, self.requester.reply_topic)
+            self.assertEqual(self.decode(response)["correlation_id"], request["correlation_id"])
+
+    def test_responses_to_other_requests_are_ignored(self):
+        future = self.requester.call("robot_control_control_cmd", timeout=0.2)
+        deliver(self.requester, self.requester.reply_topic, b'{"correlation_id": "someone else", "status": "ready"}')
+
+        self.assertFalse(future.done())
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=1)
+        self.assertEqual(self.requester._pending_requests, {})
+
+    def test_call_times_out(self):
+        self.reminder.status = self.database.status = None
+        future = self.requester.call("request/service_status", timeout=0.1)
+
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=1)
+        self.assertEqual(metrics.get_registry().snapshot()["counters"]["mqtt.rpc_timeouts"]["request/service_status"], 1)
+
+    def test_scatter_gather_waits_for_every_responder(self):
+        started = time.monotonic()
+        responses = self.requester.scatter_gather("request/service_status", ["reminder", "database"], timeout=1)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual({name: response["status"] for name, response in responses.items()}, {"reminder": "set_up", "database": "ready"})
+
+    def test_scatter_gather_returns_the_responses_received_before_the_timeout(self):
+        self.database.status = None
+        responses = self.requester.scatter_gather("request/service_status", ["reminder", "database", "peripherals"], timeout=0.1)
+
+        self.assertEqual(list(responses), ["reminder"])
+        self.assertEqual(self.requester._pending_requests, {})
+
+    def test_scatter_gather_async(self):
+        self.database.status = None
+
+        async def gather():
+            complete = await self.requester.scatter_gather_async("request/service_status", ["reminder"], timeout=1)
+            partial = await self.requester.scatter_gather_async("request/service_status", ["reminder", "database"], timeout=0.1)
+            return complete, partial
+
+        complete, partial = asyncio.run(gather())
+        self.assertEqual(list(complete), ["reminder"])
+        self.assertEqual(list(partial), ["reminder"])
+        self.assertEqual(self.requester._pending_requests, {})
+
+    def test_reply_without_a_reply_topic_uses_the_default_topic(self):
+        self.reminder.reply({"correlation_id": "1234"}, {"status": "saved"}, topic="reminder_status")
+        topic, response = self.reminder.published[-1]
+        self.assertEqual(topic, "reminder_status")
+        self.assertEqual(self.decode(response), {"status": "saved", "correlation_id": "1234"})
+
+    def decode(self, payload):
+        return self.requester.decode_payload(payload.encode("utf-8") if isinstance(payload, str) else payload)
+
+
+class TestDelivery(unittest.TestCase):
+
+    def setUp(self):
+        metrics.get_registry().reset()
+        self.sender = create_client()
+        self.receiver = create_client()
+
+    def forward(self):
+        for topic, payload in self.sender.published:
+            deliver(self.receiver, topic, payload if isinstance(payload, bytes) else payload.encode("utf-8"))
+
+    def test_dicts_are_stamped_with_the_time_they_were_sent(self):
+        self.sender.publish("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"})
+        self.forward()
+
+        # The stamp is removed before the payload is handed to the handlers
+        self.assertEqual(self.receiver.received, [("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"})])
+        delivery = metrics.get_registry().snapshot()["histograms"]["mqtt.delivery_ms"]["service/+/update_state"]
+        self.assertEqual(delivery["count"], 1)
+        self.assertLess(delivery["max"], 1000)
+
+    def test_delivery_is_measured_from_the_time_the_message_was_sent(self):
+        with patch("shared_libraries.mqtt_client_base.time.time", return_value=time.time() - 2):
+            self.sender.publish("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"})
+        self.forward()
+
+        delivery = metrics.get_registry().snapshot()["histograms"]["mqtt.delivery_ms"]["service/+/update_state"]
+        self.assertGreaterEqual(delivery["min"], 2000)
+
+    def test_the_stamp_survives_schema_encoding(self):
+        codecs = CodecRegistry()
+        codecs.set_codec("service/+/update_state", "msgpack")
+        self.sender.codecs = codecs
+        self.sender.publish("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"})
+        self.forward()
+
+        self.assertEqual(self.sender.published[0][1][2], 5)  # Still encoded against the state_update schema
+        self.assertEqual(self.receiver.received, [("service/reminder/update_state", {"state_name": "user_name", "state_value": "Alex"})])
+        self.assertEqual(metrics.get_registry().snapshot()["histograms"]["mqtt.delivery_ms"]["service/+/update_state"]["count"], 1)
+
+    def test_messages_without_a_stamp_are_not_measured(self):
+        deliver(self.receiver, "service/reminder/update_state", b'{"state_name": "user_name", "state_value": "Alex"}')
+
+        self.assertEqual(len(self.receiver.received), 1)
+        self.assertNotIn("mqtt.delivery_ms", metrics.get_registry().snapshot()["histograms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
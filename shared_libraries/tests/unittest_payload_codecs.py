@@ -0,0 +1,144 @@
+# unittest_payload_codecs.py
+
+import unittest
+from unittest.mock import patch
+import json
+import os
+import sys
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+import cbor2
+import msgpack
+
+from shared_libraries.payload_codecs import (
+    FRAME_MARKER, NO_SCHEMA, CodecRegistry, MsgpackCodec, SchemaRegistry, codec_registry_from_env, schema_registry,
+)
+
+STATE_UPDATE = {"state_name": "brightness", "state_value": 20}
+CHECK_IN = {"day": 3, "answers": [{"question": "How did it go?", "answer": "Well", "sentiment": 0.8}], "completed": True}
+
+
+class TestCodecRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.codecs = CodecRegistry()
+        self.codecs.set_codec("service/+/update_state", "msgpack")
+        self.codecs.set_codec("save_check_in", "cbor")
+
+    def test_json_is_sent_unframed(self):
+        encoded = self.codecs.encode("robot_tts", CHECK_IN)
+        self.assertEqual(json.loads(encoded), CHECK_IN)
+        self.assertEqual(self.codecs.decode(encoded.encode("utf-8")), CHECK_IN)
+
+    def test_binary_payloads_are_framed(self):
+        for topic, codec_id in (("service/reminder/update_state", 1), ("save_check_in", 2)):
+            encoded = self.codecs.encode(topic, CHECK_IN)
+            self.assertEqual(encoded[0], FRAME_MARKER)
+            self.assertEqual(encoded[1], codec_id)
+            self.assertEqual(encoded[2], NO_SCHEMA)
+            self.assertEqual(self.codecs.decode(encoded), CHECK_IN)
+
+    def test_binary_payloads_are_smaller_than_json(self):
+        encoded = self.codecs.encode("service/reminder/update_state", STATE_UPDATE)
+        self.assertLess(len(encoded), len(json.dumps(STATE_UPDATE)))
+
+    def test_the_frame_marker_cannot_start_json_or_msgpack(self):
+        with self.assertRaises(UnicodeDecodeError):
+            bytes([FRAME_MARKER]).decode("utf-8")
+        with self.assertRaises(Exception):
+            msgpack.unpackb(bytes([FRAME_MARKER]))
+
+    def test_payloads_that_are_not_json_are_returned_as_text_or_bytes(self):
+        self.assertEqual(self.codecs.decode(b"On"), "On")
+        self.assertEqual(self.codecs.decode(b"1"), 1)
+        self.assertEqual(self.codecs.decode(b"\xff\xfe"), b"\xff\xfe")
+        self.assertEqual(self.codecs.decode(bytes([FRAME_MARKER])), bytes([FRAME_MARKER]))  # Too short to be a frame
+
+    def test_unsupported_codecs_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.codecs.decode(bytes((FRAME_MARKER, 9, NO_SCHEMA)) + b"\x90")
+        with self.assertRaises(ValueError):
+            self.codecs.set_codec("robot_tts", "protobuf")
+
+    def test_codecs_are_selected_by_topic_filter(self):
+        self.assertEqual(self.codecs.codec_for("service/reminder/update_state").name, "msgpack")
+        self.assertEqual(self.codecs.codec_for("save_check_in").name, "cbor")
+        self.assertEqual(self.codecs.codec_for("robot_tts").name, "json")
+
+        self.codecs.set_codec("service/+/update_state", "cbor")
+        self.assertEqual(self.codecs.codec_for("service/reminder/update_state").name, "cbor")
+
+    def test_codecs_that_are_not_installed_fall_back_to_json(self):
+        with patch.object(MsgpackCodec, "available", False):
+            codecs = CodecRegistry()
+            codecs.set_codec("robot_tts", "msgpack")
+        self.assertEqual(codecs.codec_for("robot_tts").name, "json")
+
+    def test_configuration_from_the_environment(self):
+        environment = {"PAYLOAD_CODEC_DEFAULT": "cbor", "PAYLOAD_CODECS": "robot_tts=msgpack, service/#=json,bad=protobuf,"}
+        with patch.dict(os.environ, environment):
+            codecs = codec_registry_from_env()
+        self.assertEqual(codecs.codec_for("robot_tts").name, "msgpack")
+        self.assertEqual(codecs.codec_for("service/reminder/update_state").name, "json")
+        self.assertEqual(codecs.codec_for("bad").name, "cbor")
+
+
+class TestSchemaRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.codecs = CodecRegistry()
+        self.codecs.set_codec("service/+/update_state", "msgpack")
+        self.codecs.set_codec("save_check_in", "cbor")
+
+    def test_payloads_matching_a_schema_are_sent_without_their_field_names(self):
+        encoded = self.codecs.encode("service/reminder/update_state", STATE_UPDATE)
+
+        self.assertEqual(encoded[2], 5)  # state_update
+        self.assertEqual(msgpack.unpackb(encoded[3:]), ["brightness", 20])
+        self.assertNotIn(b"state_name", encoded)
+        self.assertEqual(self.codecs.decode(encoded), STATE_UPDATE)
+
+    def test_every_registered_schema_round_trips(self):
+        for schema_id, schema in schema_registry.schemas().items():
+            payload = {field: f"{field} value" for field in schema["fields"]}
+            for topic in ("service/reminder/update_state", "save_check_in"):
+                encoded = self.codecs.encode(topic, payload)
+                self.assertEqual(encoded[2], schema_id)
+                self.assertEqual(self.codecs.decode(encoded), payload)
+
+    def test_the_sent_at_time_is_a_trailing_value(self):
+        payload = dict(STATE_UPDATE, sent_at=1760000000.5)
+        encoded = self.codecs.encode("save_check_in", payload)
+
+        self.assertEqual(encoded[2], 5)
+        self.assertEqual(cbor2.loads(encoded[3:]), ["brightness", 20, 1760000000.5])
+        self.assertEqual(self.codecs.decode(encoded), payload)
+
+    def test_payloads_with_other_fields_are_not_encoded_against_a_schema(self):
+        for payload in ({"state_value": 20, "state_name": "brightness"}, dict(STATE_UPDATE, service_name="peripherals"), [1, 2]):
+            encoded = self.codecs.encode("service/reminder/update_state", payload)
+            self.assertEqual(encoded[2], NO_SCHEMA)
+            self.assertEqual(self.codecs.decode(encoded), payload)
+
+    def test_unknown_schemas_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.codecs.decode(bytes((FRAME_MARKER, 1, 200)) + msgpack.packb(["brightness", 20]))
+
+    def test_schema_ids_cannot_be_reused(self):
+        registry = SchemaRegistry()
+        registry.register(1, "state_update", ("state_name", "state_value"))
+        registry.register(1, "state_update", ("state_name", "state_value"))  # Registering the same schema again is fine
+        with self.assertRaises(ValueError):
+            registry.register(1, "service_status", ("service_name", "status"))
+        for schema_id in (0, 256):
+            with self.assertRaises(ValueError):
+                registry.register(schema_id, "service_status", ("service_name", "status"))
+        self.assertEqual(registry.schemas(), {1: {"name": "state_update", "fields": ["state_name", "state_value"]}})
+
+
+if __name__ == '__main__':
+    unittest.main()
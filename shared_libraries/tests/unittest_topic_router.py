@@ -0,0 +1,93 @@
+# unittest_topic_router.py
+
+import unittest
+import os
+import sys
+
+# Add the project root directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../"))
+sys.path.insert(0, project_root)
+
+from shared_libraries.topic_router import TopicTrie, validate_topic_filter
+
+
+class TestTopicTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = TopicTrie()
+
+    def test_exact_topics(self):
+        self.trie.add("database_status", "database")
+        self.trie.add("service/reminder/update_state", "reminder")
+
+        self.assertEqual(self.trie.match("database_status"), ["database"])
+        self.assertEqual(self.trie.match("service/reminder/update_state"), ["reminder"])
+        self.assertEqual(self.trie.match("service/reminder"), [])
+        self.assertEqual(self.trie.match("service/reminder/update_state/extra"), [])
+
+    def test_single_level_wildcard(self):
+        self.trie.add("service/+/update_state", "any service")
+
+        self.assertEqual(self.trie.match("service/reminder/update_state"), ["any service"])
+        self.assertEqual(self.trie.match("service//update_state"), ["any service"])
+        self.assertEqual(self.trie.match("service/reminder/status"), [])
+        self.assertEqual(self.trie.match("service/a/b/update_state"), [])
+
+    def test_multi_level_wildcard(self):
+        self.trie.add("service/#", "service")
+        self.trie.add("#", "everything")
+
+        self.assertCountEqual(self.trie.match("service/reminder/update_state"), ["service", "everything"])
+        # '#' also matches the parent level
+        self.assertCountEqual(self.trie.match("service"), ["service", "everything"])
+        self.assertEqual(self.trie.match("robot_tts"), ["everything"])
+
+    def test_every_matching_filter_is_returned(self):
+        self.trie.add("service/reminder/update_state", "exact")
+        self.trie.add("service/+/update_state", "single")
+        self.trie.add("service/#", "multi")
+
+        self.assertCountEqual(self.trie.match("service/reminder/update_state"), ["exact", "single", "multi"])
+
+    def test_values_of_a_filter_keep_their_order(self):
+        self.trie.add("robot_tts", "first")
+        self.trie.add("robot_tts", "second")
+        self.assertEqual(self.trie.match("robot_tts"), ["first", "second"])
+
+    def test_system_topics_are_not_matched_by_leading_wildcards(self):
+        self.trie.add("#", "everything")
+        self.trie.add("+/broker/uptime", "single")
+        self.trie.add("$SYS/#", "system")
+
+        self.assertEqual(self.trie.match("$SYS/broker/uptime"), ["system"])
+
+    def test_remove(self):
+        self.trie.add("service/+/update_state", "first")
+        self.trie.add("service/+/update_state", "second")
+        self.trie.add("service/reminder/update_state", "exact")
+
+        self.trie.remove("service/+/update_state", "first")
+        self.assertCountEqual(self.trie.match("service/reminder/update_state"), ["second", "exact"])
+        self.assertCountEqual(self.trie.filters(), ["service/+/update_state", "service/reminder/update_state"])
+
+        self.trie.remove("service/+/update_state")
+        self.assertEqual(self.trie.match("service/reminder/update_state"), ["exact"])
+        self.assertEqual(self.trie.filters(), ["service/reminder/update_state"])
+
+        self.trie.remove("service/reminder/update_state")
+        self.trie.remove("not/a/filter")
+        self.assertEqual(self.trie.filters(), [])
+        self.assertEqual(self.trie._root.children, {})  # Empty branches are pruned
+
+    def test_invalid_filters_are_rejected(self):
+        for topic_filter in ("", "service/#/update_state", "service/rem+/update_state", "service/reminder#"):
+            with self.assertRaises(ValueError):
+                validate_topic_filter(topic_filter)
+        with self.assertRaises(ValueError):
+            self.trie.add("service/#/update_state", "invalid")
+        self.assertEqual(validate_topic_filter("service/+/#"), ["service", "+", "#"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import time
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# (second, formatted timestamp), stored as a single tuple so concurrent callers never see a mismatched pair
+_cache = (None, "")
+
+
+def timestamp():
+    """
+    Returns the current local time formatted as "%Y-%m-%d %H:%M:%S".
+    The formatted string only changes once a second, so it is cached instead of calling time.strftime on every message.
+    """
+    global _cache
+    now = time.time()
+    second = int(now)
+    cached_second, cached_timestamp = _cache
+    if second == cached_second:
+        return cached_timestamp
+    formatted = time.strftime(TIMESTAMP_FORMAT, time.localtime(now))
+    _cache = (second, formatted)
+    return formatted
@@ -0,0 +1,95 @@
+'''
+Topic trie used by MQTTClientBase to route incoming messages to their handlers.
+
+Topic filters are split into levels and stored in a trie, so matching a topic costs one lookup per level
+(plus the '+' and '#' branches) regardless of how many filters are registered.
+'''
+
+
+def validate_topic_filter(topic_filter):
+    """Raises a ValueError if the topic filter does not follow the MQTT wildcard rules."""
+    if not topic_filter:
+        raise ValueError("Topic filter must not be empty")
+    levels = topic_filter.split("/")
+    for i, level in enumerate(levels):
+        if level == "#" and i != len(levels) - 1:
+            raise ValueError(f"'#' must be the last level of the topic filter '{topic_filter}'")
+        if level not in ("+", "#") and ("+" in level or "#" in level):
+            raise ValueError(f"Wildcards must occupy a whole level of the topic filter '{topic_filter}'")
+    return levels
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class TopicTrie:
+    '''
+    Maps MQTT topic filters (including the '+' single level and '#' multi level wildcards) to values.
+    A filter can hold several values, they are returned in the order they were added.
+    '''
+    def __init__(self):
+        self._root = _Node()
+        self._filters = {}
+
+    def add(self, topic_filter, value):
+        node = self._root
+        for level in validate_topic_filter(topic_filter):
+            node = node.children.setdefault(level, _Node())
+        node.values.append(value)
+        self._filters[topic_filter] = self._filters.get(topic_filter, 0) + 1
+
+    def remove(self, topic_filter, value=None):
+        """Removes a value from a filter, or every value of the filter if no value is given."""
+        path = [(None, self._root)]
+        for level in topic_filter.split("/"):
+            node = path[-1][1].children.get(level)
+            if node is None:
+                return
+            path.append((level, node))
+        node = path[-1][1]
+        removed = len(node.values) if value is None else node.values.count(value)
+        node.values = [] if value is None else [v for v in node.values if v != value]
+        remaining = self._filters.get(topic_filter, 0) - removed
+        if remaining > 0:
+            self._filters[topic_filter] = remaining
+        else:
+            self._filters.pop(topic_filter, None)
+        # Prune empty branches
+        for (level, child), (_, parent) in zip(reversed(path[1:]), reversed(path[:-1])):
+            if child.values or child.children:
+                break
+            del parent.children[level]
+
+    def filters(self):
+        """Returns the topic filters that currently hold at least one value."""
+        return list(self._filters)
+
+    def match(self, topic):
+        """Returns the values of every filter matching the topic."""
+        levels = topic.split("/")
+        matches = []
+        self._match(self._root, levels, 0, matches, topic.startswith("$"))
+        return matches
+
+    def _match(self, node, levels, index, matches, system_topic):
+        # Topics starting with '$' are not matched by wildcards in the first level
+        wildcards_allowed = not (system_topic and index == 0)
+        if wildcards_allowed:
+            multi_level = node.children.get("#")
+            if multi_level is not None:
+                matches.extend(multi_level.values)
+        if index == len(levels):
+            matches.extend(node.values)
+            return
+        child = node.children.get(levels[index])
+        if child is not None:
+            self._match(child, levels, index + 1, matches, system_topic)
+        if wildcards_allowed:
+            single_level = node.children.get("+")
+            if single_level is not None:
+                self._match(single_level, levels, index + 1, matches, system_topic)